@@ -0,0 +1,4 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""離線基準測試，從專案根目錄以 python -m benchmarks.<名稱> 執行"""
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""HTTP問答服務壓測
+
+以固定並發向 /query/stream 發送合成問題，報告吞吐量、首字延遲和總延遲的百分位數。
+先以假模型啟動服務，再運行壓測：
+
+    LLM_BACKEND=fake python -m rag.api --port 8080 --workers 4
+    python -m benchmarks.bench_api --url http://localhost:8080 --concurrency 32 --requests 500
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+import numpy as np
+
+from benchmarks.corpus import build_corpus
+
+
+async def stream_query(client, question):
+    """發送一個串流查詢，返回（首字延遲, 總延遲）"""
+    started = time.perf_counter()
+    first_token = None
+    async with client.stream("POST", "/query/stream", json={"question": question}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if first_token is None and line == "event: token":
+                first_token = time.perf_counter() - started
+    return first_token, time.perf_counter() - started
+
+
+async def run(url, concurrency, total):
+    _, questions = build_corpus()
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(questions[i % len(questions)].question)
+
+    first_tokens, latencies, errors = [], [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=120) as client:
+        async def worker():
+            while not queue.empty():
+                question = queue.get_nowait()
+                try:
+                    first_token, latency = await stream_query(client, question)
+                    first_tokens.append(first_token or latency)
+                    latencies.append(latency)
+                except Exception as e:
+                    errors.append(str(e))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+
+    print(f"{total} 個請求，並發 {concurrency}，耗時 {seconds:.1f} 秒，失敗 {len(errors)} 個")
+    print(f"吞吐量          {len(latencies) / seconds:>8.1f} 請求/秒")
+    for name, values in (("首字延遲", first_tokens), ("總延遲", latencies)):
+        if values:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            print(f"{name:<12} p50 {p50:>7.0f} ms  p95 {p95:>7.0f} ms  p99 {p99:>7.0f} ms")
+    if errors:
+        print(f"第一個錯誤：{errors[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP問答服務壓測")
+    parser.add_argument("--url", default="http://localhost:8080", help="服務地址")
+    parser.add_argument("--concurrency", type=int, default=16, help="並發請求數")
+    parser.add_argument("--requests", type=int, default=200, help="總請求數")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.concurrency, args.requests))
+
+
+if __name__ == "__main__":
+    main()
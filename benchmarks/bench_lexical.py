@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""詞彙索引與混合檢索基準
+
+1. 在合成稅法語料上比較純向量檢索、純BM25和RRF混合檢索的命中率；
+2. 把語料複製擴充到約十萬個文本塊，測量建索引時間和BM25查詢延遲的p50/p95/p99，
+   以及每次替換一個文檔後第一次查詢的延遲（凍結部分不失效，不應出現重新凍結的尖峰）。
+
+    python -m benchmarks.bench_lexical [--chunks 100000]
+"""
+
+import argparse
+import random
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fakes import HashingEmbeddings
+from rag.lexical import LexicalIndex, rrf_fuse
+from rag.splitter import make_splitter
+
+K = 6
+FETCH_K = 20
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000
+
+
+def evaluate_quality(chunks, questions):
+    embeddings = HashingEmbeddings()
+    matrix = np.array(embeddings.embed_documents([chunk.page_content for chunk in chunks]))
+    index = LexicalIndex(path=None)
+    index.add_chunks("corpus", [str(i) for i in range(len(chunks))], chunks)
+
+    hits = {"向量": 0, "BM25": 0, "混合（RRF）": 0}
+    for question in questions:
+        scores = matrix @ np.array(embeddings.embed_query(question.question))
+        vector_results = [chunks[i] for i in np.argsort(-scores)[:FETCH_K]]
+        lexical_results = [doc for doc, _ in index.search(question.question, k=FETCH_K)]
+        results = {
+            "向量": vector_results[:K],
+            "BM25": lexical_results[:K],
+            "混合（RRF）": rrf_fuse([vector_results, lexical_results], k=K),
+        }
+        for name, docs in results.items():
+            if any(question.answer in doc.page_content for doc in docs):
+                hits[name] += 1
+
+    print(f"命中率（k={K}，{len(chunks)} 個文本塊，{len(questions)} 個問題）")
+    for name, count in hits.items():
+        print(f"  {name:<10} {count / len(questions):>8.1%}")
+
+
+def evaluate_latency(chunks, questions, target):
+    rng = random.Random(7)
+    # 複製語料並打亂每個文本塊的句子順序，得到指定數量的文本塊
+    large = []
+    while len(large) < target:
+        for chunk in chunks:
+            sentences = chunk.page_content.split("。")
+            rng.shuffle(sentences)
+            large.append(Document(page_content="。".join(sentences), metadata={"doc_id": f"doc-{len(large)}"}))
+            if len(large) >= target:
+                break
+
+    index = LexicalIndex(path=None)
+    started = time.perf_counter()
+    for i in range(0, len(large), 100):
+        batch = large[i:i + 100]
+        index.add_chunks(f"doc-{i}", [f"doc-{i}:{j}" for j in range(len(batch))], batch)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index.search("預熱")
+    freeze_seconds = time.perf_counter() - started
+
+    latencies = []
+    for question in questions * 3:
+        started = time.perf_counter()
+        index.search(question.question, k=FETCH_K)
+        latencies.append(time.perf_counter() - started)
+
+    # 每次替換一個文檔（100個文本塊）後立即查詢
+    after_write = []
+    for round_ in range(20):
+        doc_id = f"doc-{round_ * 100}"
+        batch = large[round_ * 100:round_ * 100 + 100]
+        index.add_chunks(doc_id, [f"{doc_id}:{j}" for j in range(len(batch))], batch)
+        started = time.perf_counter()
+        index.search(questions[round_ % len(questions)].question, k=FETCH_K)
+        after_write.append(time.perf_counter() - started)
+
+    print(f"\n查詢延遲（{len(index)} 個文本塊，{len(index.postings)} 個詞項，{len(latencies)} 次查詢）")
+    print(f"  建索引        {build_seconds:>8.1f} s")
+    print(f"  首次凍結      {freeze_seconds:>8.1f} s")
+    print(f"  p50           {percentile(latencies, 50):>8.2f} ms")
+    print(f"  p95           {percentile(latencies, 95):>8.2f} ms")
+    print(f"  p99           {percentile(latencies, 99):>8.2f} ms")
+    print(f"  寫入後首次查詢 p50 {percentile(after_write, 50):.2f} ms，最大 {max(after_write) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="詞彙索引與混合檢索基準")
+    parser.add_argument("--chunks", type=int, default=100000, help="延遲測試的文本塊數")
+    args = parser.parse_args()
+
+    documents, questions = build_corpus()
+    chunks = make_splitter(300, 50).split_documents(documents)
+    evaluate_quality(chunks, questions)
+    evaluate_latency(chunks, questions, args.chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""對話記憶基準：比較完整保留歷史與摘要式記憶的每輪問題改寫提示大小
+
+模擬一段長對話，逐輪輸出改寫提示的token數；摘要式記憶應在幾輪後趨於平穩。
+
+    python -m benchmarks.bench_memory [--turns 30]
+"""
+
+import argparse
+
+from langchain_core.language_models import FakeListChatModel
+
+from benchmarks.corpus import build_corpus
+from rag.memory import SummaryBufferMemory
+from rag.pipeline import CONDENSE_QUESTION_TEMPLATE, format_chat_history, remember_turn
+from rag.splitter import token_counter
+
+ANSWER = (
+    "根據相關規定，{question}的答案如下：首先應確認適用的法條和申報期限，"
+    "其次準備相關憑證與帳簿，逾期未辦理者可能被處以罰鍰。實務上建議提前與主管稽徵機關確認細節。"
+)
+
+
+def condense_tokens(count_tokens, history, question):
+    if not history:
+        return 0
+    prompt = CONDENSE_QUESTION_TEMPLATE.format(chat_history=format_chat_history(history), question=question)
+    return count_tokens(prompt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="對話記憶基準")
+    parser.add_argument("--turns", type=int, default=30, help="模擬的對話輪數")
+    args = parser.parse_args()
+
+    count_tokens = token_counter()
+    _, questions = build_corpus()
+    summarizer = FakeListChatModel(responses=[
+        "用戶先後詢問了營業稅、所得稅與二代健保補充保費的申報期限、繳納方式與罰則，助手已逐一說明相關法條。"
+    ])
+    # 不設上限即等同完整保留歷史
+    full = SummaryBufferMemory(max_turns=args.turns, token_budget=10 ** 9)
+    bounded = SummaryBufferMemory(llm=summarizer)
+
+    print(f"{'輪次':>4} {'完整歷史':>10} {'摘要式記憶':>12}")
+    for turn, question in enumerate(questions[:args.turns], 1):
+        full_tokens = condense_tokens(count_tokens, full.messages, question.question)
+        bounded_tokens = condense_tokens(count_tokens, bounded.messages, question.question)
+        print(f"{turn:>4} {full_tokens:>10} {bounded_tokens:>12}")
+        answer = ANSWER.format(question=question.question)
+        remember_turn(full, question.question, answer)
+        remember_turn(bounded, question.question, answer)
+
+    print(f"\n摘要式記憶：預算 {bounded.token_budget} token，逐字保留 {len(bounded.recent) // 2} 輪，"
+          f"已摘要 {bounded.summarized_turns} 輪，目前 {bounded.token_count()} token")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""重排階段基準
+
+在合成稅法語料上（每部法規另有一份只改了罰鍰金額的修訂版，模擬重複上傳造成的近似重複），
+比較直接取混合檢索前k個與「多取候選 → MinHash去重 → 重新評分 → token預算」的命中率、
+提示token數、重複文本塊數，以及重排增加的延遲p50/p95（文本塊特徵未緩存和已緩存兩種情況）。
+
+    python -m benchmarks.bench_rerank [--candidates 30] [--budget 2000] [--cross-encoder BAAI/bge-reranker-base]
+"""
+
+import argparse
+import re
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fakes import HashingEmbeddings
+from rag.lexical import LexicalIndex, rrf_fuse
+from rag.metrics import MetricsRegistry
+from rag.rerank import CrossEncoderScorer, LexicalScorer, Reranker
+from rag.splitter import make_splitter, token_counter
+
+K = 6
+
+
+def revised_copy(document):
+    """修訂版：罰鍰金額改變，其餘相同"""
+    content = re.sub(r"(\d+)元", lambda match: f"{int(match.group(1)) + 500}元", document.page_content)
+    return Document(page_content=content, metadata={**document.metadata, "source": document.metadata["source"] + "（修訂）"})
+
+
+def build_candidates(chunks, questions, candidates):
+    """每個問題的混合檢索候選（RRF融合後的前candidates個）"""
+    embeddings = HashingEmbeddings()
+    matrix = np.array(embeddings.embed_documents([chunk.page_content for chunk in chunks]))
+    index = LexicalIndex(path=None)
+    index.add_chunks("corpus", [str(i) for i in range(len(chunks))], chunks)
+    results = []
+    for question in questions:
+        scores = matrix @ np.array(embeddings.embed_query(question.question))
+        vector_results = [chunks[i] for i in np.argsort(-scores)[:candidates]]
+        lexical_results = [doc for doc, _ in index.search(question.question, k=candidates)]
+        results.append(rrf_fuse([vector_results, lexical_results], k=candidates))
+    return results
+
+
+def evaluate(name, questions, candidate_lists, select, count_tokens):
+    hits, tokens, duplicates, latencies = 0, [], 0, []
+    for question, candidates in zip(questions, candidate_lists):
+        started = time.perf_counter()
+        docs = select(question.question, candidates)
+        latencies.append(time.perf_counter() - started)
+        if any(question.answer in doc.page_content for doc in docs):
+            hits += 1
+        tokens.append(sum(count_tokens(doc.page_content) for doc in docs))
+        # 去掉罰鍰金額後內容相同的文本塊視為重複
+        normalized = [re.sub(r"\d+元", "", doc.page_content) for doc in docs]
+        duplicates += len(normalized) - len(set(normalized))
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    print(f"{name:<22}{hits / len(questions):>8.1%}{np.mean(tokens):>10.0f}{duplicates / len(questions):>8.2f}"
+          f"{p50:>10.2f}{p95:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重排階段基準")
+    parser.add_argument("--candidates", type=int, default=30, help="重排的候選數")
+    parser.add_argument("--budget", type=int, default=2000, help="保留文本塊的token預算")
+    parser.add_argument("--chunk-size", type=int, default=500, help="文本塊token數")
+    parser.add_argument("--cross-encoder", default=None, help="同時測試的交叉編碼器模型名")
+    args = parser.parse_args()
+
+    documents, questions = build_corpus()
+    documents += [revised_copy(document) for document in documents]
+    chunks = make_splitter(args.chunk_size, args.chunk_size // 6).split_documents(documents)
+    count_tokens = token_counter()
+    candidate_lists = build_candidates(chunks, questions, args.candidates)
+
+    print(f"{len(chunks)} 個文本塊，{len(questions)} 個問題，k={K}，候選 {args.candidates}，預算 {args.budget} token\n")
+    print(f"{'方法':<20}{'命中率':>8}{'提示token':>9}{'重複塊':>6}{'p50(ms)':>10}{'p95(ms)':>10}")
+    evaluate("混合檢索前k個", questions, candidate_lists, lambda query, docs: docs[:K], count_tokens)
+
+    scorers = [LexicalScorer()]
+    if args.cross_encoder:
+        scorers.append(CrossEncoderScorer(args.cross_encoder))
+    for scorer in scorers:
+        # 冷：每個文本塊都重新切詞；熱：文本塊特徵已在緩存中（常被檢索到的文本塊）
+        for label, cache_size in (("冷", 0), ("熱", len(chunks))):
+            reranker = Reranker(scorer, candidates=args.candidates, token_budget=args.budget, cache_size=cache_size,
+                                count_tokens=count_tokens, metrics=MetricsRegistry())
+            if cache_size:
+                for candidates in candidate_lists:
+                    reranker.rerank("預熱", candidates, K)
+            evaluate(f"重排（{scorer.name}，{label}）", questions, candidate_lists,
+                     lambda query, docs: reranker.rerank(query, docs, K), count_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""模型路由的離線評估
+
+在合成法規語料上以假模型（快速模型每字延遲較短、按快速模型價格計費；強模型較慢、較貴）比較三種模式：
+全部用快速模型、全部用強模型、自動路由。問題集帶有標註：單條法規的查找應走快速模型，
+同時涉及兩部法規、需要比較或綜合的問題應走強模型；一半問題前面帶有幾輪對話歷史。
+報告每種模式的總耗時百分位、平均費用和強問題由強模型回答的比例，以及自動路由的混淆矩陣。
+
+    python -m benchmarks.bench_router [--backend faiss] [--classifier heuristic] [--strong-signals 2]
+"""
+
+import argparse
+import os
+import random
+import re
+import tempfile
+import time
+
+import numpy as np
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fakes import FAKE_ANSWER
+from benchmarks.suite import make_knowledge_base, write_corpus
+from rag import config
+from rag.catalog import DocumentCatalog
+from rag.metrics import MetricsRegistry
+from rag.pipeline import DEFAULT_SYSTEM_PROMPT, RAGPipeline
+from rag.router import FAST, ROUTE_NAMES, STRONG, HeuristicClassifier, ModelRouter, create_classifier
+
+FOLLOW_UP_RE = re.compile(r"Follow Up Input: (.*)\nStandalone question:", re.S)
+
+
+class EchoCondenseModel(FakeListChatModel):
+    """把改寫提示中的後續問題原樣返回的假改寫模型，每字延遲sleep秒"""
+
+    responses: list = [""]
+
+    def _call(self, messages, *args, **kwargs):
+        match = FOLLOW_UP_RE.search(messages[-1].content)
+        question = match.group(1).strip() if match else messages[-1].content
+        if self.sleep:
+            time.sleep(self.sleep * len(question))
+        return question
+
+
+def fake_models(model, seconds_per_char):
+    """（回答模型，改寫模型），以真實模型名稱命名以按MODEL_PRICES估算費用"""
+    return (FakeListChatModel(responses=[FAKE_ANSWER], sleep=seconds_per_char, name=model),
+            EchoCondenseModel(sleep=seconds_per_char, name=model))
+
+
+def labelled_questions(questions, count, history_turns, seed=7):
+    """返回 [(問題, 對話歷史, 標註路由)]：單條查找標註為快速，兩部法規的比較標註為強"""
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        first = rng.choice(questions)
+        if i % 2 == 0:
+            question, label = first.question, FAST
+        else:
+            second = rng.choice([q for q in questions if q.law != first.law])
+            question = (f"{first.question.rstrip('？')}，另外{second.question.rstrip('？')}？"
+                        f"請比較兩者的規定有什麼不同，並說明同時適用時應如何處理。")
+            label = STRONG
+        history = []
+        # 每兩組問題中有一組帶對話歷史
+        if (i // 2) % 2 == 1:
+            for previous in rng.sample(questions, history_turns):
+                history += [HumanMessage(content=previous.question), AIMessage(content=FAKE_ANSWER)]
+        items.append((question, history, label))
+    return items
+
+
+def evaluate(pipeline, items):
+    """逐題運行，返回（每題總耗時列表，每題費用列表，[(標註, 路由)]）"""
+    seconds, costs, routes = [], [], []
+    for question, history, label in items:
+        result = pipeline.invoke(question, history)
+        seconds.append(result.total_seconds)
+        costs.append(result.usage["cost"])
+        routes.append((label, result.route or (STRONG if result.model == config.ROUTER_STRONG_MODEL else FAST)))
+    return seconds, costs, routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型路由的離線評估")
+    parser.add_argument("--backend", default="chroma", help="向量存儲後端")
+    parser.add_argument("--questions", type=int, default=80, help="問題數")
+    parser.add_argument("--history-turns", type=int, default=3, help="帶歷史的問題前面的對話輪數")
+    parser.add_argument("--fast-char-seconds", type=float, default=0.002, help="快速模型每字延遲（秒）")
+    parser.add_argument("--strong-char-seconds", type=float, default=0.008, help="強模型每字延遲（秒）")
+    parser.add_argument("--classifier", default=config.ROUTER_CLASSIFIER,
+                        help="heuristic 或 模組:類別；heuristic時可用以下參數調整")
+    parser.add_argument("--strong-signals", type=int, default=config.ROUTER_STRONG_SIGNALS)
+    parser.add_argument("--long-question-tokens", type=int, default=config.ROUTER_LONG_QUESTION_TOKENS)
+    parser.add_argument("--min-sources", type=int, default=config.ROUTER_MIN_SOURCES)
+    parser.add_argument("--max-score-spread", type=float, default=config.ROUTER_SCORE_SPREAD)
+    args = parser.parse_args()
+
+    documents, questions = build_corpus()
+    items = labelled_questions(questions, args.questions, args.history_turns)
+    fast_llm, fast_condense = fake_models(config.ROUTER_FAST_MODEL, args.fast_char_seconds)
+    strong_llm, strong_condense = fake_models(config.ROUTER_STRONG_MODEL, args.strong_char_seconds)
+    if args.classifier == "heuristic":
+        classifier = HeuristicClassifier(strong_signals=args.strong_signals,
+                                         long_question_tokens=args.long_question_tokens,
+                                         min_sources=args.min_sources, max_score_spread=args.max_score_spread)
+    else:
+        classifier = create_classifier(args.classifier)
+
+    with tempfile.TemporaryDirectory() as directory:
+        catalog = DocumentCatalog(os.path.join(directory, "catalog.sqlite"))
+        for doc_info in write_corpus(directory, documents, 1):
+            catalog.add(doc_info)
+        knowledge_base = make_knowledge_base(directory, "router", catalog, args.backend)
+        knowledge_base.sync()
+        retriever = knowledge_base.as_retriever(k=6)
+
+        registry = MetricsRegistry()
+        router = ModelRouter(fast_llm, strong_llm, classifier, condense_llm=fast_condense, metrics=registry)
+        modes = [
+            ("全部快速模型", RAGPipeline(retriever, fast_llm, DEFAULT_SYSTEM_PROMPT, condense_llm=fast_condense,
+                                     metrics=MetricsRegistry())),
+            ("全部強模型", RAGPipeline(retriever, strong_llm, DEFAULT_SYSTEM_PROMPT, condense_llm=strong_condense,
+                                    metrics=MetricsRegistry())),
+            ("自動路由", RAGPipeline(retriever, strong_llm, DEFAULT_SYSTEM_PROMPT, router=router, metrics=registry)),
+        ]
+
+        strong_total = sum(1 for _, _, label in items if label == STRONG)
+        print(f"{len(items)} 個問題（{strong_total} 個標註為強模型），快速模型 {config.ROUTER_FAST_MODEL}、"
+              f"強模型 {config.ROUTER_STRONG_MODEL}\n")
+        print(f"{'模式':<10}{'p50(s)':>8}{'p95(s)':>8}{'平均費用($)':>12}{'強問題用強模型':>14}{'簡單問題用強模型':>16}")
+        for name, pipeline in modes:
+            seconds, costs, routes = evaluate(pipeline, items)
+            p50, p95 = np.percentile(seconds, [50, 95])
+            strong_hits = sum(1 for label, route in routes if label == STRONG and route == STRONG)
+            over_routed = sum(1 for label, route in routes if label == FAST and route == STRONG)
+            print(f"{name:<10}{p50:>8.3f}{p95:>8.3f}{np.mean(costs):>12.5f}"
+                  f"{strong_hits / strong_total:>14.0%}{over_routed / (len(items) - strong_total):>16.0%}")
+            if pipeline.router is not None:
+                confusion = routes
+
+        print("\n自動路由的混淆矩陣（行為標註，列為路由結果）")
+        print(f"{'':<8}{ROUTE_NAMES[FAST]:>8}{ROUTE_NAMES[STRONG]:>8}")
+        for label in (FAST, STRONG):
+            counts = [sum(1 for pair in confusion if pair == (label, route)) for route in (FAST, STRONG)]
+            print(f"{ROUTE_NAMES[label]:<8}{counts[0]:>8}{counts[1]:>8}")
+
+        summary = registry.summary()
+        print("\n自動路由各路由的總耗時")
+        for route in (FAST, STRONG):
+            stats = summary.get(f"route_{route}")
+            if stats and stats["count"]:
+                print(f"{ROUTE_NAMES[route]}：{stats['count']} 次，p50 {stats['p50']:.3f}s，p95 {stats['p95']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
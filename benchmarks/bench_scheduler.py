@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""OpenAI請求調度基準
+
+啟動限額很低的本地OpenAI模擬服務（rag.mock_openai），在子進程中同時運行背景嵌入（仿BulkIngestor：
+多個執行緒分批嵌入）和幾個反覆提問的聊天用戶（每次提問先嵌入問題再調用聊天模型，問題的嵌入與
+背景索引共用同一個模型的額度），分別在關閉和開啟調度器時報告聊天延遲、失敗數、
+服務端返回的429次數和嵌入完成時間：
+
+    python -m benchmarks.bench_scheduler [--rpm 200] [--tpm 40000] [--throttle-rate 0.05] [--texts 600]
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+
+from benchmarks.corpus import build_corpus
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(rpm, tpm, latency, throttle_rate):
+    """在背景執行緒中啟動模擬服務，返回（uvicorn.Server, base_url）"""
+    import uvicorn
+
+    from rag.mock_openai import create_mock_app
+
+    port = free_port()
+    app = create_mock_app(rpm=rpm, tpm=tpm, latency=latency, throttle_rate=throttle_rate, seed=0)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def embedding_texts(count):
+    """由合成法規的條文組成count段文本（重複時加序號，內容都不同）"""
+    documents, _ = build_corpus()
+    articles = [line for doc in documents for line in doc.page_content.splitlines() if len(line) > 40]
+    return [f"{articles[i % len(articles)]}（第{i}段）" for i in range(count)]
+
+
+def run_worker(args):
+    """子進程：同時運行背景嵌入和聊天用戶，以JSON輸出結果"""
+    from langchain_openai import OpenAIEmbeddings
+
+    from rag import config, llm
+    from rag.ingest import _embed_in_background
+    from rag.metrics import get_metrics
+    from rag.scheduler import ScheduledEmbeddings
+
+    http_client, http_async_client = llm._shared_http_clients()
+    # 離線環境沒有tiktoken編碼表，不在客戶端按上下文長度切分
+    embeddings = OpenAIEmbeddings(http_client=http_client, http_async_client=http_async_client,
+                                  check_embedding_ctx_length=False)
+    if config.OPENAI_SCHEDULER_ENABLED:
+        embeddings = ScheduledEmbeddings(embeddings)
+    chat = llm.get_chat_model(streaming=False)
+    texts = embedding_texts(args.texts)
+    _, questions = build_corpus()
+
+    result = {"chat_latencies": [], "chat_failed": 0, "embed_failed": 0}
+    lock = threading.Lock()
+
+    def embed():
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.embed_concurrency) as executor:
+            futures = [
+                executor.submit(_embed_in_background, embeddings, texts[start:start + args.batch_size])
+                for start in range(0, len(texts), args.batch_size)
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception:
+                    result["embed_failed"] += 1
+        result["embed_seconds"] = time.perf_counter() - started
+
+    def user(index):
+        for question in questions[index::args.users][:args.questions]:
+            time.sleep(args.think_time)
+            started = time.perf_counter()
+            try:
+                # 檢索時嵌入問題，與背景索引使用同一個嵌入模型的額度
+                embeddings.embed_query(question.question)
+                chat.invoke(question.question)
+            except Exception:
+                with lock:
+                    result["chat_failed"] += 1
+                continue
+            with lock:
+                result["chat_latencies"].append(time.perf_counter() - started)
+
+    embedder = threading.Thread(target=embed)
+    embedder.start()
+    # 嵌入先排滿額度，再開始提問
+    time.sleep(1.0)
+    users = [threading.Thread(target=user, args=(i,)) for i in range(args.users)]
+    for thread in users:
+        thread.start()
+    for thread in users + [embedder]:
+        thread.join()
+    counters = get_metrics().counters()
+    result["client_retries"] = sum(counters.get("openai_retries", {}).values())
+    print(json.dumps(result))
+
+
+def run_mode(args, scheduler_enabled):
+    """啟動新的模擬服務，在子進程中運行一輪，返回結果和服務端統計"""
+    server, base_url = start_mock_server(args.rpm, args.tpm, args.latency, args.throttle_rate)
+    env = dict(
+        os.environ,
+        LLM_BACKEND="openai",
+        OPENAI_API_KEY="test",
+        OPENAI_BASE_URL=f"{base_url}/v1",
+        OPENAI_SCHEDULER_ENABLED=str(scheduler_enabled).lower(),
+        OPENAI_RATE_LIMITS=json.dumps({"default": {"rpm": args.rpm, "tpm": args.tpm}}),
+    )
+    command = [sys.executable, "-m", "benchmarks.bench_scheduler", "--worker",
+               *(f"--{name.replace('_', '-')}={value}" for name, value in vars(args).items() if name != "worker")]
+    try:
+        output = subprocess.run(command, env=env, capture_output=True, text=True, check=True).stdout
+        stats = httpx.get(f"{base_url}/stats").json()
+    finally:
+        server.should_exit = True
+    return json.loads(output.strip().splitlines()[-1]), stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI請求調度基準")
+    parser.add_argument("--rpm", type=int, default=200, help="模擬服務每個模型每分鐘的請求數上限")
+    parser.add_argument("--tpm", type=int, default=40000, help="模擬服務每個模型每分鐘的token數上限")
+    parser.add_argument("--latency", type=float, default=0.05, help="模擬服務每個請求的延遲（秒）")
+    parser.add_argument("--throttle-rate", type=float, default=0.05, help="模擬服務隨機返回429的比例")
+    parser.add_argument("--texts", type=int, default=600, help="背景嵌入的文本段數")
+    parser.add_argument("--batch-size", type=int, default=64, help="每個嵌入任務的文本數")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="嵌入執行緒數")
+    parser.add_argument("--users", type=int, default=4, help="聊天用戶數")
+    parser.add_argument("--questions", type=int, default=6, help="每個用戶的提問數")
+    parser.add_argument("--think-time", type=float, default=0.5, help="每次提問前的間隔（秒）")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    print(f"模擬服務限額 {args.rpm} 請求/分、{args.tpm} token/分，隨機429比例 {args.throttle_rate:.0%}；"
+          f"背景嵌入 {args.texts} 段，{args.users} 個聊天用戶各提問 {args.questions} 次\n")
+    print(f"{'調度器':<8}{'聊天p50(s)':>12}{'聊天p95(s)':>12}{'聊天失敗':>10}{'嵌入(s)':>10}"
+          f"{'嵌入失敗':>10}{'服務端429':>10}{'客戶端重試':>12}")
+    for enabled in (False, True):
+        result, stats = run_mode(args, enabled)
+        latencies = result["chat_latencies"] or [float("nan")]
+        p50, p95 = np.percentile(latencies, [50, 95])
+        throttled = sum(stats["throttled"].values())
+        print(f"{'開啟' if enabled else '關閉':<8}{p50:>12.2f}{p95:>12.2f}{result['chat_failed']:>10}"
+              f"{result['embed_seconds']:>10.1f}{result['embed_failed']:>10}{throttled:>10}"
+              f"{result['client_retries']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""分割器基準：比較舊版按字符分割和按token、中文標點與法條分割的效果
+
+對合成稅法語料報告文本塊數、總token數、最大塊token數、k=6時塞入提示的token數，
+以及問題集的檢索命中率。
+
+    python -m benchmarks.bench_splitter
+"""
+
+import time
+
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fakes import HashingEmbeddings
+from rag.splitter import make_splitter, token_counter
+
+K = 6
+
+
+def evaluate(name, splitter, documents, questions, embeddings, count_tokens):
+    started = time.perf_counter()
+    chunks = splitter.split_documents(documents)
+    split_seconds = time.perf_counter() - started
+
+    tokens = [count_tokens(chunk.page_content) for chunk in chunks]
+    matrix = np.array(embeddings.embed_documents([chunk.page_content for chunk in chunks]))
+
+    hits = 0
+    prompt_tokens = []
+    for question in questions:
+        scores = matrix @ np.array(embeddings.embed_query(question.question))
+        top = np.argsort(-scores)[:K]
+        if any(question.answer in chunks[i].page_content for i in top):
+            hits += 1
+        prompt_tokens.append(sum(tokens[i] for i in top))
+
+    print(f"{name}")
+    print(f"  文本塊數        {len(chunks):>8}")
+    print(f"  總token數       {sum(tokens):>8,}")
+    print(f"  最大塊token數   {max(tokens):>8}")
+    print(f"  平均提示token數 {sum(prompt_tokens) / len(prompt_tokens):>8.0f}  (k={K})")
+    print(f"  最大提示token數 {max(prompt_tokens):>8}")
+    print(f"  檢索命中率      {hits / len(questions):>8.1%}")
+    print(f"  分割耗時        {split_seconds * 1000:>8.1f} ms")
+
+
+def main():
+    documents, questions = build_corpus()
+    embeddings = HashingEmbeddings()
+    count_tokens = token_counter()
+    print(f"語料：{len(documents)} 部法規，{len(questions)} 個問題，token計算：{count_tokens.__name__}\n")
+
+    evaluate(
+        "舊版：1000字符 / 重疊200字符",
+        RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len),
+        documents, questions, embeddings, count_tokens
+    )
+    for chunk_size, chunk_overlap in ((500, 80), (300, 50), (250, 80)):
+        evaluate(
+            f"中文分割：{chunk_size} token / 重疊{chunk_overlap} token",
+            make_splitter(chunk_size, chunk_overlap, length_function=count_tokens),
+            documents, questions, embeddings, count_tokens
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""抽取文本存儲基準
+
+生成一批多頁的PDF（Helvetica英文文本，pypdf寫出），比較重建時每次用PyPDFLoader重新抽取
+與讀取按內容雜湊存儲的gzip JSONL的加載耗時，並檢查兩者的文本和頁碼一致。
+
+    python -m benchmarks.bench_text_store [--files 20] [--pages 30]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from rag.ingest import new_document_entry
+from rag.loaders import file_sha256, get_loader, load_document
+from rag.text_store import TextStore
+
+
+def write_pdf(path, file_index, pages, lines_per_page=50):
+    """寫一個每頁lines_per_page行文本的PDF"""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for page_number in range(pages):
+        page = writer.add_blank_page(612, 792)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+        lines = [
+            f"Article {file_index}.{page_number}.{line}: income derived from sources within the territory "
+            f"is taxable at {5 + line % 20} percent."
+            for line in range(lines_per_page)
+        ]
+        content = DecodedStreamObject()
+        content.set_data(("BT /F1 9 Tf 11 TL 40 770 Td " + " ".join(f"({line}) '" for line in lines) + " ET").encode())
+        page[NameObject("/Contents")] = writer._add_object(content)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="抽取文本存儲基準")
+    parser.add_argument("--files", type=int, default=20, help="PDF文件數")
+    parser.add_argument("--pages", type=int, default=30, help="每個文件的頁數")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_text_store_")
+    try:
+        doc_infos = []
+        for i in range(args.files):
+            doc_info = new_document_entry(f"law-{i}.pdf", "所得稅", ["稅法"])
+            doc_info["path"] = os.path.join(directory, f"{doc_info['id']}.pdf")
+            write_pdf(doc_info["path"], i, args.pages)
+            doc_infos.append(doc_info)
+        pdf_bytes = sum(os.path.getsize(doc_info["path"]) for doc_info in doc_infos)
+        hashes = {doc_info["id"]: file_sha256(doc_info["path"]) for doc_info in doc_infos}
+        store = TextStore(os.path.join(directory, "texts"))
+
+        started = time.perf_counter()
+        parsed = [get_loader(doc_info["path"], "pdf").load() for doc_info in doc_infos]
+        parse_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for doc_info in doc_infos:
+            load_document(doc_info, hashes[doc_info["id"]], text_store=store)
+        first_seconds = time.perf_counter() - started
+        store_bytes = sum(entry.stat().st_size for entry in os.scandir(store.directory))
+
+        started = time.perf_counter()
+        stored = [load_document(doc_info, hashes[doc_info["id"]], text_store=store) for doc_info in doc_infos]
+        stored_seconds = time.perf_counter() - started
+
+        for original, cached in zip(parsed, stored):
+            assert [doc.page_content for doc in original] == [doc.page_content for doc in cached]
+            assert [doc.metadata["page"] for doc in original] == [doc.metadata["page"] for doc in cached]
+
+        pages = args.files * args.pages
+        print(f"{args.files} 個PDF，共 {pages} 頁；PDF {pdf_bytes / 1024:.0f} KB，抽取文本存儲 {store_bytes / 1024:.0f} KB\n")
+        print(f"{'方式':<16}{'總耗時(s)':>10}{'每頁(ms)':>10}")
+        for name, seconds in (("PyPDFLoader抽取", parse_seconds), ("抽取並寫入存儲", first_seconds),
+                              ("讀取存儲", stored_seconds)):
+            print(f"{name:<16}{seconds:>10.3f}{seconds / pages * 1000:>10.3f}")
+        print(f"\n重建時加載快 {parse_seconds / stored_seconds:.0f} 倍")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
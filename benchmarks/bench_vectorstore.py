@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""向量存儲後端基準：Chroma與FAISS（flat、ivf、hnsw）
+
+每個後端在獨立子進程中用同一批合成向量建索引，報告建索引時間、查詢和帶過濾查詢延遲的p50/p95、
+相對精確搜索的recall@k和記憶體峰值；再在新進程中打開已持久化的索引，測量冷啟動時間和匿名記憶體。
+
+    python -m benchmarks.bench_vectorstore [--chunks 20000] [--dim 768] [--backends chroma,faiss-ivf]
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+
+from rag.vectorstores import FaissVectorStore
+
+K = 6
+CATEGORIES = 10
+TOPICS = 200
+BATCH_SIZE = 1000
+BACKENDS = ("chroma", "faiss-flat", "faiss-ivf", "faiss-hnsw")
+
+
+class SyntheticEmbeddings(Embeddings):
+    """文本 "chunk-i" 和 "query-j" 對應固定的向量
+
+    文本塊向量圍繞TOPICS個主題中心分佈（與真實嵌入一樣有聚類結構），查詢向量是某個文本塊加上噪聲。
+    """
+
+    def __init__(self, dim, seed=0):
+        self.dim = dim
+        self.seed = seed
+
+    def _unit(self, *key):
+        vector = np.random.default_rng([self.seed, *key]).standard_normal(self.dim).astype("float32")
+        return vector / np.linalg.norm(vector)
+
+    def chunk_vector(self, i):
+        vector = self._unit(2, i % TOPICS) + 0.7 * self._unit(0, i)
+        return vector / np.linalg.norm(vector)
+
+    def query_vector(self, j, chunks):
+        rng = np.random.default_rng([self.seed, 1, j])
+        vector = self.chunk_vector(int(rng.integers(chunks))) + rng.standard_normal(self.dim).astype("float32") * 0.05
+        return vector / np.linalg.norm(vector)
+
+    def embed_documents(self, texts):
+        return [self.chunk_vector(int(text.split("-")[1])).tolist() for text in texts]
+
+    def embed_query(self, text):
+        _, j, chunks = text.split("-")
+        return self.query_vector(int(j), int(chunks)).tolist()
+
+
+def anon_rss_mb():
+    """匿名記憶體（不含記憶體映射的文件頁面）"""
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def open_store(backend, directory, embeddings):
+    if backend == "chroma":
+        return Chroma(persist_directory=directory, embedding_function=embeddings)
+    return FaissVectorStore(directory, embeddings, index_type=backend.split("-")[1], ivf_min_vectors=1000)
+
+
+def query_texts(queries, chunks):
+    return [f"query-{j}-{chunks}" for j in range(queries)]
+
+
+def run_queries(store, texts, category_filter=None):
+    latencies, results = [], []
+    for text in texts:
+        started = time.perf_counter()
+        docs = store.similarity_search(text, k=K, filter=category_filter)
+        latencies.append(time.perf_counter() - started)
+        results.append([int(doc.metadata["n"]) for doc in docs])
+    return latencies, results
+
+
+def build_and_query(backend, directory, chunks, dim, queries):
+    """子進程：建索引並查詢"""
+    embeddings = SyntheticEmbeddings(dim)
+    store = open_store(backend, directory, embeddings)
+    started = time.perf_counter()
+    for start in range(0, chunks, BATCH_SIZE):
+        ids = range(start, min(start + BATCH_SIZE, chunks))
+        store.add_texts(
+            [f"chunk-{i}" for i in ids],
+            metadatas=[{"n": i, "category": f"c{i % CATEGORIES}"} for i in ids],
+            ids=[f"chunk-{i}" for i in ids]
+        )
+    if hasattr(store, "save"):
+        store.save(force=True)
+    build_seconds = time.perf_counter() - started
+
+    texts = query_texts(queries, chunks)
+    latencies, results = run_queries(store, texts)
+    filtered_latencies, _ = run_queries(store, texts, category_filter={"category": "c3"})
+    return {
+        "build_seconds": build_seconds,
+        "latencies": latencies,
+        "filtered_latencies": filtered_latencies,
+        "results": results,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def cold_start(backend, directory, chunks, dim):
+    """子進程：打開已持久化的索引並完成第一次查詢"""
+    before = anon_rss_mb()
+    started = time.perf_counter()
+    store = open_store(backend, directory, SyntheticEmbeddings(dim))
+    store.similarity_search(query_texts(1, chunks)[0], k=K)
+    return {"cold_start_ms": (time.perf_counter() - started) * 1000, "cold_anon_mb": anon_rss_mb() - before}
+
+
+def exact_results(chunks, dim, queries):
+    embeddings = SyntheticEmbeddings(dim)
+    matrix = np.stack([embeddings.chunk_vector(i) for i in range(chunks)])
+    truth = []
+    for j in range(queries):
+        scores = matrix @ embeddings.query_vector(j, chunks)
+        truth.append(set(np.argsort(-scores)[:K].tolist()))
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量存儲後端基準")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    args = parser.parse_args()
+
+    truth = exact_results(args.chunks, args.dim, args.queries)
+    context = multiprocessing.get_context("spawn")
+    print(f"{args.chunks} 個文本塊，{args.dim} 維，{args.queries} 次查詢，k={K}\n")
+    print(f"{'後端':<12}{'建索引(s)':>10}{'p50(ms)':>9}{'p95(ms)':>9}{'過濾p50':>9}{'recall':>8}"
+          f"{'峰值RSS(MB)':>12}{'冷啟動(ms)':>11}{'冷啟動匿名(MB)':>14}")
+    for backend in args.backends.split(","):
+        with tempfile.TemporaryDirectory() as directory:
+            store_dir = os.path.join(directory, backend)
+            with context.Pool(1) as pool:
+                built = pool.apply(build_and_query, (backend, store_dir, args.chunks, args.dim, args.queries))
+            with context.Pool(1) as pool:
+                cold = pool.apply(cold_start, (backend, store_dir, args.chunks, args.dim))
+
+        recall = np.mean([len(set(found) & expected) / K for found, expected in zip(built["results"], truth)])
+        p50, p95 = np.percentile(built["latencies"], [50, 95]) * 1000
+        filtered_p50 = np.percentile(built["filtered_latencies"], 50) * 1000
+        print(f"{backend:<12}{built['build_seconds']:>10.1f}{p50:>9.2f}{p95:>9.2f}{filtered_p50:>9.2f}{recall:>8.3f}"
+              f"{built['max_rss_mb']:>12.0f}{cold['cold_start_ms']:>11.0f}{cold['cold_anon_mb']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""字幕解析基準：比較舊版逐行過濾和新解析器的輸出大小與耗時
+
+    python -m benchmarks.bench_vtt               # 使用合成的自動字幕和手動字幕
+    python -m benchmarks.bench_vtt a.vtt b.srt   # 使用指定的字幕文件（按自動字幕去除滾動重複）
+"""
+
+import sys
+import time
+
+from rag.subtitles import cues_to_text, parse_subtitles
+
+SAMPLE_SENTENCES = [
+    "今天我們來談營業稅的申報期限",
+    "營業人應於每單月十五日前申報上期的銷售額",
+    "如果逾期申報會有滯報金",
+    "扣繳憑單應在次年一月底前寄發給所得人",
+    "二代健保補充保費的費率是百分之二點一一",
+    "營利事業所得稅第二十四條規定了所得額的計算方式",
+]
+
+
+def format_timestamp(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, rest = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{rest:06.3f}"
+
+
+def legacy_parse(text):
+    """舊版get_youtube_transcript中的處理方式"""
+    transcript = []
+    for line in text.splitlines():
+        if line.strip() == "" or "-->" in line or line.startswith("WEBVTT"):
+            continue
+        transcript.append(line.strip())
+    return " ".join(transcript)
+
+
+def synthetic_auto_captions(repeats=200):
+    """模擬YouTube自動字幕：每段兩行，第一行重複上一段的第二行，並帶有逐字時間標記"""
+    lines = ["WEBVTT", "Kind: captions", "Language: zh-TW", ""]
+    previous = ""
+    start = 0.0
+    for i in range(repeats):
+        sentence = SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)]
+        words = [sentence[j:j + 2] for j in range(0, len(sentence), 2)]
+        timed = words[0] + "".join(
+            f"<{format_timestamp(start + 0.3 * k)}><c>{word}</c>" for k, word in enumerate(words[1:], 1)
+        )
+        end = start + 3.0
+        lines += [f"{format_timestamp(start)} --> {format_timestamp(end)} align:start position:0%", previous or " ", timed, ""]
+        # 自動字幕在兩段之間還有一段10毫秒、只重複文字的過渡字幕
+        lines += [f"{format_timestamp(end)} --> {format_timestamp(end + 0.01)} align:start position:0%", sentence, " ", ""]
+        previous = sentence
+        start = end + 0.01
+    return "\n".join(lines)
+
+
+def synthetic_manual_captions(repeats=200):
+    """模擬手動字幕：帶編號的單行字幕"""
+    lines = ["WEBVTT", ""]
+    for i in range(repeats):
+        start = i * 3.0
+        lines += [str(i + 1), f"{format_timestamp(start)} --> {format_timestamp(start + 3.0)}",
+                  SAMPLE_SENTENCES[i % len(SAMPLE_SENTENCES)], ""]
+    return "\n".join(lines)
+
+
+def run(name, text, rolling=True):
+    started = time.perf_counter()
+    legacy = legacy_parse(text)
+    legacy_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    cues = parse_subtitles(text.splitlines(), rolling=rolling)
+    parsed = cues_to_text(cues)
+    parsed_seconds = time.perf_counter() - started
+
+    ratio = len(legacy) / len(parsed) if parsed else float("inf")
+    print(f"{name}")
+    print(f"  原始文件    {len(text):>9,} 字符")
+    print(f"  舊版輸出    {len(legacy):>9,} 字符  {legacy_seconds * 1000:7.2f} ms")
+    print(f"  新版輸出    {len(parsed):>9,} 字符  {parsed_seconds * 1000:7.2f} ms  {len(cues)} 段帶時間字幕")
+    print(f"  縮減倍數    {ratio:.2f}x")
+
+
+def main():
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, "r", encoding="utf-8") as f:
+                run(path, f.read())
+        return
+    run("合成自動字幕（滾動重複）", synthetic_auto_captions())
+    run("合成手動字幕", synthetic_manual_captions(), rolling=False)
+
+
+if __name__ == "__main__":
+    main()
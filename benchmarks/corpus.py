@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""合成的中文稅法語料與帶標註的問題集
+
+每條法條都有唯一的（主體、行為、對象）組合和對應的事實句，問題由同一組合生成，
+檢索結果中包含該事實句即視為命中。生成過程固定隨機種子，結果可重現。
+"""
+
+import random
+from dataclasses import dataclass
+
+from langchain_core.documents import Document
+
+LAWS = [
+    ("加值型及非加值型營業稅法", "營業稅"),
+    ("所得稅法", "所得稅"),
+    ("營利事業所得稅查核準則", "所得稅"),
+    ("遺產及贈與稅法", "遺產稅"),
+    ("稅捐稽徵法", "稽徵"),
+    ("全民健康保險法", "健保"),
+]
+SUBJECTS = ["營業人", "納稅義務人", "扣繳義務人", "營利事業", "保險對象", "受贈人", "外國營業人", "獨資商號"]
+ACTIONS = ["申報", "繳納", "扣繳", "開立統一發票", "辦理結算申報", "補繳", "更正", "申請退稅"]
+OBJECTS = ["銷售額", "所得額", "補充保費", "遺產總額", "贈與總額", "營業稅額", "股利所得", "租賃所得"]
+PERIODS = [
+    "每月十五日前", "每單月十五日前", "次年一月底前", "每年五月一日起至五月三十一日止",
+    "事實發生之日起三十日內", "收到通知後六個月內", "會計年度終了後五個月內", "交易完成後十日內",
+]
+FILLERS = [
+    "前項規定之適用範圍及辦理程序，由財政部定之。",
+    "主管稽徵機關得視實際需要，通知納稅義務人提示有關帳簿、文據。",
+    "依本法規定應申報之事項，得以電子方式為之；其實施辦法由主管機關定之。",
+    "本條所稱之期間，如遇例假日者，以其次日為期間之末日。",
+    "違反前項規定者，除通知限期補正外，並得按次處罰。",
+    "經查明屬實者，應自確定之日起依法退還，並加計利息。",
+    "納稅義務人對於核定稅捐之處分如有不服，得依規定格式申請復查。",
+    "第一項所定金額，主管機關得每三年依消費者物價指數調整之。",
+]
+NUMERALS = "零一二三四五六七八九"
+
+
+def chinese_number(n):
+    """把1到99轉成中文數字"""
+    tens, ones = divmod(n, 10)
+    text = ""
+    if tens:
+        text += ("" if tens == 1 else NUMERALS[tens]) + "十"
+    if ones:
+        text += NUMERALS[ones]
+    return text
+
+
+@dataclass
+class Question:
+    """帶標註的問題：answer是相關法條中的事實句"""
+    question: str
+    answer: str
+    law: str
+    category: str
+
+
+def build_corpus(articles_per_law=40, seed=7):
+    """生成法規文檔和問題集，返回 (文檔列表, 問題列表)"""
+    rng = random.Random(seed)
+    combos = [(s, a, o) for s in SUBJECTS for a in ACTIONS for o in OBJECTS]
+    rng.shuffle(combos)
+    combos = iter(combos)
+
+    documents = []
+    questions = []
+    for law_index, (law, category) in enumerate(LAWS):
+        lines = [law]
+        for number in range(1, articles_per_law + 1):
+            subject, action, obj = next(combos)
+            period = rng.choice(PERIODS)
+            fact = f"{subject}應於{period}{action}{obj}"
+            amount = rng.randint(1, 30) * 1500
+            body = [f"{fact}。"]
+            body += rng.sample(FILLERS, rng.randint(1, 5))
+            body.append(f"違反前項規定者，處新臺幣{amount}元以下罰鍰。")
+            lines.append(f"第{chinese_number(number)}條")
+            lines.append("".join(body))
+            questions.append(Question(
+                question=f"{law}規定{subject}什麼時候要{action}{obj}？",
+                answer=fact,
+                law=law,
+                category=category
+            ))
+        documents.append(Document(
+            page_content="\n".join(lines),
+            metadata={
+                "source": law,
+                "doc_id": f"law-{law_index}",
+                "category": category,
+                "tags": "稅法,法規",
+                "type": "txt",
+            }
+        ))
+    return documents, questions
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""離線基準測試使用的假嵌入模型和假聊天模型
+
+把字元和相鄰兩字的雜湊累加成固定維度向量並歸一化。結果確定、無需網絡，
+且詞彙重疊越多的文本越相似，足以比較分割和檢索設置的相對效果。
+"""
+
+import hashlib
+import math
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import FakeListChatModel
+
+FAKE_ANSWER = "依據相關法條，納稅義務人應於規定期限內辦理申報並繳納稅款，逾期將依法處罰。"
+
+
+class HashingEmbeddings(Embeddings):
+    """字元與雙字元雜湊嵌入"""
+
+    def __init__(self, size=256):
+        self.size = size
+        self.calls = 0
+        self.model = f"hashing-{size}"
+
+    def _bucket(self, token):
+        return int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little") % self.size
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        text = "".join(text.split())
+        for i, char in enumerate(text):
+            vector[self._bucket(char)] += 0.5
+            if i + 1 < len(text):
+                vector[self._bucket(text[i:i + 2])] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self._embed(text)
+
+
+def fake_chat_model(seconds_per_char=0.0):
+    """逐字串流固定回答的假聊天模型，seconds_per_char模擬生成速度"""
+    return FakeListChatModel(responses=[FAKE_ANSWER], sleep=seconds_per_char or None)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""完整的離線基準測試
+
+用假嵌入模型和假聊天模型，在合成稅法語料上跑完導入、重建索引、檢索和問答全流程，報告：
+導入吞吐量、索引重建時間、檢索與問答延遲的p50/p95/p99、記憶體峰值以及recall@k，
+並與保存的基準結果比較，超出容忍範圍的指標標記為退化（退出碼為1）。
+
+    python -m benchmarks.suite                      # 與 benchmarks/baseline.json 比較
+    python -m benchmarks.suite --save-baseline      # 更新基準結果
+    python -m benchmarks.suite --replicas 10 --k 4  # 放大語料、調整k
+    python -m benchmarks.suite --trace-memory       # 另外統計Python物件的記憶體峰值（會拖慢計時）
+    python -m benchmarks.suite --backend faiss      # 使用FAISS向量存儲
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.corpus import build_corpus
+from benchmarks.fakes import HashingEmbeddings, fake_chat_model
+from rag.catalog import DocumentCatalog
+from rag.embedding_cache import CachedEmbeddings, EmbeddingCache
+from rag.ingest import BulkIngestor, new_document_entry
+from rag.knowledge_base import KnowledgeBase
+from rag.pipeline import DEFAULT_SYSTEM_PROMPT, RAGPipeline
+from rag.vectorstores import BACKENDS
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+RECALL_KS = (1, 3, 6)
+
+# 指標 -> 越大越好為True；與基準比較時據此判斷方向
+METRICS = {
+    "ingest_chunks_per_second": True,
+    "rebuild_seconds": False,
+    "retrieval_p50_ms": False,
+    "retrieval_p95_ms": False,
+    "retrieval_p99_ms": False,
+    "pipeline_p50_ms": False,
+    "pipeline_p95_ms": False,
+    "pipeline_p99_ms": False,
+    "max_rss_mb": False,
+    "tracemalloc_peak_mb": False,
+    **{f"recall@{k}": True for k in RECALL_KS},
+}
+
+
+def percentiles(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return float(p50), float(p95), float(p99)
+
+
+def write_corpus(directory, documents, replicas):
+    """把語料寫成文本文件，返回文檔條目列表"""
+    doc_infos = []
+    for replica in range(replicas):
+        for doc in documents:
+            doc_info = new_document_entry(f"{doc.metadata['source']}-{replica}.txt", doc.metadata["category"],
+                                          doc.metadata["tags"].split(","))
+            doc_info["path"] = os.path.join(directory, f"{doc_info['id']}.txt")
+            with open(doc_info["path"], "w", encoding="utf-8") as f:
+                f.write(doc.page_content)
+            doc_infos.append(doc_info)
+    return doc_infos
+
+
+def make_knowledge_base(directory, name, catalog, backend="chroma"):
+    """與正式環境相同的知識庫組裝，只是換成假嵌入模型和獨立的數據目錄"""
+    cache = EmbeddingCache(os.path.join(directory, f"{name}-embeddings.sqlite"))
+    return KnowledgeBase(
+        catalog,
+        persist_directory=os.path.join(directory, f"{name}-vectorstore"),
+        state_path=os.path.join(directory, f"{name}-state.json"),
+        embeddings_factory=lambda: CachedEmbeddings(HashingEmbeddings(), cache=cache),
+        lexical_index_path=os.path.join(directory, f"{name}-lexical.pkl"),
+        answer_cache_path=None,
+        backend=backend
+    )
+
+
+def run_suite(replicas, k, workers, trace_memory=False, backend="chroma"):
+    documents, questions = build_corpus()
+    results = {}
+    if trace_memory:
+        tracemalloc.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        catalog = DocumentCatalog(os.path.join(directory, "catalog.sqlite"))
+        doc_infos = write_corpus(directory, documents, replicas)
+
+        # 導入：並行解析、分割、嵌入、寫入
+        knowledge_base = make_knowledge_base(directory, "ingest", catalog, backend)
+        report = BulkIngestor(knowledge_base, parse_workers=workers).run(doc_infos)
+        if report.failures:
+            raise RuntimeError(f"導入失敗: {report.failures[0]}")
+        results["ingest_documents"] = report.files
+        results["ingest_chunks"] = report.chunks
+        results["ingest_seconds"] = report.seconds
+        results["ingest_chunks_per_second"] = report.chunks_per_second
+
+        # 重建：從文檔目錄完整同步到空的向量存儲
+        rebuilt = make_knowledge_base(directory, "rebuild", catalog, backend)
+        started = time.perf_counter()
+        rebuilt.sync()
+        results["rebuild_seconds"] = time.perf_counter() - started
+
+        # 檢索延遲和recall@k
+        hits = {recall_k: 0 for recall_k in RECALL_KS}
+        latencies = []
+        for question in questions:
+            started = time.perf_counter()
+            found = rebuilt.search(question.question, k=max(RECALL_KS + (k,)))
+            latencies.append(time.perf_counter() - started)
+            for recall_k in RECALL_KS:
+                if any(question.answer in doc.page_content for doc in found[:recall_k]):
+                    hits[recall_k] += 1
+        for recall_k in RECALL_KS:
+            results[f"recall@{recall_k}"] = hits[recall_k] / len(questions)
+        results["retrieval_p50_ms"], results["retrieval_p95_ms"], results["retrieval_p99_ms"] = \
+            percentiles(latencies)
+
+        # 完整問答（改寫、檢索、組裝提示、假模型生成）
+        pipeline = RAGPipeline(rebuilt.as_retriever(k=k), fake_chat_model(), DEFAULT_SYSTEM_PROMPT)
+        latencies = []
+        for question in questions:
+            started = time.perf_counter()
+            pipeline.invoke(question.question)
+            latencies.append(time.perf_counter() - started)
+        results["pipeline_p50_ms"], results["pipeline_p95_ms"], results["pipeline_p99_ms"] = \
+            percentiles(latencies)
+
+    results["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results["tracemalloc_peak_mb"] = peak / 1024 / 1024
+    return results
+
+
+def compare(results, baseline, tolerance, recall_tolerance):
+    """返回退化的指標列表 [(名稱, 基準值, 本次值)]"""
+    regressions = []
+    for name, higher_is_better in METRICS.items():
+        if name not in baseline or name not in results:
+            continue
+        old, new = baseline[name], results[name]
+        if name.startswith("recall@"):
+            worse = new < old - recall_tolerance
+        elif higher_is_better:
+            worse = new < old * (1 - tolerance)
+        else:
+            worse = new > old * (1 + tolerance)
+        if worse:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="離線基準測試")
+    parser.add_argument("--replicas", type=int, default=5, help="語料複製份數（放大導入規模）")
+    parser.add_argument("--k", type=int, default=6, help="問答時檢索的文本塊數")
+    parser.add_argument("--workers", type=int, default=2, help="導入時的解析進程數")
+    parser.add_argument("--backend", default="chroma", choices=BACKENDS, help="向量存儲後端")
+    parser.add_argument("--trace-memory", action="store_true", help="用tracemalloc統計記憶體峰值")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基準結果文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次結果保存為基準")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="性能指標允許的相對退化")
+    parser.add_argument("--recall-tolerance", type=float, default=0.02, help="recall允許的絕對下降")
+    args = parser.parse_args()
+
+    results = run_suite(args.replicas, args.k, args.workers, args.trace_memory, args.backend)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"{'指標':<28}{'本次':>12}{'基準':>12}")
+    for name, value in results.items():
+        old = baseline.get(name)
+        old_text = f"{old:>12.3f}" if isinstance(old, (int, float)) else f"{'—':>12}"
+        print(f"{name:<28}{value:>12.3f}{old_text}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n已保存基準結果到 {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance, args.recall_tolerance)
+    if not baseline:
+        print("\n沒有基準結果，可以用 --save-baseline 保存本次結果")
+    elif regressions:
+        print("\n以下指標退化：")
+        for name, old, new in regressions:
+            print(f"  {name}: {old:.3f} -> {new:.3f}")
+        sys.exit(1)
+    else:
+        print("\n沒有超出容忍範圍的退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""LINE Webhook服務
+
+驗證簽名後立即返回200，問答在背景執行緒池中進行，完成後通過回覆API送出
+（回覆權杖失效時改用推送API），LINE不會因為模型生成慢而判定Webhook逾時。
+重送的事件按webhookEventId去重；每個用戶的對話記憶保存在有上限的記憶存儲中。
+同一用戶的訊息排成隊列，由一個任務依次回答，連續發送大量訊息的用戶最多只佔用一個工作執行緒。
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import requests
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from line_chatbot.client import LineClient, text_messages, to_plain_text, verify_signature
+from rag import config
+from rag.catalog import get_catalog
+from rag.knowledge_base import KnowledgeBase
+from rag.llm import get_chat_model
+from rag.memory import MemoryStore, SummaryBufferMemory
+from rag.metrics import get_metrics
+from rag.pipeline import DEFAULT_SYSTEM_PROMPT, RAGPipeline, format_sources, remember_turn
+from rag.router import AUTO_MODEL, STRONG, create_router
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "目前提問的人較多，請稍後再試。"
+ERROR_MESSAGE = "抱歉，處理您的問題時發生錯誤，請稍後再試。"
+RESET_COMMANDS = {"重新開始", "/reset"}
+
+
+class RecentIds:
+    """記錄最近處理過的ID，用於丟棄重送的事件"""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, event_id):
+        """第一次見到時返回True"""
+        with self._lock:
+            if event_id in self._ids:
+                return False
+            self._ids[event_id] = None
+            if len(self._ids) > self.max_size:
+                self._ids.popitem(last=False)
+            return True
+
+
+class LineBot:
+    """處理Webhook事件：去重、排入背景執行緒池並送出回答"""
+
+    def __init__(self, pipeline, line_client, memory_store=None, workers=config.LINE_WORKERS,
+                 max_pending=config.LINE_MAX_PENDING, max_queued_per_user=config.LINE_MAX_QUEUED_PER_USER):
+        self.pipeline = pipeline
+        self.line_client = line_client
+        self.memory_store = memory_store if memory_store is not None else MemoryStore(self._new_memory)
+        self.max_pending = max_pending
+        self.max_queued_per_user = max_queued_per_user
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="line-answer")
+        # 忙碌提示不排在問答後面，以免回覆權杖在等待中失效
+        self.notifier = ThreadPoolExecutor(max_workers=2, thread_name_prefix="line-notify")
+        self.seen_events = RecentIds()
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        # 用戶 -> 等待回答的事件；用戶在其中時已有一個任務在依次回答
+        self._queues = {}
+
+    def _new_memory(self):
+        return SummaryBufferMemory(llm=self.pipeline.condense_llm)
+
+    def handle_events(self, events):
+        """分派一次Webhook中的事件，返回排入處理的事件數"""
+        accepted = 0
+        for event in events:
+            if event.get("type") != "message" or event.get("message", {}).get("type") != "text":
+                continue
+            event_id = event.get("webhookEventId") or event.get("message", {}).get("id")
+            if event_id and not self.seen_events.add(event_id):
+                continue
+            user_id = event.get("source", {}).get("userId")
+            with self._pending_lock:
+                queue = self._queues.get(user_id) if user_id else None
+                busy = self.pending >= self.max_pending or (
+                    queue is not None and len(queue) >= self.max_queued_per_user
+                )
+                if not busy:
+                    self.pending += 1
+                    if queue is not None:
+                        queue.append(event)
+                    elif user_id:
+                        self._queues[user_id] = deque([event])
+            if busy:
+                self.notifier.submit(self._safe_reply, event, BUSY_MESSAGE)
+                continue
+            if not user_id:
+                self.executor.submit(self._answer, event)
+            elif queue is None:
+                self.executor.submit(self._drain, user_id)
+            accepted += 1
+        return accepted
+
+    def _drain(self, user_id):
+        """依次回答一個用戶排隊的事件，保持對話記憶的順序；隊列清空後結束"""
+        while True:
+            with self._pending_lock:
+                queue = self._queues[user_id]
+                if not queue:
+                    del self._queues[user_id]
+                    return
+                event = queue.popleft()
+            self._answer(event)
+
+    def _answer(self, event):
+        user_id = event.get("source", {}).get("userId", "")
+        question = event["message"]["text"].strip()
+        try:
+            if question in RESET_COMMANDS:
+                self.memory_store.forget(user_id)
+                self._send(event, "已清除對話記錄，請輸入新的問題。")
+                return
+            if user_id:
+                self._best_effort(self.line_client.show_loading, user_id)
+            memory, lock = self.memory_store.session(user_id)
+            with lock:
+                result = self.pipeline.invoke(question, memory.messages)
+                remember_turn(memory, question, result.answer)
+            answer = result.answer + format_sources(result.source_documents)
+            self._send(event, to_plain_text(answer))
+        except Exception:
+            logger.exception("回答LINE訊息失敗")
+            self._safe_reply(event, ERROR_MESSAGE)
+        finally:
+            with self._pending_lock:
+                self.pending -= 1
+
+    def _send(self, event, text):
+        """優先用回覆API，回覆權杖失效時推送給用戶"""
+        messages = text_messages(text)
+        try:
+            self.line_client.reply(event["replyToken"], messages)
+        except requests.HTTPError:
+            user_id = event.get("source", {}).get("userId")
+            if not user_id:
+                raise
+            self.line_client.push(user_id, messages)
+
+    def _safe_reply(self, event, text):
+        self._best_effort(self._send, event, text)
+
+    @staticmethod
+    def _best_effort(func, *args):
+        try:
+            func(*args)
+        except Exception:
+            logger.warning("LINE API調用失敗", exc_info=True)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.notifier.shutdown(wait=True)
+
+
+def create_app(knowledge_base=None, line_client=None, channel_secret=config.LINE_CHANNEL_SECRET,
+               model=config.CHAT_MODEL, system_prompt=DEFAULT_SYSTEM_PROMPT):
+    """建立Webhook服務；知識庫和LINE客戶端未提供時在啟動時建立"""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        kb = knowledge_base
+        if kb is None:
+            config.ensure_data_dirs()
+            kb = KnowledgeBase(get_catalog())
+        # model為auto（例如CHAT_MODEL=auto）時按問題在快速模型和強模型之間路由
+        router = create_router() if model == AUTO_MODEL else None
+        pipeline = RAGPipeline(
+            retriever=kb.as_retriever(k=6),
+            llm=router.llm(STRONG) if router is not None else get_chat_model(model=model),
+            system_prompt=system_prompt,
+            answer_cache=kb.answer_cache,
+            router=router
+        )
+        app.state.bot = LineBot(pipeline, line_client or LineClient())
+        yield
+        app.state.bot.shutdown()
+
+    app = FastAPI(title="財務稅法QA機器人 LINE Webhook", lifespan=lifespan)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "pending": app.state.bot.pending}
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(get_metrics().export_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @app.post("/callback")
+    async def callback(request: Request):
+        body = await request.body()
+        if not verify_signature(channel_secret, body, request.headers.get("X-Line-Signature")):
+            raise HTTPException(status_code=400, detail="Invalid signature")
+        # 簽名正確但內容不是JSON物件時返回400，而不是500
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        if not isinstance(payload, dict):
+            raise HTTPException(status_code=400, detail="Invalid JSON body")
+        events = payload.get("events", [])
+        # 只排入背景處理，立即返回
+        app.state.bot.handle_events(events)
+        return {"status": "ok"}
+
+    return app
+
+
+app = create_app()
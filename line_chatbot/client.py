@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""LINE Messaging API客戶端與簽名驗證"""
+
+import base64
+import hashlib
+import hmac
+import re
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from rag import config
+
+# LINE單則文字訊息的長度上限與一次回覆的訊息數上限
+MAX_TEXT_LENGTH = 5000
+MAX_MESSAGES = 5
+
+MARKDOWN_LINK_RE = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
+
+
+def compute_signature(channel_secret, body):
+    """計算請求體的簽名（HMAC-SHA256，Base64編碼）"""
+    digest = hmac.new(channel_secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode("ascii")
+
+
+def verify_signature(channel_secret, body, signature):
+    if not channel_secret or not signature:
+        return False
+    return hmac.compare_digest(compute_signature(channel_secret, body), signature)
+
+
+def to_plain_text(text):
+    """LINE不支持Markdown：去掉粗體標記，連結改為「標題 網址」"""
+    text = MARKDOWN_LINK_RE.sub(r"\1 \2", text)
+    return text.replace("**", "")
+
+
+def text_messages(text):
+    """把長文本切成LINE文字訊息列表"""
+    text = text.strip() or "（沒有回答）"
+    parts = [text[i:i + MAX_TEXT_LENGTH] for i in range(0, len(text), MAX_TEXT_LENGTH)]
+    return [{"type": "text", "text": part} for part in parts[:MAX_MESSAGES]]
+
+
+class LineClient:
+    """回覆、推送和載入動畫API；api_base可以指向本地模擬服務"""
+
+    def __init__(self, access_token=config.LINE_CHANNEL_ACCESS_TOKEN, api_base=config.LINE_API_BASE,
+                 pool_size=config.LINE_WORKERS, timeout=10):
+        self.api_base = api_base.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Authorization"] = f"Bearer {access_token}"
+
+    def _post(self, path, payload):
+        response = self.session.post(f"{self.api_base}{path}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def reply(self, reply_token, messages):
+        return self._post("/v2/bot/message/reply", {"replyToken": reply_token, "messages": messages})
+
+    def push(self, to, messages):
+        return self._post("/v2/bot/message/push", {"to": to, "messages": messages})
+
+    def show_loading(self, chat_id, seconds=20):
+        """在一對一聊天中顯示載入動畫，直到回答送出"""
+        return self._post("/v2/bot/chat/loading/start", {"chatId": chat_id, "loadingSeconds": seconds})
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""本地LINE Messaging API模擬服務與Webhook測試工具
+
+記錄收到的回覆和推送，可以模擬API延遲和回覆權杖失效，並向Webhook發送簽名正確的測試事件：
+
+    python -m line_chatbot.mock_api serve --port 9000 --latency 0.05
+    LINE_API_BASE=http://localhost:9000 LINE_CHANNEL_SECRET=test python main.py
+    python -m line_chatbot.mock_api send "營業稅申報期限？" --secret test --count 20
+    curl http://localhost:9000/messages
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from fastapi import FastAPI, HTTPException, Request
+
+from line_chatbot.client import compute_signature
+
+
+def create_mock_app(latency=0.0, expired_reply_tokens=()):
+    """模擬的LINE API；expired_reply_tokens中的權杖回覆時返回400"""
+    app = FastAPI(title="LINE API模擬服務")
+    app.state.messages = []
+
+    async def record(kind, request):
+        payload = await request.json()
+        if latency:
+            await asyncio.sleep(latency)
+        app.state.messages.append({"kind": kind, "received_at": time.time(), **payload})
+        return payload
+
+    @app.post("/v2/bot/message/reply")
+    async def reply(request: Request):
+        payload = await request.json()
+        if payload.get("replyToken") in expired_reply_tokens:
+            raise HTTPException(status_code=400, detail="Invalid reply token")
+        await record("reply", request)
+        return {}
+
+    @app.post("/v2/bot/message/push")
+    async def push(request: Request):
+        await record("push", request)
+        return {}
+
+    @app.post("/v2/bot/chat/loading/start")
+    async def loading(request: Request):
+        await record("loading", request)
+        return {}
+
+    @app.get("/messages")
+    async def messages():
+        return app.state.messages
+
+    return app
+
+
+def webhook_body(text, user_id="U-test", redelivery_of=None):
+    """產生一個文字訊息事件的Webhook請求體"""
+    event_id = redelivery_of or uuid.uuid4().hex
+    return {
+        "destination": "U-bot",
+        "events": [{
+            "type": "message",
+            "webhookEventId": event_id,
+            "deliveryContext": {"isRedelivery": redelivery_of is not None},
+            "timestamp": int(time.time() * 1000),
+            "replyToken": uuid.uuid4().hex,
+            "source": {"type": "user", "userId": user_id},
+            "message": {"id": uuid.uuid4().hex, "type": "text", "text": text},
+        }],
+    }
+
+
+def send_events(url, secret, text, count):
+    """向Webhook發送count個事件（每個再重送一次），報告每次確認的延遲"""
+    import requests
+
+    session = requests.Session()
+    latencies = []
+    for i in range(count):
+        body = webhook_body(text, user_id=f"U-test-{i % 5}")
+        for payload in (body, webhook_body(text, redelivery_of=body["events"][0]["webhookEventId"])):
+            data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            started = time.perf_counter()
+            response = session.post(url, data=data, headers={
+                "Content-Type": "application/json",
+                "X-Line-Signature": compute_signature(secret, data),
+            })
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+    latencies.sort()
+    print(f"發送 {len(latencies)} 個Webhook（含重送），確認延遲 p50 {latencies[len(latencies) // 2] * 1000:.0f} ms，"
+          f"最大 {latencies[-1] * 1000:.0f} ms")
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="LINE API模擬服務")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="啟動模擬服務")
+    serve.add_argument("--port", type=int, default=9000)
+    serve.add_argument("--latency", type=float, default=0.0, help="每個API調用的延遲（秒）")
+    send = subparsers.add_parser("send", help="向Webhook發送測試事件")
+    send.add_argument("text")
+    send.add_argument("--url", default="http://localhost:8000/callback")
+    send.add_argument("--secret", required=True)
+    send.add_argument("--count", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        uvicorn.run(create_mock_app(latency=args.latency), host="0.0.0.0", port=args.port)
+    else:
+        send_events(args.url, args.secret, args.text, args.count)
+
+
+if __name__ == "__main__":
+    main()
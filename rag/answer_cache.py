@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""語義回答緩存
+
+重複的問題（例如「營業稅申報期限」）直接返回之前的回答，不再檢索和調用模型。
+問題先正規化（全半形、簡繁、空白和標點），按雜湊精確匹配，未命中時再按嵌入相似度匹配。
+每個回答記錄其來源文檔的指紋，來源文檔更新或刪除後緩存自動失效；過期（TTL）和
+超出容量（LRU）的條目會被淘汰。
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from dataclasses import dataclass, field
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag import config
+
+# 常用簡體字與對應繁體字，兩兩一組；安裝了opencc時改用opencc轉換
+SIMPLIFIED_TRADITIONAL = (
+    "税稅营營业業报報险險费費额額发發给給应應当當请請问問么麼样樣时時间間个個们們这這"
+    "补補缴繳纳納单單据據凭憑证證书書账賬帐帳务務财財会會计計规規则則条條认認销銷进進"
+    "项項货貨劳勞动動资資产產赠贈遗遺继繼价價损損润潤贷貸经經济濟机機关關构構开開统統"
+    "电電转轉让讓买買卖賣门門赋賦审審罚罰滞滯处處记記录錄办辦续續复復议議诉訴讼訟内內"
+    "国國际際员員奖獎红紅东東储儲银銀贴貼现現兑兌换換汇匯决決预預结結举舉说說为為吗嗎"
+    "还還没沒过過后後对對于於与與从從无無优優减減实實总總数數较較长長区區县縣乡鄉镇鎮"
+    "码碼号號标標签籤类類别別档檔库庫导導视視频頻讯訊网網络絡页頁图圖质質疗療医醫药藥"
+    "养養残殘亲親属屬户戶农農渔漁车車辆輛烟煙娱娛乐樂园園艺藝术術学學赁賃馈饋围圍边邊"
+    "线線级級执執赔賠偿償债債权權选選择擇众眾筹籌兴興违違检檢确確适適范範细細节節领領"
+    "该該须須将將并並仅僅虽雖尽盡够夠几幾两兩万萬亿億钱錢币幣带帶来來里裡谁誰征徵课課"
+    "获獲邮郵递遞历歷满滿题題询詢"
+)
+SIMPLIFIED_TO_TRADITIONAL = str.maketrans(dict(zip(SIMPLIFIED_TRADITIONAL[0::2], SIMPLIFIED_TRADITIONAL[1::2])))
+
+
+def _opencc_converter():
+    try:
+        from opencc import OpenCC
+        return OpenCC("s2t")
+    except Exception:
+        return None
+
+
+_converter = _opencc_converter()
+
+
+def to_traditional(text):
+    """簡體轉繁體"""
+    if _converter is not None:
+        return _converter.convert(text)
+    return text.translate(SIMPLIFIED_TO_TRADITIONAL)
+
+
+def normalize_question(text):
+    """正規化問題：全半形統一、簡轉繁、小寫，並去掉空白和標點"""
+    text = to_traditional(unicodedata.normalize("NFKC", text)).lower()
+    return "".join(char for char in text if unicodedata.category(char)[0] not in "PZC")
+
+
+def unit_vector(vector):
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class QuestionMatrix:
+    """一個命名空間中單位化的問題向量
+
+    寫入和刪除只改動一行：新問題追加到末尾（容量按倍數增長），刪除時把最後一行移到空出的位置，
+    不必每次寫入後都從SQLite重新載入整個命名空間。
+    """
+
+    def __init__(self, keys=(), vectors=None):
+        self.keys = list(keys)
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+        self._vectors = vectors
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def matrix(self):
+        return self._vectors[:len(self.keys)] if self.keys else None
+
+    def set(self, key, vector):
+        position = self.positions.get(key)
+        if position is None:
+            position = len(self.keys)
+            if self._vectors is None:
+                self._vectors = np.empty((16, len(vector)), dtype=np.float32)
+            elif position == len(self._vectors):
+                self._vectors = np.concatenate([self._vectors, np.empty_like(self._vectors)])
+            self.keys.append(key)
+            self.positions[key] = position
+        self._vectors[position] = unit_vector(vector)
+
+    def remove(self, key):
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        last = len(self.keys) - 1
+        if position != last:
+            moved = self.keys[last]
+            self.keys[position] = moved
+            self.positions[moved] = position
+            self._vectors[position] = self._vectors[last]
+        self.keys.pop()
+
+
+@dataclass
+class CachedAnswer:
+    """命中的緩存回答"""
+    answer: str
+    source_documents: list = field(default_factory=list)
+    # "exact" 或 "semantic"
+    match: str = "exact"
+    similarity: float = 1.0
+
+
+class AnswerCache:
+    """SQLite回答緩存，按命名空間（模型與系統提示）隔離
+
+    version_lookup(doc_ids) 返回 {doc_id: 當前指紋}，用於判斷來源文檔是否已變更；
+    embeddings 用於語義匹配，不提供時只做精確匹配。
+    """
+
+    def __init__(self, path=config.ANSWER_CACHE_PATH, embeddings=None, version_lookup=None,
+                 threshold=config.ANSWER_CACHE_THRESHOLD, ttl=config.ANSWER_CACHE_TTL,
+                 max_entries=config.ANSWER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.embeddings = embeddings
+        self.version_lookup = version_lookup
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        # 命名空間 -> QuestionMatrix，第一次語義查詢時載入，之後隨寫入和刪除逐行更新
+        self._matrices = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                namespace TEXT NOT NULL,
+                question_hash TEXT NOT NULL,
+                question TEXT NOT NULL,
+                vector BLOB,
+                answer TEXT NOT NULL,
+                sources TEXT NOT NULL,
+                versions TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (namespace, question_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_access ON answers (last_access)")
+        self._conn.commit()
+
+    def _current_versions(self, doc_ids):
+        if self.version_lookup is None:
+            return {}
+        return self.version_lookup(sorted(set(doc_ids)))
+
+    def _embed(self, normalized):
+        return np.array(self.embeddings.embed_query(normalized), dtype=np.float32)
+
+    def _matrix(self, namespace):
+        if namespace not in self._matrices:
+            rows = self._conn.execute(
+                "SELECT question_hash, vector FROM answers WHERE namespace = ? AND vector IS NOT NULL",
+                (namespace,)
+            ).fetchall()
+            matrix = None
+            if rows:
+                matrix = np.array([array("f", blob) for _, blob in rows], dtype=np.float32)
+                matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+            self._matrices[namespace] = QuestionMatrix([key for key, _ in rows], matrix)
+        return self._matrices[namespace]
+
+    def _forget(self, namespace, key):
+        """從已載入的向量矩陣中移除一個問題"""
+        matrix = self._matrices.get(namespace)
+        if matrix is not None:
+            matrix.remove(key)
+
+    def _nearest(self, namespace, vector):
+        """返回相似度最高的 (問題雜湊, 相似度)"""
+        vector = unit_vector(vector)
+        # 矩陣會被寫入原地修改，相似度在鎖內計算（一次矩陣向量乘法）
+        with self._lock:
+            matrix = self._matrix(namespace)
+            if not len(matrix):
+                return None, 0.0
+            similarities = matrix.matrix @ vector
+            best = int(np.argmax(similarities))
+            return matrix.keys[best], float(similarities[best])
+
+    def _delete(self, namespace, key):
+        self._conn.execute("DELETE FROM answers WHERE namespace = ? AND question_hash = ?", (namespace, key))
+        self._conn.commit()
+        self._forget(namespace, key)
+
+    def lookup(self, namespace, question):
+        """查詢緩存，返回CachedAnswer，未命中時返回None"""
+        normalized = normalize_question(question)
+        key = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        match, similarity = "exact", 1.0
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer, sources, versions, created_at FROM answers WHERE namespace = ? AND question_hash = ?",
+                (namespace, key)
+            ).fetchone()
+
+        if row is None and self.embeddings is not None and normalized:
+            nearest, similarity = self._nearest(namespace, self._embed(normalized))
+            if nearest is not None and similarity >= self.threshold:
+                key, match = nearest, "semantic"
+                with self._lock:
+                    row = self._conn.execute(
+                        "SELECT answer, sources, versions, created_at FROM answers "
+                        "WHERE namespace = ? AND question_hash = ?",
+                        (namespace, key)
+                    ).fetchone()
+
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        answer, sources, versions, created_at = row
+        versions = json.loads(versions)
+        expired = self.ttl and time.time() - created_at > self.ttl
+        # 來源文檔已更新或刪除時回答作廢
+        stale = not expired and self._current_versions(versions) != versions
+        with self._lock:
+            if expired or stale:
+                self._delete(namespace, key)
+                self.misses += 1
+                if expired:
+                    self.expired += 1
+                else:
+                    self.invalidated += 1
+                return None
+            self._conn.execute(
+                "UPDATE answers SET last_access = ? WHERE namespace = ? AND question_hash = ?",
+                (time.time(), namespace, key)
+            )
+            self._conn.commit()
+            if match == "exact":
+                self.exact_hits += 1
+            else:
+                self.semantic_hits += 1
+
+        source_documents = [Document(page_content=doc["page_content"], metadata=doc["metadata"])
+                            for doc in json.loads(sources)]
+        return CachedAnswer(answer=answer, source_documents=source_documents, match=match, similarity=similarity)
+
+    def put(self, namespace, question, answer, source_documents):
+        """寫入一個回答，記錄來源文檔的當前指紋"""
+        if not answer:
+            return
+        normalized = normalize_question(question)
+        key = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        vector = None
+        if self.embeddings is not None and normalized:
+            vector = self._embed(normalized)
+        doc_ids = [doc.metadata.get("doc_id", "") for doc in source_documents]
+        versions = self._current_versions(doc_ids)
+        sources = [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in source_documents]
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (namespace, question_hash, question, vector, answer, sources, "
+                "versions, created_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, question, vector.tobytes() if vector is not None else None, answer,
+                 json.dumps(sources, ensure_ascii=False), json.dumps(versions, ensure_ascii=False), now, now)
+            )
+            evicted = self._evict(now)
+            self._conn.commit()
+            # 只更新受影響的行，未載入的命名空間在下次查詢時載入
+            for evicted_namespace, evicted_key in evicted:
+                self._forget(evicted_namespace, evicted_key)
+            matrix = self._matrices.get(namespace)
+            if matrix is not None and (namespace, key) not in evicted:
+                if vector is not None:
+                    matrix.set(key, vector)
+                else:
+                    matrix.remove(key)
+
+    def _evict(self, now):
+        """刪除過期和超出容量的條目，返回被刪除的 {(命名空間, 問題雜湊)}"""
+        victims = []
+        if self.ttl:
+            victims += self._conn.execute(
+                "SELECT rowid, namespace, question_hash FROM answers WHERE created_at < ?", (now - self.ttl,)
+            ).fetchall()
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        overflow = count - len(victims) - self.max_entries
+        if overflow > 0:
+            expired = [rowid for rowid, _, _ in victims]
+            victims += self._conn.execute(
+                f"SELECT rowid, namespace, question_hash FROM answers "
+                f"WHERE rowid NOT IN ({','.join('?' * len(expired))}) ORDER BY last_access LIMIT ?",
+                (*expired, overflow)
+            ).fetchall()
+        self._conn.executemany("DELETE FROM answers WHERE rowid = ?", [(rowid,) for rowid, _, _ in victims])
+        return {(namespace, key) for _, namespace, key in victims}
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+            self._matrices.clear()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    @property
+    def hits(self):
+        return self.exact_hits + self.semantic_hits
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "invalidated": self.invalidated,
+            "expired": self.expired,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+        }
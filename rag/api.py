@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""無介面的HTTP問答服務
+
+與Streamlit介面共用同一套知識庫和問答流程，可以多實例部署在負載均衡之後：
+
+    python -m rag.api --port 8080 --workers 4
+    LLM_BACKEND=fake python -m rag.api      # 使用離線假模型壓測
+
+接口：
+    POST /query          問答，返回完整回答和來源；filters限定檢索的分類、類型、標籤和添加日期，
+                         model為auto時按問題在快速模型和強模型之間路由（返回route和route_reason）
+    POST /query/stream   問答，以SSE逐段返回回答
+    GET  /filters        可選的分類、類型和標籤
+    GET  /documents      列出知識庫文檔
+    POST /documents      上傳文檔（請求體為文件內容，name/category/tags為查詢參數）；內容與已有文檔相同時
+                         只更新已有文檔的分類和標籤（linked為true）
+    PUT  /documents/{id} 替換文檔內容（請求體為新文件，name為可選的查詢參數），只重新嵌入該文檔
+    DELETE /documents/{id} 刪除文檔、存儲的文件和它的向量
+    POST /reindex        把文檔目錄增量同步到向量存儲；mode=rebuild 時在背景完整重建並返回任務（202）
+    GET  /reindex        最近一次背景重建任務的狀態和進度
+    GET  /reindex/{id}   背景重建任務的狀態和進度（任務記錄在提交它的工作進程中）
+    POST /compact        清除已刪除的向量，回收索引佔用的磁碟空間
+    GET  /metrics        各階段耗時和token用量（Prometheus文本格式）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from langchain_core.messages import AIMessage, HumanMessage
+from pydantic import BaseModel, Field
+
+from rag import config
+from rag.catalog import get_catalog
+from rag.filters import build_filter
+from rag.ingest import SUPPORTED_EXTENSIONS, BulkIngestor, HashingWriter, new_document_entry
+from rag.knowledge_base import KnowledgeBase
+from rag.llm import get_chat_model
+from rag.metrics import get_metrics
+from rag.pipeline import DEFAULT_SYSTEM_PROMPT, RAGPipeline, youtube_link
+from rag.reindex import REBUILD
+from rag.router import AUTO_MODEL, STRONG, create_router
+
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+
+class QueryFilters(BaseModel):
+    """檢索範圍：同一項中的多個值為「或」，不同項之間為「且」；日期為ISO格式"""
+    categories: List[str] = []
+    types: List[str] = []
+    tags: List[str] = []
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+
+
+class QueryRequest(BaseModel):
+    question: str
+    history: List[ChatMessage] = []
+    k: int = Field(6, ge=1, le=config.API_MAX_K)
+    # CHAT_MODEL、API_MODELS中的模型或auto；未指定時使用CHAT_MODEL
+    model: Optional[str] = None
+    filters: Optional[QueryFilters] = None
+
+
+def to_chat_history(history):
+    """把請求中的對話記錄轉成消息列表"""
+    return [
+        HumanMessage(content=message.content) if message.role == "user" else AIMessage(content=message.content)
+        for message in history
+    ]
+
+
+def to_filter(filters):
+    """把請求中的檢索範圍轉成向量存儲的過濾條件"""
+    if filters is None:
+        return None
+    try:
+        return build_filter(filters.categories, filters.types, filters.tags, filters.date_from, filters.date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"無效的日期: {e}")
+
+
+def source_payload(doc):
+    """來源文檔的JSON表示"""
+    metadata = doc.metadata
+    payload = {
+        "doc_id": metadata.get("doc_id", ""),
+        "source": metadata.get("source", ""),
+        "type": metadata.get("type", ""),
+        "category": metadata.get("category", ""),
+        "content": doc.page_content,
+    }
+    if metadata.get("type") == "youtube":
+        payload["link"] = youtube_link(metadata)
+    return payload
+
+
+def result_payload(result):
+    """查詢結果的JSON表示（不含來源）"""
+    return {
+        "question": result.question,
+        "standalone_question": result.standalone_question,
+        "answer": result.answer,
+        "cache_hit": result.cache_hit,
+        "retrieval_seconds": result.retrieval_seconds,
+        "time_to_first_token": result.time_to_first_token,
+        "total_seconds": result.total_seconds,
+        "prompt_tokens": result.prompt_tokens,
+        "stage_seconds": result.stage_seconds,
+        "usage": result.usage,
+        "model": result.model,
+        "route": result.route,
+        "route_reason": result.route_reason,
+    }
+
+
+async def receive_file(request, path):
+    """把請求體邊接收邊寫入文件並計算SHA-256，不把整個文件讀進記憶體；磁碟寫入在執行緒池中進行，不阻塞事件循環"""
+    f = await run_in_threadpool(open, path, "wb")
+    try:
+        writer = HashingWriter(f)
+        async for chunk in request.stream():
+            await run_in_threadpool(writer.write, chunk)
+    finally:
+        await run_in_threadpool(f.close)
+    return writer.hexdigest()
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def create_app(knowledge_base=None, system_prompt=DEFAULT_SYSTEM_PROMPT):
+    """建立服務；knowledge_base未提供時在啟動時打開預設的共用知識庫"""
+
+    @asynccontextmanager
+    async def lifespan(app):
+        if app.state.knowledge_base is None:
+            config.ensure_data_dirs()
+            app.state.knowledge_base = KnowledgeBase(get_catalog())
+        yield
+
+    app = FastAPI(title="財務稅法QA機器人", lifespan=lifespan)
+    app.state.knowledge_base = knowledge_base
+    app.state.pipelines = OrderedDict()
+    app.state.reindex_lock = asyncio.Lock()
+
+    def get_pipeline(model, k):
+        """同一模型和k值的問答流程在請求之間共用；只接受設定中的模型，共用的流程數有上限"""
+        model = model or config.CHAT_MODEL
+        if model != AUTO_MODEL and model not in config.API_MODELS:
+            raise HTTPException(status_code=400, detail=f"不支持的模型: {model}，可用的模型: "
+                                                        f"{', '.join(config.API_MODELS + [AUTO_MODEL])}")
+        key = (model, k)
+        pipelines = app.state.pipelines
+        if key in pipelines:
+            pipelines.move_to_end(key)
+        else:
+            kb = app.state.knowledge_base
+            # model為auto時按問題在快速模型和強模型之間路由
+            router = create_router() if key[0] == AUTO_MODEL else None
+            pipelines[key] = RAGPipeline(
+                retriever=kb.as_retriever(k=k),
+                llm=router.llm(STRONG) if router is not None else get_chat_model(model=key[0]),
+                system_prompt=system_prompt,
+                answer_cache=kb.answer_cache,
+                router=router
+            )
+            while len(pipelines) > config.API_MAX_PIPELINES:
+                pipelines.popitem(last=False)
+        return pipelines[key]
+
+    @app.get("/health")
+    async def health():
+        kb = app.state.knowledge_base
+        return {"status": "ok", "documents": len(kb.catalog), "indexed": kb.is_indexed}
+
+    @app.get("/metrics")
+    async def metrics():
+        return PlainTextResponse(get_metrics().export_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @app.post("/query")
+    async def query(request: QueryRequest):
+        pipeline = get_pipeline(request.model, request.k)
+        result = await pipeline.aprepare(
+            request.question, to_chat_history(request.history), filter=to_filter(request.filters)
+        )
+        async for _ in pipeline.astream(result):
+            pass
+        return {**result_payload(result), "sources": [source_payload(doc) for doc in result.source_documents]}
+
+    @app.post("/query/stream")
+    async def query_stream(request: QueryRequest):
+        pipeline = get_pipeline(request.model, request.k)
+        result = await pipeline.aprepare(
+            request.question, to_chat_history(request.history), filter=to_filter(request.filters)
+        )
+
+        async def events():
+            # 先送出來源，客戶端可以在生成期間顯示
+            yield sse_event("sources", [source_payload(doc) for doc in result.source_documents])
+            async for text in pipeline.astream(result):
+                yield sse_event("token", {"text": text})
+            yield sse_event("done", result_payload(result))
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/filters")
+    async def filter_options():
+        return await run_in_threadpool(app.state.knowledge_base.filter_options)
+
+    @app.get("/documents")
+    async def list_documents():
+        return await run_in_threadpool(app.state.knowledge_base.catalog.list_documents)
+
+    @app.post("/documents")
+    async def upload_document(request: Request, name: str, category: str = "財務稅法", tags: str = "財務,稅法"):
+        if os.path.splitext(name)[1].lower() not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"不支持的文件類型: {name}")
+        doc_info = new_document_entry(name, category, [tag.strip() for tag in tags.split(",") if tag.strip()])
+        try:
+            doc_info["content_hash"] = await receive_file(request, doc_info["path"])
+        except BaseException:
+            # 客戶端中斷上傳時不留下不完整的文件
+            if os.path.exists(doc_info["path"]):
+                os.remove(doc_info["path"])
+            raise
+
+        kb = app.state.knowledge_base
+        # 在執行緒池中解析這一個文件，不為每次上傳fork服務進程
+        ingestor = BulkIngestor(kb, parse_workers=1, processes=False)
+        report = await run_in_threadpool(ingestor.run, [doc_info])
+        if report.failures:
+            raise HTTPException(status_code=422, detail=report.failures[0][1])
+        if report.linked:
+            # 內容與已有文檔相同：不重複存儲和嵌入，只更新了已有文檔的分類和標籤
+            existing = await run_in_threadpool(kb.catalog.find_by_content_hash, doc_info["content_hash"])
+            return {"document": existing, "linked": True, "chunks": 0, "seconds": report.seconds}
+        return {"document": doc_info, "linked": False, "chunks": report.chunks, "seconds": report.seconds}
+
+    @app.put("/documents/{doc_id}")
+    async def replace_document(doc_id: str, request: Request, name: Optional[str] = None):
+        kb = app.state.knowledge_base
+        doc_info = await run_in_threadpool(kb.catalog.get, doc_id)
+        if doc_info is None:
+            raise HTTPException(status_code=404, detail=f"文檔不存在: {doc_id}")
+        extension = os.path.splitext(name or doc_info["name"])[1].lower()
+        if extension not in SUPPORTED_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"不支持的文件類型: {name or doc_info['name']}")
+        # 先寫入臨時文件，建好索引後才替換原文件
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(doc_info["path"]), suffix=extension)
+        os.close(fd)
+        try:
+            content_hash = await receive_file(request, tmp_path)
+            stats = await run_in_threadpool(kb.replace_document, doc_id, tmp_path, name, content_hash)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return {"document": kb.catalog.get(doc_id), **asdict(stats)}
+
+    @app.delete("/documents/{doc_id}")
+    async def delete_document(doc_id: str):
+        try:
+            chunks = await run_in_threadpool(app.state.knowledge_base.delete_document, doc_id)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"文檔不存在: {doc_id}")
+        return {"doc_id": doc_id, "chunks_removed": chunks}
+
+    @app.post("/reindex")
+    async def reindex(mode: str = Query("sync", pattern="^(sync|rebuild)$")):
+        kb = app.state.knowledge_base
+        if mode == "rebuild":
+            # 在背景的新一代索引中重建，建好後原子切換，期間查詢照常使用舊索引
+            job = kb.reindex_worker.submit(REBUILD)
+            return JSONResponse(job.to_dict(), status_code=202)
+        # 同一進程內同時只進行一次同步，期間查詢由知識庫的讀寫鎖協調
+        async with app.state.reindex_lock:
+            stats = await run_in_threadpool(kb.sync)
+        return asdict(stats)
+
+    @app.get("/reindex")
+    async def latest_reindex():
+        job = app.state.knowledge_base.reindex_worker.latest()
+        if job is None:
+            raise HTTPException(status_code=404, detail="沒有重建任務")
+        return job.to_dict()
+
+    @app.get("/reindex/{job_id}")
+    async def reindex_status(job_id: str):
+        job = app.state.knowledge_base.reindex_worker.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"重建任務不存在: {job_id}")
+        return job.to_dict()
+
+    @app.post("/compact")
+    async def compact():
+        async with app.state.reindex_lock:
+            return await run_in_threadpool(app.state.knowledge_base.compact)
+
+    return app
+
+
+app = create_app()
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="啟動問答HTTP服務")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=1, help="工作進程數")
+    args = parser.parse_args()
+    uvicorn.run("rag.api:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
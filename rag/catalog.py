@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""持久化的文檔目錄
+
+取代只存在於Streamlit會話中的document_list，所有會話和進程共用同一份SQLite目錄，
+重啟後無需重新添加文檔。條目按文件內容的SHA-256（content_hash）和youtube_id建有索引，
+用於識別重複上傳。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from rag import config
+from rag.loaders import file_sha256
+
+
+class DocumentCatalog:
+    """文檔目錄，每個條目的結構與原先的document_list元素相同"""
+
+    def __init__(self, path=config.CATALOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._backfilled = False
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                youtube_id TEXT,
+                content_hash TEXT,
+                date_added TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+        # 舊版目錄沒有content_hash欄位
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(documents)")}
+        if "content_hash" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_youtube ON documents (youtube_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_content ON documents (content_hash)")
+        self._conn.commit()
+
+    def list_documents(self):
+        """按添加時間列出全部文檔"""
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM documents ORDER BY date_added").fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def get(self, doc_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by_content_hash(self, content_hash):
+        """內容相同的文檔（最早添加的一個），沒有時返回None"""
+        self._backfill_content_hashes()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM documents WHERE content_hash = ? ORDER BY date_added LIMIT 1", (content_hash,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def find_by_youtube_id(self, youtube_id):
+        """已添加的同一部YouTube影片，沒有時返回None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM documents WHERE youtube_id = ? ORDER BY date_added LIMIT 1", (youtube_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _backfill_content_hashes(self):
+        """為舊版目錄中沒有記錄內容雜湊的文件補算一次"""
+        if self._backfilled:
+            return
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM documents WHERE content_hash IS NULL AND youtube_id IS NULL"
+            ).fetchall()
+        for (data,) in rows:
+            doc_info = json.loads(data)
+            if not os.path.exists(doc_info["path"]):
+                continue
+            content_hash = file_sha256(doc_info["path"])
+            # 原地更新，期間被刪除或修改的條目不受影響
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE documents SET content_hash = ?, data = json_set(data, '$.content_hash', ?) "
+                    "WHERE id = ? AND content_hash IS NULL",
+                    (content_hash, content_hash, doc_info["id"])
+                )
+                self._conn.commit()
+        self._backfilled = True
+
+    def add(self, doc_info):
+        """添加或覆蓋一個文檔條目"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (id, youtube_id, content_hash, date_added, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    doc_info["id"],
+                    doc_info.get("youtube_id"),
+                    doc_info.get("content_hash"),
+                    doc_info["date_added"],
+                    json.dumps(doc_info, ensure_ascii=False)
+                )
+            )
+            self._conn.commit()
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def import_orphan_files(self, category="財務稅法", tags=None):
+        """把數據目錄中尚未登記的文件補登到目錄（舊版只存在會話中的文檔）"""
+        tags = tags or ["財務", "稅法"]
+        known_paths = {os.path.normpath(doc["path"]) for doc in self.list_documents()}
+        imported = 0
+        for directory, doc_type in ((config.DOCUMENTS_DIR, None), (config.YOUTUBE_DIR, "youtube")):
+            if not os.path.isdir(directory):
+                continue
+            for file_name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, file_name)
+                doc_id, extension = os.path.splitext(file_name)
+                if not os.path.isfile(path) or os.path.normpath(path) in known_paths:
+                    continue
+                if doc_type == "youtube" and extension != ".txt":
+                    continue
+                self.add({
+                    "id": doc_id,
+                    "name": file_name,
+                    "type": doc_type or extension[1:].lower(),
+                    "category": category,
+                    "tags": tags,
+                    "date_added": datetime.fromtimestamp(os.path.getmtime(path)).isoformat(),
+                    "path": path
+                })
+                imported += 1
+        return imported
+
+
+_shared_catalog = None
+_shared_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """進程內共用的文檔目錄，首次創建時補登已存在的文件"""
+    global _shared_catalog
+    with _shared_catalog_lock:
+        if _shared_catalog is None:
+            is_new = not os.path.exists(config.CATALOG_PATH)
+            _shared_catalog = DocumentCatalog()
+            if is_new:
+                _shared_catalog.import_orphan_files()
+        return _shared_catalog
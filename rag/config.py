@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""路徑與知識庫參數設置"""
+
+import json
+import os
+
+# 數據目錄
+DATA_DIR = os.getenv("DATA_DIR", "data")
+DOCUMENTS_DIR = os.path.join(DATA_DIR, "documents")
+YOUTUBE_DIR = os.path.join(DATA_DIR, "youtube")
+VECTORSTORE_DIR = os.path.join(DATA_DIR, "vectorstore")
+
+# YouTube提取結果緩存（按youtube_id）
+YOUTUBE_CACHE_DIR = os.path.join(YOUTUBE_DIR, "cache")
+
+# 抽取文本存儲：PDF、Word每頁的文本按文件內容雜湊保存，重建時不再重新解析
+TEXT_STORE_DIR = os.path.join(DATA_DIR, "texts")
+
+# 持久化文檔目錄
+CATALOG_PATH = os.path.join(DATA_DIR, "catalog.sqlite")
+
+# 增量索引狀態：記錄每個doc_id已嵌入的內容雜湊和向量ID
+INDEX_STATE_PATH = os.path.join(DATA_DIR, "index_state.json")
+# 索引狀態和詞彙索引每次都是整個文件重寫，同步過程中按這個最短間隔（秒）寫入，同步和批量導入結束時一定寫入；
+# 中斷時間隔內的變更在下次同步時重做（嵌入緩存命中）
+INDEX_SAVE_INTERVAL = float(os.getenv("INDEX_SAVE_INTERVAL", "30"))
+
+# 向量存儲後端：chroma（預設）或 faiss。FAISS的索引與元數據表存放在FAISS_DIR，
+# 索引狀態分開記錄，切換後端後更新知識庫會重新寫入全部文檔（嵌入緩存命中，不重複調用API）
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+FAISS_DIR = os.path.join(DATA_DIR, "faiss")
+FAISS_INDEX_STATE_PATH = os.path.join(FAISS_DIR, "index_state.json")
+FAISS_LEXICAL_INDEX_PATH = os.path.join(FAISS_DIR, "lexical_index.pkl")
+# 索引類型：ivf（向量數達到FAISS_IVF_MIN_VECTORS前為精確搜索）、hnsw 或 flat
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "ivf")
+FAISS_IVF_MIN_VECTORS = int(os.getenv("FAISS_IVF_MIN_VECTORS", "10000"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+# 寫入索引文件的最短間隔（秒）；間隔內的變更由元數據表恢復，同步和批量導入結束時一定寫入
+FAISS_SAVE_INTERVAL = float(os.getenv("FAISS_SAVE_INTERVAL", "30"))
+
+# 嵌入緩存：以（模型，文本雜湊）為鍵，超過上限按LRU淘汰
+EMBEDDING_CACHE_PATH = os.path.join(DATA_DIR, "embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+# 詞彙索引（BM25）與混合檢索
+LEXICAL_INDEX_PATH = os.path.join(DATA_DIR, "lexical_index.pkl")
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+
+# 檢索結果重排：多取RERANK_CANDIDATES個候選，去掉詞項Jaccard相似度（MinHash估計）不低於
+# RERANK_DEDUPE_THRESHOLD的近似重複，
+# 重新評分後在RERANK_TOKEN_BUDGET個token內保留最好的k個。RERANK_MODEL為 lexical 或 cross-encoder:<模型名>
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "lexical")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_TOKEN_BUDGET = int(os.getenv("RERANK_TOKEN_BUDGET", "2000"))
+RERANK_DEDUPE_THRESHOLD = float(os.getenv("RERANK_DEDUPE_THRESHOLD", "0.9"))
+# 緩存最近重排過的文本塊的切詞結果和token數
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))
+
+# 語義回答緩存：相似度閾值、有效期（秒，0為不過期）和容量上限
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_PATH = os.path.join(DATA_DIR, "answer_cache.sqlite")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+
+# 對話記憶：最近N輪逐字保留，其餘摘要化；token預算可按模型覆蓋，例如
+# MEMORY_TOKEN_BUDGET='{"gpt-4o": 3000}'
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "4"))
+MEMORY_TOKEN_BUDGET = {
+    "default": 1500,
+    **json.loads(os.getenv("MEMORY_TOKEN_BUDGET", "{}"))
+}
+# 服務端按用戶保存記憶時的用戶數上限和閒置淘汰時間（秒）
+MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", "10000"))
+MEMORY_IDLE_TTL = int(os.getenv("MEMORY_IDLE_TTL", str(24 * 3600)))
+
+# 模型：LLM_BACKEND=fake 時使用離線假模型（壓測用），假模型每個字的生成延遲為FAKE_LLM_TOKEN_SECONDS
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-3.5-turbo-16k")
+FAKE_LLM_TOKEN_SECONDS = float(os.getenv("FAKE_LLM_TOKEN_SECONDS", "0.01"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+# 模型路由：模型設為 auto（例如 CHAT_MODEL=auto）時，問題改寫和簡單問題使用快速模型，需要綜合多份文檔的
+# 問題使用強模型。ROUTER_CLASSIFIER 為 heuristic 或 "模組:類別" 形式的自定義分類器；分類器出錯或返回未知的路由時
+# 使用 ROUTER_FALLBACK（fast 或 strong）。
+# 啟發式分類器在以下信號中至少ROUTER_STRONG_SIGNALS個成立時選強模型：問題不少於ROUTER_LONG_QUESTION_TOKENS個token、
+# 相關性分數不低於最高分ROUTER_RELEVANCE_RATIO倍的文本塊來自至少ROUTER_MIN_SOURCES份文檔、
+# 最高分與次高分的相對差距小於ROUTER_SCORE_SPREAD（沒有明顯最相關的文本塊）、對話已有至少ROUTER_HISTORY_TURNS輪
+ROUTER_FAST_MODEL = os.getenv("ROUTER_FAST_MODEL", "gpt-4o-mini")
+ROUTER_STRONG_MODEL = os.getenv("ROUTER_STRONG_MODEL", "gpt-4o")
+ROUTER_CLASSIFIER = os.getenv("ROUTER_CLASSIFIER", "heuristic")
+ROUTER_FALLBACK = os.getenv("ROUTER_FALLBACK", "strong")
+ROUTER_STRONG_SIGNALS = int(os.getenv("ROUTER_STRONG_SIGNALS", "2"))
+ROUTER_LONG_QUESTION_TOKENS = int(os.getenv("ROUTER_LONG_QUESTION_TOKENS", "40"))
+ROUTER_RELEVANCE_RATIO = float(os.getenv("ROUTER_RELEVANCE_RATIO", "0.7"))
+ROUTER_MIN_SOURCES = int(os.getenv("ROUTER_MIN_SOURCES", "2"))
+ROUTER_SCORE_SPREAD = float(os.getenv("ROUTER_SCORE_SPREAD", "0.1"))
+ROUTER_HISTORY_TURNS = int(os.getenv("ROUTER_HISTORY_TURNS", "3"))
+
+# HTTP服務：請求可以指定的模型（CHAT_MODEL、路由的兩個模型、auto，以及API_MODELS中逗號分隔的其他模型），
+# k的上限，以及按（模型，k）共用的問答流程的數量上限（超過時淘汰最久未用的）
+API_MODELS = sorted({
+    CHAT_MODEL, ROUTER_FAST_MODEL, ROUTER_STRONG_MODEL,
+    *[model.strip() for model in os.getenv("API_MODELS", "").split(",") if model.strip()]
+} - {"auto"})
+API_MAX_K = int(os.getenv("API_MAX_K", "20"))
+API_MAX_PIPELINES = int(os.getenv("API_MAX_PIPELINES", "16"))
+
+# OpenAI請求調度：所有聊天和嵌入請求經過進程內共用的調度器，按模型以令牌桶限制每分鐘的請求數（rpm）和
+# token數（tpm），聊天優先於背景索引，429時帶抖動退避重試。限額可按模型覆蓋，例如
+# OPENAI_RATE_LIMITS='{"gpt-4o": {"rpm": 500, "tpm": 30000}}'
+OPENAI_SCHEDULER_ENABLED = os.getenv("OPENAI_SCHEDULER_ENABLED", "true").lower() == "true"
+OPENAI_RATE_LIMITS = {
+    "default": {"rpm": 3000, "tpm": 1000000},
+    **json.loads(os.getenv("OPENAI_RATE_LIMITS", "{}"))
+}
+# 背景請求（索引）不使用每個令牌桶最後這一比例的額度，保留給聊天
+OPENAI_INTERACTIVE_RESERVE = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", "0.2"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+# 退避時間在 0 到 min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2^重試次數) 之間隨機；服務端給了Retry-After時按它等待
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "30"))
+# 請求沒有指定max_tokens時預留的輸出token數
+OPENAI_COMPLETION_TOKENS = int(os.getenv("OPENAI_COMPLETION_TOKENS", "512"))
+# 嵌入的批次大小：成功時逐步增大，被限流時減半
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_MIN_BATCH_SIZE = int(os.getenv("EMBEDDING_MIN_BATCH_SIZE", "8"))
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+
+# 每1000個token的價格（美元，輸入、輸出），按模型名稱前綴匹配，用於估算費用；可以用
+# MODEL_PRICES='{"gpt-4o": [0.0025, 0.01]}' 覆蓋
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4-turbo": (0.01, 0.03),
+    **{model: tuple(prices) for model, prices in json.loads(os.getenv("MODEL_PRICES", "{}")).items()}
+}
+
+# 指標：每個階段保留最近N次耗時，用於顯示百分位
+METRICS_RECENT_SIZE = int(os.getenv("METRICS_RECENT_SIZE", "200"))
+
+# 文本分割參數：以模型token數計算，可按分類覆蓋，例如
+# CHUNK_SETTINGS='{"營業稅": {"chunk_size": 300, "chunk_overlap": 50}}'
+# 預設值取自 python -m benchmarks.bench_splitter（k=6）：舊版1000字符分割命中率47.5%、提示約4984 token；
+# 500/80 token提示減半（2451）但命中率降到42.1%，300/50為44.2%；250/80命中率47.9%、提示約1147 token。
+# 更小的塊（200 token命中率54%）在合成語料上更好，但實際法規條文較長，容易把一條切成幾段，未採用
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "gpt-3.5-turbo")
+CHUNK_SETTINGS = {
+    "default": {"chunk_size": 250, "chunk_overlap": 80},
+    **json.loads(os.getenv("CHUNK_SETTINGS", "{}"))
+}
+
+# YouTube字幕按時間合併成片段的最大字符數
+YOUTUBE_SEGMENT_CHARS = 1000
+
+# LINE機器人：API地址可以指向本地模擬服務；回答在背景執行緒池中生成
+LINE_CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET", "")
+LINE_CHANNEL_ACCESS_TOKEN = os.getenv("LINE_CHANNEL_ACCESS_TOKEN", "")
+LINE_API_BASE = os.getenv("LINE_API_BASE", "https://api.line.me")
+LINE_WORKERS = int(os.getenv("LINE_WORKERS", "8"))
+LINE_MAX_PENDING = int(os.getenv("LINE_MAX_PENDING", "200"))
+# 每個用戶最多排隊等待回答的訊息數，超過時回覆忙碌提示
+LINE_MAX_QUEUED_PER_USER = int(os.getenv("LINE_MAX_QUEUED_PER_USER", "5"))
+
+
+def ensure_data_dirs():
+    """建立所需的數據目錄"""
+    for path in (DOCUMENTS_DIR, YOUTUBE_DIR, VECTORSTORE_DIR, FAISS_DIR, TEXT_STORE_DIR):
+        os.makedirs(path, exist_ok=True)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""以內容定址的嵌入向量緩存
+
+鍵為（模型名稱，正規化文本的SHA-256），存放在SQLite中，跨重建、跨會話共用。
+超過容量上限時按最近使用時間淘汰（LRU）。每寫入容量的1%才統計一次條目數並淘汰，條目數最多短暫超出上限1%；
+讀取時的使用時間先記在內存中，隨下一次寫入、淘汰或累積到一批時一起提交。
+"""
+
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from rag import config
+from rag.metrics import get_metrics
+
+
+def normalize_text(text):
+    """正規化文本：全半形統一並壓縮空白"""
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def text_key(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite嵌入緩存，帶命中統計和LRU容量限制"""
+
+    def __init__(self, path=config.EMBEDDING_CACHE_PATH, max_entries=config.EMBEDDING_CACHE_MAX_ENTRIES,
+                 evict_every=None, touch_batch=1000):
+        self.path = path
+        self.max_entries = max_entries
+        # 寫入多少條後檢查一次容量
+        self.evict_every = evict_every or max(1, max_entries // 100)
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self._written = 0
+        # (model, key) -> 最近讀取時間，尚未寫入數據庫
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings (last_access)")
+        self._conn.commit()
+
+    def get_many(self, model, keys):
+        """批量查詢，返回 {key: vector}"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite的參數數量有限制，分批查詢
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch]
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._touched.update(((model, key), now) for key in found)
+                if len(self._touched) >= self.touch_batch:
+                    self._flush_touched()
+                    self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, model, items):
+        """批量寫入 {key: vector}，並在超出容量時淘汰最久未使用的條目"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                [(model, key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            for key in items:
+                self._touched.pop((model, key), None)
+            self._flush_touched()
+            self._written += len(items)
+            if self._written >= self.evict_every:
+                self._evict()
+            self._conn.commit()
+
+    def flush(self):
+        """把內存中的讀取時間寫入數據庫"""
+        with self._lock:
+            self._flush_touched()
+            self._conn.commit()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                [(accessed, model, key) for (model, key), accessed in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _evict(self):
+        # 其他進程也可能寫入同一個數據庫，每次檢查時重新統計條目數
+        self._written = 0
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                (overflow,)
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "entries": len(self),
+            "max_entries": self.max_entries,
+        }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """進程內共用的嵌入緩存"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+        return _shared_cache
+
+
+class CachedEmbeddings(Embeddings):
+    """先查緩存、只對未命中的文本調用底層嵌入模型"""
+
+    def __init__(self, underlying, cache=None, model_name=None, metrics=None):
+        self.underlying = underlying
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.model_name = model_name or getattr(underlying, "model", type(underlying).__name__)
+        self.metrics = metrics if metrics is not None else get_metrics()
+
+    def embed_documents(self, texts):
+        keys = [text_key(text) for text in texts]
+        found = self.cache.get_many(self.model_name, keys)
+
+        # 同一批次中重複的文本只嵌入一次
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            # 只有實際調用嵌入模型的時間記為embed階段
+            with self.metrics.timer("embed"):
+                vectors = self.underlying.embed_documents(list(missing.values()))
+            # 與緩存中的float32精度保持一致，首次和後續重建得到相同的向量
+            computed = {key: array("f", vector).tolist() for key, vector in zip(missing.keys(), vectors)}
+            self.cache.put_many(self.model_name, computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = text_key(text)
+        found = self.cache.get_many(self.model_name, [key])
+        if key in found:
+            return found[key]
+        vector = array("f", self.underlying.embed_query(text)).tolist()
+        self.cache.put_many(self.model_name, {key: vector})
+        return vector
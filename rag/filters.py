@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""檢索範圍的元數據過濾
+
+過濾條件使用Chroma的where格式，直接傳給向量存儲在搜索時過濾（FAISS後端轉成SQL），
+詞彙索引用 metadata_matches 對同一條件求值。
+
+標籤原本以逗號連接成一個字串，無法按單個標籤過濾；寫入向量時每個標籤另外存成
+一個布爾欄位（tag_稅法: True），添加日期另存一個數值時間戳 date_added_ts 用於範圍比較。
+"""
+
+import re
+from datetime import date, datetime, time, timedelta
+
+TAG_PREFIX = "tag_"
+
+
+def split_tags(tags):
+    """標籤列表或逗號分隔的字串 → 去掉空白的標籤列表"""
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return [tag.strip() for tag in tags or () if tag and tag.strip()]
+
+
+def tag_key(tag):
+    """標籤對應的布爾元數據欄位"""
+    return TAG_PREFIX + re.sub(r"\W+", "_", tag.strip())
+
+
+def filter_metadata(doc_info):
+    """寫入向量時附加的可過濾元數據"""
+    metadata = {tag_key(tag): True for tag in split_tags(doc_info.get("tags"))}
+    if doc_info.get("date_added"):
+        metadata["date_added_ts"] = datetime.fromisoformat(doc_info["date_added"]).timestamp()
+    return metadata
+
+
+def _date_condition(value, end):
+    """日期或時間 → date_added_ts的比較條件；只給日期時結束日期包含當天"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value) if len(value) == 10 else datetime.fromisoformat(value)
+    if isinstance(value, datetime):
+        return {"$lte" if end else "$gte": value.timestamp()}
+    start = datetime.combine(value, time.min)
+    if end:
+        return {"$lt": (start + timedelta(days=1)).timestamp()}
+    return {"$gte": start.timestamp()}
+
+
+def build_filter(categories=None, types=None, tags=None, date_from=None, date_to=None):
+    """組合檢索範圍，返回Chroma格式的where條件；沒有任何條件時返回None
+
+    同一項中的多個值為「或」，不同項之間為「且」。
+    """
+    conditions = []
+    if categories:
+        conditions.append({"category": {"$in": list(categories)}})
+    if types:
+        conditions.append({"type": {"$in": list(types)}})
+    tag_conditions = [{tag_key(tag): True} for tag in split_tags(tags)]
+    if len(tag_conditions) == 1:
+        conditions.append(tag_conditions[0])
+    elif tag_conditions:
+        conditions.append({"$or": tag_conditions})
+    if date_from:
+        conditions.append({"date_added_ts": _date_condition(date_from, end=False)})
+    if date_to:
+        conditions.append({"date_added_ts": _date_condition(date_to, end=True)})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+_COMPARISONS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+}
+
+
+def metadata_matches(metadata, where):
+    """在Python中對一條元數據求值where條件（語義與向量存儲的過濾相同）"""
+    for key, value in where.items():
+        if key == "$and":
+            if not all(metadata_matches(metadata, item) for item in value):
+                return False
+            continue
+        if key == "$or":
+            if not any(metadata_matches(metadata, item) for item in value):
+                return False
+            continue
+        conditions = value if isinstance(value, dict) else {"$eq": value}
+        for operator, operand in conditions.items():
+            if operator not in _COMPARISONS:
+                raise ValueError(f"不支持的過濾運算符: {operator}")
+            if not _COMPARISONS[operator](metadata.get(key), operand):
+                return False
+    return True
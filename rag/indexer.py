@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""增量知識庫索引
+
+記錄每個doc_id已嵌入的內容雜湊與向量ID，更新時只嵌入新增或變更的文檔，
+並刪除已移除文檔的向量，使更新成本與變更量成正比，而不是與整個語料庫成正比。
+"""
+
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
+from rag import config
+from rag.embedding_cache import CachedEmbeddings
+from rag.loaders import clean_metadata, file_sha256, join_tags, load_document
+from rag.metrics import get_metrics
+from rag.scheduler import background
+from rag.splitter import CategorySplitter
+
+# 寫入向量的元數據欄位變更時遞增，已索引的文檔在下次同步時重新寫入（嵌入緩存命中）
+METADATA_VERSION = 2
+
+
+@dataclass
+class IndexStats:
+    """一次同步的統計結果"""
+    added: int = 0
+    updated: int = 0
+    removed: int = 0
+    unchanged: int = 0
+    chunks_added: int = 0
+    chunks_removed: int = 0
+    errors: list = field(default_factory=list)
+
+    @property
+    def changed(self):
+        return self.added + self.updated + self.removed > 0
+
+
+def document_fingerprint(doc_info, content_hash, split_signature=None):
+    """文檔指紋：內容雜湊、分割設置加上會寫入向量元數據的欄位"""
+    payload = json.dumps({
+        "content": content_hash,
+        "split": split_signature,
+        "name": doc_info["name"],
+        "category": doc_info["category"],
+        "tags": join_tags(doc_info["tags"]),
+        "type": doc_info["type"],
+        "metadata": METADATA_VERSION,
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IncrementalIndexer:
+    """把文檔列表增量同步到向量存儲"""
+
+    def __init__(self, vectorstore, state_path=config.INDEX_STATE_PATH, text_splitter=None, lexical_index=None,
+                 metrics=None, save_interval=config.INDEX_SAVE_INTERVAL):
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.state_path = state_path
+        self.text_splitter = text_splitter or CategorySplitter()
+        self.legacy = not os.path.exists(state_path)
+        self.state = self._load_state()
+        self.save_interval = save_interval
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self, force=False):
+        """寫入索引狀態和詞彙索引；未指定force時按save_interval節流，避免每個文檔後都重寫整個文件"""
+        self._dirty = True
+        if not force and time.monotonic() - self._last_save < self.save_interval:
+            return
+        # 向量存儲有延遲寫入時（FAISS）先寫入，狀態不會記錄還沒寫入的向量
+        save_vectors = getattr(self.vectorstore, "save", None)
+        if save_vectors is not None:
+            save_vectors(force=True)
+        # 先寫臨時文件再替換，避免中斷時留下損壞的狀態
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+        if self.lexical_index is not None:
+            self.lexical_index.save()
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    @property
+    def dirty(self):
+        """是否有按save_interval延遲、還沒寫入磁碟的修改"""
+        return self._dirty
+
+    def flush(self):
+        """立即寫入延遲寫入的向量、索引狀態和詞彙索引"""
+        if self._dirty:
+            self._save_state(force=True)
+            return
+        save_vectors = getattr(self.vectorstore, "save", None)
+        if save_vectors is not None:
+            save_vectors(force=True)
+
+    def fingerprint(self, doc_info, content_hash):
+        signature = getattr(self.text_splitter, "signature", None)
+        split_signature = signature(doc_info["category"]) if signature else None
+        return document_fingerprint(doc_info, content_hash, split_signature)
+
+    @property
+    def indexed_doc_ids(self):
+        return set(self.state)
+
+    def _delete_vectors(self, doc_id):
+        """刪除一個文檔的全部向量，返回刪除的塊數"""
+        entry = self.state.pop(doc_id, None)
+        if self.lexical_index is not None:
+            self.lexical_index.remove_document(doc_id)
+        if entry and entry["chunk_ids"]:
+            self.vectorstore.delete(ids=entry["chunk_ids"])
+            return len(entry["chunk_ids"])
+        return 0
+
+    def split_documents(self, documents):
+        """分割文檔並過濾複雜的元數據"""
+        with self.metrics.timer("split"):
+            return clean_metadata(self.text_splitter.split_documents(documents))
+
+    def _store_chunks(self, doc_id, fingerprint, chunks):
+        """寫入一個文檔的全部文本塊，返回寫入的塊數"""
+        chunk_ids = [f"{doc_id}:{i}" for i in range(len(chunks))]
+        if chunks:
+            embeddings = self.vectorstore.embeddings
+            # 索引的嵌入請求排在聊天之後
+            with background():
+                if isinstance(embeddings, CachedEmbeddings):
+                    # 先嵌入並寫入緩存（耗時由嵌入緩存記為embed），寫入向量庫時全部命中，upsert只含寫入
+                    embeddings.embed_documents([chunk.page_content for chunk in chunks])
+                with self.metrics.timer("upsert"):
+                    self.vectorstore.add_documents(chunks, ids=chunk_ids)
+        if self.lexical_index is not None:
+            self.lexical_index.add_chunks(doc_id, chunk_ids, chunks)
+        self.state[doc_id] = {
+            "fingerprint": fingerprint,
+            "chunk_ids": chunk_ids,
+        }
+        return len(chunks)
+
+    def _embed_document(self, doc_info, fingerprint, content_hash):
+        """加載、分割並嵌入一個文檔，返回寫入的塊數"""
+        with self.metrics.timer("load"):
+            documents = load_document(doc_info, content_hash)
+        chunks = self.split_documents(documents)
+        return self._store_chunks(doc_info["id"], fingerprint, chunks)
+
+    def index_chunks(self, doc_info, chunks, content_hash):
+        """寫入已在別處解析和分割好的文本塊（批量導入），返回寫入的塊數"""
+        fingerprint = self.fingerprint(doc_info, content_hash)
+        self._delete_vectors(doc_info["id"])
+        count = self._store_chunks(doc_info["id"], fingerprint, chunks)
+        self._save_state()
+        return count
+
+    def index_document(self, doc_info):
+        """只重新索引一個文檔（例如替換了文件），內容和設置未變時不重做"""
+        stats = IndexStats()
+        doc_id = doc_info["id"]
+        content_hash = doc_info.get("content_hash") or file_sha256(doc_info["path"])
+        fingerprint = self.fingerprint(doc_info, content_hash)
+        entry = self.state.get(doc_id)
+        if entry and entry["fingerprint"] == fingerprint:
+            stats.unchanged = 1
+            return stats
+
+        # 先加載和分割，新文件無法解析時保留原來的向量
+        with self.metrics.timer("load"):
+            documents = load_document(doc_info, content_hash)
+        chunks = self.split_documents(documents)
+        stats.chunks_removed = self._delete_vectors(doc_id)
+        stats.chunks_added = self._store_chunks(doc_id, fingerprint, chunks)
+        if entry:
+            stats.updated = 1
+        else:
+            stats.added = 1
+        self._save_state()
+        return stats
+
+    def remove_document(self, doc_id):
+        """刪除一個文檔的向量和詞彙索引條目，返回刪除的塊數"""
+        count = self._delete_vectors(doc_id)
+        self._save_state()
+        return count
+
+    def compact(self):
+        """清除沒有被索引狀態追蹤的向量和詞彙索引條目，返回清除的塊數"""
+        purged = self._purge_untracked()
+        if self.lexical_index is not None:
+            for doc_id in set(self.lexical_index.doc_chunks) - set(self.state):
+                self.lexical_index.remove_document(doc_id)
+        self._save_state(force=True)
+        return purged
+
+    def _purge_untracked(self):
+        """清除沒有被索引狀態追蹤的向量（舊版全量重建留下的重複向量）"""
+        tracked = {chunk_id for entry in self.state.values() for chunk_id in entry["chunk_ids"]}
+        existing = self.vectorstore.get(include=[])["ids"]
+        stale = [chunk_id for chunk_id in existing if chunk_id not in tracked]
+        if stale:
+            self.vectorstore.delete(ids=stale)
+        return len(stale)
+
+    def sync(self, document_list, progress=None):
+        """同步文檔列表：新增或變更的文檔重新嵌入，已移除的文檔刪除向量
+
+        progress(已處理數, 總數, 文檔名) 在每個文檔處理後調用。
+        """
+        stats = IndexStats()
+        if self.legacy:
+            stats.chunks_removed += self._purge_untracked()
+            self.legacy = False
+        current_ids = {doc_info["id"] for doc_info in document_list}
+
+        # 刪除已不在文檔列表中的文檔
+        for doc_id in list(self.state):
+            if doc_id not in current_ids:
+                stats.chunks_removed += self._delete_vectors(doc_id)
+                stats.removed += 1
+        self._save_state()
+
+        for done, doc_info in enumerate(document_list, 1):
+            doc_id = doc_info["id"]
+            try:
+                # 上傳時已記錄內容雜湊（文件上傳後不會改變），不必每次重建都讀一遍大文件
+                content_hash = doc_info.get("content_hash") or file_sha256(doc_info["path"])
+                fingerprint = self.fingerprint(doc_info, content_hash)
+                entry = self.state.get(doc_id)
+                if entry and entry["fingerprint"] == fingerprint:
+                    stats.unchanged += 1
+                    if progress is not None:
+                        progress(done, len(document_list), doc_info["name"])
+                    continue
+
+                stats.chunks_removed += self._delete_vectors(doc_id)
+                stats.chunks_added += self._embed_document(doc_info, fingerprint, content_hash)
+                if entry:
+                    stats.updated += 1
+                else:
+                    stats.added += 1
+            except Exception as e:
+                stats.errors.append((doc_info["name"], str(e)))
+            # 按間隔保存狀態，中途失敗時已保存的部分不會重做
+            self._save_state()
+            if progress is not None:
+                progress(done, len(document_list), doc_info["name"])
+
+        self.flush()
+        return stats
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""批量文檔導入
+
+在進程池中並行解析文件，分割後按批次以有限並發嵌入，最後寫入共用知識庫。
+也可以從命令行導入整個目錄，或持續監視目錄中的新文件：
+
+    python -m rag.ingest 法規資料夾 --category 營業稅 --tags 稅法,法規
+    python -m rag.ingest 法規資料夾 --watch
+
+監視時等文件寫完（兩次掃描間大小不變）才導入，已導入的文件修改後替換原文檔。
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from rag import config
+from rag.knowledge_base import KnowledgeBase
+from rag.loaders import file_sha256, load_document
+from rag.scheduler import background
+
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".doc", ".txt", ".md", ".csv"}
+
+# 上傳文件每次讀寫的塊大小
+COPY_BLOCK_SIZE = 1 << 20
+
+
+@dataclass
+class IngestReport:
+    """一次批量導入的結果與吞吐量"""
+    files: int = 0
+    succeeded: list = field(default_factory=list)
+    failures: list = field(default_factory=list)
+    failed_paths: list = field(default_factory=list)
+    # 內容與已有文檔相同的文件：（文件名，已有文檔名），只更新了已有文檔的分類和標籤
+    linked: list = field(default_factory=list)
+    linked_paths: list = field(default_factory=list)
+    # 已導入過、內容改變後替換了原文檔的文件名
+    replaced: list = field(default_factory=list)
+    pages: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+
+    @property
+    def pages_per_second(self):
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    @property
+    def chunks_per_second(self):
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        summary = (
+            f"成功 {len(self.succeeded) + len(self.replaced)}/{self.files} 個文件，{self.pages} 頁，{self.chunks} 個文本塊，"
+            f"耗時 {self.seconds:.1f} 秒（{self.pages_per_second:.1f} 頁/秒，{self.chunks_per_second:.1f} 塊/秒）"
+        )
+        if self.linked:
+            summary += f"；{len(self.linked)} 個與已有文檔內容相同，只更新了分類和標籤"
+        if self.replaced:
+            summary += f"；{len(self.replaced)} 個已導入的文件內容改變，已替換原文檔"
+        return summary
+
+
+class HashingWriter:
+    """寫入文件的同時計算內容的SHA-256，不需要再讀一次文件"""
+
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.f.write(data)
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+
+def copy_with_sha256(source, path, block_size=COPY_BLOCK_SIZE):
+    """把文件對象分塊複製到path，返回內容的SHA-256"""
+    with open(path, "wb") as f:
+        writer = HashingWriter(f)
+        shutil.copyfileobj(source, writer, block_size)
+    return writer.hexdigest()
+
+
+def new_document_entry(name, category, tags):
+    """建立新文檔條目，文件應寫入條目中的path"""
+    doc_id = str(uuid.uuid4())
+    file_extension = os.path.splitext(name)[1].lower()
+    return {
+        "id": doc_id,
+        "name": name,
+        "type": file_extension[1:],
+        "category": category,
+        "tags": tags,
+        "date_added": datetime.now().isoformat(),
+        "path": os.path.join(config.DOCUMENTS_DIR, f"{doc_id}{file_extension}")
+    }
+
+
+def register_file(source_path, category, tags):
+    """把文件複製到文檔目錄，返回帶內容雜湊的文檔條目（尚未登記到目錄）"""
+    doc_info = new_document_entry(os.path.basename(source_path), category, tags)
+    with open(source_path, "rb") as source:
+        doc_info["content_hash"] = copy_with_sha256(source, doc_info["path"])
+    doc_info["source_path"] = os.path.abspath(source_path)
+    return doc_info
+
+
+def register_upload(file, category, tags):
+    """把上傳的文件分塊寫入文檔目錄，返回帶內容雜湊的文檔條目（尚未登記到目錄）"""
+    doc_info = new_document_entry(file.name, category, tags)
+    file.seek(0)
+    doc_info["content_hash"] = copy_with_sha256(file, doc_info["path"])
+    return doc_info
+
+
+def _parse_file(doc_info):
+    """在子進程（或執行緒池）中解析一個文件，返回（頁面列表，內容雜湊，解析耗時）"""
+    started = time.perf_counter()
+    content_hash = doc_info.get("content_hash") or file_sha256(doc_info["path"])
+    documents = load_document(doc_info, content_hash)
+    return documents, content_hash, time.perf_counter() - started
+
+
+def _embed_in_background(embeddings, texts):
+    """在執行緒池中嵌入，請求以背景優先級排在聊天之後"""
+    with background():
+        return embeddings.embed_documents(texts)
+
+
+class BulkIngestor:
+    """並行解析、分批嵌入並寫入知識庫
+
+    預設在進程池中解析；processes為False時改用執行緒池，適合在服務進程中導入單個文件，
+    不必為每個請求fork一次已有多個執行緒的進程。
+    """
+
+    def __init__(self, knowledge_base, parse_workers=None, embed_concurrency=4, batch_size=64, processes=True):
+        self.knowledge_base = knowledge_base
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.embed_concurrency = embed_concurrency
+        self.batch_size = batch_size
+        self.processes = processes
+
+    def _embed_batches(self, executor, texts):
+        """按批次提交嵌入任務；結果寫入嵌入緩存，寫入向量庫時不再調用API"""
+        embeddings = self.knowledge_base.vectorstore.embeddings
+        return [
+            executor.submit(_embed_in_background, embeddings, texts[start:start + self.batch_size])
+            for start in range(0, len(texts), self.batch_size)
+        ]
+
+    def _link_duplicates(self, doc_infos, report):
+        """內容已在知識庫中（或在同一批中重複）的文件不再解析和嵌入：刪除副本，更新已有文檔的分類和標籤"""
+        unique = []
+        seen = {}
+        for doc_info in doc_infos:
+            content_hash = doc_info.get("content_hash")
+            # 同一批中的重複只導入第一個
+            existing = seen.get(content_hash) or self.knowledge_base.link_duplicate(doc_info)
+            if existing is None:
+                unique.append(doc_info)
+                if content_hash:
+                    seen[content_hash] = doc_info
+                continue
+            report.linked.append((doc_info["name"], existing["name"]))
+            if doc_info.get("source_path"):
+                report.linked_paths.append(doc_info["source_path"])
+            if os.path.exists(doc_info["path"]):
+                os.remove(doc_info["path"])
+        return unique
+
+    def run(self, doc_infos, progress=None):
+        """導入一批文檔條目；progress(完成數, 總數, 文件名) 用於顯示進度"""
+        report = IngestReport(files=len(doc_infos))
+        started_at = time.perf_counter()
+        doc_infos = self._link_duplicates(doc_infos, report)
+        indexer = self.knowledge_base.indexer
+        parsed = []
+        failed_ids = set()
+        embed_futures = []
+        pending_texts = []
+
+        parse_executor = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        with parse_executor(max_workers=self.parse_workers) as parse_pool, \
+                ThreadPoolExecutor(max_workers=self.embed_concurrency) as embed_pool:
+            futures = {parse_pool.submit(_parse_file, doc_info): doc_info for doc_info in doc_infos}
+            for done, future in enumerate(as_completed(futures), 1):
+                doc_info = futures[future]
+                try:
+                    documents, content_hash, load_seconds = future.result()
+                    # 解析可能在子進程中進行，耗時由父進程記錄到指標
+                    indexer.metrics.observe("load", load_seconds)
+                    chunks = indexer.split_documents(documents)
+                    report.pages += len(documents)
+                    parsed.append((doc_info, chunks, content_hash))
+
+                    # 解析與嵌入重疊進行：湊滿一批就提交
+                    pending_texts.extend(chunk.page_content for chunk in chunks)
+                    if len(pending_texts) >= self.batch_size:
+                        embed_futures.extend(self._embed_batches(embed_pool, pending_texts))
+                        pending_texts = []
+                except Exception as e:
+                    failed_ids.add(doc_info["id"])
+                    report.failures.append((doc_info["name"], f"解析失敗: {e}"))
+                if progress:
+                    progress(done, len(doc_infos), doc_info["name"])
+
+            embed_futures.extend(self._embed_batches(embed_pool, pending_texts))
+            # 預嵌入失敗的批次會在寫入向量庫時重試，錯誤在那裡按文件報告
+            wait(embed_futures)
+
+        for doc_info, chunks, content_hash in parsed:
+            try:
+                report.chunks += self.knowledge_base.index_chunks(doc_info, chunks, content_hash)
+                report.succeeded.append(doc_info["name"])
+            except Exception as e:
+                failed_ids.add(doc_info["id"])
+                report.failures.append((doc_info["name"], f"嵌入失敗: {e}"))
+        self.knowledge_base.flush()
+
+        # 失敗的文件不保留副本
+        for doc_info in doc_infos:
+            if doc_info["id"] not in failed_ids:
+                continue
+            if doc_info.get("source_path"):
+                report.failed_paths.append(doc_info["source_path"])
+            if os.path.exists(doc_info["path"]):
+                os.remove(doc_info["path"])
+
+        report.seconds = time.perf_counter() - started_at
+        return report
+
+
+def find_files(directory):
+    """列出目錄（含子目錄）中支持的文件"""
+    paths = []
+    for root, _, file_names in os.walk(directory):
+        for file_name in sorted(file_names):
+            if os.path.splitext(file_name)[1].lower() in SUPPORTED_EXTENSIONS:
+                paths.append(os.path.join(root, file_name))
+    return paths
+
+
+class DirectoryWatcher:
+    """逐次掃描目錄，導入新文件並替換內容已改變的文件
+
+    監視時文件在相鄰兩次掃描間大小和修改時間都不變才導入，仍在複製中的文件留到之後的掃描。
+    是否已導入按內容雜湊判斷：已導入的文件修改後，用新內容替換原文檔（保留doc_id、分類和標籤）；
+    導入失敗的內容不再重試，直到文件再次改變。
+    """
+
+    def __init__(self, ingestor, directory, category, tags):
+        self.ingestor = ingestor
+        self.directory = directory
+        self.category = category
+        self.tags = tags
+        self.failed_hashes = set()
+        # 路徑 -> 上次掃描時的（大小，修改時間）
+        self._stats = {}
+        # 路徑 -> （（大小，修改時間），內容雜湊），文件未變時不重新計算
+        self._hashes = {}
+
+    def stable_files(self, wait=True):
+        """大小和修改時間與上次掃描相同的文件；wait為False時返回全部文件"""
+        current = {}
+        for path in find_files(self.directory):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            current[os.path.abspath(path)] = (stat.st_size, stat.st_mtime_ns)
+        previous, self._stats = self._stats, current
+        return [path for path, signature in current.items() if not wait or previous.get(path) == signature]
+
+    def _content_hash(self, path):
+        signature = self._stats[path]
+        cached = self._hashes.get(path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, file_sha256(path))
+            self._hashes[path] = cached
+        return cached[1]
+
+    def scan(self, progress=None, wait=True):
+        """掃描一次並導入，返回導入報告"""
+        knowledge_base = self.ingestor.knowledge_base
+        # 同一來源路徑導入過多次時以最後一次為準
+        imported = {
+            doc["source_path"]: doc for doc in knowledge_base.catalog.list_documents() if doc.get("source_path")
+        }
+        new_infos, changed = [], []
+        for path in self.stable_files(wait=wait):
+            try:
+                content_hash = self._content_hash(path)
+            except FileNotFoundError:
+                continue
+            if content_hash in self.failed_hashes or knowledge_base.catalog.find_by_content_hash(content_hash):
+                continue
+            if path in imported:
+                changed.append((imported[path], path))
+            else:
+                new_infos.append(register_file(path, self.category, self.tags))
+
+        report = self.ingestor.run(new_infos, progress=progress)
+        for doc_info, path in changed:
+            self._replace(doc_info, path, report)
+        for path in report.failed_paths:
+            if path in self._hashes:
+                self.failed_hashes.add(self._hashes[path][1])
+        return report
+
+    def _replace(self, doc_info, path, report):
+        """用修改後的文件替換已導入的文檔；來源文件不動，先複製一份再替換"""
+        report.files += 1
+        name = os.path.basename(path)
+        copy_path = os.path.join(os.path.dirname(doc_info["path"]), f"{uuid.uuid4()}{os.path.splitext(name)[1]}")
+        started_at = time.perf_counter()
+        try:
+            with open(path, "rb") as source:
+                content_hash = copy_with_sha256(source, copy_path)
+            stats = self.ingestor.knowledge_base.replace_document(doc_info["id"], copy_path, name=name,
+                                                                 content_hash=content_hash)
+        except Exception as e:
+            report.failures.append((name, f"替換失敗: {e}"))
+            report.failed_paths.append(path)
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+        else:
+            report.replaced.append(name)
+            report.chunks += stats.chunks_added
+        report.seconds += time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量導入文檔到知識庫")
+    parser.add_argument("directory", help="要導入的目錄")
+    parser.add_argument("--category", default="財務稅法", help="分類")
+    parser.add_argument("--tags", default="財務,稅法", help="標籤，用逗號分隔")
+    parser.add_argument("--workers", type=int, default=None, help="解析進程數")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="同時進行的嵌入請求數")
+    parser.add_argument("--batch-size", type=int, default=64, help="每次嵌入請求的文本塊數")
+    parser.add_argument("--watch", action="store_true", help="持續監視目錄中的新文件和修改過的文件")
+    parser.add_argument("--interval", type=float, default=10.0, help="監視間隔（秒）")
+    args = parser.parse_args()
+
+    config.ensure_data_dirs()
+    ingestor = BulkIngestor(
+        KnowledgeBase(),
+        parse_workers=args.workers,
+        embed_concurrency=args.embed_concurrency,
+        batch_size=args.batch_size
+    )
+    tags = args.tags.split(",")
+
+    def progress(done, total, name):
+        print(f"[{done}/{total}] {name}")
+
+    watcher = DirectoryWatcher(ingestor, args.directory, args.category, tags)
+    while True:
+        # 只導入一次時不必等待文件寫完
+        report = watcher.scan(progress=progress, wait=args.watch)
+        if report.files:
+            for name, error in report.failures:
+                print(f"失敗: {name} - {error}")
+            for name, existing in report.linked:
+                print(f"重複: {name} 與 {existing} 內容相同")
+            print(report.summary())
+        if not args.watch:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""進程內共用的知識庫
+
+整個進程只持有一個向量存儲客戶端，所有會話通過同一個執行緒安全的檢索器查詢；
+每個會話只保留自己的對話記憶。
+
+完整重建（rebuild）在新的一代目錄中進行，期間查詢照常使用舊索引；建好後寫入CURRENT指針並原子切換，
+其他進程在下一次查詢時發現指針變更並改用新的一代。多個進程（例如API的多個工作進程）共用同一個索引時，
+每次查詢和寫入前也檢查索引狀態和詞彙索引文件，其他進程寫入過就重新打開，回答緩存不會按過期的指紋判斷。
+"""
+
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from rag import config
+from rag.answer_cache import AnswerCache
+from rag.catalog import get_catalog
+from rag.embedding_cache import CachedEmbeddings
+from rag.filters import split_tags
+from rag.indexer import IncrementalIndexer
+from rag.lexical import LexicalIndex, rrf_fuse
+from rag.llm import create_embeddings
+from rag.loaders import file_sha256
+from rag.reindex import ReindexWorker
+from rag.rerank import create_reranker
+from rag.text_store import EXTRACTED_TYPES, get_text_store
+from rag.vectorstores import compact_vectorstore, create_vectorstore
+
+
+class ReadWriteLock:
+    """讀寫鎖：查詢可以並行，索引更新時獨佔"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+def default_embeddings():
+    """帶嵌入緩存的嵌入模型"""
+    return CachedEmbeddings(create_embeddings())
+
+
+class KnowledgeBase:
+    """共用的文檔目錄、向量存儲與檢索入口"""
+
+    def __init__(self, catalog=None, persist_directory=None, state_path=None, embeddings_factory=default_embeddings,
+                 lexical_index_path=None, hybrid=config.HYBRID_SEARCH,
+                 answer_cache_path=config.ANSWER_CACHE_PATH if config.ANSWER_CACHE_ENABLED else None,
+                 backend=config.VECTOR_BACKEND, reranker=config.RERANK_MODEL if config.RERANK_ENABLED else None):
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.backend = backend
+        # 不同後端的向量、索引狀態和詞彙索引分開存放
+        if persist_directory is None:
+            persist_directory = config.FAISS_DIR if backend == "faiss" else config.VECTORSTORE_DIR
+        if state_path is None:
+            state_path = config.FAISS_INDEX_STATE_PATH if backend == "faiss" else config.INDEX_STATE_PATH
+        if lexical_index_path is None:
+            lexical_index_path = config.FAISS_LEXICAL_INDEX_PATH if backend == "faiss" else config.LEXICAL_INDEX_PATH
+        self.hybrid = hybrid
+        # 初始路徑；重建後的每一代存放在 <persist_directory>-generations/<代名稱>/
+        self._base_paths = (persist_directory, state_path, lexical_index_path)
+        self.generations_dir = f"{os.path.normpath(persist_directory)}-generations"
+        self.answer_cache_path = answer_cache_path
+        # 重排器可以是模型名稱（第一次查詢時才建立，交叉編碼器載入較慢）或Reranker實例
+        self._reranker = reranker
+        self._embeddings_factory = embeddings_factory
+        self._vectorstore = None
+        self._indexer = None
+        self._answer_cache = None
+        self._reindex_worker = None
+        self._init_lock = threading.Lock()
+        self._lock = ReadWriteLock()
+        generation, self._pointer_mtime = self._read_pointer()
+        self._use_generation(generation)
+
+    # 索引的代
+
+    @property
+    def _pointer_path(self):
+        return os.path.join(self.generations_dir, "CURRENT")
+
+    def _read_pointer(self):
+        """返回（當前一代的名稱，指針文件的修改時間）；還沒有重建過時名稱為None，使用初始路徑"""
+        try:
+            mtime = os.stat(self._pointer_path).st_mtime_ns
+            with open(self._pointer_path, "r", encoding="utf-8") as f:
+                return f.read().strip() or None, mtime
+        except FileNotFoundError:
+            return None, None
+
+    def _write_pointer(self, generation):
+        tmp_path = f"{self._pointer_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(generation)
+        os.replace(tmp_path, self._pointer_path)
+        self._pointer_mtime = os.stat(self._pointer_path).st_mtime_ns
+
+    def _generation_paths(self, generation):
+        """一代的（向量存儲目錄，索引狀態路徑，詞彙索引路徑）"""
+        if generation is None:
+            return self._base_paths
+        directory = os.path.join(self.generations_dir, generation)
+        return (
+            os.path.join(directory, "vectorstore"),
+            os.path.join(directory, "index_state.json"),
+            os.path.join(directory, "lexical_index.pkl"),
+        )
+
+    def _use_generation(self, generation, vectorstore=None, indexer=None):
+        """改用某一代的索引；未提供已打開的向量存儲和索引器時延遲打開"""
+        persist_directory, state_path, lexical_index_path = self._generation_paths(generation)
+        self.generation = generation
+        self.persist_directory = persist_directory
+        self.state_path = state_path
+        self.lexical_index_path = lexical_index_path
+        if indexer is not None:
+            self.lexical_index = indexer.lexical_index
+        else:
+            self.lexical_index = LexicalIndex(lexical_index_path) if self.hybrid else None
+        self._vectorstore = vectorstore
+        self._indexer = indexer
+        self._index_stats = self._stat_index()
+
+    def _stat_index(self):
+        """索引狀態和詞彙索引文件的（inode，修改時間），不存在的文件為None
+
+        兩個文件都是寫臨時文件再替換，每次寫入後inode都會改變，修改時間精度較低的文件系統上也能發現。
+        """
+        stats = []
+        for path in (self.state_path, self.lexical_index_path if self.hybrid else None):
+            try:
+                stat = os.stat(path) if path else None
+            except FileNotFoundError:
+                stat = None
+            stats.append((stat.st_ino, stat.st_mtime_ns) if stat else None)
+        return tuple(stats)
+
+    def _pointer_changed(self):
+        try:
+            return os.stat(self._pointer_path).st_mtime_ns != self._pointer_mtime
+        except FileNotFoundError:
+            return False
+
+    def _follow_pointer(self):
+        """其他進程切換了索引或寫入了當前一代時重新打開（沒有變更時只需要三次stat）"""
+        if self._pointer_changed() or self._stat_index() != self._index_stats:
+            with self._lock.write():
+                self._reload()
+
+    def _reload(self):
+        """在寫鎖內跟上其他進程的修改：改用新的一代，或重新打開當前一代的向量存儲、索引狀態和詞彙索引
+
+        本進程還有延遲寫入的修改時（批量導入中）不重新打開，以免丟失；這些修改寫入時以本進程為準。
+        """
+        if self._pointer_changed():
+            generation, self._pointer_mtime = self._read_pointer()
+            if generation != self.generation:
+                self._use_generation(generation)
+                return
+        if self._stat_index() == self._index_stats or self._indexer is not None and self._indexer.dirty:
+            return
+        # 本進程寫入過的FAISS索引和Chroma的向量索引都留在記憶體中，需要重新打開才能讀到新的向量
+        embeddings = self._vectorstore.embeddings if self._vectorstore is not None else self._embeddings_factory()
+        vectorstore = create_vectorstore(self.backend, self.persist_directory, embeddings, reload=True)
+        self._use_generation(self.generation, vectorstore)
+
+    @contextmanager
+    def _writing(self):
+        """寫入操作的寫鎖：先跟上其他進程的修改，結束時記錄本進程寫入後的文件修改時間"""
+        with self._lock.write():
+            self._reload()
+            try:
+                yield
+            finally:
+                self._index_stats = self._stat_index()
+
+    def _remove_generations(self, keep):
+        """刪除不再使用的代；上一代保留到下次重建，讓其他進程有時間切換"""
+        if not os.path.isdir(self.generations_dir):
+            return
+        for name in os.listdir(self.generations_dir):
+            path = os.path.join(self.generations_dir, name)
+            if os.path.isdir(path) and name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+    @property
+    def vectorstore(self):
+        """延遲打開已持久化的向量存儲（需要API Key才能創建嵌入模型）"""
+        if self._vectorstore is None:
+            with self._init_lock:
+                if self._vectorstore is None:
+                    self._vectorstore = create_vectorstore(
+                        self.backend, self.persist_directory, self._embeddings_factory()
+                    )
+        return self._vectorstore
+
+    @property
+    def is_indexed(self):
+        """是否已有持久化的索引"""
+        return os.path.exists(self.state_path)
+
+    @property
+    def indexer(self):
+        if self._indexer is None:
+            vectorstore = self.vectorstore
+            with self._init_lock:
+                if self._indexer is None:
+                    self._indexer = IncrementalIndexer(
+                        vectorstore, state_path=self.state_path, lexical_index=self.lexical_index
+                    )
+                    # 升級前建立的索引還沒有詞彙索引，從向量存儲補建
+                    if self.lexical_index is not None and not len(self.lexical_index) and self._indexer.state:
+                        self.lexical_index.rebuild_from(vectorstore)
+        return self._indexer
+
+    @property
+    def reranker(self):
+        if isinstance(self._reranker, str):
+            with self._init_lock:
+                if isinstance(self._reranker, str):
+                    self._reranker = create_reranker(self._reranker)
+        return self._reranker
+
+    @property
+    def answer_cache(self):
+        """共用的語義回答緩存；未設置路徑時不啟用"""
+        if self.answer_cache_path and self._answer_cache is None:
+            embeddings = self.vectorstore.embeddings
+            with self._init_lock:
+                if self._answer_cache is None:
+                    self._answer_cache = AnswerCache(
+                        self.answer_cache_path, embeddings=embeddings, version_lookup=self.document_versions
+                    )
+        return self._answer_cache
+
+    def document_versions(self, doc_ids):
+        """文檔當前的索引指紋，已刪除的文檔為None"""
+        self._follow_pointer()
+        with self._lock.read():
+            state = self.indexer.state
+            return {doc_id: state.get(doc_id, {}).get("fingerprint") for doc_id in doc_ids}
+
+    # 以下寫入操作都在寫鎖內取得索引器並更新文檔目錄，切換索引後不會寫到舊的一代，
+    # 背景重建切換前的補同步也不會看到索引和目錄不一致的中間狀態
+
+    def sync(self, progress=None):
+        """把文檔目錄增量同步到向量存儲，期間暫停查詢"""
+        with self._writing():
+            indexer = self.indexer
+            stats = indexer.sync(self.catalog.list_documents(), progress=progress)
+            indexer.flush()
+        return stats
+
+    def rebuild(self, progress=None):
+        """在新的一代目錄中從文檔目錄完整重建索引，完成後原子切換
+
+        重建期間查詢照常使用舊索引（嵌入緩存命中，不重複調用API）；期間在舊索引上進行的新增、刪除和替換
+        在切換前的短暫寫鎖內增量補上。
+        """
+        self._follow_pointer()
+        generation = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}"
+        persist_directory, state_path, lexical_index_path = self._generation_paths(generation)
+        os.makedirs(os.path.dirname(state_path), exist_ok=True)
+        try:
+            vectorstore = create_vectorstore(self.backend, persist_directory, self._embeddings_factory())
+            lexical_index = LexicalIndex(lexical_index_path) if self.hybrid else None
+            indexer = IncrementalIndexer(vectorstore, state_path=state_path, lexical_index=lexical_index)
+            stats = indexer.sync(self.catalog.list_documents(), progress=progress)
+            indexer.flush()
+            with self._lock.write():
+                catch_up = indexer.sync(self.catalog.list_documents())
+                indexer.flush()
+                previous = self.generation
+                self._write_pointer(generation)
+                self._use_generation(generation, vectorstore, indexer)
+        except Exception:
+            shutil.rmtree(os.path.dirname(state_path), ignore_errors=True)
+            raise
+        # 第一輪失敗的文檔在補同步時會重試，以最後一次的結果為準
+        stats.errors = catch_up.errors
+        self._remove_generations(keep={generation, previous})
+        return stats
+
+    @property
+    def reindex_worker(self):
+        """在背景執行重建的工作執行緒"""
+        if self._reindex_worker is None:
+            with self._init_lock:
+                if self._reindex_worker is None:
+                    self._reindex_worker = ReindexWorker(self)
+        return self._reindex_worker
+
+    def index_chunks(self, doc_info, chunks, content_hash):
+        """寫入已分割好的文本塊並登記到文檔目錄"""
+        with self._writing():
+            count = self.indexer.index_chunks(doc_info, chunks, content_hash)
+            self.catalog.add(doc_info)
+        return count
+
+    def flush(self):
+        """把延遲寫入的向量索引寫入磁碟（批量導入結束時調用）"""
+        with self._writing():
+            self.indexer.flush()
+
+    def _get_document(self, doc_id):
+        doc_info = self.catalog.get(doc_id)
+        if doc_info is None:
+            raise KeyError(f"文檔不存在: {doc_id}")
+        return doc_info
+
+    def delete_document(self, doc_id):
+        """刪除一個文檔的向量、目錄條目和存儲的文件，返回刪除的塊數"""
+        doc_info = self._get_document(doc_id)
+        with self._writing():
+            indexer = self.indexer
+            count = indexer.remove_document(doc_id)
+            indexer.flush()
+            self.catalog.remove(doc_id)
+        for path in (doc_info.get("path"), doc_info.get("cues_path")):
+            if path and os.path.exists(path):
+                os.remove(path)
+        return count
+
+    def update_labels(self, doc_id, category, tags):
+        """更新文檔的分類和標籤，已索引時重新寫入它的向量元數據（嵌入緩存和抽取文本存儲命中）"""
+        doc_info = self._get_document(doc_id)
+        updated = {**doc_info, "category": category, "tags": tags}
+        if updated == doc_info:
+            return doc_info
+        with self._writing():
+            if self.is_indexed:
+                indexer = self.indexer
+                if doc_id in indexer.state:
+                    indexer.index_document(updated)
+                    indexer.flush()
+            self.catalog.add(updated)
+        return updated
+
+    def link_duplicate(self, doc_info):
+        """新條目的文件內容（或YouTube影片）已在知識庫中時，把新條目的分類和標籤合併到已有文檔並返回它
+
+        分類改為新條目的分類，標籤取兩者的聯集（已有的在前）。
+
+        沒有重複時返回None，調用方照常登記新條目；重複時調用方應刪除新條目的文件。
+        """
+        if doc_info.get("youtube_id"):
+            existing = self.catalog.find_by_youtube_id(doc_info["youtube_id"])
+        elif doc_info.get("content_hash"):
+            existing = self.catalog.find_by_content_hash(doc_info["content_hash"])
+        else:
+            return None
+        if existing is None or existing["id"] == doc_info.get("id"):
+            return None
+        try:
+            tags = list(dict.fromkeys(split_tags(existing.get("tags")) + split_tags(doc_info["tags"])))
+            return self.update_labels(existing["id"], doc_info["category"] or existing["category"], tags)
+        except KeyError:
+            # 已有文檔剛被刪除
+            return None
+
+    def replace_document(self, doc_id, source_path, name=None, content_hash=None):
+        """用新文件替換文檔內容：保留doc_id、分類和標籤，只重新嵌入這一個文檔
+
+        source_path的文件會被移動到文檔目錄；新文件無法解析時拋出異常，原文檔不受影響。
+        寫入時已計算過內容雜湊可以傳入content_hash。
+        """
+        doc_info = self._get_document(doc_id)
+        if doc_info["type"] == "youtube":
+            raise ValueError("YouTube影片不支持替換文件")
+        name = name or doc_info["name"]
+        extension = os.path.splitext(name)[1].lower()
+        path = os.path.join(os.path.dirname(doc_info["path"]), f"{doc_id}{extension}")
+        updated = {**doc_info, "name": name, "type": extension[1:], "path": path,
+                   "content_hash": content_hash or file_sha256(source_path)}
+
+        with self._writing():
+            indexer = self.indexer
+            # 直接從新文件建索引，成功後再移動到位
+            stats = indexer.index_document({**updated, "path": source_path})
+            indexer.flush()
+            # 移動文件和更新目錄也在寫鎖內：背景重建的補同步不會讀到仍指向舊文件和舊雜湊的目錄條目
+            shutil.move(source_path, path)
+            if os.path.normpath(doc_info["path"]) != os.path.normpath(path) and os.path.exists(doc_info["path"]):
+                os.remove(doc_info["path"])
+            self.catalog.add(updated)
+        return stats
+
+    def compact(self):
+        """清除未被追蹤的向量並回收向量存儲的磁碟空間，同時刪除已不在文檔目錄中的抽取文本"""
+        with self._writing():
+            purged = self.indexer.compact()
+            reclaimed = compact_vectorstore(self.vectorstore, self.persist_directory)
+        content_hashes = {
+            doc_info.get("content_hash") or file_sha256(doc_info["path"]) for doc_info in self.catalog.list_documents()
+            if doc_info["type"] in EXTRACTED_TYPES and os.path.exists(doc_info["path"])
+        }
+        texts_removed, text_bytes = get_text_store().prune(content_hashes)
+        return {"chunks_purged": purged, "texts_removed": texts_removed, "bytes_reclaimed": reclaimed + text_bytes}
+
+    def search(self, query, k=6, filter=None):
+        """檢索最相關的k個文本塊；啟用混合檢索時融合向量與BM25兩路結果
+
+        filter為Chroma格式的元數據過濾條件（見rag.filters.build_filter），在兩路搜索中直接過濾。
+        """
+        self._follow_pointer()
+        reranker = self.reranker
+        # 啟用重排時多取候選，由重排器去重並選出k個
+        top_k = max(k, reranker.candidates) if reranker is not None else k
+        with self._lock.read():
+            # 先取得索引器，確保升級後第一次查詢前已補建詞彙索引
+            lexical_index = self.indexer.lexical_index
+            vectorstore = self.vectorstore
+            if lexical_index is None:
+                results = vectorstore.similarity_search(query, k=top_k, filter=filter)
+            else:
+                fetch_k = max(top_k, k * 3, 20)
+                vector_results = vectorstore.similarity_search(query, k=fetch_k, filter=filter)
+                lexical_results = [doc for doc, _ in lexical_index.search(query, k=fetch_k, filter=filter)]
+        if lexical_index is not None:
+            results = rrf_fuse([vector_results, lexical_results], k=top_k)
+        if reranker is not None:
+            results = reranker.rerank(query, results, k)
+        return results
+
+    def filter_options(self):
+        """文檔目錄中的全部分類、類型和標籤，用於選擇檢索範圍"""
+        documents = self.catalog.list_documents()
+        return {
+            "categories": sorted({doc["category"] for doc in documents if doc.get("category")}),
+            "types": sorted({doc["type"] for doc in documents}),
+            "tags": sorted({tag for doc in documents for tag in split_tags(doc.get("tags"))}),
+        }
+
+    def as_retriever(self, k=6):
+        return SharedRetriever(knowledge_base=self, k=k)
+
+
+class SharedRetriever(BaseRetriever):
+    """通過共用知識庫檢索的輕量檢索器，可以安全地在多個會話之間共用"""
+
+    knowledge_base: Any
+    k: int = 6
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun, filter=None):
+        return self.knowledge_base.search(query, k=self.k, filter=filter)
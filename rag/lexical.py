@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""本地詞彙索引與混合檢索
+
+以中文雙字元（bigram）和英數詞為詞項建立倒排索引，用BM25評分，
+補足向量檢索對法條編號、專有名詞（如「第24條」「扣繳憑單」）的不足，
+再以倒數排名融合（RRF）合併兩路結果。
+"""
+
+import json
+import math
+import operator
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+import numpy as np
+from langchain_core.documents import Document
+
+from rag import config
+from rag.filters import metadata_matches
+
+CJK_RUN_RE = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]+")
+WORD_RE = re.compile(r"[a-z0-9]+")
+ARTICLE_RE = re.compile(r"第\s*([0-9一二三四五六七八九十百千零〇兩]+)\s*條(?:\s*之\s*([0-9一二三四五六七八九十]+))?")
+CHINESE_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "兩": 2, "三": 3, "四": 4,
+                  "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+CHINESE_UNITS = {"十": 10, "百": 100, "千": 1000}
+# 緩存最近使用的過濾條件對應的文本塊掩碼，每次凍結或合併後重新計算
+FILTER_CACHE_SIZE = 64
+# 凍結後新增和刪除的文本塊超過這個數量、且超過凍結部分的MERGE_RATIO時，在背景合併進凍結倒排表
+MERGE_MIN_CHUNKS = 256
+MERGE_RATIO = 0.1
+
+
+def chinese_to_int(text):
+    """把阿拉伯數字或中文數字（到千位）轉成整數"""
+    if text.isdigit():
+        return int(text)
+    total = 0
+    digit = 0
+    for char in text:
+        if char in CHINESE_DIGITS:
+            digit = CHINESE_DIGITS[char]
+        elif char in CHINESE_UNITS:
+            total += (digit or 1) * CHINESE_UNITS[char]
+            digit = 0
+    return total + digit
+
+
+def tokenize(text):
+    """切分詞項：法條編號正規化、中文雙字元、英數詞"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+
+    # 「第二十四條」和「第24條」視為同一個詞項
+    for match in ARTICLE_RE.finditer(text):
+        token = f"第{chinese_to_int(match.group(1))}條"
+        if match.group(2):
+            token += f"之{chinese_to_int(match.group(2))}"
+        tokens.append(token)
+
+    for run in CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(map(operator.add, run, run[1:]))
+    tokens.extend(WORD_RE.findall(text))
+    return tokens
+
+
+def document_key(doc):
+    """用於融合時識別同一個文本塊"""
+    return doc.metadata.get("doc_id", ""), doc.page_content
+
+
+def rrf_fuse(result_lists, k=6, c=60):
+    """倒數排名融合：每個結果的分數為各路排名的 1/(c+rank) 之和"""
+    scores = {}
+    documents = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, 1):
+            key = document_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (c + rank)
+            documents.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked[:k]]
+
+
+def bm25_idf(count, df):
+    return math.log(1 + (count - df + 0.5) / (df + 0.5))
+
+
+class FrozenPostings:
+    """凍結成numpy陣列的倒排表（建好後不再修改，查詢時不必持鎖）
+
+    每個詞項保存（文本塊位置，詞頻）並預先計算每個文本塊上的BM25權重；
+    保留詞頻是為了合併新增的文本塊時不必從詞典重新凍結。
+    """
+
+    def __init__(self, chunk_ids, entries, lengths, postings, k1, b, position=None):
+        self.chunk_ids = chunk_ids
+        self.entries = entries
+        self.lengths = lengths
+        self.position = position if position is not None else {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+        self.average_length = float(lengths.mean()) if len(lengths) else 1.0
+        self.k1 = k1
+        self.b = b
+        # 詞項 -> (位置陣列, 詞頻陣列)
+        self.postings = postings
+        self.weights = {term: self._bm25(indices, tf) for term, (indices, tf) in postings.items()}
+        # 緩存最近使用的過濾條件對應的文本塊掩碼
+        self.masks = {}
+
+    @classmethod
+    def from_postings(cls, chunks, postings, k1, b):
+        """從詞典形式的倒排表凍結"""
+        chunk_ids = list(chunks)
+        position = {chunk_id: i for i, chunk_id in enumerate(chunk_ids)}
+        lengths = np.array([chunks[chunk_id][2] for chunk_id in chunk_ids], dtype=np.float32)
+        frozen = {}
+        for term, posting in postings.items():
+            indices = np.fromiter((position[chunk_id] for chunk_id in posting), dtype=np.int32, count=len(posting))
+            frozen[term] = (indices, np.fromiter(posting.values(), dtype=np.float32, count=len(posting)))
+        entries = [chunks[chunk_id] for chunk_id in chunk_ids]
+        return cls(chunk_ids, entries, lengths, frozen, k1, b, position)
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def _bm25(self, indices, tf):
+        norm = self.k1 * (1 - self.b + self.b * self.lengths[indices] / self.average_length)
+        return bm25_idf(len(self.chunk_ids), len(indices)) * tf * (self.k1 + 1) / (tf + norm)
+
+    def merged(self, deleted, added_ids, added_entries, added_counts):
+        """去掉已刪除的位置、追加新的文本塊，返回新的凍結倒排表；全部是陣列運算，不遍歷詞典"""
+        alive = np.ones(len(self.chunk_ids), dtype=bool)
+        if deleted:
+            alive[np.fromiter(deleted, dtype=np.int64, count=len(deleted))] = False
+        remap = (np.cumsum(alive) - 1).astype(np.int32)
+        base = int(alive.sum())
+        chunk_ids = [chunk_id for chunk_id, keep in zip(self.chunk_ids, alive) if keep] + list(added_ids)
+        entries = [entry for entry, keep in zip(self.entries, alive) if keep] + list(added_entries)
+        lengths = np.concatenate([self.lengths[alive],
+                                  np.array([entry[2] for entry in added_entries], dtype=np.float32)])
+
+        additions = {}
+        for offset, counts in enumerate(added_counts):
+            for term, tf in counts.items():
+                additions.setdefault(term, []).append((base + offset, tf))
+        postings = {}
+        for term in self.postings.keys() | additions.keys():
+            indices, tf = self.postings.get(term, (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)))
+            if deleted:
+                keep = alive[indices]
+                indices, tf = remap[indices[keep]], tf[keep]
+            extra = additions.get(term)
+            if extra:
+                indices = np.concatenate([indices, np.array([position for position, _ in extra], dtype=np.int32)])
+                tf = np.concatenate([tf, np.array([count for _, count in extra], dtype=np.float32)])
+            if len(indices):
+                postings[term] = (indices, tf)
+        return FrozenPostings(chunk_ids, entries, lengths, postings, self.k1, self.b)
+
+    def filter_mask(self, where):
+        """符合過濾條件的文本塊（布爾陣列）"""
+        key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = np.fromiter((metadata_matches(entry[1], where) for entry in self.entries), dtype=bool,
+                               count=len(self.entries))
+            if len(self.masks) >= FILTER_CACHE_SIZE:
+                self.masks.pop(next(iter(self.masks)))
+            self.masks[key] = mask
+        return mask
+
+
+class LexicalIndex:
+    """可增量更新的BM25倒排索引
+
+    更新時修改詞典形式的倒排表（持久化的內容）；查詢使用凍結成numpy陣列的倒排表，
+    評分是對陣列的向量化累加，十萬個文本塊的查詢也只需要幾毫秒。
+    凍結後的寫入不使凍結部分失效：刪除的文本塊記為已刪除的位置，新增的文本塊放在小的增量段中
+    直接按詞典評分；增量段超過凍結部分的MERGE_RATIO時在背景執行緒中合併，查詢不必等待重新凍結。
+    """
+
+    def __init__(self, path=config.LEXICAL_INDEX_PATH, k1=1.5, b=0.75, background_merge=True):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.background_merge = background_merge
+        self._lock = threading.RLock()
+        # chunk_id -> (page_content, metadata, 長度)
+        self.chunks = {}
+        # doc_id -> [chunk_id]
+        self.doc_chunks = {}
+        # 詞項 -> {chunk_id: 詞頻}
+        self.postings = {}
+        self._frozen = None
+        # 凍結後刪除或替換的文本塊在凍結倒排表中的位置
+        self._deleted = set()
+        # 凍結後新增的文本塊：chunk_id -> 詞頻；以及它們的倒排表 詞項 -> {chunk_id: 詞頻}
+        self._delta = {}
+        self._delta_postings = {}
+        self._merging = False
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            data = pickle.load(f)
+        self.chunks = data["chunks"]
+        self.doc_chunks = data["doc_chunks"]
+        self.postings = data["postings"]
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"chunks": self.chunks, "doc_chunks": self.doc_chunks, "postings": self.postings}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def add_chunks(self, doc_id, chunk_ids, chunks):
+        """加入一個文檔的文本塊（先移除該文檔的舊文本塊）"""
+        with self._lock:
+            self.remove_document(doc_id)
+            for chunk_id, chunk in zip(chunk_ids, chunks):
+                counts = Counter(tokenize(chunk.page_content))
+                self.chunks[chunk_id] = (chunk.page_content, dict(chunk.metadata), sum(counts.values()))
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = tf
+                if self._frozen is not None:
+                    self._add_delta(chunk_id, counts)
+            self.doc_chunks[doc_id] = list(chunk_ids)
+            self._maybe_merge()
+
+    def remove_document(self, doc_id):
+        with self._lock:
+            chunk_ids = self.doc_chunks.pop(doc_id, [])
+            for chunk_id in chunk_ids:
+                entry = self.chunks.pop(chunk_id, None)
+                if entry is None:
+                    continue
+                for term in set(tokenize(entry[0])):
+                    posting = self.postings.get(term)
+                    if posting is not None:
+                        posting.pop(chunk_id, None)
+                        if not posting:
+                            del self.postings[term]
+                if self._frozen is not None and not self._pop_delta(chunk_id):
+                    position = self._frozen.position.get(chunk_id)
+                    if position is not None:
+                        self._deleted.add(position)
+            if chunk_ids:
+                self._maybe_merge()
+
+    def _add_delta(self, chunk_id, counts):
+        position = self._frozen.position.get(chunk_id)
+        if position is not None:
+            self._deleted.add(position)
+        self._delta[chunk_id] = counts
+        for term, tf in counts.items():
+            self._delta_postings.setdefault(term, {})[chunk_id] = tf
+
+    def _pop_delta(self, chunk_id):
+        """從增量段移除文本塊，不在增量段中時返回False"""
+        counts = self._delta.pop(chunk_id, None)
+        if counts is None:
+            return False
+        for term in counts:
+            posting = self._delta_postings[term]
+            del posting[chunk_id]
+            if not posting:
+                del self._delta_postings[term]
+        return True
+
+    def _freeze(self):
+        """把詞典形式的倒排表整個凍結（首次查詢時）"""
+        self._frozen = FrozenPostings.from_postings(self.chunks, self.postings, self.k1, self.b)
+        self._deleted = set()
+        self._delta = {}
+        self._delta_postings = {}
+        return self._frozen
+
+    def _maybe_merge(self):
+        if self._frozen is None or self._merging:
+            return
+        if len(self._delta) + len(self._deleted) < max(MERGE_MIN_CHUNKS, MERGE_RATIO * len(self._frozen)):
+            return
+        self._merging = True
+        if self.background_merge:
+            threading.Thread(target=self._merge, name="lexical-merge", daemon=True).start()
+        else:
+            self._merge()
+
+    def _merge(self):
+        """把增量段和已刪除的位置合併進凍結倒排表；耗時的陣列運算在鎖外進行"""
+        try:
+            with self._lock:
+                frozen = self._frozen
+                deleted = set(self._deleted)
+                added = dict(self._delta)
+                entries = [self.chunks[chunk_id] for chunk_id in added]
+            merged = frozen.merged(deleted, list(added), entries, list(added.values()))
+        except Exception:
+            with self._lock:
+                self._merging = False
+            raise
+        with self._lock:
+            self._merging = False
+            if self._frozen is not frozen:
+                # 期間整個重新凍結過
+                return
+            # 合併期間的寫入改記在新的凍結倒排表上
+            deleted_after = {merged.position[frozen.chunk_ids[position]] for position in self._deleted - deleted}
+            for chunk_id, counts in added.items():
+                if self._delta.get(chunk_id) is counts:
+                    self._pop_delta(chunk_id)
+                else:
+                    deleted_after.add(merged.position[chunk_id])
+            self._frozen = merged
+            self._deleted = deleted_after
+            self._maybe_merge()
+
+    def _score_delta(self, terms, frozen):
+        """按詞典為增量段的文本塊評分，返回 {chunk_id: 分數}；文檔頻率包含凍結部分"""
+        scores = {}
+        count = len(frozen) + len(self._delta)
+        for term in terms:
+            posting = self._delta_postings.get(term)
+            if not posting:
+                continue
+            base = frozen.postings.get(term)
+            idf = bm25_idf(count, len(posting) + (len(base[0]) if base is not None else 0))
+            for chunk_id, tf in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.chunks[chunk_id][2] / frozen.average_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, k=6, filter=None):
+        """BM25檢索，返回 [(Document, 分數)]；filter為Chroma格式的元數據過濾條件"""
+        terms = set(tokenize(query))
+        with self._lock:
+            frozen = self._frozen or self._freeze()
+            mask = frozen.filter_mask(filter) if filter else None
+            deleted = np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted)) if self._deleted else None
+            delta = [
+                (self.chunks[chunk_id], score) for chunk_id, score in self._score_delta(terms, frozen).items()
+                if not filter or metadata_matches(self.chunks[chunk_id][1], filter)
+            ]
+
+        results = []
+        if len(frozen):
+            scores = np.zeros(len(frozen), dtype=np.float32)
+            for term in terms:
+                entry = frozen.postings.get(term)
+                if entry is not None:
+                    scores[entry[0]] += frozen.weights[term]
+            if mask is not None:
+                scores[~mask] = 0
+            if deleted is not None:
+                scores[deleted] = 0
+
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+            results = [(frozen.entries[i], float(scores[i])) for i in candidates]
+
+        results = sorted(results + delta, key=lambda item: item[1], reverse=True)[:k]
+        return [(Document(page_content=entry[0], metadata=dict(entry[1])), score) for entry, score in results]
+
+    def rebuild_from(self, vectorstore):
+        """從向量存儲中已有的文本塊重建索引（升級時補建）"""
+        data = vectorstore.get(include=["documents", "metadatas"])
+        grouped = {}
+        for chunk_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"]):
+            doc_id = (metadata or {}).get("doc_id", "")
+            grouped.setdefault(doc_id, []).append((chunk_id, Document(page_content=text, metadata=metadata or {})))
+        for doc_id, items in grouped.items():
+            self.add_chunks(doc_id, [chunk_id for chunk_id, _ in items], [doc for _, doc in items])
+        self.save()
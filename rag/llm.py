@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""進程內共用的模型客戶端
+
+聊天模型和嵌入模型共用同一組HTTP連接池，同樣參數的聊天模型只建立一次。
+連接池裝有共用的請求調度器（rag.scheduler），所有OpenAI請求按模型限速、排隊和重試。
+設置 LLM_BACKEND=fake 時改用離線的假模型，方便在沒有API Key的環境下壓測。
+"""
+
+import os
+import threading
+
+import httpx
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from rag import config
+from rag.scheduler import AsyncScheduledTransport, ScheduledEmbeddings, ScheduledTransport, get_scheduler
+
+FAKE_ANSWER = (
+    "根據知識庫中的相關規定，營業人應於每單月十五日前申報上期之銷售額與應納稅額，"
+    "逾期未申報者將依法處以罰鍰。以上內容僅供參考，實際適用請以主管機關公告為準。"
+)
+
+_http_clients = None
+_chat_models = {}
+_lock = threading.Lock()
+
+
+def _shared_http_clients():
+    """同步和異步的共用HTTP客戶端（帶連接池）"""
+    global _http_clients
+    if _http_clients is None:
+        limits = httpx.Limits(
+            max_connections=config.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=config.OPENAI_MAX_CONNECTIONS
+        )
+        timeout = httpx.Timeout(60.0, connect=10.0)
+        transport = httpx.HTTPTransport(limits=limits)
+        async_transport = httpx.AsyncHTTPTransport(limits=limits)
+        if config.OPENAI_SCHEDULER_ENABLED:
+            scheduler = get_scheduler()
+            transport = ScheduledTransport(transport, scheduler)
+            async_transport = AsyncScheduledTransport(async_transport, scheduler)
+        _http_clients = (
+            httpx.Client(transport=transport, timeout=timeout),
+            httpx.AsyncClient(transport=async_transport, timeout=timeout),
+        )
+    return _http_clients
+
+
+def get_chat_model(model=config.CHAT_MODEL, temperature=0.7, streaming=True):
+    """返回共用的聊天模型；參數相同的調用得到同一個實例"""
+    # API Key可能在運行中才設置（例如在Streamlit側邊欄輸入），也作為鍵的一部分
+    key = (config.LLM_BACKEND, model, temperature, streaming, os.getenv("OPENAI_API_KEY", ""))
+    with _lock:
+        if key not in _chat_models:
+            if config.LLM_BACKEND == "fake":
+                # 逐字串流，每字延遲FAKE_LLM_TOKEN_SECONDS，模擬生成耗時
+                _chat_models[key] = FakeListChatModel(
+                    responses=[FAKE_ANSWER], sleep=config.FAKE_LLM_TOKEN_SECONDS, name=model
+                )
+            else:
+                http_client, http_async_client = _shared_http_clients()
+                _chat_models[key] = ChatOpenAI(
+                    model=model,
+                    temperature=temperature,
+                    streaming=streaming,
+                    # 串流時也在最後一段返回token用量，指標不必估算
+                    stream_usage=True,
+                    http_client=http_client,
+                    http_async_client=http_async_client
+                )
+        return _chat_models[key]
+
+
+def create_embeddings():
+    """建立嵌入模型（不含緩存），共用HTTP連接池"""
+    if config.LLM_BACKEND == "fake":
+        return DeterministicFakeEmbedding(size=256)
+    with _lock:
+        http_client, http_async_client = _shared_http_clients()
+    embeddings = OpenAIEmbeddings(http_client=http_client, http_async_client=http_async_client)
+    if config.OPENAI_SCHEDULER_ENABLED:
+        # 按調度器自適應的批次大小分批請求
+        return ScheduledEmbeddings(embeddings)
+    return embeddings
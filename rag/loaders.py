@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""文檔加載與元數據處理"""
+
+import hashlib
+import json
+import os
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders import (
+    PyPDFLoader,
+    Docx2txtLoader,
+    TextLoader
+)
+
+from rag import config
+from rag.filters import filter_metadata
+from rag.subtitles import Cue, group_cues
+from rag.text_store import EXTRACTED_TYPES, get_text_store
+
+
+def file_sha256(path, block_size=1 << 20):
+    """計算文件內容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def join_tags(tags):
+    """將標籤列表轉換為逗號分隔的字符串"""
+    return ",".join(tags) if isinstance(tags, list) else tags
+
+
+def get_loader(path, doc_type):
+    """根據文檔類型選擇加載器"""
+    if doc_type == "youtube":
+        return TextLoader(path, encoding="utf-8")
+    if doc_type == "pdf":
+        return PyPDFLoader(path)
+    if doc_type in ["doc", "docx"]:
+        return Docx2txtLoader(path)
+    return TextLoader(path)
+
+
+def load_youtube_segments(cues_path, max_chars=config.YOUTUBE_SEGMENT_CHARS):
+    """按字幕時間分段加載影片字幕，每段帶有開始秒數"""
+    with open(cues_path, "r", encoding="utf-8") as f:
+        cues = [Cue(start, start, text) for start, text in json.load(f)]
+    return [
+        Document(page_content=text, metadata={"start_seconds": int(start)})
+        for start, text in group_cues(cues, max_chars=max_chars)
+    ]
+
+
+def load_document(doc_info, content_hash=None, text_store=None):
+    """加載文檔列表中的一個條目，並附上知識庫元數據
+
+    PDF和Word優先讀取抽取文本存儲；已計算過文件雜湊時傳入content_hash，不必再讀一次文件。
+    """
+    cues_path = doc_info.get("cues_path")
+    if doc_info["type"] == "youtube" and cues_path and os.path.exists(cues_path):
+        documents = load_youtube_segments(cues_path)
+    elif doc_info["type"] in EXTRACTED_TYPES:
+        text_store = text_store if text_store is not None else get_text_store()
+        documents = text_store.load(doc_info["path"], doc_info["type"],
+                                    content_hash or file_sha256(doc_info["path"]), get_loader)
+    else:
+        documents = get_loader(doc_info["path"], doc_info["type"]).load()
+
+    valid_documents = []
+    for doc in documents:
+        if not hasattr(doc, "metadata"):
+            continue
+        doc.metadata["source"] = doc_info["name"]
+        doc.metadata["doc_id"] = doc_info["id"]
+        doc.metadata["category"] = doc_info["category"]
+        doc.metadata["tags"] = join_tags(doc_info["tags"])
+        doc.metadata["type"] = doc_info["type"]
+        if doc_info.get("date_added"):
+            doc.metadata["date_added"] = doc_info["date_added"]
+        for key in ("youtube_id", "youtube_url", "author"):
+            if doc_info.get(key):
+                doc.metadata[key] = doc_info[key]
+        # 按標籤和日期過濾用的欄位
+        doc.metadata.update(filter_metadata(doc_info))
+        valid_documents.append(doc)
+    return valid_documents
+
+
+def clean_metadata(chunks):
+    """過濾向量庫無法存儲的複雜元數據"""
+    filtered_chunks = []
+    for chunk in chunks:
+        # 確保chunk是Document對象而不是字符串
+        if not hasattr(chunk, "metadata"):
+            continue
+        for key in list(chunk.metadata.keys()):
+            value = chunk.metadata[key]
+            # 如果值是複雜類型（不是str、int、float或bool），則轉換或刪除
+            if not isinstance(value, (str, int, float, bool)):
+                if isinstance(value, list):
+                    chunk.metadata[key] = ",".join(map(str, value))
+                else:
+                    del chunk.metadata[key]
+        filtered_chunks.append(chunk)
+    return filtered_chunks
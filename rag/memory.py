@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""有上限的摘要式對話記憶
+
+最近N輪對話逐字保留，更早的對話合併進一段滾動摘要；保留的對話和摘要合計不超過
+該模型的token預算，長對話的問題改寫提示大小因此維持在固定範圍內。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from rag import config
+from rag.splitter import token_counter
+
+SUMMARY_PREFIX = "先前對話摘要："
+
+SUMMARY_TEMPLATE = """請把以下對話內容合併進現有摘要，產生新的摘要。
+保留用戶關心的主題、提到的稅目、法條、金額和期限等關鍵事實，省略寒暄和重複內容，使用繁體中文，不超過{max_chars}字。
+
+現有摘要：
+{summary}
+
+新的對話：
+{conversation}
+
+新的摘要："""
+
+
+def memory_token_budget(model):
+    """某個模型的對話記憶token預算"""
+    return config.MEMORY_TOKEN_BUDGET.get(model, config.MEMORY_TOKEN_BUDGET["default"])
+
+
+def format_turns(messages):
+    lines = []
+    for message in messages:
+        role = "用戶" if isinstance(message, HumanMessage) else "助手"
+        lines.append(f"{role}：{message.content}")
+    return "\n".join(lines)
+
+
+class SummaryBufferMemory(BaseChatMessageHistory):
+    """最近max_turns輪逐字保留，其餘摘要化的對話記憶
+
+    沒有設置摘要模型時，舊對話只保留用戶問題，並截斷到預算內。
+    """
+
+    def __init__(self, llm=None, model=config.TOKENIZER_MODEL, max_turns=config.MEMORY_MAX_TURNS,
+                 token_budget=None, count_tokens=None):
+        self.llm = llm
+        self.model = model
+        self.max_turns = max_turns
+        self._token_budget = token_budget
+        self.count_tokens = count_tokens or token_counter()
+        self.summary = ""
+        self.recent = []
+        self.summarized_turns = 0
+        self._lock = threading.Lock()
+        # 摘要要調用模型，不持有_lock；_summary_lock讓摘要依次合併，clear()後遞增_generation使進行中的摘要作廢
+        self._summary_lock = threading.Lock()
+        self._generation = 0
+
+    @property
+    def token_budget(self):
+        return self._token_budget or memory_token_budget(self.model)
+
+    def configure(self, llm=None, model=None):
+        """切換摘要使用的模型和預算對應的模型"""
+        if llm is not None:
+            self.llm = llm
+        if model is not None:
+            self.model = model
+        self._prune()
+
+    @property
+    def messages(self):
+        with self._lock:
+            messages = list(self.recent)
+            if self.summary:
+                messages.insert(0, SystemMessage(content=SUMMARY_PREFIX + self.summary))
+            return messages
+
+    def add_message(self, message):
+        with self._lock:
+            self.recent.append(message)
+        # 一輪對話以助手回答結束，此時才整理記憶
+        if isinstance(message, AIMessage):
+            self._prune()
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.recent = []
+            self.summarized_turns = 0
+            self._generation += 1
+
+    def token_count(self):
+        """目前記憶（摘要加逐字對話）的token數"""
+        return sum(self.count_tokens(message.content) for message in self.messages)
+
+    def _recent_tokens(self):
+        return sum(self.count_tokens(message.content) for message in self.recent)
+
+    def _evict_count(self, summary_budget):
+        """需要移入摘要的最舊訊息數（整輪計算，至少保留最近一輪）"""
+        tokens = self._recent_tokens()
+        count = 0
+        while len(self.recent) - count > 2 and (
+            len(self.recent) - count > self.max_turns * 2
+            or tokens + summary_budget > self.token_budget
+        ):
+            tokens -= sum(self.count_tokens(message.content) for message in self.recent[count:count + 2])
+            count += 2
+        return count
+
+    def _prune(self):
+        """超過輪數或預算時，把最舊的對話移入摘要
+
+        在鎖內取出要摘要的對話，在鎖外調用摘要模型，再在鎖內一次換上新摘要並移除這些對話；
+        摘要期間讀取記憶和加入新對話不必等待，讀到的仍是完整的舊狀態。
+        """
+        with self._summary_lock:
+            summary_budget = self.token_budget // 3
+            with self._lock:
+                count = self._evict_count(summary_budget)
+                if not count:
+                    return
+                evicted = self.recent[:count]
+                summary = self.summary
+                generation = self._generation
+            new_summary = self._summarize(summary, evicted, summary_budget)
+            with self._lock:
+                # 摘要期間記憶被清除時捨棄結果；其他時候只有這裡會移除recent開頭的訊息
+                if generation != self._generation:
+                    return
+                self.summary = new_summary
+                self.recent = self.recent[count:]
+                self.summarized_turns += count // 2
+
+    def _max_chars(self, budget, text):
+        """token預算換算成提示中的字數上限，按待摘要文本每個字平均的token數估算"""
+        tokens = self.count_tokens(text)
+        if not tokens:
+            return budget
+        return max(1, int(budget * len(text) / tokens))
+
+    def _summarize(self, summary, messages, budget):
+        conversation = format_turns(messages)
+        if self.llm is not None:
+            prompt = SUMMARY_TEMPLATE.format(
+                max_chars=self._max_chars(budget, summary + conversation), summary=summary or "（無）",
+                conversation=conversation
+            )
+            try:
+                summary = self.llm.invoke(prompt).content.strip()
+            except Exception:
+                summary = ""
+            if summary:
+                return self._truncate(summary, budget)
+
+        # 沒有摘要模型或摘要失敗：只保留用戶問題
+        questions = [f"用戶問過：{message.content}" for message in messages if isinstance(message, HumanMessage)]
+        combined = "\n".join(part for part in [summary, *questions] if part)
+        return self._truncate(combined, budget, keep_tail=True)
+
+    def _truncate(self, text, budget, keep_tail=False):
+        """把文本截斷到budget個token以內"""
+        if self.count_tokens(text) <= budget:
+            return text
+        low, high = 0, len(text)
+        while low < high:
+            middle = (low + high + 1) // 2
+            part = text[-middle:] if keep_tail else text[:middle]
+            if self.count_tokens(part) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return text[-low:] if keep_tail and low else text[:low]
+
+
+class MemoryStore:
+    """按用戶保存對話記憶，超過max_users或閒置超過ttl秒的記憶會被淘汰
+
+    session(user_id) 返回 (記憶, 鎖)；同一用戶的問答應持有該鎖依次處理。
+    """
+
+    def __init__(self, factory=SummaryBufferMemory, max_users=config.MEMORY_MAX_USERS, ttl=config.MEMORY_IDLE_TTL):
+        self.factory = factory
+        self.max_users = max_users
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def session(self, user_id):
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.pop(user_id, None)
+            if entry is None or (self.ttl and now - entry[2] > self.ttl):
+                entry = (self.factory(), threading.Lock(), now)
+            self._sessions[user_id] = (entry[0], entry[1], now)
+            # 按最近使用排序，最前面的就是最久未使用的
+            while len(self._sessions) > self.max_users or (
+                self.ttl and now - next(iter(self._sessions.values()))[2] > self.ttl
+            ):
+                self._sessions.popitem(last=False)
+            return entry[0], entry[1]
+
+    def forget(self, user_id):
+        with self._lock:
+            self._sessions.pop(user_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""進程內的分階段耗時與token用量指標
+
+導入（load、split、embed、upsert）和問答（condense、retrieve、rerank、generate）各階段的耗時
+都記錄到同一個註冊表：直方圖以Prometheus文本格式導出，最近的樣本用於介面顯示百分位。
+問答流程通過LangChain回調記錄模型和檢索器調用的耗時與token用量。
+其他元件（如OpenAI請求調度器）可以記錄帶標籤的計數器和即時值。
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.callbacks import BaseCallbackHandler
+
+from rag import config
+
+INGEST_STAGES = ("load", "split", "embed", "upsert")
+QUERY_STAGES = ("condense", "retrieve", "rerank", "generate")
+STAGES = INGEST_STAGES + QUERY_STAGES
+
+# 直方圖的桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """按config.MODEL_PRICES估算費用（美元）；未知的模型返回0"""
+    # 取最長的前綴匹配，例如 gpt-4o-mini-2024-07-18 對應 gpt-4o-mini 而不是 gpt-4o
+    matches = [name for name in config.MODEL_PRICES if model and model.startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = config.MODEL_PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class Histogram:
+    """累計的桶計數加上最近的樣本"""
+
+    def __init__(self, buckets, recent_size):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=recent_size)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+
+class MetricsRegistry:
+    """各階段耗時直方圖、錯誤數和按模型累計的token用量"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, recent_size=config.METRICS_RECENT_SIZE):
+        self.buckets = tuple(buckets)
+        self.recent_size = recent_size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._errors = {}
+            self._usage = {}
+            # {名稱: (說明, {標籤元組: 值})}
+            self._counters = {}
+            self._gauges = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets, self.recent_size)
+            histogram.observe(seconds)
+
+    def record_error(self, stage):
+        with self._lock:
+            self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    def add_usage(self, model, prompt_tokens, completion_tokens, cost):
+        with self._lock:
+            usage = self._usage.setdefault(model, {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0})
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+            usage["cost"] += cost
+
+    def increment(self, name, labels=None, amount=1, description=""):
+        """累加計數器（Prometheus名稱為 rag_<name>_total）"""
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            _, values = self._counters.setdefault(name, (description, {}))
+            values[key] = values.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=None, description=""):
+        """設置即時值（Prometheus名稱為 rag_<name>）"""
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            _, values = self._gauges.setdefault(name, (description, {}))
+            values[key] = value
+
+    def counters(self):
+        """{名稱: {標籤元組: 值}}"""
+        with self._lock:
+            return {name: dict(values) for name, (_, values) in self._counters.items()}
+
+    def gauges(self):
+        with self._lock:
+            return {name: dict(values) for name, (_, values) in self._gauges.items()}
+
+    @contextmanager
+    def timer(self, stage):
+        """記錄with區塊的耗時；拋出異常時計入錯誤數"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record_error(stage)
+            raise
+        self.observe(stage, time.perf_counter() - started)
+
+    def summary(self):
+        """每個階段的累計次數、最近樣本的p50/p95和最近一次耗時（秒）"""
+        with self._lock:
+            snapshot = {stage: (histogram.count, list(histogram.recent))
+                        for stage, histogram in self._histograms.items()}
+            errors = dict(self._errors)
+        summary = {}
+        for stage in sorted(set(snapshot) | set(errors), key=self._stage_order):
+            count, recent = snapshot.get(stage, (0, []))
+            p50, p95 = np.percentile(recent, [50, 95]) if recent else (None, None)
+            summary[stage] = {
+                "count": count,
+                "errors": errors.get(stage, 0),
+                "p50": float(p50) if recent else None,
+                "p95": float(p95) if recent else None,
+                "last": recent[-1] if recent else None,
+            }
+        return summary
+
+    def usage(self):
+        with self._lock:
+            return {model: dict(usage) for model, usage in self._usage.items()}
+
+    @staticmethod
+    def _stage_order(stage):
+        return (STAGES.index(stage) if stage in STAGES else len(STAGES), stage)
+
+    def export_prometheus(self):
+        """Prometheus文本格式（0.0.4）"""
+        lines = [
+            "# HELP rag_stage_seconds 各階段耗時（秒）",
+            "# TYPE rag_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage in sorted(self._histograms, key=self._stage_order):
+                histogram = self._histograms[stage]
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            lines += ["# HELP rag_stage_errors_total 各階段失敗次數", "# TYPE rag_stage_errors_total counter"]
+            for stage in sorted(self._errors, key=self._stage_order):
+                lines.append(f'rag_stage_errors_total{{stage="{stage}"}} {self._errors[stage]}')
+
+            lines += ["# HELP rag_llm_tokens_total 模型token用量", "# TYPE rag_llm_tokens_total counter"]
+            for model, usage in sorted(self._usage.items()):
+                label = model.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'rag_llm_tokens_total{{model="{label}",kind="prompt"}} {usage["prompt_tokens"]}')
+                lines.append(
+                    f'rag_llm_tokens_total{{model="{label}",kind="completion"}} {usage["completion_tokens"]}'
+                )
+
+            lines += ["# HELP rag_llm_cost_usd_total 估算的模型費用（美元）", "# TYPE rag_llm_cost_usd_total counter"]
+            for model, usage in sorted(self._usage.items()):
+                label = model.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'rag_llm_cost_usd_total{{model="{label}"}} {usage["cost"]}')
+
+            for kind, suffix, metrics in (("counter", "_total", self._counters), ("gauge", "", self._gauges)):
+                for name, (description, values) in sorted(metrics.items()):
+                    metric = f"rag_{name}{suffix}"
+                    lines += [f"# HELP {metric} {description or name}", f"# TYPE {metric} {kind}"]
+                    for key, value in sorted(values.items()):
+                        lines.append(f"{metric}{self._format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_labels(key):
+        if not key:
+            return ""
+        labels = []
+        for name, value in key:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            labels.append(f'{name}="{value}"')
+        return "{" + ",".join(labels) + "}"
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_metrics():
+    """進程內共用的指標註冊表"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+class StageCallbackHandler(BaseCallbackHandler):
+    """一次查詢的LangChain回調：按調用時的tags把模型和檢索器的耗時歸到對應階段
+
+    模型返回了token用量時直接使用，串流等沒有用量的情況用count_tokens估算。
+    """
+
+    # 異步調用時也在事件循環中直接執行，計時不受執行緒池排隊影響
+    run_inline = True
+
+    def __init__(self, registry=None, count_tokens=None):
+        self.registry = registry if registry is not None else get_metrics()
+        self.count_tokens = count_tokens or len
+        self.stage_seconds = {}
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+        self._runs = {}
+
+    @staticmethod
+    def _stage(tags, default):
+        for tag in tags or ():
+            if tag in STAGES:
+                return tag
+        return default
+
+    def _start(self, run_id, stage, model=None, prompts=()):
+        self._runs[run_id] = (stage, time.perf_counter(), model, prompts)
+
+    def _end(self, run_id):
+        """結束一次調用並記錄耗時，返回開始時保存的信息"""
+        stage, started, model, prompts = self._runs.pop(run_id)
+        seconds = time.perf_counter() - started
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        self.registry.observe(stage, seconds)
+        return model, prompts
+
+    def _error(self, run_id):
+        entry = self._runs.pop(run_id, None)
+        if entry is not None:
+            self.registry.record_error(entry[0])
+
+    @staticmethod
+    def _model_name(serialized, metadata, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        return ((metadata or {}).get("ls_model_name") or params.get("model_name") or params.get("model")
+                or kwargs.get("name") or (serialized or {}).get("name") or "unknown")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, metadata=None, **kwargs):
+        prompts = [str(message.content) for batch in messages for message in batch]
+        self._start(run_id, self._stage(tags, "generate"), self._model_name(serialized, metadata, kwargs), prompts)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, metadata=None, **kwargs):
+        self._start(run_id, self._stage(tags, "generate"), self._model_name(serialized, metadata, kwargs), prompts)
+
+    @staticmethod
+    def _reported_usage(response):
+        """模型返回的（輸入，輸出）token數，沒有返回時為None"""
+        token_usage = (response.llm_output or {}).get("token_usage")
+        if token_usage:
+            return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+        for generations in response.generations:
+            for generation in generations:
+                usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage_metadata:
+                    return usage_metadata["input_tokens"], usage_metadata["output_tokens"]
+        return None
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id not in self._runs:
+            return
+        model, prompts = self._end(run_id)
+        reported = self._reported_usage(response)
+        if reported is not None:
+            prompt_tokens, completion_tokens = reported
+        else:
+            # 計數在調用結束後才進行，不影響首字延遲
+            prompt_tokens = sum(self.count_tokens(prompt) for prompt in prompts)
+            completion_tokens = sum(self.count_tokens(generation.text)
+                                    for generations in response.generations for generation in generations)
+
+        cost = estimate_cost(model, prompt_tokens, completion_tokens)
+        self.usage["prompt_tokens"] += prompt_tokens
+        self.usage["completion_tokens"] += completion_tokens
+        self.usage["cost"] += cost
+        self.registry.add_usage(model, prompt_tokens, completion_tokens, cost)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._error(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, tags=None, **kwargs):
+        self._start(run_id, self._stage(tags, "retrieve"))
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        if run_id in self._runs:
+            self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._error(run_id)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""本地OpenAI API模擬服務
+
+提供 /v1/embeddings 和 /v1/chat/completions（含串流），按模型以令牌桶限制每分鐘的請求數和token數，
+超出時像OpenAI一樣返回429和Retry-After，也可以按比例隨機注入429，用於在沒有API Key的環境下驗證
+請求調度器的排隊和退避：
+
+    python -m rag.mock_openai serve --port 9100 --rpm 120 --tpm 40000 --throttle-rate 0.05
+    OPENAI_BASE_URL=http://localhost:9100/v1 OPENAI_API_KEY=test streamlit run streamlit_app.py
+    curl http://localhost:9100/stats
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+import uuid
+from collections import Counter
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from rag.scheduler import TokenBucket
+from rag.splitter import token_counter
+
+MOCK_ANSWER = "根據知識庫中的相關規定，營業人應於每單月十五日前申報上期之銷售額與應納稅額。"
+
+
+def mock_embedding(text, dimensions):
+    """由文本雜湊決定的單位向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def create_mock_app(rpm=3000, tpm=1000000, latency=0.0, token_latency=0.0, throttle_rate=0.0,
+                    dimensions=256, seed=None):
+    """模擬的OpenAI API；每個模型各自的限額為rpm和tpm，throttle_rate為隨機返回429的比例"""
+    app = FastAPI(title="OpenAI API模擬服務")
+    app.state.requests = Counter()
+    app.state.throttled = Counter()
+    app.state.tokens = Counter()
+    buckets = {}
+    count_tokens = token_counter()
+    rng = random.Random(seed)
+
+    def admit(endpoint, model, tokens):
+        """扣除額度；超出限額時返回429響應"""
+        requests, token_bucket = buckets.setdefault(model, (TokenBucket(rpm), TokenBucket(tpm)))
+        now = time.monotonic()
+        requests.refill(now)
+        token_bucket.refill(now)
+        headers = {"x-ratelimit-limit-requests": str(rpm), "x-ratelimit-limit-tokens": str(tpm)}
+        # 超過每分鐘上限的單個請求按上限計算
+        tokens = min(tokens, tpm)
+        wait = max(requests.wait_time(1), token_bucket.wait_time(tokens))
+        if wait == 0 and rng.random() < throttle_rate:
+            wait = 0.1
+        if wait > 0:
+            app.state.throttled[endpoint] += 1
+            headers["retry-after-ms"] = str(int(wait * 1000) + 1)
+            headers["retry-after"] = str(int(wait) + 1)
+            return JSONResponse(status_code=429, headers=headers, content={"error": {
+                "message": f"Rate limit reached for {model}", "type": "requests", "code": "rate_limit_exceeded"
+            }})
+        requests.level -= 1
+        token_bucket.level -= tokens
+        app.state.requests[endpoint] += 1
+        app.state.tokens[endpoint] += tokens
+        headers["x-ratelimit-remaining-requests"] = str(int(requests.level))
+        headers["x-ratelimit-remaining-tokens"] = str(int(token_bucket.level))
+        return headers
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        payload = await request.json()
+        inputs = payload["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+        tokens = sum(len(text) if isinstance(text, list) else count_tokens(text) for text in inputs)
+        model = payload.get("model", "text-embedding-ada-002")
+        admitted = admit("embeddings", model, tokens)
+        if isinstance(admitted, JSONResponse):
+            return admitted
+        if latency:
+            await asyncio.sleep(latency)
+        data = []
+        for index, text in enumerate(texts):
+            vector = mock_embedding(text, dimensions)
+            if payload.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return JSONResponse(headers=admitted, content={
+            "object": "list", "data": data, "model": model,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        payload = await request.json()
+        model = payload.get("model", "gpt-3.5-turbo")
+        prompt_tokens = sum(count_tokens(message.get("content") or "") for message in payload.get("messages", []))
+        max_tokens = payload.get("max_completion_tokens") or payload.get("max_tokens") or 0
+        admitted = admit("chat", model, prompt_tokens + max_tokens)
+        if isinstance(admitted, JSONResponse):
+            return admitted
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        pieces = [MOCK_ANSWER[i:i + 4] for i in range(0, len(MOCK_ANSWER), 4)]
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(MOCK_ANSWER),
+                 "total_tokens": prompt_tokens + count_tokens(MOCK_ANSWER)}
+
+        def chunk(delta, finish_reason=None):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        if payload.get("stream"):
+            async def events():
+                if latency:
+                    await asyncio.sleep(latency)
+                yield f"data: {json.dumps(chunk({'role': 'assistant', 'content': ''}))}\n\n"
+                for piece in pieces:
+                    if token_latency:
+                        await asyncio.sleep(token_latency)
+                    yield f"data: {json.dumps(chunk({'content': piece}), ensure_ascii=False)}\n\n"
+                yield f"data: {json.dumps(chunk({}, 'stop'))}\n\n"
+                if (payload.get("stream_options") or {}).get("include_usage"):
+                    final = {**chunk({}), "choices": [], "usage": usage}
+                    yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream", headers=admitted)
+
+        await asyncio.sleep(latency + token_latency * len(pieces))
+        return JSONResponse(headers=admitted, content={
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": MOCK_ANSWER},
+                         "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests, "throttled": app.state.throttled, "tokens": app.state.tokens}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OpenAI API模擬服務")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="啟動模擬服務")
+    serve.add_argument("--port", type=int, default=9100)
+    serve.add_argument("--rpm", type=int, default=3000, help="每個模型每分鐘的請求數上限")
+    serve.add_argument("--tpm", type=int, default=1000000, help="每個模型每分鐘的token數上限")
+    serve.add_argument("--latency", type=float, default=0.0, help="每個請求的延遲（秒）")
+    serve.add_argument("--token-latency", type=float, default=0.0, help="聊天每個輸出片段的延遲（秒）")
+    serve.add_argument("--throttle-rate", type=float, default=0.0, help="隨機返回429的比例")
+    args = parser.parse_args()
+
+    app = create_mock_app(rpm=args.rpm, tpm=args.tpm, latency=args.latency, token_latency=args.token_latency,
+                          throttle_rate=args.throttle_rate)
+    uvicorn.run(app, host="0.0.0.0", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""檢索增強問答流程
+
+先完成問題改寫和檢索，再以串流方式生成回答，並記錄每次查詢的首字延遲。
+設置了回答緩存時，改寫後的問題命中緩存就直接返回之前的回答。
+改寫、檢索和生成的耗時與token用量通過回調記錄到指標註冊表（rag.metrics）。
+設置了模型路由器（rag.router）時，改寫使用快速模型，回答的模型在檢索後按路由結果選擇。
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from rag.metrics import StageCallbackHandler, get_metrics
+from rag.splitter import token_counter
+
+# 預設的系統提示，Streamlit介面可以修改
+DEFAULT_SYSTEM_PROMPT = """你是一個專業的財務稅法顧問，負責回答用戶的財務和稅法問題。
+
+請遵循以下指導原則：
+1. 使用繁體中文回答所有問題，即使用戶使用簡體中文提問。
+2. 首先仔細分析用戶問題的真正意圖和語義，理解用戶真正想知道的是什麼。
+3. 基於提供的文檔內容回答問題，但不要僅僅複製文檔中的內容。
+4. 如果文檔中的信息不完整，請使用你的專業知識補充回答，但明確區分哪些是來自文檔的信息，哪些是你的專業補充。
+5. 如果文檔中完全沒有相關信息，請誠實地說明，並提供你的專業建議或引導用戶尋找更多資源。
+6. 回答應該專業、準確、易於理解，並引用相關的法規或文檔來源。
+7. 對於會計、稅務等專業問題，請提供系統性的回答，而不僅僅是列出文檔中提到的片段。
+
+記住：你的目標是真正解決用戶的問題，而不僅僅是檢索和呈現文檔內容。"""
+
+# 回答時附加在系統提示後的檢索內容與步驟說明
+ANSWER_INSTRUCTIONS = """
+
+文檔內容: {context}
+
+請記住以下步驟來回答用戶的問題：
+1. 仔細分析用戶問題的真正意圖和語義
+2. 思考這個問題在財務稅法領域的專業背景和重要性
+3. 從提供的文檔中找出相關信息
+4. 組織一個結構化、系統性的回答，而不僅僅是列出文檔片段
+5. 如有必要，補充專業知識以提供完整回答
+6. 確保回答使用繁體中文，專業準確且易於理解
+"""
+
+# 與ConversationalRetrievalChain相同的問題改寫提示
+CONDENSE_QUESTION_TEMPLATE = """Given the following conversation and a follow up question, rephrase the follow up question to be a standalone question, in its original language.
+
+Chat History:
+{chat_history}
+Follow Up Input: {question}
+Standalone question:"""
+
+
+def format_chat_history(messages):
+    """把對話記錄轉成問題改寫提示使用的文本"""
+    lines = []
+    for message in messages:
+        if isinstance(message, SystemMessage):
+            # 摘要式記憶中較早對話的摘要
+            role = "Summary"
+        else:
+            role = "Human" if isinstance(message, HumanMessage) else "Assistant"
+        lines.append(f"{role}: {message.content}")
+    return "\n".join(lines)
+
+
+def youtube_link(metadata):
+    """影片連結，有字幕開始時間時直接跳到該時刻"""
+    youtube_id = metadata.get("youtube_id")
+    if not youtube_id:
+        return metadata.get("youtube_url")
+    link = f"https://www.youtube.com/watch?v={youtube_id}"
+    if "start_seconds" in metadata:
+        link += f"&t={int(metadata['start_seconds'])}s"
+    return link
+
+
+def format_sources(source_documents, limit=3):
+    """生成回答末尾的參考來源文本"""
+    if not source_documents:
+        return ""
+
+    # 去重邏輯：使用集合記錄已經添加的文檔ID和內容
+    added_sources = set()
+    unique_docs = []
+    for doc in source_documents:
+        doc_id = doc.metadata.get("doc_id", "")
+        # 創建唯一標識，結合文檔ID和內容的前50個字符
+        content_hash = f"{doc_id}_{doc.page_content[:50]}"
+        if content_hash not in added_sources:
+            added_sources.add(content_hash)
+            unique_docs.append(doc)
+
+    sources_text = "\n\n**參考來源：**\n"
+    # 最多顯示limit個不重複的來源
+    for i, doc in enumerate(unique_docs[:limit], 1):
+        source = doc.metadata.get("source", "未知來源")
+        doc_type = doc.metadata.get("type", "文件")
+        category = doc.metadata.get("category", "")
+
+        # 提取文檔片段的簡短摘要（最多100個字符）
+        content_preview = doc.page_content[:100] + "..." if len(doc.page_content) > 100 else doc.page_content
+
+        if doc_type == "youtube":
+            link = youtube_link(doc.metadata)
+            title = f"[{source}]({link})" if link else source
+            sources_text += f"{i}. YouTube影片：{title}\n   相關內容：「{content_preview}」\n"
+        else:
+            sources_text += f"{i}. 文件：{source} (類別：{category})\n   相關內容：「{content_preview}」\n"
+    return sources_text
+
+
+@dataclass
+class QueryResult:
+    """一次查詢的檢索結果、回答與耗時"""
+    question: str
+    standalone_question: str
+    source_documents: list = field(default_factory=list)
+    answer: str = ""
+    started_at: float = 0.0
+    retrieval_seconds: float = 0.0
+    time_to_first_token: Optional[float] = None
+    total_seconds: Optional[float] = None
+    messages: list = field(default_factory=list)
+    # 命中回答緩存時為 "exact" 或 "semantic"
+    cache_hit: Optional[str] = None
+    # 本輪送入模型的對話歷史和提示（改寫加回答）token數
+    history_tokens: int = 0
+    prompt_tokens: int = 0
+    # 各階段耗時（秒）和本次查詢的模型用量 {"prompt_tokens", "completion_tokens", "cost"}
+    stage_seconds: dict = field(default_factory=dict)
+    usage: dict = field(default_factory=dict)
+    callbacks: list = field(default_factory=list)
+    # 檢索範圍（Chroma格式的元數據過濾條件）
+    filter: Optional[dict] = None
+    # 回答使用的模型；自動路由時另有路由名稱（fast、strong）和原因
+    model: Optional[str] = None
+    route: Optional[str] = None
+    route_reason: Optional[str] = None
+
+
+class RAGPipeline:
+    """問題改寫 → 檢索 → 串流生成"""
+
+    def __init__(self, retriever, llm, system_prompt, condense_llm=None, answer_cache=None, metrics=None,
+                 router=None):
+        self.retriever = retriever
+        self.llm = llm
+        self.router = router
+        self.condense_llm = condense_llm or (router.condense_llm if router is not None else llm)
+        self.system_prompt = system_prompt
+        self.answer_cache = answer_cache
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.count_tokens = token_counter()
+        self.model_name = (getattr(llm, "model_name", None) or getattr(llm, "model", None)
+                           or getattr(llm, "name", None) or type(llm).__name__)
+        # 不同模型（或路由設置）和系統提示的回答分開緩存
+        model_name = router.name if router is not None else self.model_name
+        self.cache_namespace = hashlib.sha256(f"{model_name}\n{system_prompt}".encode("utf-8")).hexdigest()[:16]
+
+    def namespace(self, filter=None):
+        """回答緩存的命名空間：限定了檢索範圍的回答與不限範圍的分開緩存"""
+        if not filter:
+            return self.cache_namespace
+        key = json.dumps(filter, sort_keys=True, ensure_ascii=False)
+        return f"{self.cache_namespace}:{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}"
+
+    def condense_prompt(self, question, chat_history):
+        """問題改寫提示；沒有對話歷史時不需要改寫，返回None"""
+        if not chat_history:
+            return None
+        return CONDENSE_QUESTION_TEMPLATE.format(
+            chat_history=format_chat_history(chat_history),
+            question=question
+        )
+
+    def condense_question(self, question, chat_history, callbacks=None):
+        """有對話歷史時把後續問題改寫成獨立問題"""
+        prompt = self.condense_prompt(question, chat_history)
+        if prompt is None:
+            return question
+        response = self.condense_llm.invoke(prompt, config={"callbacks": callbacks, "tags": ["condense"]})
+        return response.content.strip() or question
+
+    def build_messages(self, question, documents):
+        """把檢索到的文檔合併到一個提示中（stuff）"""
+        context = "\n\n".join(doc.page_content for doc in documents)
+        system_message = self.system_prompt + ANSWER_INSTRUCTIONS.format(context=context)
+        return [SystemMessage(content=system_message), HumanMessage(content=question)]
+
+    def prepare(self, question, chat_history=(), filter=None):
+        """完成問題改寫和檢索，返回待生成回答的查詢結果；filter限定檢索範圍"""
+        started_at = time.perf_counter()
+        handler = StageCallbackHandler(self.metrics, self.count_tokens)
+        callbacks = [handler]
+        chat_history = list(chat_history)
+        condense_prompt = self.condense_prompt(question, chat_history)
+        history_tokens = sum(self.count_tokens(message.content) for message in chat_history)
+        condense_tokens = self.count_tokens(condense_prompt) if condense_prompt else 0
+        standalone_question = self.condense_question(question, chat_history, callbacks)
+
+        if self.answer_cache is not None:
+            cached = self.answer_cache.lookup(self.namespace(filter), standalone_question)
+            if cached is not None:
+                return QueryResult(
+                    question=question,
+                    standalone_question=standalone_question,
+                    source_documents=cached.source_documents,
+                    answer=cached.answer,
+                    started_at=started_at,
+                    retrieval_seconds=time.perf_counter() - started_at,
+                    cache_hit=cached.match,
+                    history_tokens=history_tokens,
+                    prompt_tokens=condense_tokens,
+                    stage_seconds=handler.stage_seconds,
+                    usage=handler.usage,
+                    callbacks=callbacks,
+                    filter=filter
+                )
+
+        # 只在有過濾條件時傳入，不支持過濾的檢索器照常使用
+        retriever_kwargs = {"filter": filter} if filter else {}
+        documents = self.retriever.invoke(
+            standalone_question, config={"callbacks": callbacks, "tags": ["retrieve"]}, **retriever_kwargs
+        )
+        result = QueryResult(
+            question=question,
+            standalone_question=standalone_question,
+            source_documents=documents,
+            started_at=started_at,
+            retrieval_seconds=time.perf_counter() - started_at,
+            history_tokens=history_tokens,
+            stage_seconds=handler.stage_seconds,
+            usage=handler.usage,
+            callbacks=callbacks,
+            filter=filter,
+            model=self.model_name
+        )
+        if self.router is not None:
+            route = self.router.route(standalone_question, documents, chat_history)
+            result.route, result.model, result.route_reason = route.name, route.model, route.reason
+        result.messages = self.build_messages(standalone_question, documents)
+        result.prompt_tokens = condense_tokens + sum(self.count_tokens(message.content) for message in result.messages)
+        return result
+
+    def stream(self, result):
+        """串流生成回答，逐段返回文本並記錄首字延遲"""
+        if result.cache_hit:
+            result.time_to_first_token = time.perf_counter() - result.started_at
+            yield result.answer
+            result.total_seconds = time.perf_counter() - result.started_at
+            return
+
+        parts = []
+        for chunk in self.answer_llm(result).stream(result.messages, config=self._generate_config(result)):
+            text = self._record_chunk(result, chunk, parts)
+            if text:
+                yield text
+        self._finish(result, parts)
+
+    def answer_llm(self, result):
+        """生成回答使用的模型"""
+        if result.route is not None:
+            return self.router.llm(result.route)
+        return self.llm
+
+    @staticmethod
+    def _generate_config(result):
+        return {"callbacks": result.callbacks, "tags": ["generate"]}
+
+    def _record_chunk(self, result, chunk, parts):
+        text = chunk.content
+        if text:
+            if result.time_to_first_token is None:
+                result.time_to_first_token = time.perf_counter() - result.started_at
+            parts.append(text)
+        return text
+
+    def _finish(self, result, parts):
+        result.answer = "".join(parts)
+        result.total_seconds = time.perf_counter() - result.started_at
+        if result.route is not None:
+            self.router.record(result.route, result.model, result.total_seconds, result.usage.get("cost", 0.0))
+        if self.answer_cache is not None:
+            self.answer_cache.put(self.namespace(result.filter), result.standalone_question, result.answer,
+                                  result.source_documents)
+
+    async def aprepare(self, question, chat_history=(), filter=None):
+        """prepare的異步版本，改寫和檢索在執行緒池中進行"""
+        return await asyncio.to_thread(self.prepare, question, chat_history, filter)
+
+    async def astream(self, result):
+        """stream的異步版本，生成時不佔用執行緒"""
+        if result.cache_hit:
+            result.time_to_first_token = time.perf_counter() - result.started_at
+            yield result.answer
+            result.total_seconds = time.perf_counter() - result.started_at
+            return
+
+        parts = []
+        async for chunk in self.answer_llm(result).astream(result.messages, config=self._generate_config(result)):
+            text = self._record_chunk(result, chunk, parts)
+            if text:
+                yield text
+        await asyncio.to_thread(self._finish, result, parts)
+
+    def invoke(self, question, chat_history=(), filter=None):
+        """不串流，直接返回完整的查詢結果"""
+        result = self.prepare(question, chat_history, filter)
+        for _ in self.stream(result):
+            pass
+        return result
+
+
+def remember_turn(chat_history, question, answer):
+    """把一輪問答寫入對話記憶"""
+    chat_history.add_message(HumanMessage(content=question))
+    chat_history.add_message(AIMessage(content=answer))
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""背景更新索引
+
+更新在單獨的工作執行緒中排隊執行，介面和API只需提交任務再查詢狀態（queued → running → done/failed）。
+預設的 sync 任務只增量同步有變更的文檔（KnowledgeBase.sync）；明確要求的 rebuild 任務由 KnowledgeBase.rebuild
+在新的一代目錄中完整重建，完成後才原子切換，期間查詢照常使用舊索引。
+"""
+
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from rag.metrics import get_metrics
+
+# 保留最近多少個任務的狀態
+JOB_HISTORY_SIZE = 20
+
+SYNC = "sync"
+REBUILD = "rebuild"
+
+
+@dataclass
+class ReindexJob:
+    """一次更新任務的狀態和進度"""
+    id: str
+    mode: str = SYNC
+    status: str = "queued"
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    done: int = 0
+    total: int = 0
+    current: Optional[str] = None
+    stats: Optional[dict] = None
+    error: Optional[str] = None
+    # 本次任務期間嵌入緩存的命中和未命中次數
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class ReindexWorker:
+    """單一工作執行緒依次執行更新任務"""
+
+    def __init__(self, knowledge_base, metrics=None):
+        self.knowledge_base = knowledge_base
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, mode=SYNC):
+        """提交更新任務；已有同一模式的排隊中任務時直接返回它（結果相同，不必執行兩次）"""
+        if mode not in (SYNC, REBUILD):
+            raise ValueError(f"不支持的更新模式: {mode}")
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == "queued" and job.mode == mode:
+                    return job
+            job = ReindexJob(id=uuid.uuid4().hex[:12], mode=mode)
+            self._jobs[job.id] = job
+            while len(self._jobs) > JOB_HISTORY_SIZE:
+                oldest = next(iter(self._jobs))
+                if not self._jobs[oldest].finished:
+                    break
+                del self._jobs[oldest]
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="reindex-worker", daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest(self):
+        """最近提交的任務，沒有時返回None"""
+        with self._lock:
+            return next(reversed(self._jobs.values()), None)
+
+    @property
+    def busy(self):
+        with self._lock:
+            return any(not job.finished for job in self._jobs.values())
+
+    def _loop(self):
+        while True:
+            self._run(self._queue.get())
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+
+        def progress(done, total, name):
+            job.done, job.total, job.current = done, total, name
+
+        cache = None
+        try:
+            cache = getattr(self.knowledge_base.vectorstore.embeddings, "cache", None)
+            hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+            if job.mode == REBUILD:
+                with self.metrics.timer("reindex"):
+                    stats = self.knowledge_base.rebuild(progress=progress)
+            else:
+                stats = self.knowledge_base.sync(progress=progress)
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        else:
+            job.stats = asdict(stats)
+            job.status = "done"
+        finally:
+            if cache is not None:
+                job.cache_hits, job.cache_misses = cache.hits - hits, cache.misses - misses
+            job.current = None
+            job.finished_at = time.time()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""檢索結果重排
+
+先多取一批候選（RERANK_CANDIDATES），用MinHash估計詞項集合的Jaccard相似度，去掉近似重複的
+文本塊（重複上傳或只有少量修訂的文檔），再按與問題的相關性重新評分，在token預算內保留最好的k個，
+使提示更短、生成更快。評分器：
+- lexical（預設）：在候選集上計算的BM25，純CPU、不需要模型
+- cross-encoder:<模型名>：本地的交叉編碼器，在CPU上運行（需要安裝 sentence-transformers），例如
+  RERANK_MODEL=cross-encoder:BAAI/bge-reranker-base
+"""
+
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from rag import config
+from rag.lexical import tokenize
+from rag.metrics import get_metrics
+from rag.splitter import token_counter
+
+MINHASH_PERMUTATIONS = 64
+# 小於2^32的最大質數：32位雜湊乘32位係數不會溢出uint64
+MINHASH_PRIME = 4294967291
+_rng = np.random.default_rng(20240601)
+_PERMUTATION_A = _rng.integers(1, MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERMUTATION_B = _rng.integers(0, MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def term_hashes(text):
+    """文本的詞項雜湊（排序、去重）和對應的詞頻"""
+    counts = Counter(tokenize(text))
+    # 進程內的字串雜湊足以比較同一次查詢的候選
+    hashes = np.fromiter((hash(term) & 0xFFFFFFFF for term in counts), dtype=np.uint64, count=len(counts))
+    frequencies = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    order = np.argsort(hashes)
+    return hashes[order], frequencies[order]
+
+
+def minhash(hashes):
+    """詞項集合的MinHash簽名（MINHASH_PERMUTATIONS個雜湊的最小值）"""
+    if not len(hashes):
+        return np.full(MINHASH_PERMUTATIONS, MINHASH_PRIME, dtype=np.uint64)
+    permuted = (hashes[:, None] * _PERMUTATION_A[None, :] + _PERMUTATION_B[None, :]) % MINHASH_PRIME
+    return permuted.min(axis=0)
+
+
+@dataclass
+class ChunkFeatures:
+    """文本塊的詞項、MinHash簽名和token數，按文本緩存"""
+    hashes: np.ndarray
+    frequencies: np.ndarray
+    signature: np.ndarray
+    length: float
+    # 模型token數只在選入結果時才計算
+    tokens: Optional[int] = None
+
+
+def near_duplicates(features, threshold):
+    """按原順序找出與前面某個保留的文本塊估計Jaccard相似度不低於threshold的位置"""
+    if len(features) < 2:
+        return set()
+    signatures = np.stack([feature.signature for feature in features])
+    similarity = (signatures[:, None, :] == signatures[None, :, :]).mean(axis=2)
+    duplicates = set()
+    for i in range(1, len(features)):
+        for j in range(i):
+            if j not in duplicates and similarity[i, j] >= threshold:
+                duplicates.add(i)
+                break
+    return duplicates
+
+
+class LexicalScorer:
+    """以候選集為語料的BM25評分"""
+
+    name = "lexical"
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+    def score(self, query, documents, features):
+        query_hashes = np.unique(term_hashes(query)[0])
+        if not len(query_hashes) or not features:
+            return [0.0] * len(features)
+        # 每個候選在每個查詢詞項上的詞頻矩陣
+        tf = np.zeros((len(features), len(query_hashes)), dtype=np.float32)
+        for i, feature in enumerate(features):
+            if not len(feature.hashes):
+                continue
+            positions = np.minimum(np.searchsorted(feature.hashes, query_hashes), len(feature.hashes) - 1)
+            present = feature.hashes[positions] == query_hashes
+            tf[i, present] = feature.frequencies[positions[present]]
+        lengths = np.array([feature.length for feature in features], dtype=np.float32)
+        frequency = (tf > 0).sum(axis=0)
+        idf = np.log(1 + (len(features) - frequency + 0.5) / (frequency + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * lengths / (lengths.mean() or 1.0))
+        scores = (idf * tf * (self.k1 + 1) / (tf + norm[:, None])).sum(axis=1)
+        return scores.tolist()
+
+
+class CrossEncoderScorer:
+    """本地交叉編碼器評分（CPU）"""
+
+    def __init__(self, model_name, max_length=512):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("交叉編碼器重排需要安裝 sentence-transformers") from e
+        self.name = model_name
+        self.model = CrossEncoder(model_name, device="cpu", max_length=max_length)
+
+    def score(self, query, documents, features):
+        return self.model.predict([(query, doc.page_content) for doc in documents]).tolist()
+
+
+class Reranker:
+    """去重、重新評分並按token預算截取檢索候選"""
+
+    def __init__(self, scorer=None, candidates=config.RERANK_CANDIDATES, token_budget=config.RERANK_TOKEN_BUDGET,
+                 dedupe_threshold=config.RERANK_DEDUPE_THRESHOLD, cache_size=config.RERANK_CACHE_SIZE,
+                 count_tokens=None, metrics=None):
+        self.scorer = scorer or LexicalScorer()
+        self.candidates = candidates
+        self.token_budget = token_budget
+        self.dedupe_threshold = dedupe_threshold
+        self.cache_size = cache_size
+        self.count_tokens = count_tokens or token_counter()
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def features(self, text):
+        """文本塊的特徵；常被檢索到的文本塊不必每次重新切詞"""
+        with self._lock:
+            feature = self._cache.get(text)
+            if feature is not None:
+                self._cache.move_to_end(text)
+                return feature
+        hashes, frequencies = term_hashes(text)
+        feature = ChunkFeatures(hashes, frequencies, minhash(hashes), float(frequencies.sum()))
+        with self._lock:
+            self._cache[text] = feature
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return feature
+
+    def rerank(self, query, documents, k):
+        """返回最多k個文本塊，總token數不超過預算（至少保留一個）"""
+        with self.metrics.timer("rerank"):
+            features = [self.features(doc.page_content) for doc in documents]
+            duplicates = near_duplicates(features, self.dedupe_threshold)
+            kept = [i for i in range(len(documents)) if i not in duplicates]
+            scores = self.scorer.score(query, [documents[i] for i in kept], [features[i] for i in kept])
+            # 分數相同時保持原來的檢索順序
+            ranked = [kept[j] for j in sorted(range(len(kept)), key=lambda j: -scores[j])]
+
+            selected, used = [], 0
+            for i in ranked:
+                if features[i].tokens is None:
+                    features[i].tokens = self.count_tokens(documents[i].page_content)
+                tokens = features[i].tokens
+                if selected and used + tokens > self.token_budget:
+                    continue
+                selected.append(documents[i])
+                used += tokens
+                if len(selected) >= k:
+                    break
+        return selected
+
+
+def create_reranker(model=config.RERANK_MODEL, **kwargs):
+    """按名稱建立重排器：lexical 或 cross-encoder:<模型名>"""
+    if model == "lexical":
+        return Reranker(LexicalScorer(), **kwargs)
+    if model.startswith("cross-encoder:"):
+        return Reranker(CrossEncoderScorer(model.split(":", 1)[1]), **kwargs)
+    raise ValueError(f"不支持的重排模型: {model}")
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""快速模型與強模型之間的自動路由
+
+模型設為 auto 時，問題改寫一律使用快速模型；檢索完成後由分類器根據問題長度、檢索結果的分佈和
+對話歷史決定回答使用的模型：簡單的查找交給快速模型，需要綜合多份文檔的問題交給強模型。
+分類器可以替換（ROUTER_CLASSIFIER），只需提供 classify(features) 方法，返回（路由，原因）；
+分類器出錯或返回未知的路由時使用預設路由（ROUTER_FALLBACK）。
+每條路由的回答耗時、次數和費用記錄到指標註冊表。
+"""
+
+import importlib
+import logging
+from dataclasses import asdict, dataclass
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from rag import config
+from rag.llm import get_chat_model
+from rag.metrics import get_metrics
+from rag.rerank import ChunkFeatures, LexicalScorer, term_hashes
+from rag.splitter import token_counter
+
+logger = logging.getLogger(__name__)
+
+AUTO_MODEL = "auto"
+FAST = "fast"
+STRONG = "strong"
+ROUTE_NAMES = {FAST: "快速模型", STRONG: "強模型"}
+
+
+@dataclass
+class RouteFeatures:
+    """分類器使用的查詢特徵"""
+    question_tokens: int
+    # 相關性分數接近最高分的文本塊來自多少份不同的文檔
+    sources: int
+    # 最相關與次相關文本塊的相關性分數的相對差距（0到1），越小表示沒有單一明顯的答案來源
+    score_spread: float
+    history_turns: int
+    # 較早的對話已合併成摘要
+    has_summary: bool = False
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class Route:
+    """一次查詢的路由結果"""
+    name: str
+    model: str
+    reason: str
+    features: RouteFeatures
+
+
+def relevance_scores(question, documents):
+    """以文本塊集合為語料計算問題與每個文本塊的BM25分數；與檢索後端無關，不同後端的結果可比"""
+    features = []
+    for doc in documents:
+        hashes, frequencies = term_hashes(doc.page_content)
+        features.append(ChunkFeatures(hashes, frequencies, None, float(frequencies.sum())))
+    return LexicalScorer().score(question, documents, features)
+
+
+def route_features(question, documents, chat_history=(), relevance_ratio=config.ROUTER_RELEVANCE_RATIO,
+                   count_tokens=None):
+    """計算查詢特徵；question為改寫後的獨立問題"""
+    count_tokens = count_tokens or token_counter()
+    documents = list(documents)
+    scores = relevance_scores(question, documents)
+    ranked = sorted(scores, reverse=True)
+    top = ranked[0] if ranked else 0.0
+    if top <= 0:
+        spread = 0.0
+    else:
+        spread = (top - ranked[1]) / top if len(ranked) > 1 else 1.0
+    sources = {
+        doc.metadata.get("doc_id") or doc.metadata.get("source")
+        for doc, score in zip(documents, scores)
+        if top > 0 and score >= relevance_ratio * top
+    }
+    return RouteFeatures(
+        question_tokens=count_tokens(question),
+        sources=len(sources),
+        score_spread=spread,
+        history_turns=sum(1 for message in chat_history if isinstance(message, HumanMessage)),
+        has_summary=any(isinstance(message, SystemMessage) for message in chat_history)
+    )
+
+
+class HeuristicClassifier:
+    """按成立的信號數選擇路由，信號數不少於strong_signals時使用強模型"""
+
+    name = "heuristic"
+
+    def __init__(self, strong_signals=config.ROUTER_STRONG_SIGNALS,
+                 long_question_tokens=config.ROUTER_LONG_QUESTION_TOKENS, min_sources=config.ROUTER_MIN_SOURCES,
+                 max_score_spread=config.ROUTER_SCORE_SPREAD, history_turns=config.ROUTER_HISTORY_TURNS):
+        self.strong_signals = strong_signals
+        self.long_question_tokens = long_question_tokens
+        self.min_sources = min_sources
+        self.max_score_spread = max_score_spread
+        self.history_turns = history_turns
+
+    def signals(self, features):
+        """成立的信號描述列表"""
+        signals = []
+        if features.question_tokens >= self.long_question_tokens:
+            signals.append(f"問題較長（{features.question_tokens} token）")
+        if features.sources >= self.min_sources:
+            signals.append(f"相關內容分佈在 {features.sources} 份文檔")
+        if features.score_spread < self.max_score_spread:
+            signals.append(f"沒有明顯最相關的文本塊（差距 {features.score_spread:.2f}）")
+        if features.history_turns >= self.history_turns or features.has_summary:
+            signals.append("多輪對話")
+        return signals
+
+    def classify(self, features):
+        signals = self.signals(features)
+        if len(signals) >= self.strong_signals:
+            return STRONG, "、".join(signals)
+        return FAST, "、".join(signals) or "簡單查找"
+
+
+def create_classifier(name=config.ROUTER_CLASSIFIER):
+    """按名稱建立分類器：heuristic 或 "模組:類別"（無參數建立）"""
+    if name == "heuristic":
+        return HeuristicClassifier()
+    if ":" in name:
+        module_name, attribute = name.split(":", 1)
+        classifier = getattr(importlib.import_module(module_name), attribute)
+        return classifier() if isinstance(classifier, type) else classifier
+    raise ValueError(f"不支持的路由分類器: {name}")
+
+
+def model_name(llm):
+    """聊天模型的名稱（假模型使用name）"""
+    return (getattr(llm, "model_name", None) or getattr(llm, "model", None) or getattr(llm, "name", None)
+            or type(llm).__name__)
+
+
+class ModelRouter:
+    """問題改寫用快速模型，回答按分類結果選擇快速或強模型"""
+
+    def __init__(self, fast_llm, strong_llm, classifier=None, condense_llm=None, count_tokens=None, metrics=None,
+                 fallback=config.ROUTER_FALLBACK):
+        self.llms = {FAST: fast_llm, STRONG: strong_llm}
+        if fallback not in self.llms:
+            raise ValueError(f"不支持的預設路由: {fallback}")
+        self.fallback = fallback
+        self.condense_llm = condense_llm or fast_llm
+        self.classifier = classifier or HeuristicClassifier()
+        self.count_tokens = count_tokens or token_counter()
+        self.metrics = metrics if metrics is not None else get_metrics()
+
+    @property
+    def name(self):
+        """回答緩存的命名空間使用的名稱，兩個模型或分類器改變時緩存分開"""
+        classifier = getattr(self.classifier, "name", type(self.classifier).__name__)
+        return f"{AUTO_MODEL}:{model_name(self.llms[FAST])}:{model_name(self.llms[STRONG])}:{classifier}"
+
+    def llm(self, route_name):
+        return self.llms[route_name]
+
+    def route(self, question, documents, chat_history=()):
+        features = route_features(question, documents, chat_history, count_tokens=self.count_tokens)
+        try:
+            name, reason = self.classifier.classify(features)
+        except Exception:
+            logger.exception("路由分類失敗，使用預設路由")
+            name, reason = None, None
+        if name not in self.llms:
+            self.metrics.record_error("route")
+            name, reason = self.fallback, "分類失敗，使用預設路由"
+        return Route(name=name, model=model_name(self.llms[name]), reason=reason, features=features)
+
+    def record(self, route_name, model, seconds, cost):
+        """記錄一次回答的總耗時和費用"""
+        self.metrics.observe(f"route_{route_name}", seconds)
+        labels = {"route": route_name, "model": model}
+        self.metrics.increment("route_queries", labels, description="按路由統計的查詢次數")
+        self.metrics.increment("route_cost_usd", labels, cost, description="按路由統計的估算費用（美元）")
+
+
+def create_router(temperature=0.7, fast_model=config.ROUTER_FAST_MODEL, strong_model=config.ROUTER_STRONG_MODEL,
+                  classifier=config.ROUTER_CLASSIFIER, fallback=config.ROUTER_FALLBACK):
+    """使用共用聊天模型的路由器；問題改寫使用溫度為0的快速模型"""
+    return ModelRouter(
+        fast_llm=get_chat_model(model=fast_model, temperature=temperature),
+        strong_llm=get_chat_model(model=strong_model, temperature=temperature),
+        classifier=create_classifier(classifier),
+        condense_llm=get_chat_model(model=fast_model, temperature=0, streaming=False),
+        fallback=fallback
+    )
@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""進程內共用的OpenAI請求調度器
+
+聊天模型和嵌入模型共用的HTTP客戶端裝有 ScheduledTransport，所有 /chat/completions 和 /embeddings 請求
+在發出前按模型向令牌桶申請額度（每分鐘請求數和token數）：
+- 等待中的請求按優先級排隊，聊天（預設）先於在 background() 中發出的索引請求；
+  背景請求不使用每個令牌桶最後 OPENAI_INTERACTIVE_RESERVE 的額度，聊天到來時不必等補充
+- 429或503時按Retry-After（沒有時為帶全抖動的指數退避）暫停該模型的全部請求後重試
+- 響應頭中的剩餘額度（x-ratelimit-remaining-*）會同步到令牌桶
+- 嵌入的批次大小按模型自適應：成功時逐步增大，被限流時減半
+
+排隊長度、等待時間、限流和重試次數記錄到指標註冊表。
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+from langchain_core.embeddings import Embeddings
+
+from rag import config
+from rag.metrics import get_metrics
+from rag.splitter import token_counter
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+RETRY_STATUS_CODES = (429, 503)
+# 異步請求等待額度時的輪詢間隔（秒）
+ASYNC_POLL_SECONDS = 0.05
+
+_priority = ContextVar("openai_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def background():
+    """在此區塊中（同一執行緒或協程）發出的請求以背景優先級排隊"""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class TokenBucket:
+    """每分鐘補充per_minute、容量也為per_minute的令牌桶"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, floor=0.0):
+        """扣除amount後仍不低於floor還需要等待的秒數"""
+        return max(0.0, (amount + floor - self.level) / self.rate)
+
+
+class ModelLimiter:
+    """一個模型的請求數和token數令牌桶，等待的請求按（優先級，到達順序）放行"""
+
+    def __init__(self, model, rpm, tpm, reserve=config.OPENAI_INTERACTIVE_RESERVE, metrics=None):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.reserve = reserve
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.paused_until = 0.0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def max_request_tokens(self):
+        """背景請求能申請的最大token數；更大的請求按此計算，避免永遠等不到額度"""
+        return self.tokens.capacity * (1 - self.reserve)
+
+    def _enqueue(self, priority):
+        ticket = (priority, next(self._sequence))
+        heapq.heappush(self._waiting, ticket)
+        self._report_depth(priority)
+        return ticket
+
+    def _dequeue(self, ticket):
+        if self._waiting and self._waiting[0] == ticket:
+            heapq.heappop(self._waiting)
+        else:
+            self._waiting.remove(ticket)
+            heapq.heapify(self._waiting)
+        self._report_depth(ticket[0])
+        self._cond.notify_all()
+
+    def _report_depth(self, priority):
+        depth = sum(1 for waiting_priority, _ in self._waiting if waiting_priority == priority)
+        self.metrics.set_gauge("openai_queue_depth", depth,
+                               {"model": self.model, "priority": PRIORITY_NAMES[priority]},
+                               description="等待OpenAI請求額度的請求數")
+
+    def _try_take(self, ticket, tokens):
+        """輪到ticket且額度足夠時扣除並返回0；否則返回建議等待的秒數（None表示等前面的請求）"""
+        if self._waiting[0] != ticket:
+            return None
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        background_request = ticket[0] == BACKGROUND
+        tokens = min(tokens, self.max_request_tokens())
+        wait = max(
+            self.requests.wait_time(1, self.reserve * self.requests.capacity if background_request else 0.0),
+            self.tokens.wait_time(tokens, self.reserve * self.tokens.capacity if background_request else 0.0),
+        )
+        if wait > 0:
+            return wait
+        self.requests.level -= 1
+        self.tokens.level -= tokens
+        self._dequeue(ticket)
+        return 0.0
+
+    def _admitted(self, priority, started):
+        labels = {"model": self.model, "priority": PRIORITY_NAMES[priority]}
+        self.metrics.increment("openai_requests", labels, description="經過調度器的OpenAI請求數")
+        self.metrics.increment("openai_queue_wait_seconds", labels, time.perf_counter() - started,
+                               description="OpenAI請求等待額度的累計秒數")
+
+    def acquire(self, tokens, priority=INTERACTIVE):
+        """阻塞直到取得一個請求和tokens個token的額度"""
+        started = time.perf_counter()
+        with self._cond:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    wait = self._try_take(ticket, tokens)
+                    if wait == 0.0:
+                        break
+                    self._cond.wait(timeout=wait)
+            except BaseException:
+                self._dequeue(ticket)
+                raise
+        self._admitted(priority, started)
+
+    async def acquire_async(self, tokens, priority=INTERACTIVE):
+        """acquire的異步版本，等待時不阻塞事件循環"""
+        started = time.perf_counter()
+        with self._cond:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(ticket, tokens)
+                if wait == 0.0:
+                    break
+                await asyncio.sleep(min(wait or ASYNC_POLL_SECONDS, ASYNC_POLL_SECONDS))
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._dequeue(ticket)
+            raise
+        self._admitted(priority, started)
+
+    def pause(self, seconds):
+        """服務端限流時暫停這個模型的全部請求"""
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def sync_remaining(self, requests=None, tokens=None):
+        """按服務端返回的剩餘額度下調令牌桶（其他進程也在用同一個API Key時）"""
+        with self._cond:
+            now = time.monotonic()
+            if requests is not None:
+                self.requests.refill(now)
+                self.requests.level = min(self.requests.level, requests)
+            if tokens is not None:
+                self.tokens.refill(now)
+                self.tokens.level = min(self.tokens.level, tokens)
+
+
+def _parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class OpenAIScheduler:
+    """按模型管理令牌桶、重試退避和嵌入批次大小"""
+
+    def __init__(self, limits=None, reserve=config.OPENAI_INTERACTIVE_RESERVE, max_retries=config.OPENAI_MAX_RETRIES,
+                 backoff_base=config.OPENAI_BACKOFF_BASE, backoff_max=config.OPENAI_BACKOFF_MAX,
+                 completion_tokens=config.OPENAI_COMPLETION_TOKENS, batch_size=config.EMBEDDING_BATCH_SIZE,
+                 min_batch_size=config.EMBEDDING_MIN_BATCH_SIZE, batch_tokens=config.EMBEDDING_BATCH_TOKENS,
+                 count_tokens=None, metrics=None, rng=None):
+        self.limits = limits if limits is not None else config.OPENAI_RATE_LIMITS
+        self.reserve = reserve
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.completion_tokens = completion_tokens
+        self.max_batch_size = batch_size
+        self.min_batch_size = min_batch_size
+        self.batch_tokens = batch_tokens
+        self.count_tokens = count_tokens or token_counter()
+        self.metrics = metrics if metrics is not None else get_metrics()
+        self.rng = rng or random.Random()
+        self._limiters = {}
+        self._batch_sizes = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, model):
+        with self._lock:
+            limiter = self._limiters.get(model)
+            if limiter is None:
+                limits = self.limits.get(model) or self.limits["default"]
+                limiter = self._limiters[model] = ModelLimiter(
+                    model, limits["rpm"], limits["tpm"], reserve=self.reserve, metrics=self.metrics
+                )
+            return limiter
+
+    # 請求
+
+    def describe(self, request):
+        """需要調度的請求返回（模型，估計的token數），其他請求返回None"""
+        path = request.url.path
+        if not (path.endswith("/chat/completions") or path.endswith("/embeddings")):
+            return None
+        try:
+            payload = json.loads(request.content or b"{}")
+        except (httpx.RequestNotRead, ValueError):
+            payload = {}
+        model = payload.get("model") or "unknown"
+        if path.endswith("/embeddings"):
+            return model, self._input_tokens(payload.get("input"))
+        prompt_tokens = sum(self._message_tokens(message.get("content")) for message in payload.get("messages", []))
+        completion_tokens = (payload.get("max_completion_tokens") or payload.get("max_tokens")
+                             or self.completion_tokens)
+        return model, prompt_tokens + completion_tokens
+
+    def _input_tokens(self, value):
+        """嵌入輸入的token數：字串、字串列表、token ID列表或其列表"""
+        if value is None:
+            return 0
+        if isinstance(value, str):
+            return self.count_tokens(value)
+        if value and isinstance(value[0], int):
+            return len(value)
+        return sum(self._input_tokens(item) for item in value)
+
+    def _message_tokens(self, content):
+        if isinstance(content, str):
+            return self.count_tokens(content)
+        if isinstance(content, list):
+            return sum(self.count_tokens(part.get("text", "")) for part in content if isinstance(part, dict))
+        return 0
+
+    def retry_delay(self, model, response, attempt):
+        """需要重試時返回等待秒數並暫停該模型，否則返回None"""
+        limiter = self.limiter(model)
+        headers = response.headers
+        if response.status_code not in RETRY_STATUS_CODES:
+            limiter.sync_remaining(_parse_number(headers.get("x-ratelimit-remaining-requests")),
+                                   _parse_number(headers.get("x-ratelimit-remaining-tokens")))
+            if response.status_code < 400 and model in self._batch_sizes:
+                self._resize_batch(model, grow=True)
+            return None
+
+        self.metrics.increment("openai_throttled", {"model": model, "status": response.status_code},
+                               description="OpenAI返回429或503的次數")
+        if model in self._batch_sizes:
+            self._resize_batch(model, grow=False)
+        if attempt >= self.max_retries:
+            return None
+        retry_after_ms = _parse_number(headers.get("retry-after-ms"))
+        delay = retry_after_ms / 1000 if retry_after_ms is not None else _parse_number(headers.get("retry-after"))
+        if delay is None or delay < 0:
+            # 全抖動：同時被限流的請求不會在同一時刻重試
+            delay = self.rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        limiter.pause(delay)
+        self.metrics.increment("openai_retries", {"model": model}, description="OpenAI請求的重試次數")
+        return delay
+
+    # 嵌入批次
+
+    def embedding_batch_size(self, model):
+        with self._lock:
+            return self._batch_sizes.setdefault(model, self.max_batch_size)
+
+    def _resize_batch(self, model, grow):
+        with self._lock:
+            size = self._batch_sizes.get(model, self.max_batch_size)
+            if grow:
+                size = min(self.max_batch_size, size + max(1, self.min_batch_size // 2))
+            else:
+                size = max(self.min_batch_size, size // 2)
+            self._batch_sizes[model] = size
+        self.metrics.set_gauge("openai_embedding_batch_size", size, {"model": model},
+                               description="目前的嵌入批次大小")
+
+    def embedding_batches(self, model, texts):
+        """按目前的批次大小和每個請求的token上限切分文本；批次大小在迭代過程中隨限流情況調整"""
+        max_tokens = min(self.batch_tokens, self.limiter(model).max_request_tokens())
+        start = 0
+        while start < len(texts):
+            size = self.embedding_batch_size(model)
+            end, tokens = start, 0
+            while end < len(texts) and end - start < size:
+                text_tokens = self.count_tokens(texts[end])
+                if end > start and tokens + text_tokens > max_tokens:
+                    break
+                tokens += text_tokens
+                end += 1
+            yield texts[start:end]
+            start = end
+
+
+class ScheduledTransport(httpx.BaseTransport):
+    """在發出OpenAI請求前取得額度，429時退避重試"""
+
+    def __init__(self, transport, scheduler):
+        self.transport = transport
+        self.scheduler = scheduler
+
+    def handle_request(self, request):
+        described = self.scheduler.describe(request)
+        if described is None:
+            return self.transport.handle_request(request)
+        model, tokens = described
+        limiter = self.scheduler.limiter(model)
+        priority = current_priority()
+        for attempt in itertools.count():
+            limiter.acquire(tokens, priority)
+            response = self.transport.handle_request(request)
+            delay = self.scheduler.retry_delay(model, response, attempt)
+            if delay is None:
+                return response
+            response.close()
+            time.sleep(delay)
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncScheduledTransport(httpx.AsyncBaseTransport):
+    """ScheduledTransport的異步版本"""
+
+    def __init__(self, transport, scheduler):
+        self.transport = transport
+        self.scheduler = scheduler
+
+    async def handle_async_request(self, request):
+        described = self.scheduler.describe(request)
+        if described is None:
+            return await self.transport.handle_async_request(request)
+        model, tokens = described
+        limiter = self.scheduler.limiter(model)
+        priority = current_priority()
+        for attempt in itertools.count():
+            await limiter.acquire_async(tokens, priority)
+            response = await self.transport.handle_async_request(request)
+            delay = self.scheduler.retry_delay(model, response, attempt)
+            if delay is None:
+                return response
+            await response.aclose()
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+class ScheduledEmbeddings(Embeddings):
+    """按調度器目前的批次大小分批調用底層嵌入模型"""
+
+    def __init__(self, underlying, scheduler=None):
+        self.underlying = underlying
+        self.scheduler = scheduler if scheduler is not None else get_scheduler()
+        # 嵌入緩存以模型名稱為鍵的一部分，保持與底層模型相同
+        self.model = getattr(underlying, "model", type(underlying).__name__)
+
+    def embed_documents(self, texts):
+        vectors = []
+        for batch in self.scheduler.embedding_batches(self.model, texts):
+            vectors.extend(self.underlying.embed_documents(batch))
+        return vectors
+
+    def embed_query(self, text):
+        return self.underlying.embed_query(text)
+
+
+_shared_scheduler = None
+_shared_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """進程內共用的OpenAI請求調度器"""
+    global _shared_scheduler
+    with _shared_scheduler_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = OpenAIScheduler()
+        return _shared_scheduler
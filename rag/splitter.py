@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""面向中文法規的分割器
+
+以模型token數衡量文本塊長度，優先在段落、法條（第X條）、句號、分號等邊界分割，
+文本塊大小可以按分類設定。
+"""
+
+import hashlib
+import json
+import re
+from functools import lru_cache
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from rag import config
+
+CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+CHINESE_NUMERALS = "一二三四五六七八九十百千零〇"
+
+# 由粗到細的分割點；都是正則，除換行外均為零寬匹配，分割後標點留在句尾
+CJK_SEPARATORS = [
+    r"\n\s*\n",
+    rf"\n(?=\s*第\s*[{CHINESE_NUMERALS}\d]+\s*條)",
+    r"\n",
+    r"(?<=[。！？!?])",
+    r"(?<=[；;])",
+    r"(?<=[，,、：:])",
+    r" ",
+    r"",
+]
+
+
+def approximate_token_count(text):
+    """tiktoken不可用時的估算：中文每字約一個token，其他字符約四個一個token"""
+    cjk = len(CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@lru_cache(maxsize=None)
+def token_counter(model=config.TOKENIZER_MODEL):
+    """返回計算模型token數的函數"""
+    try:
+        import tiktoken
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # 沒有安裝tiktoken或無法下載編碼表（例如離線環境）
+        return approximate_token_count
+
+    def count(text):
+        return len(encoding.encode(text, disallowed_special=()))
+    return count
+
+
+def chunk_settings(category):
+    """某個分類的文本塊設置（token數）"""
+    settings = dict(config.CHUNK_SETTINGS["default"])
+    settings.update(config.CHUNK_SETTINGS.get(category, {}))
+    return settings
+
+
+def make_splitter(chunk_size, chunk_overlap, length_function=None):
+    """按token數分割的中文遞歸分割器"""
+    return RecursiveCharacterTextSplitter(
+        separators=CJK_SEPARATORS,
+        is_separator_regex=True,
+        # 分割點本身會保留在文本中，合併時不再插入分隔符
+        keep_separator=True,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=length_function or token_counter()
+    )
+
+
+class CategorySplitter:
+    """按文檔分類選用不同塊大小的分割器"""
+
+    def __init__(self, length_function=None, tokenizer_model=config.TOKENIZER_MODEL):
+        self.length_function = length_function or token_counter(tokenizer_model)
+        # 計算長度的方式不同，分割結果也不同；離線時的估算與tiktoken分開
+        self.tokenizer = "approximate" if self.length_function is approximate_token_count else tokenizer_model
+        self._splitters = {}
+
+    def splitter_for(self, category):
+        settings = chunk_settings(category)
+        key = (settings["chunk_size"], settings["chunk_overlap"])
+        if key not in self._splitters:
+            self._splitters[key] = make_splitter(*key, length_function=self.length_function)
+        return self._splitters[key]
+
+    def signature(self, category):
+        """分割設置的指紋；設置改變時文檔需要重新分割和嵌入"""
+        payload = json.dumps({"separators": CJK_SEPARATORS, "tokenizer": self.tokenizer, **chunk_settings(category)},
+                             sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+    def split_documents(self, documents):
+        chunks = []
+        for doc in documents:
+            splitter = self.splitter_for(doc.metadata.get("category", ""))
+            chunks.extend(splitter.split_documents([doc]))
+        return chunks
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""VTT/SRT字幕解析
+
+逐行串流解析，去掉標頭、編號、時間軸和<c>等標記，並移除自動字幕中滾動重複的行
+（手動字幕不去重，重複的短句如「對」「好」或副歌都是實際內容），保留每段字幕的開始時間，
+讓引用可以直接跳到影片中的對應時刻。
+"""
+
+import html
+import re
+from collections import deque
+from dataclasses import dataclass
+
+TIMING_RE = re.compile(
+    r"^\s*((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})\s*-->\s*((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})"
+)
+TAG_RE = re.compile(r"<[^>]*>")
+CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+@dataclass
+class Cue:
+    """一段字幕"""
+    start: float
+    end: float
+    text: str
+
+
+def parse_timestamp(value):
+    """把 00:01:02.345 或 01:02,345 轉換成秒數"""
+    value = value.replace(",", ".")
+    parts = value.split(":")
+    seconds = float(parts[-1])
+    minutes = int(parts[-2]) if len(parts) > 1 else 0
+    hours = int(parts[-3]) if len(parts) > 2 else 0
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def clean_line(line):
+    """去掉字幕標記和HTML實體"""
+    line = TAG_RE.sub("", line)
+    return html.unescape(line).replace("\xa0", " ").strip()
+
+
+def join_text(left, right):
+    """連接兩段文本：中文之間不加空格，其他情況用空格分隔"""
+    if not left:
+        return right
+    if not right:
+        return left
+    if CJK_RE.match(left[-1]) or CJK_RE.match(right[0]):
+        return left + right
+    return f"{left} {right}"
+
+
+def iter_cues(lines):
+    """從行迭代器中逐個解析字幕段，支持VTT和SRT"""
+    start = end = None
+    text_lines = []
+    skip_block = False
+
+    for raw_line in lines:
+        if isinstance(raw_line, bytes):
+            raw_line = raw_line.decode("utf-8", errors="replace")
+        line = raw_line.rstrip("\r\n").lstrip("\ufeff")
+
+        if not line:
+            # 空行結束當前區塊（自動字幕中只有空格的行屬於字幕段內容）
+            if start is not None and text_lines:
+                yield Cue(start, end, "\n".join(text_lines))
+            start = end = None
+            text_lines = []
+            skip_block = False
+            continue
+
+        if skip_block:
+            continue
+
+        timing = TIMING_RE.match(line)
+        if timing:
+            if start is not None and text_lines:
+                yield Cue(start, end, "\n".join(text_lines))
+            start, end = parse_timestamp(timing.group(1)), parse_timestamp(timing.group(2))
+            text_lines = []
+            continue
+
+        if start is None:
+            # 時間軸之前的行：標頭、NOTE/STYLE/REGION區塊或字幕編號
+            if line.startswith(("NOTE", "STYLE", "REGION")):
+                skip_block = True
+            continue
+
+        text = clean_line(line)
+        if text:
+            text_lines.append(text)
+
+    if start is not None and text_lines:
+        yield Cue(start, end, "\n".join(text_lines))
+
+
+def dedupe_rolling(cues, window=3):
+    """移除自動字幕中滾動重複的行，只保留每段新增的文本"""
+    recent = deque(maxlen=window)
+    for cue in cues:
+        new_parts = []
+        for line in cue.text.split("\n"):
+            if line in recent:
+                continue
+            previous = recent[-1] if recent else ""
+            if previous and line.startswith(previous):
+                # 上一行逐字增長的情況只保留新增的部分
+                addition = line[len(previous):].strip()
+                recent[-1] = line
+            else:
+                addition = line
+                recent.append(line)
+            if addition:
+                new_parts.append(addition)
+        if new_parts:
+            text = ""
+            for part in new_parts:
+                text = join_text(text, part)
+            yield Cue(cue.start, cue.end, text)
+
+
+def join_lines(cues):
+    """把每段字幕中的多行合併成一行"""
+    for cue in cues:
+        text = ""
+        for line in cue.text.split("\n"):
+            text = join_text(text, line)
+        yield Cue(cue.start, cue.end, text)
+
+
+def parse_subtitles(lines, rolling=False):
+    """解析字幕，返回字幕段列表；rolling為True時（自動字幕）去除滾動重複"""
+    cues = iter_cues(lines)
+    return list(dedupe_rolling(cues) if rolling else join_lines(cues))
+
+
+def cues_to_text(cues):
+    """合併字幕段為純文本"""
+    text = ""
+    for cue in cues:
+        text = join_text(text, cue.text)
+    return text
+
+
+def group_cues(cues, max_chars=1000):
+    """把相鄰字幕段合併成不超過max_chars的片段，返回 [(開始秒數, 文本)]"""
+    segments = []
+    start = None
+    text = ""
+    for cue in cues:
+        candidate = join_text(text, cue.text)
+        if text and len(candidate) > max_chars:
+            segments.append((start, text))
+            start, text = cue.start, cue.text
+            continue
+        if start is None:
+            start = cue.start
+        text = candidate
+    if text:
+        segments.append((start, text))
+    return segments
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""以文件內容定址的抽取文本存儲
+
+PDF和Word的文本抽取佔了重建索引的大部分CPU時間，而上傳後的文件不會改變。第一次加載時把每頁的文本和
+頁碼等元數據寫成gzip壓縮的JSONL（每行一頁），鍵為（文件內容的SHA-256，文檔類型）；之後的重建、
+改變分割設置後的重新分割和切換向量存儲後端都直接順序讀取，不再調用解析器。
+純文本類型本身就是順序讀取，不另外存儲。
+"""
+
+import gzip
+import json
+import os
+import threading
+import uuid
+
+from langchain_core.documents import Document
+
+from rag import config
+
+# 需要解析器抽取文本的類型
+EXTRACTED_TYPES = ("pdf", "doc", "docx")
+
+
+class TextStore:
+    """每個文件一個 <sha256>.<類型>.jsonl.gz"""
+
+    def __init__(self, directory=config.TEXT_STORE_DIR, compresslevel=6):
+        self.directory = directory
+        self.compresslevel = compresslevel
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, content_hash, doc_type):
+        return os.path.join(self.directory, f"{content_hash}.{doc_type}.jsonl.gz")
+
+    def get(self, content_hash, doc_type):
+        """已抽取的頁面列表，沒有存儲時返回None"""
+        try:
+            with gzip.open(self._path(content_hash, doc_type), "rt", encoding="utf-8") as f:
+                documents = [Document(page_content=record["text"], metadata=record["metadata"])
+                             for record in map(json.loads, f)]
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return documents
+
+    def put(self, content_hash, doc_type, documents):
+        """寫入抽取結果；先寫臨時文件再改名，並行寫入同一文件時不會讀到一半的內容"""
+        path = self._path(content_hash, doc_type)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=self.compresslevel) as f:
+            for doc in documents:
+                # 加載器記錄的source是文件路徑，加載時會換成文檔名，不必保存
+                metadata = {key: value for key, value in doc.metadata.items() if key != "source"}
+                record = {"text": doc.page_content, "metadata": metadata}
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        os.replace(tmp_path, path)
+
+    def load(self, path, doc_type, content_hash, loader_factory):
+        """讀取已抽取的文本，沒有時用加載器抽取並存儲"""
+        documents = self.get(content_hash, doc_type)
+        if documents is None:
+            documents = loader_factory(path, doc_type).load()
+            self.put(content_hash, doc_type, documents)
+        return documents
+
+    def prune(self, keep):
+        """刪除不在keep（內容雜湊集合）中的存儲，返回（刪除的文件數，釋放的位元組數）"""
+        removed, freed = 0, 0
+        for name in os.listdir(self.directory):
+            # 正在寫入的臨時文件不動
+            if name.endswith(".tmp") or name.split(".", 1)[0] in keep:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += size
+        return removed, freed
+
+
+_shared_store = None
+_shared_store_lock = threading.Lock()
+
+
+def get_text_store():
+    """進程內共用的抽取文本存儲"""
+    global _shared_store
+    with _shared_store_lock:
+        if _shared_store is None:
+            _shared_store = TextStore()
+        return _shared_store
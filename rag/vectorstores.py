@@ -0,0 +1,510 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""向量存儲後端
+
+由 config.VECTOR_BACKEND 選擇：
+- chroma：langchain的Chroma（SQLite持久化）
+- faiss：FAISS索引加SQLite元數據表。只讀時以記憶體映射打開索引文件，冷啟動不需要把向量讀進記憶體，
+  多個進程共用同一份頁面緩存；寫入時才載入可修改的副本。
+
+兩者提供知識庫用到的同一組接口：embeddings、add_documents、delete、get 和
+帶Chroma格式元數據過濾（filter）的 similarity_search。
+"""
+
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from rag import config
+
+BACKENDS = ("chroma", "faiss")
+
+COMPARISON_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+# 欄位名只允許字母、數字和底線（包括中文，例如 tag_稅法）
+FIELD_RE = re.compile(r"^\w+$")
+# 建立表達式索引的常用過濾欄位，按分類、類型或日期縮小範圍時不必掃描整個表
+INDEXED_FIELDS = ("doc_id", "category", "type", "date_added_ts")
+
+# 過濾後的候選數不超過此值時直接精確計算相似度（HNSW帶過濾搜索可能漏掉結果）
+EXACT_FILTER_LIMIT = 4096
+# HNSW不支持刪除，已刪除的向量超過此比例時在保存前重建索引
+MAX_DEAD_RATIO = 0.2
+# IVF在向量數增長到訓練時的此倍數後重新訓練
+IVF_RETRAIN_GROWTH = 4
+# 緩存最近使用的過濾條件對應的候選ID，寫入時清空
+FILTER_CACHE_SIZE = 64
+
+
+def json_column(key):
+    """元數據欄位的SQL表達式（與表達式索引的寫法一致才會用到索引）"""
+    return f"json_extract(metadata, '$.{key}')"
+
+
+def filter_to_sql(where):
+    """把Chroma格式的元數據過濾條件轉成SQL條件和參數
+
+    支持 {"欄位": 值}、$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin 以及 $and/$or 組合。
+    """
+    clauses, params = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [filter_to_sql(item) for item in value]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(sql for sql, _ in parts) + ")")
+            for _, part_params in parts:
+                params.extend(part_params)
+            continue
+        if not FIELD_RE.match(key):
+            raise ValueError(f"不支持的元數據欄位: {key}")
+        column = json_column(key)
+        conditions = value if isinstance(value, dict) else {"$eq": value}
+        for operator, operand in conditions.items():
+            if operator in ("$in", "$nin"):
+                if not operand:
+                    clauses.append("0" if operator == "$in" else "1")
+                    continue
+                placeholders = ",".join("?" * len(operand))
+                clauses.append(f"{column} {'IN' if operator == '$in' else 'NOT IN'} ({placeholders})")
+                params.extend(operand)
+            elif operator in COMPARISON_OPERATORS:
+                clauses.append(f"{column} {COMPARISON_OPERATORS[operator]} ?")
+                params.append(operand)
+            else:
+                raise ValueError(f"不支持的過濾運算符: {operator}")
+    return " AND ".join(clauses) or "1", params
+
+
+def normalize_vectors(vectors):
+    """轉成float32並L2歸一化，內積即為餘弦相似度"""
+    array = np.ascontiguousarray(np.asarray(vectors, dtype="float32"))
+    if array.ndim == 1:
+        array = array.reshape(1, -1)
+    faiss.normalize_L2(array)
+    return array
+
+
+class FaissVectorStore(VectorStore):
+    """FAISS索引加SQLite元數據表的向量存儲
+
+    元數據表記錄每個文本塊的FAISS ID、文本塊ID、文本和元數據，是文本塊是否存在的依據：
+    搜索結果只保留表中仍存在的ID。索引文件按 save_interval 節流寫入，
+    間隔內新增的文本塊在下次寫入前從表中的文本重新嵌入恢復（嵌入緩存命中）。
+    """
+
+    def __init__(self, persist_directory=config.FAISS_DIR, embedding_function=None,
+                 index_type=config.FAISS_INDEX_TYPE, ivf_min_vectors=config.FAISS_IVF_MIN_VECTORS,
+                 nprobe=config.FAISS_NPROBE, hnsw_m=config.FAISS_HNSW_M, ef_search=config.FAISS_EF_SEARCH,
+                 save_interval=config.FAISS_SAVE_INTERVAL):
+        if index_type not in ("ivf", "hnsw", "flat"):
+            raise ValueError(f"不支持的FAISS索引類型: {index_type}")
+        os.makedirs(persist_directory, exist_ok=True)
+        self.persist_directory = persist_directory
+        self.index_path = os.path.join(persist_directory, "index.faiss")
+        self._embedding = embedding_function
+        self.index_type = index_type
+        self.ivf_min_vectors = ivf_min_vectors
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.save_interval = save_interval
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(persist_directory, "metadata.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # AUTOINCREMENT保證ID不重用：HNSW中已刪除的向量仍在索引裡，重用ID會讓它們復活
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chunk_id TEXT NOT NULL UNIQUE,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        for field in INDEXED_FIELDS:
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_chunks_{field} ON chunks ({json_column(field)})")
+        self._conn.commit()
+
+        self._index = None
+        self._writable = False
+        self._dirty = False
+        self._loaded_mtime = None
+        self._last_save = time.monotonic()
+        self._filter_cache = OrderedDict()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # 元數據表
+
+    def _meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def _live_count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _live_ids(self):
+        return np.array([row[0] for row in self._conn.execute("SELECT id FROM chunks ORDER BY id")], dtype="int64")
+
+    def __len__(self):
+        with self._lock:
+            return self._live_count()
+
+    # 索引的打開、建立與重建
+
+    def _searchable(self):
+        """返回可搜索的索引：本進程寫入過時為記憶體中的副本，否則為記憶體映射的索引文件"""
+        with self._lock:
+            if self._writable:
+                return self._index
+            if not os.path.exists(self.index_path):
+                return None
+            # 索引文件被其他進程更新後重新映射
+            mtime = os.stat(self.index_path).st_mtime_ns
+            if self._index is None or mtime != self._loaded_mtime:
+                flag = faiss.IO_FLAG_MMAP if self._meta("kind") == "ivf" else faiss.IO_FLAG_MMAP_IFC
+                self._index = faiss.read_index(self.index_path, flag | faiss.IO_FLAG_READ_ONLY)
+                self._loaded_mtime = mtime
+                self._filter_cache.clear()
+            return self._index
+
+    def _writable_index(self, dimension):
+        """載入可修改的索引副本（記憶體映射的索引不能修改），並恢復上次寫入後新增的文本塊"""
+        if self._writable:
+            return self._index
+        if os.path.exists(self.index_path):
+            self._index = faiss.read_index(self.index_path)
+        else:
+            self._index = self._new_index("hnsw" if self.index_type == "hnsw" else "flat", dimension)
+        self._writable = True
+
+        checkpoint = self._meta("checkpoint_id", 0)
+        rows = self._conn.execute("SELECT id, text FROM chunks WHERE id > ? ORDER BY id", (checkpoint,)).fetchall()
+        if rows:
+            ids = np.array([row[0] for row in rows], dtype="int64")
+            self._remove_from_index(ids)
+            self._index.add_with_ids(normalize_vectors(self._embedding.embed_documents([row[1] for row in rows])), ids)
+            self._dirty = True
+        return self._index
+
+    def _new_index(self, kind, dimension, training_vectors=None):
+        if kind == "hnsw":
+            return faiss.IndexIDMap2(faiss.IndexHNSWFlat(dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT))
+        if kind == "ivf":
+            count = len(training_vectors)
+            # 約4√n個聚類，每個聚類至少39個訓練向量
+            nlist = max(1, min(int(4 * math.sqrt(count)), count // 39))
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dimension), dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(training_vectors)
+            # 雜湊表形式的ID映射，支持按任意ID刪除和取回向量
+            index.set_direct_map_type(faiss.DirectMap.Hashtable)
+            return index
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+
+    @staticmethod
+    def _index_kind(index):
+        if isinstance(index, faiss.IndexIVF):
+            return "ivf"
+        inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap2) else index
+        return "hnsw" if isinstance(inner, faiss.IndexHNSW) else "flat"
+
+    def _remove_from_index(self, faiss_ids):
+        """從索引中刪除向量；HNSW不支持刪除，只從元數據表刪除，搜索時過濾，之後重建時清除"""
+        if not len(faiss_ids):
+            return
+        try:
+            self._index.remove_ids(np.asarray(faiss_ids, dtype="int64"))
+        except RuntimeError:
+            pass
+
+    def _maybe_rebuild(self, force=False):
+        """按需要訓練IVF、重新訓練或清除HNSW中已刪除的向量；force時總是重建"""
+        index = self._index
+        kind = self._index_kind(index)
+        live_ids = self._live_ids()
+        live = len(live_ids)
+        if self.index_type == "ivf" and live >= self.ivf_min_vectors:
+            target = "ivf"
+            rebuild = kind != "ivf" or live > IVF_RETRAIN_GROWTH * self._meta("trained_count", live)
+        else:
+            target = kind
+            rebuild = False
+        rebuild = force or rebuild or index.ntotal - live > MAX_DEAD_RATIO * max(index.ntotal, 1)
+        if not rebuild:
+            return
+        vectors = index.reconstruct_batch(live_ids) if live else np.zeros((0, index.d), dtype="float32")
+        if target == "ivf" and live < self.ivf_min_vectors:
+            target = "flat"
+        rebuilt = self._new_index(target, index.d, training_vectors=vectors)
+        if live:
+            rebuilt.add_with_ids(vectors, live_ids)
+        if target == "ivf":
+            self._set_meta("trained_count", live)
+        self._index = rebuilt
+
+    def save(self, force=False):
+        """把修改過的索引寫入磁碟（先寫臨時文件再替換）；未指定force時按save_interval節流"""
+        with self._lock:
+            if not self._dirty:
+                return False
+            if not force and time.monotonic() - self._last_save < self.save_interval:
+                return False
+            self._maybe_rebuild()
+            tmp_path = f"{self.index_path}.tmp"
+            faiss.write_index(self._index, tmp_path)
+            os.replace(tmp_path, self.index_path)
+            (max_id,) = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM chunks").fetchone()
+            self._set_meta("checkpoint_id", max_id)
+            self._set_meta("kind", self._index_kind(self._index))
+            self._conn.commit()
+            self._dirty = False
+            self._last_save = time.monotonic()
+            return True
+
+    def compact(self):
+        """重建索引清除全部已刪除的向量，並整理元數據表的空閒頁面"""
+        with self._lock:
+            if os.path.exists(self.index_path) or self._writable:
+                self._writable_index(None)
+                self._maybe_rebuild(force=True)
+                self._dirty = True
+                self.save(force=True)
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # 寫入與刪除
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        """寫入文本塊；已存在的文本塊ID會被替換"""
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = normalize_vectors(self._embedding.embed_documents(texts))
+        with self._lock:
+            index = self._writable_index(vectors.shape[1])
+            self._delete_locked(ids)
+            faiss_ids = []
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (chunk_id, text, metadata) VALUES (?, ?, ?)",
+                    (chunk_id, text, json.dumps(metadata or {}, ensure_ascii=False))
+                )
+                faiss_ids.append(cursor.lastrowid)
+            index.add_with_ids(vectors, np.array(faiss_ids, dtype="int64"))
+            self._conn.commit()
+            self._dirty = True
+            self._filter_cache.clear()
+        return ids
+
+    def _delete_locked(self, chunk_ids):
+        faiss_ids = []
+        for start in range(0, len(chunk_ids), 500):
+            batch = chunk_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            faiss_ids += [row[0] for row in self._conn.execute(
+                f"SELECT id FROM chunks WHERE chunk_id IN ({placeholders})", batch
+            )]
+            self._conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+        if faiss_ids:
+            self._remove_from_index(faiss_ids)
+            self._dirty = True
+            self._filter_cache.clear()
+        return len(faiss_ids)
+
+    def delete(self, ids=None, **kwargs):
+        if not ids:
+            return False
+        with self._lock:
+            if os.path.exists(self.index_path) or self._writable:
+                self._writable_index(None)
+            deleted = self._delete_locked(list(ids))
+            self._conn.commit()
+        return deleted > 0
+
+    # 查詢
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas"), **kwargs):
+        """與Chroma.get相同的返回格式 {"ids", "documents", "metadatas"}"""
+        sql = "SELECT chunk_id, text, metadata FROM chunks"
+        params = []
+        conditions = []
+        if ids is not None:
+            ids = list(ids)
+            if not ids:
+                return {"ids": [], "documents": [], "metadatas": []}
+            conditions.append(f"chunk_id IN ({','.join('?' * len(ids))})")
+            params += ids
+        if where:
+            where_sql, where_params = filter_to_sql(where)
+            conditions.append(where_sql)
+            params += where_params
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY id", params).fetchall()
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": [row[1] for row in rows] if "documents" in include else None,
+            "metadatas": [json.loads(row[2]) for row in rows] if "metadatas" in include else None,
+        }
+
+    def _filter_ids(self, where):
+        """符合過濾條件的FAISS ID"""
+        key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            candidates = self._filter_cache.get(key)
+            if candidates is not None:
+                self._filter_cache.move_to_end(key)
+                return candidates
+            where_sql, params = filter_to_sql(where)
+            if not self._writable:
+                # 記憶體映射的索引只包含上次寫入索引文件前的文本塊
+                where_sql = f"({where_sql}) AND id <= ?"
+                params = [*params, self._meta("checkpoint_id", 0)]
+            candidates = np.array([row[0] for row in self._conn.execute(
+                f"SELECT id FROM chunks WHERE {where_sql}", params
+            )], dtype="int64")
+            self._filter_cache[key] = candidates
+            if len(self._filter_cache) > FILTER_CACHE_SIZE:
+                self._filter_cache.popitem(last=False)
+            return candidates
+
+    def _search_params(self, index, selector=None, widen=1):
+        kind = self._index_kind(index)
+        if kind == "ivf":
+            return faiss.SearchParametersIVF(sel=selector, nprobe=min(index.nlist, self.nprobe * widen))
+        if kind == "hnsw":
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search * widen)
+        return faiss.SearchParameters(sel=selector) if selector is not None else None
+
+    def _rows(self, faiss_ids):
+        placeholders = ",".join("?" * len(faiss_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, text, metadata FROM chunks WHERE id IN ({placeholders})", [int(i) for i in faiss_ids]
+            ).fetchall()
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None):
+        """返回 [(Document, 餘弦相似度)]，相似度由高到低"""
+        index = self._searchable()
+        if index is None or not index.ntotal or k <= 0:
+            return []
+        query = normalize_vectors(embedding)
+
+        if filter:
+            candidates = self._filter_ids(filter)
+            if not len(candidates):
+                return []
+            if len(candidates) <= EXACT_FILTER_LIMIT:
+                # 候選不多時精確計算，不受近似索引漏檢影響
+                scores = index.reconstruct_batch(candidates) @ query[0]
+                order = np.argsort(-scores)[:k]
+                hits = [(int(candidates[i]), float(scores[i])) for i in order]
+            else:
+                params = self._search_params(index, faiss.IDSelectorBatch(candidates), widen=2)
+                hits = self._search_hits(index, query, k, params)
+        else:
+            hits = self._search_hits(index, query, k, self._search_params(index))
+
+        if not hits:
+            return []
+        rows = self._rows([faiss_id for faiss_id, _ in hits])
+        results = []
+        for faiss_id, score in hits:
+            if faiss_id in rows and len(results) < k:
+                text, metadata = rows.pop(faiss_id)
+                results.append((Document(page_content=text, metadata=json.loads(metadata)), score))
+        return results
+
+    def _search_hits(self, index, query, k, params):
+        """近似搜索，已刪除（只在元數據表中刪除）的向量不計入k個結果"""
+        with self._lock:
+            dead = index.ntotal - self._live_count()
+        fetch_k = min(index.ntotal, k if dead <= 0 else k * 2)
+        while True:
+            scores, faiss_ids = index.search(query, fetch_k, params=params)
+            hits = [(int(i), float(s)) for i, s in zip(faiss_ids[0], scores[0]) if i >= 0]
+            if dead <= 0 or fetch_k >= index.ntotal:
+                return hits
+            live = self._rows([faiss_id for faiss_id, _ in hits])
+            if len(live) >= k:
+                return hits
+            fetch_k = min(index.ntotal, fetch_k * 4)
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k=k, filter=filter)
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        # 餘弦相似度映射到 [0, 1]
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, **kwargs):
+        store = cls(embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        store.save(force=True)
+        return store
+
+
+def directory_size(path):
+    """目錄下全部文件的總字節數"""
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    )
+
+
+def compact_vectorstore(vectorstore, persist_directory):
+    """回收已刪除的向量佔用的磁碟空間，返回回收的字節數"""
+    before = directory_size(persist_directory)
+    compact = getattr(vectorstore, "compact", None)
+    if compact is not None:
+        compact()
+    else:
+        # Chroma刪除後只把SQLite頁面標記為空閒，VACUUM後文件才會縮小（向量索引文件由Chroma自行管理）
+        path = os.path.join(persist_directory, "chroma.sqlite3")
+        if os.path.exists(path):
+            with closing(sqlite3.connect(path, timeout=30)) as conn:
+                conn.execute("VACUUM")
+    return max(0, before - directory_size(persist_directory))
+
+
+def create_vectorstore(backend, persist_directory, embeddings, reload=False):
+    """按後端名稱打開（或建立）持久化的向量存儲；reload時不沿用進程內已載入的索引，讀到其他進程的寫入"""
+    if backend == "faiss":
+        return FaissVectorStore(persist_directory=persist_directory, embedding_function=embeddings)
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+        if reload:
+            from chromadb.api.client import SharedSystemClient
+            # 同一目錄的Chroma客戶端在進程內共用一個系統，其中的向量索引不會重新讀取磁碟；
+            # 只從緩存中移除（不停止），仍持有舊客戶端的查詢不受影響
+            SharedSystemClient._identifier_to_system.pop(persist_directory, None)
+        return Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+    raise ValueError(f"不支持的向量存儲後端: {backend}，可選 {', '.join(BACKENDS)}")
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""YouTube字幕與影片信息獲取
+
+每個影片只做一次yt-dlp提取，同時得到字幕和影片信息；結果按youtube_id緩存在磁碟上，
+字幕下載共用一個連接池。提取器和HTTP會話都可以替換，方便對本地樁服務測試。
+"""
+
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+import requests
+import yt_dlp
+from requests.adapters import HTTPAdapter
+
+from rag import config
+from rag.subtitles import cues_to_text, parse_subtitles
+
+WATCH_URL = "https://www.youtube.com/watch?v={}"
+
+
+class YouTubeError(Exception):
+    """無法獲取YouTube影片或字幕"""
+
+
+def extract_youtube_id(url):
+    """從YouTube URL中提取視頻ID"""
+    youtube_regex = r"(?:youtube\.com\/(?:[^\/\n\s]+\/\S+\/|(?:v|e(?:mbed)?)\/|\S*?[?&]v=)|youtu\.be\/)([a-zA-Z0-9_-]{11})"
+    match = re.search(youtube_regex, url)
+    return match.group(1) if match else None
+
+
+def select_subtitle_track(info):
+    """選擇字幕：優先手動字幕，其次自動字幕；語言優先中文，其次英文，最後任何可用語言
+
+    返回 (字幕網址, 來源類型, 語言)，沒有可用字幕時返回None
+    """
+    sources = [(info.get("subtitles") or {}, "手動"), (info.get("automatic_captions") or {}, "自動")]
+    for prefix in ("zh", "en", ""):
+        for source, source_name in sources:
+            for lang, tracks in source.items():
+                if not lang.startswith(prefix):
+                    continue
+                for track in tracks:
+                    if track.get("ext") == "vtt":
+                        return track["url"], source_name, lang
+                # 沒有指定語言前綴時只嘗試第一個語言
+                if not prefix:
+                    break
+    return None
+
+
+@dataclass
+class YouTubeVideo:
+    """一個影片的信息和字幕"""
+    youtube_id: str
+    title: str
+    author: str
+    publish_date: Optional[str]
+    views: int
+    thumbnail_url: str
+    transcript: str
+    subtitle_lang: str
+    subtitle_source: str
+    available_langs: list = field(default_factory=list)
+    # [(開始秒數, 文本)]，舊版緩存沒有這個欄位
+    cues: list = field(default_factory=list)
+
+
+class YouTubeFetcher:
+    """獲取並緩存YouTube影片的字幕和信息"""
+
+    def __init__(self, cache_dir=config.YOUTUBE_CACHE_DIR, extractor_factory=yt_dlp.YoutubeDL,
+                 session=None, max_workers=4, watch_url=WATCH_URL):
+        self.cache_dir = cache_dir
+        self.extractor_factory = extractor_factory
+        self.max_workers = max_workers
+        self.watch_url = watch_url
+        self.session = session or self._pooled_session(max_workers)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _pooled_session(pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _cache_path(self, youtube_id):
+        return os.path.join(self.cache_dir, f"{youtube_id}.json")
+
+    def _load_cached(self, youtube_id):
+        path = self._cache_path(youtube_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return YouTubeVideo(**json.load(f))
+
+    def _save_cached(self, video):
+        path = self._cache_path(video.youtube_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(asdict(video), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def extract_info(self, url, **options):
+        with self.extractor_factory({"quiet": True, **options}) as ydl:
+            return ydl.extract_info(url, download=False)
+
+    def fetch(self, youtube_id, use_cache=True):
+        """一次提取同時取得字幕和影片信息"""
+        if use_cache:
+            cached = self._load_cached(youtube_id)
+            if cached:
+                return cached
+
+        try:
+            info = self.extract_info(self.watch_url.format(youtube_id))
+        except Exception as e:
+            raise YouTubeError(f"獲取YouTube信息失敗: {e}") from e
+
+        track = select_subtitle_track(info)
+        if not track:
+            raise YouTubeError("此影片沒有任何可用字幕")
+        subtitle_url, source_type, lang = track
+
+        try:
+            with self.session.get(subtitle_url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                response.encoding = "utf-8"
+                # 邊下載邊解析，不把整個字幕文件讀進記憶體；只有自動字幕有滾動重複
+                cues = parse_subtitles(response.iter_lines(decode_unicode=True), rolling=source_type == "自動")
+        except requests.RequestException as e:
+            raise YouTubeError(f"下載字幕失敗: {e}") from e
+        transcript = cues_to_text(cues)
+        if not transcript:
+            raise YouTubeError(f"無法獲取YouTube視頻 {youtube_id} 的字幕，請確保視頻有字幕")
+
+        video = YouTubeVideo(
+            youtube_id=youtube_id,
+            title=info.get("title") or f"YouTube視頻 {youtube_id}",
+            author=info.get("uploader") or "YouTube作者",
+            publish_date=info.get("upload_date"),
+            views=info.get("view_count") or 0,
+            thumbnail_url=info.get("thumbnail") or f"https://img.youtube.com/vi/{youtube_id}/0.jpg",
+            transcript=transcript,
+            subtitle_lang=lang,
+            subtitle_source=source_type,
+            available_langs=list(info.get("subtitles") or {}) + list(info.get("automatic_captions") or {}),
+            cues=[(cue.start, cue.text) for cue in cues]
+        )
+        self._save_cached(video)
+        return video
+
+    def expand_urls(self, urls):
+        """把URL列表展開成影片ID列表，播放清單會展開成其中的所有影片"""
+        youtube_ids = []
+        for url in urls:
+            url = url.strip()
+            if not url:
+                continue
+            if "list=" in url:
+                info = self.extract_info(url, extract_flat="in_playlist")
+                youtube_ids.extend(entry["id"] for entry in info.get("entries") or [] if entry.get("id"))
+                continue
+            youtube_id = extract_youtube_id(url)
+            if youtube_id:
+                youtube_ids.append(youtube_id)
+        return list(dict.fromkeys(youtube_ids))
+
+    def fetch_many(self, urls):
+        """並發獲取多個影片，返回 [(youtube_id, 影片或異常)]"""
+        youtube_ids = self.expand_urls(urls)
+
+        def fetch_one(youtube_id):
+            try:
+                return youtube_id, self.fetch(youtube_id)
+            except Exception as e:
+                return youtube_id, e
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(fetch_one, youtube_ids))
+
+
+_shared_fetcher = None
+_shared_fetcher_lock = threading.Lock()
+
+
+def get_youtube_fetcher():
+    """進程內共用的YouTube獲取器（共用HTTP連接池）"""
+    global _shared_fetcher
+    with _shared_fetcher_lock:
+        if _shared_fetcher is None:
+            _shared_fetcher = YouTubeFetcher()
+        return _shared_fetcher
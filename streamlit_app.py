@@ -2,26 +2,26 @@
 # -*- coding: utf-8 -*-
 
 import os
+import json
+import time
 import uuid
 import streamlit as st
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_openai import ChatOpenAI
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    Docx2txtLoader,
-    TextLoader,
-    UnstructuredURLLoader
-)
-from langchain_community.vectorstores import Chroma
-from langchain.chains import ConversationalRetrievalChain
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import SystemMessagePromptTemplate, HumanMessagePromptTemplate, ChatPromptTemplate
-import re
 import pandas as pd
 from datetime import datetime
-import yt_dlp
-import requests
+
+from rag import config
+from rag.catalog import get_catalog
+from rag.filters import build_filter
+from rag.ingest import SUPPORTED_EXTENSIONS, BulkIngestor, copy_with_sha256, register_upload
+from rag.knowledge_base import KnowledgeBase
+from rag.llm import get_chat_model
+from rag.loaders import load_document
+from rag.memory import SummaryBufferMemory
+from rag.metrics import INGEST_STAGES, QUERY_STAGES, get_metrics
+from rag.pipeline import DEFAULT_SYSTEM_PROMPT, RAGPipeline, format_sources, remember_turn
+from rag.reindex import REBUILD, SYNC
+from rag.router import AUTO_MODEL, FAST, ROUTE_NAMES, STRONG, create_router
+from rag.youtube import WATCH_URL, extract_youtube_id, get_youtube_fetcher
 
 # 設置頁面配置
 st.set_page_config(
@@ -32,36 +32,35 @@ st.set_page_config(
 )
 
 # 初始化目錄
-os.makedirs("data/documents", exist_ok=True)
-os.makedirs("data/youtube", exist_ok=True)
-os.makedirs("data/vectorstore", exist_ok=True)
+config.ensure_data_dirs()
+
+@st.cache_resource
+def get_knowledge_base():
+    """進程內共用的知識庫：所有會話共用同一個向量存儲和檢索器"""
+    return KnowledgeBase(get_catalog())
+
+knowledge_base = get_knowledge_base()
+catalog = knowledge_base.catalog
 
 # 初始化會話狀態
 if "conversation" not in st.session_state:
     st.session_state.conversation = None
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
-if "document_list" not in st.session_state:
-    st.session_state.document_list = []
+if "memory" not in st.session_state:
+    # 最近幾輪逐字保留、更早的對話摘要化，問題改寫提示不會隨對話無限增長
+    st.session_state.memory = SummaryBufferMemory()
+if "query_timings" not in st.session_state:
+    st.session_state.query_timings = []
+if "session_usage" not in st.session_state:
+    # 本會話累計的模型用量和估算費用
+    st.session_state.session_usage = {"queries": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
 if "openai_api_key" not in st.session_state:
-    st.session_state.openai_api_key = ""
-if "vectorstore" not in st.session_state:
-    st.session_state.vectorstore = None
+    st.session_state.openai_api_key = os.getenv("OPENAI_API_KEY", "")
 if "selected_model" not in st.session_state:
-    st.session_state.selected_model = "gpt-3.5-turbo-16k"
+    st.session_state.selected_model = config.CHAT_MODEL
 if "system_prompt" not in st.session_state:
-    st.session_state.system_prompt = """你是一個專業的財務稅法顧問，負責回答用戶的財務和稅法問題。
-
-請遵循以下指導原則：
-1. 使用繁體中文回答所有問題，即使用戶使用簡體中文提問。
-2. 首先仔細分析用戶問題的真正意圖和語義，理解用戶真正想知道的是什麼。
-3. 基於提供的文檔內容回答問題，但不要僅僅複製文檔中的內容。
-4. 如果文檔中的信息不完整，請使用你的專業知識補充回答，但明確區分哪些是來自文檔的信息，哪些是你的專業補充。
-5. 如果文檔中完全沒有相關信息，請誠實地說明，並提供你的專業建議或引導用戶尋找更多資源。
-6. 回答應該專業、準確、易於理解，並引用相關的法規或文檔來源。
-7. 對於會計、稅務等專業問題，請提供系統性的回答，而不僅僅是列出文檔中提到的片段。
-
-記住：你的目標是真正解決用戶的問題，而不僅僅是檢索和呈現文檔內容。"""
+    st.session_state.system_prompt = DEFAULT_SYSTEM_PROMPT
 
 # 側邊欄 - API設置
 with st.sidebar:
@@ -79,7 +78,8 @@ with st.sidebar:
         "GPT-3.5 Turbo": "gpt-3.5-turbo-16k",
         "GPT-4o": "gpt-4o",
         "GPT-4.1 Turbo": "gpt-4-turbo",
-        "GPT-4 Mini": "gpt-4-mini"
+        "GPT-4 Mini": "gpt-4-mini",
+        "自動（快速／強模型路由）": AUTO_MODEL
     }
     selected_model_name = st.selectbox(
         "選擇OpenAI模型",
@@ -87,7 +87,13 @@ with st.sidebar:
         index=0
     )
     st.session_state.selected_model = model_options[selected_model_name]
-    st.caption(f"當前選擇: {st.session_state.selected_model}")
+    if st.session_state.selected_model == AUTO_MODEL:
+        st.caption(
+            f"問題改寫和簡單問題使用 {config.ROUTER_FAST_MODEL}，"
+            f"需要綜合多份文檔的問題使用 {config.ROUTER_STRONG_MODEL}"
+        )
+    else:
+        st.caption(f"當前選擇: {st.session_state.selected_model}")
     
     st.divider()
     
@@ -107,441 +113,404 @@ with st.sidebar:
     page = st.radio("選擇頁面", ["聊天對話", "知識庫管理"])
 
 # 工具函數
-def extract_youtube_id(url):
-    """從YouTube URL中提取視頻ID"""
-    youtube_regex = r"(?:youtube\.com\/(?:[^\/\n\s]+\/\S+\/|(?:v|e(?:mbed)?)\/|\S*?[?&]v=)|youtu\.be\/)([a-zA-Z0-9_-]{11})"
-    match = re.search(youtube_regex, url)
-    return match.group(1) if match else None
-
-def get_youtube_transcript(youtube_id):
-    """獲取YouTube視頻的字幕"""
-    try:
-        youtube_url = f"https://www.youtube.com/watch?v={youtube_id}"
-        
-        # 使用yt_dlp獲取視頻信息
-        with st.spinner("正在獲取YouTube字幕..."):
-            with yt_dlp.YoutubeDL({}) as ydl:
-                info = ydl.extract_info(youtube_url, download=False)
-                subs = info.get('subtitles', {})
-                auto_subs = info.get('automatic_captions', {})
-                
-                # 顯示可用的字幕語言
-                all_langs = list(subs.keys()) + list(auto_subs.keys())
-                if all_langs:
-                    st.info(f"該視頻有以下語言的字幕可用: {', '.join(all_langs)}")
-                
-                # 優先手動字幕，其次自動字幕
-                target = None
-                source_type = None
-                lang_found = None
-                
-                # 優先查找中文字幕
-                for source, source_name in [(subs, "手動"), (auto_subs, "自動")]:
-                    for lang, tracks in source.items():
-                        if lang.startswith('zh'):
-                            # 找到字幕網址
-                            for track in tracks:
-                                if track['ext'] == 'vtt':
-                                    target = track['url']
-                                    source_type = source_name
-                                    lang_found = lang
-                                    break
-                        if target:
-                            break
-                    if target:
-                        break
-                
-                # 如果沒有中文字幕，嘗試英文字幕
-                if not target:
-                    for source, source_name in [(subs, "手動"), (auto_subs, "自動")]:
-                        for lang, tracks in source.items():
-                            if lang.startswith('en'):
-                                # 找到字幕網址
-                                for track in tracks:
-                                    if track['ext'] == 'vtt':
-                                        target = track['url']
-                                        source_type = source_name
-                                        lang_found = lang
-                                        break
-                            if target:
-                                break
-                        if target:
-                            break
-                
-                # 如果還是沒有，嘗試任何可用的字幕
-                if not target and (subs or auto_subs):
-                    for source, source_name in [(subs, "手動"), (auto_subs, "自動")]:
-                        if source:
-                            first_lang = list(source.keys())[0]
-                            tracks = source[first_lang]
-                            for track in tracks:
-                                if track['ext'] == 'vtt':
-                                    target = track['url']
-                                    source_type = source_name
-                                    lang_found = first_lang
-                                    break
-                            if target:
-                                break
-                
-                if not target:
-                    st.error("此影片沒有任何可用字幕")
-                    return None
-                
-                st.success(f"找到{lang_found}字幕，來源：{source_type}")
-                
-                # 下載字幕內容
-                r = requests.get(target)
-                
-                # 解析VTT格式字幕
-                transcript = []
-                for line in r.text.splitlines():
-                    # 過濾掉VTT標頭、時間軸等
-                    if line.strip() == "" or "-->" in line or line.startswith("WEBVTT"):
-                        continue
-                    transcript.append(line.strip())
-                
-                # 合併字幕文本
-                return " ".join(transcript)
-    except Exception as e:
-        st.error(f"獲取YouTube字幕失敗: {str(e)}")
-        return None
-
-def get_youtube_info(youtube_id):
-    """獲取YouTube視頻的信息"""
-    try:
-        youtube_url = f"https://www.youtube.com/watch?v={youtube_id}"
-        
-        # 使用yt_dlp獲取視頻信息
-        with yt_dlp.YoutubeDL({}) as ydl:
-            info = ydl.extract_info(youtube_url, download=False)
-            
-            return {
-                "title": info.get('title', f"YouTube視頻 {youtube_id}"),
-                "author": info.get('uploader', "YouTube作者"),
-                "publish_date": info.get('upload_date'),
-                "views": info.get('view_count', 0),
-                "thumbnail_url": info.get('thumbnail') or f"https://img.youtube.com/vi/{youtube_id}/0.jpg"
-            }
-    except Exception as e:
-        st.error(f"獲取YouTube信息失敗: {str(e)}")
-        # 返回默認值
-        return {
-            "title": f"YouTube視頻 {youtube_id}",
-            "author": "YouTube作者",
-            "publish_date": None,
-            "views": 0,
-            "thumbnail_url": f"https://img.youtube.com/vi/{youtube_id}/0.jpg"
-        }
-
 def process_document(file, category, tags):
-    """處理上傳的文檔"""
-    # 生成唯一ID
-    doc_id = str(uuid.uuid4())
-    
+    """處理上傳的文檔：分塊寫入並計算SHA-256，內容已在知識庫中時只更新已有文檔的分類和標籤"""
     # 獲取文件擴展名
     file_extension = os.path.splitext(file.name)[1].lower()
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        st.error(f"不支持的文件類型: {file_extension}")
+        return None
     
     # 保存文件
-    file_path = f"data/documents/{doc_id}{file_extension}"
-    with open(file_path, "wb") as f:
-        f.write(file.getbuffer())
+    doc_info = register_upload(file, category, tags)
+    existing = knowledge_base.link_duplicate(doc_info)
+    if existing is not None:
+        os.remove(doc_info["path"])
+        st.info(f"內容與已有文檔「{existing['name']}」相同，不重複存儲，已更新它的分類和標籤")
+        return None
     
-    # 根據文件類型選擇加載器
     try:
-        if file_extension == ".pdf":
-            loader = PyPDFLoader(file_path)
-        elif file_extension in [".docx", ".doc"]:
-            loader = Docx2txtLoader(file_path)
-        elif file_extension in [".txt", ".md", ".csv"]:
-            loader = TextLoader(file_path)
-        else:
-            st.error(f"不支持的文件類型: {file_extension}")
-            return None
-        
         # 加載文檔
-        documents = loader.load()
-        
-        # 添加元數據
-        valid_documents = []
-        for doc in documents:
-            if hasattr(doc, 'metadata'):
-                doc.metadata["source"] = file.name
-                doc.metadata["doc_id"] = doc_id
-                doc.metadata["category"] = category
-                doc.metadata["tags"] = ",".join(tags) if isinstance(tags, list) else tags
-                doc.metadata["date_added"] = datetime.now().isoformat()
-                doc.metadata["type"] = "document"
-                valid_documents.append(doc)
-            else:
-                st.warning(f"跳過無效的文檔: {type(doc)}")
-        
-        documents = valid_documents
+        documents = load_document(doc_info, doc_info["content_hash"])
         
         # 將文檔添加到文檔列表
-        st.session_state.document_list.append({
-            "id": doc_id,
-            "name": file.name,
-            "type": file_extension[1:],
-            "category": category,
-            "tags": tags,
-            "date_added": datetime.now().isoformat(),
-            "path": file_path
-        })
+        catalog.add(doc_info)
         
         return documents
     except Exception as e:
+        os.remove(doc_info["path"])
         st.error(f"處理文檔失敗: {str(e)}")
         return None
 
-def process_youtube(youtube_url, category, tags):
-    """處理YouTube URL"""
-    # 提取YouTube ID
-    youtube_id = extract_youtube_id(youtube_url)
-    if not youtube_id:
-        st.error("無效的YouTube URL")
+def process_bulk_upload(files, category, tags):
+    """批量導入上傳的文檔：並行解析、分批嵌入，並顯示進度和失敗文件"""
+    if not st.session_state.openai_api_key:
+        st.error("請先設置OpenAI API Key")
         return None
     
-    # 獲取字幕
-    transcript = get_youtube_transcript(youtube_id)
-    if not transcript:
-        st.error(f"無法獲取YouTube視頻 {youtube_id} 的字幕，請確保視頻有字幕")
-        return None
+    doc_infos = [register_upload(file, category, tags) for file in files]
+    progress_bar = st.progress(0.0, text="正在解析文檔...")
+    
+    def progress(done, total, name):
+        progress_bar.progress(done / total, text=f"已解析 {done}/{total}：{name}")
     
-    # 獲取YouTube信息（即使失敗也繼續）
-    info = get_youtube_info(youtube_id)
+    with st.spinner("正在嵌入並寫入知識庫..."):
+        report = BulkIngestor(knowledge_base).run(doc_infos, progress=progress)
+    
+    for name, error in report.failures:
+        st.error(f"{name}: {error}")
+    for name, existing in report.linked:
+        st.info(f"{name} 與已有文檔「{existing}」內容相同，不重複存儲，已更新它的分類和標籤")
+    if report.succeeded:
+        st.success(report.summary())
+    else:
+        st.warning(report.summary())
+    return report
+
+def add_youtube_video(video, youtube_url, category, tags):
+    """保存字幕並把影片登記到文檔目錄；影片已在知識庫中時只更新分類和標籤，返回None"""
+    existing = knowledge_base.link_duplicate({"youtube_id": video.youtube_id, "category": category, "tags": tags})
+    if existing is not None:
+        st.info(f"影片「{existing['name']}」已在知識庫中，已更新它的分類和標籤")
+        return None
     
     # 生成唯一ID
     doc_id = str(uuid.uuid4())
     
     # 保存字幕
-    transcript_path = f"data/youtube/{doc_id}.txt"
+    transcript_path = os.path.join(config.YOUTUBE_DIR, f"{doc_id}.txt")
     with open(transcript_path, "w", encoding="utf-8") as f:
-        f.write(transcript)
-    
-    # 創建文檔
-    loader = TextLoader(transcript_path)
-    documents = loader.load()
-    
-    # 添加元數據
-    valid_documents = []
-    for doc in documents:
-        if hasattr(doc, 'metadata'):
-            doc.metadata["source"] = info["title"]
-            doc.metadata["doc_id"] = doc_id
-            doc.metadata["youtube_id"] = youtube_id
-            doc.metadata["youtube_url"] = youtube_url
-            doc.metadata["category"] = category
-            doc.metadata["tags"] = ",".join(tags) if isinstance(tags, list) else tags
-            doc.metadata["date_added"] = datetime.now().isoformat()
-            doc.metadata["type"] = "youtube"
-            doc.metadata["author"] = info["author"]
-            valid_documents.append(doc)
-        else:
-            st.warning(f"跳過無效的YouTube文檔: {type(doc)}")
+        f.write(video.transcript)
     
-    documents = valid_documents
+    # 保存帶時間的字幕段，分塊時用於標記每段的開始時間
+    cues_path = os.path.join(config.YOUTUBE_DIR, f"{doc_id}.cues.json")
+    with open(cues_path, "w", encoding="utf-8") as f:
+        json.dump(video.cues, f, ensure_ascii=False)
     
     # 將文檔添加到文檔列表
-    st.session_state.document_list.append({
+    doc_info = {
         "id": doc_id,
-        "name": info["title"],
+        "name": video.title,
         "type": "youtube",
         "category": category,
         "tags": tags,
         "date_added": datetime.now().isoformat(),
         "path": transcript_path,
-        "youtube_id": youtube_id,
+        "cues_path": cues_path,
+        "youtube_id": video.youtube_id,
         "youtube_url": youtube_url,
-        "thumbnail_url": info["thumbnail_url"]
-    })
+        "thumbnail_url": video.thumbnail_url,
+        "author": video.author
+    }
+    catalog.add(doc_info)
+    return load_document(doc_info)
+
+def process_youtube(youtube_url, category, tags):
+    """處理YouTube URL"""
+    # 提取YouTube ID
+    youtube_id = extract_youtube_id(youtube_url)
+    if not youtube_id:
+        st.error("無效的YouTube URL")
+        return None
+    
+    # 已添加過的影片不必再獲取字幕
+    existing = knowledge_base.link_duplicate({"youtube_id": youtube_id, "category": category, "tags": tags})
+    if existing is not None:
+        st.info(f"影片「{existing['name']}」已在知識庫中，已更新它的分類和標籤")
+        return None
+    
+    # 一次提取同時獲取字幕和影片信息
+    try:
+        with st.spinner("正在獲取YouTube字幕..."):
+            video = get_youtube_fetcher().fetch(youtube_id)
+    except Exception as e:
+        st.error(str(e))
+        return None
     
-    st.success(f"成功添加YouTube視頻: {info['title']}")
+    if video.available_langs:
+        st.info(f"該視頻有以下語言的字幕可用: {', '.join(video.available_langs)}")
+    st.success(f"找到{video.subtitle_lang}字幕，來源：{video.subtitle_source}")
+    
+    documents = add_youtube_video(video, youtube_url, category, tags)
+    if documents is not None:
+        st.success(f"成功添加YouTube視頻: {video.title}")
     return documents
 
-def update_vectorstore():
-    """更新向量存儲"""
+def process_youtube_batch(urls, category, tags):
+    """並發處理多個YouTube URL或播放清單"""
+    with st.spinner("正在並發獲取YouTube字幕..."):
+        results = get_youtube_fetcher().fetch_many(urls)
+    
+    added = 0
+    for youtube_id, video in results:
+        if isinstance(video, Exception):
+            st.error(f"{youtube_id}: {video}")
+            continue
+        if add_youtube_video(video, WATCH_URL.format(youtube_id), category, tags) is not None:
+            added += 1
+    
+    if added:
+        st.success(f"成功添加 {added}/{len(results)} 個YouTube影片")
+    elif not results:
+        st.warning("沒有找到有效的YouTube URL")
+    return added
+
+def update_vectorstore(mode=SYNC):
+    """提交背景更新任務：預設只同步有變更的文檔；完整重建在新的一代索引中進行，完成後原子切換，期間照常問答"""
     if not st.session_state.openai_api_key:
         st.error("請先設置OpenAI API Key")
         return
     
-    with st.spinner("正在更新知識庫..."):
-        # 初始化嵌入模型
-        embeddings = OpenAIEmbeddings()
-        
-        # 從文檔列表中加載所有文檔
-        all_documents = []
-        for doc_info in st.session_state.document_list:
-            try:
-                if doc_info["type"] == "youtube":
-                    loader = TextLoader(doc_info["path"])
-                elif doc_info["type"] == "pdf":
-                    loader = PyPDFLoader(doc_info["path"])
-                elif doc_info["type"] in ["doc", "docx"]:
-                    loader = Docx2txtLoader(doc_info["path"])
-                else:
-                    loader = TextLoader(doc_info["path"])
-                
-                documents = loader.load()
-                
-                # 添加元數據
-                valid_documents = []
-                for doc in documents:
-                    if hasattr(doc, 'metadata'):
-                        doc.metadata["source"] = doc_info["name"]
-                        doc.metadata["doc_id"] = doc_info["id"]
-                        doc.metadata["category"] = doc_info["category"]
-                        doc.metadata["tags"] = ",".join(doc_info["tags"]) if isinstance(doc_info["tags"], list) else doc_info["tags"]
-                        doc.metadata["type"] = doc_info["type"]
-                        valid_documents.append(doc)
-                    else:
-                        st.warning(f"跳過無效的文檔: {type(doc)}")
-                
-                all_documents.extend(valid_documents)
-            except Exception as e:
-                st.error(f"加載文檔 {doc_info['name']} 失敗: {str(e)}")
-        
-        if not all_documents:
-            st.warning("沒有可用的文檔")
-            return
-        
-        # 分割文檔
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len
+    if not catalog.list_documents():
+        st.warning("沒有可用的文檔")
+        return
+    
+    # 所有會話共用同一個知識庫和工作執行緒，已有排隊中的同類任務時不會重複提交
+    job = knowledge_base.reindex_worker.submit(mode)
+    st.session_state.reindex_job = job.id
+    if mode == REBUILD:
+        st.info("已提交完整重建任務，完成前查詢仍使用目前的索引")
+    else:
+        st.info("已提交更新任務，只處理新增、修改和刪除的文檔")
+
+def render_reindex_status():
+    """顯示最近一次更新任務的狀態和進度"""
+    worker = knowledge_base.reindex_worker
+    job = worker.get(st.session_state.get("reindex_job")) or worker.latest()
+    if job is None:
+        return
+    
+    action = "重建" if job.mode == REBUILD else "更新"
+    if job.status == "queued":
+        st.info(f"{action}任務排隊中...")
+    elif job.status == "running":
+        st.progress(job.done / job.total if job.total else 0.0,
+                    text=f"正在{action}知識庫：{job.done}/{job.total} {job.current or ''}")
+    elif job.status == "done":
+        stats = job.stats
+        for name, error in stats["errors"]:
+            st.error(f"加載文檔 {name} 失敗: {error}")
+        if job.mode == REBUILD:
+            st.success(
+                f"知識庫重建完成並已切換：{stats['added'] + stats['updated']} 個文檔重新索引，"
+                f"寫入 {stats['chunks_added']} 個文本塊，耗時 {job.finished_at - job.started_at:.1f} 秒"
+            )
+        else:
+            st.success(
+                f"知識庫更新完成！新增 {stats['added']} 個、更新 {stats['updated']} 個、刪除 {stats['removed']} 個文檔，"
+                f"{stats['unchanged']} 個未變更；寫入 {stats['chunks_added']} 個文本塊，移除 {stats['chunks_removed']} 個。"
+            )
+        total = job.cache_hits + job.cache_misses
+        st.caption(
+            f"嵌入緩存：命中 {job.cache_hits} 次，未命中 {job.cache_misses} 次"
+            f"（本次命中率 {job.cache_hits / total if total else 0.0:.0%}）"
         )
-        chunks = text_splitter.split_documents(all_documents)
-        
-        # 過濾複雜的元數據
-        filtered_chunks = []
-        for chunk in chunks:
-            # 確保chunk是Document對象而不是字符串
-            if hasattr(chunk, 'metadata'):
-                # 手動過濾複雜的元數據
-                for key in list(chunk.metadata.keys()):
-                    value = chunk.metadata[key]
-                    # 如果值是複雜類型（不是str、int、float或bool），則轉換或刪除
-                    if not isinstance(value, (str, int, float, bool)):
-                        if isinstance(value, list):
-                            # 將列表轉換為字符串
-                            chunk.metadata[key] = ",".join(map(str, value))
-                        else:
-                            # 刪除其他複雜類型
-                            del chunk.metadata[key]
-                
-                filtered_chunks.append(chunk)
-            else:
-                st.warning(f"跳過無效的文檔塊: {type(chunk)}")
-        
-        # 使用過濾後的chunks
-        chunks = filtered_chunks
-        
-        # 創建向量存儲
-        st.session_state.vectorstore = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory="data/vectorstore"
+    else:
+        st.error(f"知識庫{action}失敗: {job.error}")
+    
+    if not job.finished:
+        # 狀態在背景更新，重新執行頁面即可看到最新進度
+        st.button("重新整理狀態")
+
+def delete_documents(doc_ids):
+    """刪除選中的文檔及其向量"""
+    removed = 0
+    for doc_id in doc_ids:
+        try:
+            removed += knowledge_base.delete_document(doc_id)
+        except KeyError:
+            continue
+    st.success(f"已刪除 {len(doc_ids)} 個文檔，移除 {removed} 個文本塊")
+
+def replace_document(doc_id, file):
+    """用上傳的新版本替換文檔，只重新嵌入該文檔"""
+    if not st.session_state.openai_api_key:
+        st.error("請先設置OpenAI API Key")
+        return
+    
+    extension = os.path.splitext(file.name)[1].lower()
+    tmp_path = os.path.join(config.DOCUMENTS_DIR, f"{doc_id}.{uuid.uuid4().hex}{extension}")
+    file.seek(0)
+    content_hash = copy_with_sha256(file, tmp_path)
+    try:
+        with st.spinner("正在重新索引文檔..."):
+            started = time.perf_counter()
+            stats = knowledge_base.replace_document(doc_id, tmp_path, name=file.name, content_hash=content_hash)
+        st.success(
+            f"已替換 {file.name}：移除 {stats.chunks_removed} 個文本塊，寫入 {stats.chunks_added} 個，"
+            f"耗時 {time.perf_counter() - started:.1f} 秒"
         )
-        
-        # 創建提示模板
-        system_template = st.session_state.system_prompt + """
+    except Exception as e:
+        st.error(f"替換文檔失敗: {str(e)}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
-文檔內容: {context}
+def compact_vectorstore():
+    """清除已刪除的向量並回收磁碟空間"""
+    with st.spinner("正在壓縮索引..."):
+        result = knowledge_base.compact()
+    st.success(
+        f"壓縮完成：清除 {result['chunks_purged']} 個殘留文本塊、{result['texts_removed']} 份已刪除文檔的抽取文本，"
+        f"回收 {result['bytes_reclaimed'] / 1024 / 1024:.1f} MB"
+    )
 
-請記住以下步驟來回答用戶的問題：
-1. 仔細分析用戶問題的真正意圖和語義
-2. 思考這個問題在財務稅法領域的專業背景和重要性
-3. 從提供的文檔中找出相關信息
-4. 組織一個結構化、系統性的回答，而不僅僅是列出文檔片段
-5. 如有必要，補充專業知識以提供完整回答
-6. 確保回答使用繁體中文，專業準確且易於理解
-"""
-        system_message_prompt = SystemMessagePromptTemplate.from_template(system_template)
-        human_template = "{question}"
-        human_message_prompt = HumanMessagePromptTemplate.from_template(human_template)
-        
-        # 組合提示模板
-        chat_prompt = ChatPromptTemplate.from_messages([
-            system_message_prompt,
-            human_message_prompt
-        ])
-        
-        # 初始化對話鏈
-        st.session_state.conversation = ConversationalRetrievalChain.from_llm(
-            llm=ChatOpenAI(
-                temperature=0.7,  # 提高溫度以獲得更多樣化的回答
-                model=st.session_state.selected_model  # 使用用戶選擇的模型
-            ),
-            combine_docs_chain_kwargs={"prompt": chat_prompt},  # 使用自定義提示模板
-            retriever=st.session_state.vectorstore.as_retriever(
-                search_kwargs={"k": 6}  # 檢索6個最相關的文檔片段
-            ),
-            memory=ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="answer"  # 明確指定要存儲的輸出鍵
-            ),
-            chain_type="stuff",  # 使用stuff方法將所有檢索到的文檔合併到一個提示中
-            verbose=True,  # 啟用詳細日誌
-            return_source_documents=True  # 返回源文檔以便調試
+def build_conversation():
+    """基於共用檢索器創建本會話的問答流程，只有對話記憶屬於會話"""
+    if st.session_state.selected_model == AUTO_MODEL:
+        router = create_router(temperature=0.7)
+        # 對話摘要和問題改寫一樣使用快速模型
+        st.session_state.memory.configure(llm=router.condense_llm, model=config.ROUTER_FAST_MODEL)
+        return RAGPipeline(
+            retriever=knowledge_base.as_retriever(k=6),
+            llm=router.llm(STRONG),
+            system_prompt=st.session_state.system_prompt,
+            answer_cache=knowledge_base.answer_cache,
+            router=router
         )
-        
-        st.success(f"知識庫更新完成！共處理了 {len(chunks)} 個文本塊。")
+
+    llm = get_chat_model(
+        model=st.session_state.selected_model,  # 使用用戶選擇的模型
+        temperature=0.7  # 提高溫度以獲得更多樣化的回答
+    )
+    # 對話摘要使用同一模型，token預算也按該模型設定
+    st.session_state.memory.configure(
+        llm=get_chat_model(model=st.session_state.selected_model, temperature=0, streaming=False),
+        model=st.session_state.selected_model
+    )
+    return RAGPipeline(
+        retriever=knowledge_base.as_retriever(k=6),  # 檢索6個最相關的文檔片段
+        llm=llm,
+        system_prompt=st.session_state.system_prompt,
+        answer_cache=knowledge_base.answer_cache  # 重複的問題直接返回緩存的回答
+    )
 
 def process_query(query):
-    """處理用戶查詢"""
+    """處理用戶查詢：先完成檢索，再以串流方式顯示回答"""
     if not st.session_state.conversation:
         st.error("請先更新知識庫")
         return
     
-    with st.spinner("思考中..."):
-        response = st.session_state.conversation({"question": query})
-        answer = response["answer"]
-        source_documents = response.get("source_documents", [])
+    pipeline = st.session_state.conversation
+    with st.spinner("檢索中..."):
+        result = pipeline.prepare(
+            query, st.session_state.memory.messages, filter=st.session_state.get("retrieval_filter")
+        )
+    
+    with st.chat_message("assistant"):
+        st.write_stream(pipeline.stream(result))
         
-        # 添加來源信息
-        if source_documents:
-            sources_text = "\n\n**參考來源：**\n"
-            
-            # 去重邏輯：使用集合記錄已經添加的文檔ID和內容
-            added_sources = set()
-            unique_docs = []
-            
-            for doc in source_documents:
-                source = doc.metadata.get("source", "未知來源")
-                doc_id = doc.metadata.get("doc_id", "")
-                # 創建唯一標識，結合文檔ID和內容的前50個字符
-                content_hash = f"{doc_id}_{doc.page_content[:50]}"
-                
-                # 如果這個來源還沒有添加過，則添加它
-                if content_hash not in added_sources:
-                    added_sources.add(content_hash)
-                    unique_docs.append(doc)
-            
-            # 最多顯示3個不重複的來源
-            for i, doc in enumerate(unique_docs[:3], 1):
-                source = doc.metadata.get("source", "未知來源")
-                doc_type = doc.metadata.get("type", "文件")
-                category = doc.metadata.get("category", "")
-                
-                # 提取文檔片段的簡短摘要（最多100個字符）
-                content_preview = doc.page_content[:100] + "..." if len(doc.page_content) > 100 else doc.page_content
-                
-                # 確保使用繁體中文
-                if doc_type == "youtube":
-                    sources_text += f"{i}. YouTube影片：{source}\n   相關內容：「{content_preview}」\n"
-                else:
-                    sources_text += f"{i}. 文件：{source} (類別：{category})\n   相關內容：「{content_preview}」\n"
-            
-            # 將來源信息添加到回答中
-            answer_with_sources = f"{answer}\n{sources_text}"
-        else:
-            answer_with_sources = answer
+        # 串流結束後附上來源信息
+        sources_text = format_sources(result.source_documents)
+        if sources_text:
+            st.write(sources_text)
         
-        st.session_state.chat_history.append({"role": "user", "content": query})
-        st.session_state.chat_history.append({"role": "assistant", "content": answer_with_sources})
+        ttft = result.time_to_first_token
+        ttft_text = f"{ttft:.2f} 秒" if ttft is not None else "—"
+        timing_text = (
+            f"檢索 {result.retrieval_seconds:.2f} 秒・首字延遲 {ttft_text}・總耗時 {result.total_seconds:.2f} 秒・"
+            f"提示 {result.prompt_tokens} token（對話歷史 {result.history_tokens}）"
+        )
+        if result.route:
+            timing_text += f"・{ROUTE_NAMES[result.route]} {result.model}（{result.route_reason}）"
+        if result.cache_hit:
+            cache = pipeline.answer_cache
+            match_text = "精確" if result.cache_hit == "exact" else "語義"
+            timing_text += f"・緩存命中（{match_text}，累計命中率 {cache.hit_rate:.0%}）"
+        st.caption(timing_text)
+    
+    remember_turn(st.session_state.memory, query, result.answer)
+    st.session_state.query_timings.append({
+        "question": query,
+        "retrieval_seconds": result.retrieval_seconds,
+        "time_to_first_token": ttft,
+        "total_seconds": result.total_seconds,
+        "cache_hit": result.cache_hit,
+        "prompt_tokens": result.prompt_tokens,
+        "history_tokens": result.history_tokens,
+        "stage_seconds": dict(result.stage_seconds),
+        "usage": dict(result.usage),
+        "model": result.model,
+        "route": result.route
+    })
+    session_usage = st.session_state.session_usage
+    session_usage["queries"] += 1
+    for key, value in result.usage.items():
+        session_usage[key] += value
+    
+    answer_with_sources = f"{result.answer}\n{sources_text}" if sources_text else result.answer
+    st.session_state.chat_history.append({"role": "user", "content": query})
+    st.session_state.chat_history.append({"role": "assistant", "content": answer_with_sources})
+    
+    return answer_with_sources
+
+def render_metrics_panel(placeholder):
+    """側邊欄的效能指標：各階段最近的耗時（進程內所有會話）和本會話的用量；再次調用時替換原來的內容"""
+    summary = get_metrics().summary()
+    with placeholder.container(), st.expander("📊 效能指標"):
+        rows = [
+            {
+                "階段": stage,
+                "次數": summary[stage]["count"],
+                "p50 (ms)": round(summary[stage]["p50"] * 1000, 1),
+                "p95 (ms)": round(summary[stage]["p95"] * 1000, 1),
+                "最近 (ms)": round(summary[stage]["last"] * 1000, 1),
+                "失敗": summary[stage]["errors"],
+            }
+            for stage in QUERY_STAGES + INGEST_STAGES
+            if stage in summary and summary[stage]["count"]
+        ]
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+        else:
+            st.caption("尚無記錄")
         
-        return answer_with_sources
+        timings = st.session_state.query_timings
+        if timings and timings[-1]["stage_seconds"]:
+            last = "・".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings[-1]["stage_seconds"].items())
+            st.caption(f"上一次查詢：{last}")
+
+        # 自動路由：每條路由的回答次數、總耗時和平均費用（進程內所有會話）
+        costs = {}
+        for labels, cost in get_metrics().counters().get("route_cost_usd", {}).items():
+            route = dict(labels)["route"]
+            costs[route] = costs.get(route, 0.0) + cost
+        route_rows = [
+            {
+                "路由": f"{ROUTE_NAMES[route]}",
+                "次數": summary[f"route_{route}"]["count"],
+                "p50 (s)": round(summary[f"route_{route}"]["p50"], 2),
+                "p95 (s)": round(summary[f"route_{route}"]["p95"], 2),
+                "平均費用 ($)": round(costs.get(route, 0.0) / summary[f"route_{route}"]["count"], 5),
+            }
+            for route in (FAST, STRONG)
+            if summary.get(f"route_{route}", {}).get("count")
+        ]
+        if route_rows:
+            st.dataframe(pd.DataFrame(route_rows), hide_index=True, use_container_width=True)
+
+        # OpenAI請求調度：排隊中的請求和被限流的次數
+        metrics = get_metrics()
+        queued = sum(metrics.gauges().get("openai_queue_depth", {}).values())
+        counters = metrics.counters()
+        throttled = sum(counters.get("openai_throttled", {}).values())
+        retries = sum(counters.get("openai_retries", {}).values())
+        if queued or throttled:
+            st.caption(f"OpenAI請求：排隊 {queued} 個，被限流 {throttled} 次，重試 {retries} 次")
+
+        usage = st.session_state.session_usage
+        st.caption(
+            f"本會話：{usage['queries']} 次查詢，輸入 {usage['prompt_tokens']} token、"
+            f"輸出 {usage['completion_tokens']} token，估算費用 ${usage['cost']:.4f}"
+        )
+
+# 效能指標先顯示一次，頁面因未設置API Key、沒有文檔等提前st.stop()時也能看到；頁面執行完後再更新為包含本次查詢的數據
+metrics_placeholder = st.sidebar.empty()
+render_metrics_panel(metrics_placeholder)
+
+# 頁腳
+st.sidebar.divider()
+st.sidebar.caption("© 2025 財務稅法QA機器人 | 版本 0.1.0")
 
 # 知識庫管理頁面
 if page == "知識庫管理":
@@ -566,6 +535,22 @@ if page == "知識庫管理":
                 documents = process_document(uploaded_file, category, tags.split(","))
                 if documents:
                     st.success(f"文檔 '{uploaded_file.name}' 上傳成功！")
+        
+        # 批量上傳：並行解析並直接寫入知識庫
+        st.subheader("批量上傳")
+        with st.form("bulk_upload_form"):
+            uploaded_files = st.file_uploader(
+                "選擇多個文檔",
+                type=["pdf", "docx", "txt", "md", "csv"],
+                accept_multiple_files=True
+            )
+            category = st.text_input("分類", "財務稅法")
+            tags = st.text_input("標籤 (用逗號分隔)", "財務,稅法")
+            
+            submit_button = st.form_submit_button("批量導入")
+            
+            if submit_button and uploaded_files:
+                process_bulk_upload(uploaded_files, category, tags.split(","))
     
     # 添加YouTube選項卡
     with tab2:
@@ -583,29 +568,64 @@ if page == "知識庫管理":
                 documents = process_youtube(youtube_url, category, tags.split(","))
                 if documents:
                     st.success(f"YouTube影片添加成功！")
+        
+        # 批量添加：多個URL或播放清單
+        st.subheader("批量添加")
+        with st.form("youtube_batch_form"):
+            youtube_urls = st.text_area("YouTube URL或播放清單（每行一個）")
+            category = st.text_input("分類", "財務稅法")
+            tags = st.text_input("標籤 (用逗號分隔)", "財務,稅法")
+            
+            submit_button = st.form_submit_button("批量添加")
+            
+            if submit_button and youtube_urls.strip():
+                process_youtube_batch(youtube_urls.splitlines(), category, tags.split(","))
     
     # 管理知識庫選項卡
     with tab3:
         st.subheader("知識庫內容")
         
-        if st.session_state.document_list:
+        document_list = catalog.list_documents()
+        if document_list:
             # 創建數據框
-            df = pd.DataFrame(st.session_state.document_list)
+            df = pd.DataFrame(document_list)
             df = df[["name", "type", "category", "tags", "date_added"]]
             df.columns = ["名稱", "類型", "分類", "標籤", "添加日期"]
             
             # 顯示數據框
             st.dataframe(df, use_container_width=True)
             
-            # 刪除文檔
-            if st.button("刪除選中的文檔"):
-                st.warning("此功能尚未實現")
+            # 刪除文檔：只移除選中文檔的向量、目錄條目和文件，不重建知識庫
+            labels = {doc["id"]: f"{doc['name']}（{doc['type']}，{doc['date_added'][:10]}）" for doc in document_list}
+            selected_ids = st.multiselect("選擇文檔", list(labels), format_func=labels.get)
+            if st.button("刪除選中的文檔", disabled=not selected_ids):
+                delete_documents(selected_ids)
+                st.rerun()
+            
+            # 替換文檔：保留分類和標籤，只重新嵌入這一個文檔
+            replaceable = [doc_id for doc_id in selected_ids if catalog.get(doc_id)["type"] != "youtube"]
+            if len(replaceable) == 1:
+                with st.form("replace_form"):
+                    new_file = st.file_uploader(
+                        f"用新版本替換 {labels[replaceable[0]]}", type=["pdf", "docx", "txt", "md", "csv"]
+                    )
+                    if st.form_submit_button("替換文檔") and new_file:
+                        replace_document(replaceable[0], new_file)
         else:
             st.info("知識庫中沒有文檔")
         
-        # 更新向量存儲
-        if st.button("更新知識庫"):
+        # 回收已刪除文檔佔用的索引空間
+        if st.button("壓縮索引"):
+            compact_vectorstore()
+        
+        # 在背景增量同步向量存儲，只處理有變更的文檔
+        busy = knowledge_base.reindex_worker.busy
+        if st.button("更新知識庫", disabled=busy):
             update_vectorstore()
+        # 完整重建在新的一代索引中進行（例如修改分割設置後），完成後原子切換
+        if st.button("完整重建", disabled=busy, help="重新分割和寫入全部文檔，嵌入緩存命中的文本塊不重複調用API"):
+            update_vectorstore(REBUILD)
+        render_reindex_status()
 
 # 聊天對話頁面
 elif page == "聊天對話":
@@ -617,17 +637,34 @@ elif page == "聊天對話":
         st.stop()
     
     # 檢查是否有文檔
-    if not st.session_state.document_list:
+    if not len(catalog):
         st.warning("請先在知識庫管理頁面添加文檔")
         st.stop()
     
     # 檢查是否初始化了向量存儲
-    if not st.session_state.vectorstore:
+    if not knowledge_base.is_indexed:
         st.info("請先更新知識庫")
-        if st.button("更新知識庫"):
+        if st.button("更新知識庫", disabled=knowledge_base.reindex_worker.busy):
             update_vectorstore()
+        render_reindex_status()
         st.stop()
     
+    # 已有持久化索引時直接使用共用的檢索器，不需要重建；切換模型（包括自動路由）後重新創建問答流程
+    if (not st.session_state.conversation
+            or st.session_state.get("conversation_model") != st.session_state.selected_model):
+        st.session_state.conversation = build_conversation()
+        st.session_state.conversation_model = st.session_state.selected_model
+    
+    # 檢索範圍：過濾條件在向量搜索時直接套用，不是檢索後再篩選
+    with st.expander("🔎 檢索範圍"):
+        options = knowledge_base.filter_options()
+        filter_categories = st.multiselect("分類", options["categories"])
+        filter_types = st.multiselect("類型", options["types"])
+        filter_tags = st.multiselect("標籤（任一符合）", options["tags"])
+        use_date = st.checkbox("只檢索某日期之後添加的資料")
+        date_from = st.date_input("起始日期") if use_date else None
+    st.session_state.retrieval_filter = build_filter(filter_categories, filter_types, filter_tags, date_from)
+    
     # 顯示聊天歷史
     for message in st.session_state.chat_history:
         with st.chat_message(message["role"]):
@@ -640,13 +677,7 @@ elif page == "聊天對話":
         with st.chat_message("user"):
             st.write(user_query)
         
-        # 獲取回答
-        answer = process_query(user_query)
-        
-        # 顯示助手消息
-        with st.chat_message("assistant"):
-            st.write(answer)
+        # 獲取並串流顯示回答
+        process_query(user_query)
 
-# 頁腳
-st.sidebar.divider()
-st.sidebar.caption("© 2025 財務稅法QA機器人 | 版本 0.1.0")
\ No newline at end of file
+render_metrics_panel(metrics_placeholder)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""測試共用的設置：全部離線執行（LLM_BACKEND=fake），數據目錄放在臨時目錄
+
+    python -m pytest -q
+"""
+
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 必須在導入rag之前設定，rag.config在導入時讀取環境變量
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_TOKEN_SECONDS", "0")
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="rag-tests-"))
+
+import pytest  # noqa: E402
+
+
+class StaticServer:
+    """在本地埠提供固定內容的HTTP服務，routes為 {路徑: (狀態碼, 內容)}"""
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(self.path)
+                status, body = server.routes.get(self.path, (404, b"not found"))
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+
+@pytest.fixture
+def static_server():
+    server = StaticServer()
+    server.thread.start()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
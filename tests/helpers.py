@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""測試用的小工具：在背景執行緒啟動ASGI應用、等待條件成立"""
+
+import socket
+import threading
+import time
+
+import uvicorn
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def serve(app):
+    """在背景執行緒用uvicorn啟動應用（含lifespan），返回停止函數；地址記在app.state.base_url"""
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    if not wait_for(lambda: server.started):
+        raise RuntimeError("測試服務啟動逾時")
+    app.state.base_url = f"http://127.0.0.1:{port}"
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=10)
+    return stop
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""語義回答緩存：正規化精確匹配、語義匹配、來源失效、TTL和容量淘汰"""
+
+import os
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from rag.answer_cache import AnswerCache, QuestionMatrix, normalize_question
+
+NAMESPACE = "gpt-test"
+
+
+class KeywordEmbeddings:
+    """按是否包含關鍵詞產生向量，讓語義相似的問題有相同方向"""
+
+    KEYWORDS = ("營業稅", "所得稅", "申報", "期限", "罰鍰")
+
+    def embed_query(self, text):
+        return [1.0 if keyword in text else 0.0 for keyword in self.KEYWORDS] + [0.01]
+
+
+def source(doc_id="doc-1"):
+    return Document(page_content="營業人應於每單月十五日前申報銷售額。", metadata={"doc_id": doc_id})
+
+
+@pytest.fixture
+def versions():
+    return {"doc-1": "v1"}
+
+
+@pytest.fixture
+def make_cache(tmp_path, versions):
+    def make(**kwargs):
+        kwargs.setdefault("version_lookup", lambda doc_ids: {doc_id: versions.get(doc_id) for doc_id in doc_ids})
+        kwargs.setdefault("ttl", 0)
+        return AnswerCache(os.path.join(tmp_path, "answers.sqlite"), **kwargs)
+    return make
+
+
+def test_normalize_question():
+    assert normalize_question("营业税 申报期限？") == normalize_question("營業稅申報期限?")
+    assert normalize_question("ＡＢＣ　稅") == "abc稅"
+
+
+def test_exact_hit_after_normalization(make_cache):
+    cache = make_cache()
+    assert cache.lookup(NAMESPACE, "營業稅申報期限？") is None
+
+    cache.put(NAMESPACE, "營業稅申報期限？", "每單月十五日前", [source()])
+    hit = cache.lookup(NAMESPACE, "营业税 申报期限")
+
+    assert (hit.answer, hit.match) == ("每單月十五日前", "exact")
+    assert hit.source_documents[0].metadata["doc_id"] == "doc-1"
+    assert cache.lookup("other-model", "營業稅申報期限？") is None
+    assert (cache.exact_hits, cache.misses) == (1, 2)
+
+
+def test_semantic_hit_above_threshold(make_cache):
+    cache = make_cache(embeddings=KeywordEmbeddings(), threshold=0.95)
+    cache.put(NAMESPACE, "營業稅申報期限是什麼時候？", "每單月十五日前", [source()])
+
+    hit = cache.lookup(NAMESPACE, "請問營業稅的申報期限")
+    assert hit.match == "semantic" and hit.similarity >= 0.95
+    assert cache.lookup(NAMESPACE, "所得稅罰鍰") is None
+
+
+def test_changed_or_deleted_source_invalidates(make_cache, versions):
+    cache = make_cache()
+    cache.put(NAMESPACE, "營業稅申報期限？", "每單月十五日前", [source()])
+
+    versions["doc-1"] = "v2"
+    assert cache.lookup(NAMESPACE, "營業稅申報期限？") is None
+    assert cache.invalidated == 1 and len(cache) == 0
+
+    cache.put(NAMESPACE, "營業稅申報期限？", "每單月十五日前", [source()])
+    del versions["doc-1"]
+    assert cache.lookup(NAMESPACE, "營業稅申報期限？") is None
+
+
+def test_expired_entries_miss(make_cache, monkeypatch):
+    cache = make_cache(ttl=60)
+    cache.put(NAMESPACE, "營業稅申報期限？", "每單月十五日前", [source()])
+
+    import rag.answer_cache
+    now = rag.answer_cache.time.time()
+    monkeypatch.setattr(rag.answer_cache.time, "time", lambda: now + 61)
+    assert cache.lookup(NAMESPACE, "營業稅申報期限？") is None
+    assert cache.expired == 1
+
+
+def test_evicts_least_recently_used(make_cache):
+    cache = make_cache(max_entries=2)
+    for question in ("問題一", "問題二"):
+        cache.put(NAMESPACE, question, f"{question}的回答", [source()])
+    assert cache.lookup(NAMESPACE, "問題一") is not None
+
+    cache.put(NAMESPACE, "問題三", "問題三的回答", [source()])
+
+    assert len(cache) == 2
+    assert cache.lookup(NAMESPACE, "問題二") is None
+    assert cache.lookup(NAMESPACE, "問題一") is not None
+
+
+def matrix_loads(cache):
+    """記錄從SQLite載入命名空間向量矩陣的次數"""
+    loads = []
+    cache._conn.set_trace_callback(lambda sql: loads.append(sql) if "SELECT question_hash, vector" in sql else None)
+    return loads
+
+
+def test_put_updates_loaded_matrix_in_place(make_cache):
+    cache = make_cache(embeddings=KeywordEmbeddings(), threshold=0.95)
+    cache.put(NAMESPACE, "營業稅申報期限是什麼時候？", "每單月十五日前", [source()])
+    cache.put("other-model", "所得稅申報期限？", "五月", [source()])
+    loads = matrix_loads(cache)
+    assert cache.lookup(NAMESPACE, "請問營業稅的申報期限").match == "semantic"
+    assert len(loads) == 1
+
+    # 寫入後不重新載入：新問題追加到已載入的矩陣，其他命名空間不受影響
+    cache.put(NAMESPACE, "所得稅罰鍰多少？", "處以罰鍰", [source()])
+    hit = cache.lookup(NAMESPACE, "所得稅的罰鍰")
+    assert (hit.answer, hit.match) == ("處以罰鍰", "semantic")
+    assert cache.lookup(NAMESPACE, "請問營業稅的申報期限").answer == "每單月十五日前"
+    assert len(loads) == 1
+    assert cache.lookup("other-model", "所得稅的申報期限").answer == "五月"
+    assert len(loads) == 2
+
+
+def test_evicted_and_invalidated_rows_leave_matrix(make_cache, versions):
+    cache = make_cache(embeddings=KeywordEmbeddings(), threshold=0.95, max_entries=2)
+    cache.put(NAMESPACE, "營業稅申報期限？", "每單月十五日前", [source()])
+    cache.put(NAMESPACE, "所得稅罰鍰？", "處以罰鍰", [source("doc-2")])
+    loads = matrix_loads(cache)
+    assert cache.lookup(NAMESPACE, "營業稅的申報期限").match == "semantic"
+
+    # 超出容量淘汰最久未使用的所得稅問題，矩陣中同時移除
+    cache.put(NAMESPACE, "營業稅罰鍰？", "處以罰鍰", [source()])
+    assert cache.lookup(NAMESPACE, "所得稅的罰鍰") is None
+    assert sorted(cache._matrices[NAMESPACE].keys) == sorted(
+        key for (key,) in cache._conn.execute("SELECT question_hash FROM answers WHERE namespace = ?", (NAMESPACE,))
+    )
+
+    versions["doc-1"] = "v2"
+    assert cache.lookup(NAMESPACE, "營業稅的申報期限") is None
+    assert len(cache._matrices[NAMESPACE]) == len(cache) == 1
+    assert len(loads) == 1
+
+    # 同一問題重寫只替換原來的行
+    cache.put(NAMESPACE, "營業稅罰鍰？", "處罰鍰", [source()])
+    assert len(cache._matrices[NAMESPACE]) == 1
+    assert cache.lookup(NAMESPACE, "營業稅的罰鍰").answer == "處罰鍰"
+
+
+def test_question_matrix_grows_and_swaps_rows():
+    matrix = QuestionMatrix()
+    for i in range(40):
+        matrix.set(f"q{i}", np.array([1.0, float(i)], dtype=np.float32))
+    matrix.remove("q0")
+    matrix.remove("q39")
+
+    assert len(matrix) == 38 and matrix.matrix.shape == (38, 2)
+    for key, row in zip(matrix.keys, matrix.matrix):
+        i = int(key[1:])
+        np.testing.assert_allclose(row, np.array([1.0, i]) / np.hypot(1.0, i), rtol=1e-6)
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""HTTP問答服務：問答（含SSE串流）、參數檢查、共用的問答流程，以及上傳、替換和刪除文檔（假模型，FAISS後端）"""
+
+import json
+import os
+import socket
+import threading
+
+import pytest
+import requests
+
+import rag.api
+import rag.ingest
+from benchmarks.suite import make_knowledge_base
+from rag import config
+from rag.api import create_app
+from rag.catalog import DocumentCatalog
+from rag.llm import FAKE_ANSWER
+from tests.helpers import serve, wait_for
+
+TEXT = "第一條\n娛樂稅代徵人應於每月十日前繳納代徵稅款。\n第二條\n逾期繳納者加徵滯納金。"
+
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    config.ensure_data_dirs()
+    catalog = DocumentCatalog(os.path.join(tmp_path, "catalog.sqlite"))
+    return make_knowledge_base(str(tmp_path), "api", catalog, backend="faiss")
+
+
+@pytest.fixture
+def api(knowledge_base):
+    app = create_app(knowledge_base=knowledge_base)
+    stop = serve(app)
+    yield app
+    stop()
+
+
+def upload(app, data, name="娛樂稅法.txt", **params):
+    return requests.post(f"{app.state.base_url}/documents", params={"name": name, **params},
+                         data=data.encode("utf-8") if isinstance(data, str) else data, timeout=30)
+
+
+def test_upload_parses_in_threads(api, knowledge_base, monkeypatch):
+    # 服務進程有多個執行緒，上傳時不應為解析fork子進程
+    def no_processes(*args, **kwargs):
+        raise AssertionError("上傳不應建立進程池")
+    monkeypatch.setattr(rag.ingest, "ProcessPoolExecutor", no_processes)
+
+    response = upload(api, TEXT, category="娛樂稅", tags="稅法, 地方稅")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["linked"] is False and body["chunks"] > 0
+    doc_info = knowledge_base.catalog.get(body["document"]["id"])
+    assert (doc_info["category"], doc_info["tags"]) == ("娛樂稅", ["稅法", "地方稅"])
+    assert knowledge_base.search("娛樂稅代徵人", k=1)[0].metadata["doc_id"] == doc_info["id"]
+
+
+def test_interrupted_upload_removes_partial_file(api, knowledge_base, monkeypatch):
+    received = threading.Event()
+    paths = []
+    receive_file = rag.api.receive_file
+
+    async def recording_receive_file(request, path):
+        paths.append(path)
+        try:
+            return await receive_file(request, path)
+        finally:
+            received.set()
+    monkeypatch.setattr(rag.api, "receive_file", recording_receive_file)
+
+    # 聲明的長度比實際送出的多，送出一部分後斷開連線
+    host, port = api.state.base_url[len("http://"):].split(":")
+    with socket.create_connection((host, int(port))) as sock:
+        sock.sendall(b"POST /documents?name=partial.txt HTTP/1.1\r\nHost: test\r\n"
+                     b"Content-Length: 1000000\r\n\r\n" + b"x" * 1000)
+    assert received.wait(timeout=10)
+
+    assert len(paths) == 1
+    assert wait_for(lambda: not os.path.exists(paths[0]))
+    assert knowledge_base.catalog.list_documents() == []
+
+
+def test_unsupported_upload_is_rejected(api):
+    response = upload(api, TEXT, name="娛樂稅法.exe")
+    assert response.status_code == 400
+
+
+def replace(app, doc_id, data, **params):
+    return requests.put(f"{app.state.base_url}/documents/{doc_id}", params=params,
+                        data=data.encode("utf-8") if isinstance(data, str) else data, timeout=30)
+
+
+def test_replace_document_endpoint(api, knowledge_base):
+    doc_info = upload(api, TEXT).json()["document"]
+    old_chunks = set(knowledge_base.lexical_index.doc_chunks[doc_info["id"]])
+
+    response = replace(api, doc_info["id"], "第一條\n營業人應於每單月十五日前申報銷售額。", name="營業稅法.md")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["updated"] == 1 and body["chunks_removed"] == len(old_chunks) and body["chunks_added"] > 0
+    assert body["document"]["name"] == "營業稅法.md"
+    assert body["document"]["content_hash"] != doc_info["content_hash"]
+    assert all(doc.metadata["doc_id"] != doc_info["id"]
+               for doc in knowledge_base.search("娛樂稅代徵人", k=20) if "娛樂稅" in doc.page_content)
+    assert knowledge_base.search("單月申報銷售額", k=1)[0].metadata["doc_id"] == doc_info["id"]
+    # 臨時文件已移動到位，文檔目錄中沒有殘留
+    documents_dir = os.path.dirname(body["document"]["path"])
+    assert [name for name in os.listdir(documents_dir) if name.startswith("tmp")] == []
+
+
+def test_replace_failures_keep_original(api, knowledge_base):
+    doc_info = upload(api, TEXT).json()["document"]
+    chunks = set(knowledge_base.lexical_index.doc_chunks[doc_info["id"]])
+
+    assert replace(api, "missing", TEXT).status_code == 404
+    assert replace(api, doc_info["id"], TEXT, name="法規.exe").status_code == 400
+    response = replace(api, doc_info["id"], b"not a pdf", name="法規.pdf")
+    assert response.status_code == 422
+
+    assert knowledge_base.catalog.get(doc_info["id"]) == doc_info
+    assert open(doc_info["path"], encoding="utf-8").read() == TEXT
+    assert set(knowledge_base.lexical_index.doc_chunks[doc_info["id"]]) == chunks
+    assert knowledge_base.search("娛樂稅代徵人", k=1)[0].metadata["doc_id"] == doc_info["id"]
+    documents_dir = os.path.dirname(doc_info["path"])
+    assert [name for name in os.listdir(documents_dir) if name.startswith("tmp")] == []
+
+
+def test_duplicate_upload_links_existing_document(api, knowledge_base):
+    first = upload(api, TEXT, category="娛樂稅", tags="稅法").json()
+    chunks = len(knowledge_base.vectorstore)
+    documents_dir = os.path.dirname(first["document"]["path"])
+    files = set(os.listdir(documents_dir))
+
+    response = upload(api, TEXT, name="副本.txt", category="地方稅", tags="法規,稅法")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["linked"] is True and body["chunks"] == 0
+    assert body["document"]["id"] == first["document"]["id"]
+    assert (body["document"]["category"], body["document"]["tags"]) == ("地方稅", ["稅法", "法規"])
+    assert len(knowledge_base.catalog) == 1 and len(knowledge_base.vectorstore) == chunks
+    # 副本不保留在文檔目錄中
+    assert set(os.listdir(documents_dir)) == files
+
+
+@pytest.fixture
+def indexed(api):
+    """已上傳一份文檔的服務"""
+    assert upload(api, TEXT, category="娛樂稅").status_code == 200
+    return api
+
+
+def query(app, path="/query", **payload):
+    payload.setdefault("question", "娛樂稅代徵人應於何時繳納？")
+    return requests.post(f"{app.state.base_url}{path}", json=payload, timeout=30)
+
+
+def sse_events(response):
+    """把SSE回應解析成 [(事件, 數據)]"""
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_query_returns_answer_and_sources(indexed, knowledge_base):
+    response = query(indexed, k=2)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["answer"] == FAKE_ANSWER and body["model"]
+    assert 0 < len(body["sources"]) <= 2
+    assert body["sources"][0]["category"] == "娛樂稅" and "娛樂稅" in body["sources"][0]["content"]
+
+    # 過濾條件限定在沒有文檔的分類時沒有來源
+    response = query(indexed, filters={"categories": ["營業稅"]})
+    assert response.status_code == 200 and response.json()["sources"] == []
+    assert query(indexed, filters={"date_from": "not-a-date"}).status_code == 400
+
+
+def test_query_stream_sends_sources_tokens_and_done(indexed):
+    response = query(indexed, path="/query/stream", k=2)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(response)
+    names = [name for name, _ in events]
+    assert names[0] == "sources" and names[-1] == "done"
+    assert set(names[1:-1]) == {"token"}
+    assert events[0][1] and "娛樂稅" in events[0][1][0]["content"]
+    answer = "".join(data["text"] for name, data in events if name == "token")
+    assert answer == events[-1][1]["answer"] == FAKE_ANSWER
+
+
+def test_query_rejects_unknown_model_and_bad_k(indexed):
+    response = query(indexed, model="gpt-unknown")
+    assert response.status_code == 400 and "gpt-unknown" in response.json()["detail"]
+    assert query(indexed, k=0).status_code == 422
+    assert query(indexed, k=config.API_MAX_K + 1).status_code == 422
+    assert query(indexed, k=config.API_MAX_K).status_code == 200
+    assert indexed.state.pipelines and all(key[0] != "gpt-unknown" for key in indexed.state.pipelines)
+
+
+def test_pipelines_are_shared_and_bounded(indexed, monkeypatch):
+    monkeypatch.setattr(config, "API_MAX_PIPELINES", 2)
+    pipelines = indexed.state.pipelines
+    for k in (1, 2):
+        assert query(indexed, k=k).status_code == 200
+    first = pipelines[(config.CHAT_MODEL, 1)]
+
+    # 再用k=1時沿用同一個流程並移到最近使用，之後新增的流程淘汰最久未使用的k=2
+    assert query(indexed, k=1).status_code == 200
+    assert query(indexed, k=3).status_code == 200
+    assert list(pipelines) == [(config.CHAT_MODEL, 1), (config.CHAT_MODEL, 3)]
+    assert pipelines[(config.CHAT_MODEL, 1)] is first
+
+
+def test_list_and_delete_documents(indexed, knowledge_base):
+    documents = requests.get(f"{indexed.state.base_url}/documents", timeout=10).json()
+    assert [doc["name"] for doc in documents] == ["娛樂稅法.txt"]
+    doc_info = documents[0]
+
+    response = requests.delete(f"{indexed.state.base_url}/documents/{doc_info['id']}", timeout=10)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["doc_id"] == doc_info["id"] and body["chunks_removed"] > 0
+    assert not os.path.exists(doc_info["path"])
+    assert requests.get(f"{indexed.state.base_url}/documents", timeout=10).json() == []
+    assert query(indexed).json()["sources"] == []
+    assert requests.delete(f"{indexed.state.base_url}/documents/{doc_info['id']}", timeout=10).status_code == 404
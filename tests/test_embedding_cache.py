@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""嵌入緩存：LRU淘汰順序、命中統計、讀取時間的批量提交，以及只對未命中的文本調用嵌入模型"""
+
+import itertools
+import os
+import sqlite3
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from rag.embedding_cache import CachedEmbeddings, EmbeddingCache, text_key
+from rag.metrics import MetricsRegistry
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """每次調用遞增的時間，使用順序不受時鐘精度影響"""
+    ticks = itertools.count(1)
+    monkeypatch.setattr("rag.embedding_cache.time.time", lambda: float(next(ticks)))
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    def make(**kwargs):
+        return EmbeddingCache(os.path.join(tmp_path, "embeddings.sqlite"), **kwargs)
+    return make
+
+
+def keys(cache):
+    return sorted(cache.get_many("m", ["a", "b", "c", "d", "e"]))
+
+
+def stored_access(cache, key):
+    with sqlite3.connect(cache.path) as conn:
+        return conn.execute("SELECT last_access FROM embeddings WHERE text_hash = ?", (key,)).fetchone()[0]
+
+
+def test_evicts_least_recently_used(make_cache, clock):
+    cache = make_cache(max_entries=3, evict_every=1)
+    for key in ("a", "b", "c"):
+        cache.put_many("m", {key: [float(ord(key))]})
+    # 讀取a之後，最久未使用的是b
+    assert cache.get_many("m", ["a"]) == {"a": [97.0]}
+
+    cache.put_many("m", {"d": [100.0]})
+    assert len(cache) == 3 and keys(cache) == ["a", "c", "d"]
+    cache.put_many("m", {"e": [101.0], "a": [1.0]})
+    assert keys(cache) == ["a", "d", "e"]
+
+
+def test_eviction_runs_every_n_writes(make_cache, clock):
+    cache = make_cache(max_entries=2, evict_every=3)
+    for key in ("a", "b", "c"):
+        cache.put_many("m", {key: [1.0]})
+    # 第三條寫入時才檢查容量並淘汰到上限
+    assert keys(cache) == ["b", "c"]
+    cache.put_many("m", {"d": [1.0]})
+    cache.put_many("m", {"e": [1.0]})
+    assert len(cache) == 4
+    cache.put_many("m", {"a": [1.0]})
+    assert len(cache) == 2 and keys(cache) == ["a", "e"]
+
+
+def test_read_times_are_written_in_batches(make_cache, clock):
+    cache = make_cache(touch_batch=2)
+    cache.put_many("m", {"a": [1.0], "b": [2.0]})
+    written = stored_access(cache, "a")
+
+    cache.get_many("m", ["a"])
+    assert stored_access(cache, "a") == written
+    cache.get_many("m", ["b"])
+    assert stored_access(cache, "a") > written and stored_access(cache, "b") > written
+
+    cache.get_many("m", ["a"])
+    read = stored_access(cache, "a")
+    cache.flush()
+    assert stored_access(cache, "a") > read
+
+
+def test_counts_hits_and_misses(make_cache):
+    cache = make_cache()
+    assert cache.stats()["hit_rate"] == 0.0
+    cache.put_many("m", {"a": [1.0]})
+
+    # 重複的鍵每次都計數；不同模型的向量分開
+    assert cache.get_many("m", ["a", "a", "b"]) == {"a": [1.0]}
+    assert cache.get_many("other", ["a"]) == {}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 2, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_cached_embeddings_only_embed_misses(make_cache):
+    cache = make_cache()
+    underlying = DeterministicFakeEmbedding(size=8)
+    calls = []
+    embed_documents = underlying.embed_documents
+    object.__setattr__(underlying, "embed_documents", lambda texts: calls.append(texts) or embed_documents(texts))
+    embeddings = CachedEmbeddings(underlying, cache=cache, model_name="fake", metrics=MetricsRegistry())
+
+    first = embeddings.embed_documents(["營業稅", "所得稅", "營業稅"])
+    # 全半形和空白不同的文本正規化後相同，命中緩存
+    second = embeddings.embed_documents(["營業稅 ", "遺產稅", "所得稅"])
+
+    assert calls == [["營業稅", "所得稅"], ["遺產稅"]]
+    assert first[0] == first[2] == second[0] and first[1] == second[2]
+    assert embeddings.embed_query("所得稅") == first[1]
+    assert text_key("ＡＢＣ  稅") == text_key("ABC 稅")
+    assert (cache.hits, cache.misses) == (3, 4)
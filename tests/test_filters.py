@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""檢索範圍的過濾條件與其在Python中的求值"""
+
+from datetime import datetime
+
+import pytest
+
+from rag.filters import build_filter, filter_metadata, metadata_matches, split_tags, tag_key
+
+
+def metadata(category="所得稅", doc_type="pdf", tags="稅法,法規", date_added="2024-03-15T10:30:00"):
+    doc_info = {"category": category, "type": doc_type, "tags": tags, "date_added": date_added}
+    return {"category": category, "type": doc_type, **filter_metadata(doc_info)}
+
+
+def test_split_tags_and_tag_key():
+    assert split_tags(" 稅法, ,法規 ") == ["稅法", "法規"]
+    assert split_tags(["稅法", "", None]) == ["稅法"]
+    assert tag_key("營業 稅/申報") == "tag_營業_稅_申報"
+
+
+def test_no_conditions_returns_none():
+    assert build_filter() is None
+    assert build_filter(categories=[], tags="") is None
+
+
+def test_single_condition_is_not_wrapped():
+    assert build_filter(categories=["所得稅"]) == {"category": {"$in": ["所得稅"]}}
+    assert build_filter(tags="稅法") == {"tag_稅法": True}
+
+
+def test_values_or_within_and_across():
+    where = build_filter(categories=["所得稅", "營業稅"], tags=["稅法", "健保"])
+    assert where == {"$and": [
+        {"category": {"$in": ["所得稅", "營業稅"]}},
+        {"$or": [{"tag_稅法": True}, {"tag_健保": True}]},
+    ]}
+    assert metadata_matches(metadata(), where)
+    assert metadata_matches(metadata(category="營業稅", tags="健保"), where)
+    assert not metadata_matches(metadata(category="遺產稅"), where)
+    assert not metadata_matches(metadata(tags="其他"), where)
+
+
+@pytest.mark.parametrize("date_from, date_to, expected", [
+    ("2024-03-15", "2024-03-15", True),
+    ("2024-03-16", None, False),
+    (None, "2024-03-14", False),
+    (datetime(2024, 3, 15, 10), datetime(2024, 3, 15, 11), True),
+    (None, datetime(2024, 3, 15, 10), False),
+])
+def test_date_range_includes_whole_end_day(date_from, date_to, expected):
+    where = build_filter(date_from=date_from, date_to=date_to)
+    assert metadata_matches(metadata(), where) is expected
+
+
+def test_missing_field_does_not_match_range():
+    assert not metadata_matches({"category": "所得稅"}, build_filter(date_from="2024-01-01"))
+
+
+def test_unknown_operator_raises():
+    with pytest.raises(ValueError):
+        metadata_matches({"category": "所得稅"}, {"category": {"$regex": "所得"}})
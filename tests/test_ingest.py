@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""文檔導入：邊寫入邊計算雜湊、按內容雜湊去重並合併分類和標籤、並行導入的報告，以及監視目錄"""
+
+import hashlib
+import io
+import os
+
+import pytest
+
+from benchmarks.suite import make_knowledge_base
+from rag import config
+from rag.catalog import DocumentCatalog
+from rag.filters import build_filter
+from rag.ingest import (
+    BulkIngestor, DirectoryWatcher, HashingWriter, copy_with_sha256, new_document_entry, register_file
+)
+
+TEXT = "第一條\n娛樂稅代徵人應於每月十日前繳納代徵稅款。\n第二條\n逾期繳納者加徵滯納金。"
+
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    config.ensure_data_dirs()
+    catalog = DocumentCatalog(os.path.join(tmp_path, "catalog.sqlite"))
+    return make_knowledge_base(str(tmp_path), "ingest", catalog, backend="faiss")
+
+
+def write_source(directory, name, text=TEXT):
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def test_hashing_writer_hashes_what_it_writes(tmp_path):
+    data = os.urandom(3000)
+    buffer = io.BytesIO()
+    writer = HashingWriter(buffer)
+    for start in range(0, len(data), 1024):
+        writer.write(data[start:start + 1024])
+    assert buffer.getvalue() == data
+    assert writer.hexdigest() == hashlib.sha256(data).hexdigest()
+
+    path = os.path.join(tmp_path, "copy.bin")
+    assert copy_with_sha256(io.BytesIO(data), path, block_size=100) == hashlib.sha256(data).hexdigest()
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_catalog_finds_earliest_document_by_content_hash(tmp_path):
+    catalog = DocumentCatalog(os.path.join(tmp_path, "catalog.sqlite"))
+    first = {**new_document_entry("a.txt", "營業稅", []), "content_hash": "h1", "date_added": "2024-01-01"}
+    second = {**new_document_entry("b.txt", "營業稅", []), "content_hash": "h1", "date_added": "2024-02-01"}
+    # 舊版條目沒有記錄雜湊，第一次查找時按文件內容補算
+    legacy = new_document_entry("c.txt", "營業稅", [])
+    legacy["path"] = write_source(tmp_path, "legacy.txt")
+    for doc_info in (second, first, legacy):
+        catalog.add(doc_info)
+
+    assert catalog.find_by_content_hash("h1")["id"] == first["id"]
+    assert catalog.find_by_content_hash("h2") is None
+    digest = hashlib.sha256(TEXT.encode("utf-8")).hexdigest()
+    assert catalog.find_by_content_hash(digest)["id"] == legacy["id"]
+    assert catalog.get(legacy["id"])["content_hash"] == digest
+
+
+def test_duplicate_links_and_merges_labels(knowledge_base, tmp_path):
+    ingestor = BulkIngestor(knowledge_base, parse_workers=1, processes=False)
+    original = register_file(write_source(tmp_path, "娛樂稅法.txt"), "娛樂稅", ["稅法", "地方稅"])
+    report = ingestor.run([original])
+    chunks = report.chunks
+    assert chunks > 0 and report.linked == []
+
+    # 內容相同的兩份（同一批中也重複）：不解析和嵌入，刪除副本，分類和標籤合併到已有文檔
+    copies = [register_file(write_source(tmp_path, name), "地方稅", ["法規", "稅法"])
+              for name in ("副本一.txt", "副本二.txt")]
+    report = ingestor.run(copies)
+
+    assert report.linked == [("副本一.txt", "娛樂稅法.txt"), ("副本二.txt", "娛樂稅法.txt")]
+    assert report.chunks == 0 and report.succeeded == []
+    assert report.linked_paths == [copy["source_path"] for copy in copies]
+    assert not any(os.path.exists(copy["path"]) for copy in copies)
+    assert len(knowledge_base.catalog) == 1
+    assert len(knowledge_base.indexer.state[original["id"]]["chunk_ids"]) == chunks
+    linked = knowledge_base.catalog.get(original["id"])
+    assert (linked["category"], linked["tags"]) == ("地方稅", ["稅法", "地方稅", "法規"])
+    # 向量元數據同時更新，按新分類和標籤過濾可以檢索到
+    results = knowledge_base.search("娛樂稅代徵人", k=1, filter=build_filter(categories=["地方稅"], tags=["法規"]))
+    assert [doc.metadata["doc_id"] for doc in results] == [original["id"]]
+
+
+def test_link_duplicate_without_match_returns_none(knowledge_base):
+    assert knowledge_base.link_duplicate({"content_hash": "none", "category": "稅法", "tags": []}) is None
+    assert knowledge_base.link_duplicate({"category": "稅法", "tags": []}) is None
+    assert knowledge_base.link_duplicate({"youtube_id": "abc", "category": "稅法", "tags": []}) is None
+
+
+def test_bulk_ingest_reports_chunks_and_failures(knowledge_base, tmp_path):
+    ingestor = BulkIngestor(knowledge_base, parse_workers=2, batch_size=2, processes=False)
+    good = [register_file(write_source(tmp_path, f"法規{number}.txt", TEXT.replace("十日", f"{number}日")), "稅法", [])
+            for number in range(3)]
+    broken = register_file(write_source(tmp_path, "損壞.pdf", "不是PDF"), "稅法", [])
+    done = []
+
+    report = ingestor.run(good + [broken], progress=lambda *args: done.append(args))
+
+    assert sorted(report.succeeded) == ["法規0.txt", "法規1.txt", "法規2.txt"]
+    assert [name for name, _ in report.failures] == ["損壞.pdf"] and "解析失敗" in report.failures[0][1]
+    assert report.failed_paths == [broken["source_path"]] and not os.path.exists(broken["path"])
+    assert report.pages == 3 and report.chunks == sum(
+        len(knowledge_base.indexer.state[doc_info["id"]]["chunk_ids"]) for doc_info in good
+    )
+    assert sorted(total for _, total, _ in done) == [4] * 4 and max(count for count, _, _ in done) == 4
+    assert len(knowledge_base.catalog) == 3
+    assert knowledge_base.search("逾期繳納者加徵滯納金", k=1)
+
+
+@pytest.fixture
+def watcher(knowledge_base, tmp_path):
+    directory = os.path.join(tmp_path, "inbox")
+    os.makedirs(directory)
+    return DirectoryWatcher(BulkIngestor(knowledge_base, parse_workers=1, processes=False), directory, "稅法", ["法規"])
+
+
+def touch(path, mtime):
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_watcher_waits_until_file_stops_changing(watcher):
+    path = write_source(watcher.directory, "娛樂稅法.txt", TEXT[:10])
+    touch(path, 1)
+    # 第一次看到的文件可能還在複製中
+    assert watcher.scan().files == 0
+
+    write_source(watcher.directory, "娛樂稅法.txt")
+    touch(path, 2)
+    assert watcher.scan().files == 0
+
+    report = watcher.scan()
+    assert report.succeeded == ["娛樂稅法.txt"]
+    (doc_info,) = watcher.ingestor.knowledge_base.catalog.list_documents()
+    assert doc_info["content_hash"] == hashlib.sha256(TEXT.encode("utf-8")).hexdigest()
+    assert (doc_info["category"], doc_info["tags"]) == ("稅法", ["法規"])
+    # 之後的掃描不再導入
+    assert watcher.scan().files == 0
+
+
+def test_watcher_replaces_changed_files(watcher):
+    knowledge_base = watcher.ingestor.knowledge_base
+    path = write_source(watcher.directory, "娛樂稅法.txt")
+    assert watcher.scan(wait=False).succeeded == ["娛樂稅法.txt"]
+    (original,) = knowledge_base.catalog.list_documents()
+    knowledge_base.update_labels(original["id"], "地方稅", ["娛樂稅"])
+
+    changed = TEXT + "\n第三條\n本法自公布日施行。"
+    write_source(watcher.directory, "娛樂稅法.txt", changed)
+    touch(path, 5)
+    watcher.scan()
+    report = watcher.scan()
+
+    # 保留doc_id、分類和標籤，只替換內容；來源文件不動
+    assert report.replaced == ["娛樂稅法.txt"] and report.chunks > 0 and report.succeeded == []
+    (doc_info,) = knowledge_base.catalog.list_documents()
+    assert doc_info["id"] == original["id"] and (doc_info["category"], doc_info["tags"]) == ("地方稅", ["娛樂稅"])
+    assert doc_info["content_hash"] == hashlib.sha256(changed.encode("utf-8")).hexdigest()
+    assert os.path.exists(path)
+    with open(doc_info["path"], encoding="utf-8") as f:
+        assert f.read() == changed
+    results = knowledge_base.search("本法自公布日施行", k=1)
+    assert [doc.metadata["doc_id"] for doc in results] == [original["id"]]
+    assert watcher.scan().files == 0
+
+
+def test_watcher_retries_failed_files_only_after_change(watcher):
+    path = os.path.join(watcher.directory, "娛樂稅法.txt")
+    with open(path, "wb") as f:
+        f.write(b"\xff\xfe\x00")
+    report = watcher.scan(wait=False)
+    assert [name for name, _ in report.failures] == ["娛樂稅法.txt"]
+    assert watcher.scan().files == 0
+
+    # 修正內容後重試
+    write_source(watcher.directory, "娛樂稅法.txt")
+    touch(path, 5)
+    watcher.scan()
+    assert watcher.scan().succeeded == ["娛樂稅法.txt"]
+
+
+def test_watcher_skips_content_already_imported(watcher, knowledge_base, tmp_path):
+    BulkIngestor(knowledge_base, parse_workers=1, processes=False).run(
+        [register_file(write_source(tmp_path, "娛樂稅法.txt"), "稅法", [])]
+    )
+    # 內容相同的文件放到監視目錄中不重複導入
+    write_source(watcher.directory, "副本.txt")
+    assert watcher.scan(wait=False).files == 0
+    assert len(knowledge_base.catalog) == 1
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""知識庫的增量同步、刪除、壓縮和過濾檢索（假嵌入模型，兩種向量後端）"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+from langchain_core.documents import Document
+
+from benchmarks.corpus import build_corpus
+from benchmarks.suite import make_knowledge_base, write_corpus
+from rag.catalog import DocumentCatalog
+from rag.filters import build_filter
+from rag.ingest import new_document_entry
+from rag.loaders import file_sha256
+
+
+@pytest.fixture(params=["faiss", "chroma"])
+def knowledge_base(request, tmp_path):
+    documents, _ = build_corpus(articles_per_law=5)
+    catalog = DocumentCatalog(os.path.join(tmp_path, "catalog.sqlite"))
+    for doc_info in write_corpus(str(tmp_path), documents, replicas=1):
+        catalog.add(doc_info)
+    return make_knowledge_base(str(tmp_path), "kb", catalog, backend=request.param)
+
+
+def chunk_count(knowledge_base):
+    return len(knowledge_base.vectorstore.get(include=[])["ids"])
+
+
+def test_sync_only_embeds_changes(knowledge_base):
+    catalog = knowledge_base.catalog
+    total = len(catalog.list_documents())
+
+    stats = knowledge_base.sync()
+    assert (stats.added, stats.updated, stats.removed, stats.errors) == (total, 0, 0, [])
+    assert stats.chunks_added == chunk_count(knowledge_base) > 0
+
+    stats = knowledge_base.sync()
+    assert (stats.added, stats.unchanged, stats.chunks_added) == (0, total, 0)
+
+    # 修改一個文件、從目錄中移除另一個
+    changed, removed = catalog.list_documents()[:2]
+    with open(changed["path"], "a", encoding="utf-8") as f:
+        f.write("\n第九十九條\n營業人應於每月十五日前申報補充保費。")
+    catalog.remove(removed["id"])
+    stats = knowledge_base.sync()
+    assert (stats.updated, stats.removed, stats.unchanged) == (1, 1, total - 2)
+    assert removed["id"] not in knowledge_base.indexer.state
+
+
+def test_delete_document_removes_vectors_and_file(knowledge_base):
+    knowledge_base.sync()
+    doc_info = knowledge_base.catalog.list_documents()[0]
+    before = chunk_count(knowledge_base)
+
+    removed = knowledge_base.delete_document(doc_info["id"])
+
+    assert removed > 0
+    assert chunk_count(knowledge_base) == before - removed
+    assert knowledge_base.catalog.get(doc_info["id"]) is None
+    assert not os.path.exists(doc_info["path"])
+    results = knowledge_base.search(doc_info["name"], k=20)
+    assert all(doc.metadata["doc_id"] != doc_info["id"] for doc in results)
+    with pytest.raises(KeyError):
+        knowledge_base.delete_document(doc_info["id"])
+
+
+def test_compact_purges_untracked_vectors(knowledge_base):
+    knowledge_base.sync()
+    before = chunk_count(knowledge_base)
+    assert knowledge_base.compact()["chunks_purged"] == 0
+
+    knowledge_base.vectorstore.add_documents([Document(page_content="沒有被追蹤的文本塊", metadata={"doc_id": "orphan"})],
+                                             ids=["orphan:0"])
+    assert chunk_count(knowledge_base) == before + 1
+
+    assert knowledge_base.compact()["chunks_purged"] == 1
+    assert chunk_count(knowledge_base) == before
+
+
+def test_search_applies_filters(knowledge_base):
+    knowledge_base.sync()
+    query = "營業人應於每單月十五日前申報銷售額"
+
+    results = knowledge_base.search(query, k=6, filter=build_filter(categories=["所得稅"]))
+    assert results and all(doc.metadata["category"] == "所得稅" for doc in results)
+
+    results = knowledge_base.search(query, k=6, filter=build_filter(categories=["所得稅"], types=["pdf"]))
+    assert results == []
+
+    results = knowledge_base.search(query, k=6, filter=build_filter(tags=["法規"], date_to="2000-01-01"))
+    assert results == []
+
+    assert knowledge_base.filter_options()["tags"] == ["法規", "稅法"]
+
+
+def add_document(knowledge_base, directory, text, name="新增文件.txt"):
+    doc_info = new_document_entry(name, "營業稅", ["稅法"])
+    doc_info["path"] = os.path.join(directory, f"{doc_info['id']}.txt")
+    with open(doc_info["path"], "w", encoding="utf-8") as f:
+        f.write(text)
+    knowledge_base.catalog.add(doc_info)
+    return doc_info
+
+
+def found(knowledge_base, query, doc_id):
+    vector_results = knowledge_base.vectorstore.similarity_search(query, k=20)
+    lexical_results = [doc for doc, _ in knowledge_base.lexical_index.search(query, k=20)]
+    return [any(doc.metadata["doc_id"] == doc_id for doc in results) for results in (vector_results, lexical_results)]
+
+
+def test_second_instance_sees_writes(knowledge_base, tmp_path):
+    # 同一數據目錄上的兩個實例，相當於API的兩個工作進程
+    knowledge_base.sync()
+    other = make_knowledge_base(str(tmp_path), "kb", knowledge_base.catalog, backend=knowledge_base.backend)
+    query = "娛樂稅代徵人應於每月十日前繳納"
+    assert other.search(query, k=6)
+
+    doc_info = add_document(knowledge_base, str(tmp_path), f"第一條\n{query}。")
+    knowledge_base.sync()
+    fingerprint = knowledge_base.document_versions([doc_info["id"]])[doc_info["id"]]
+    assert fingerprint is not None
+
+    # 回答緩存按document_versions判斷來源是否變更
+    assert other.document_versions([doc_info["id"]]) == {doc_info["id"]: fingerprint}
+    assert other.search(query, k=1)[0].metadata["doc_id"] == doc_info["id"]
+    assert found(other, query, doc_info["id"]) == [True, True]
+
+    # 另一個實例也可以寫入，寫入前先跟上已有的修改，不會覆蓋掉它們
+    other.delete_document(doc_info["id"])
+    assert knowledge_base.document_versions([doc_info["id"]]) == {doc_info["id"]: None}
+    assert found(knowledge_base, query, doc_info["id"]) == [False, False]
+    assert len(knowledge_base.indexer.state) == len(other.indexer.state) == len(knowledge_base.catalog.list_documents())
+
+
+WRITER = """
+import sys
+from benchmarks.suite import make_knowledge_base
+from rag.catalog import DocumentCatalog
+
+directory, backend = sys.argv[1:]
+catalog = DocumentCatalog(directory + "/catalog.sqlite")
+make_knowledge_base(directory, "kb", catalog, backend=backend).sync()
+"""
+
+
+def test_sees_writes_from_another_process(knowledge_base, tmp_path):
+    # Chroma和FAISS都把向量索引留在進程的記憶體中，其他進程寫入後必須重新打開
+    knowledge_base.sync()
+    query = "娛樂稅代徵人應於每月十日前繳納"
+    knowledge_base.search(query, k=6)
+    doc_info = add_document(knowledge_base, str(tmp_path), f"第一條\n{query}。")
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", WRITER, str(tmp_path), knowledge_base.backend], cwd=root, check=True)
+
+    assert knowledge_base.document_versions([doc_info["id"]])[doc_info["id"]] is not None
+    assert found(knowledge_base, query, doc_info["id"]) == [True, True]
+
+
+def chunk_ids(knowledge_base, doc_id):
+    return set(knowledge_base.vectorstore.get(where={"doc_id": doc_id}, include=[])["ids"])
+
+
+def test_replace_document_reindexes_only_that_document(knowledge_base, tmp_path):
+    knowledge_base.sync()
+    doc_info, other = knowledge_base.catalog.list_documents()[:2]
+    old_text = open(doc_info["path"], encoding="utf-8").read()
+    old_hash = file_sha256(doc_info["path"])
+    other_version = knowledge_base.document_versions([other["id"]])
+    source_path = os.path.join(tmp_path, "新版.md")
+    with open(source_path, "w", encoding="utf-8") as f:
+        f.write("第一條\n娛樂稅代徵人應於每月十日前繳納代徵稅款。")
+
+    stats = knowledge_base.replace_document(doc_info["id"], source_path, name="娛樂稅法.md")
+
+    assert (stats.updated, stats.chunks_added) == (1, len(chunk_ids(knowledge_base, doc_info["id"])))
+    assert stats.chunks_removed > 0
+    updated = knowledge_base.catalog.get(doc_info["id"])
+    assert (updated["name"], updated["type"], updated["category"]) == ("娛樂稅法.md", "md", doc_info["category"])
+    assert updated["content_hash"] == file_sha256(updated["path"]) != old_hash
+    assert updated["path"].endswith(".md") and not os.path.exists(doc_info["path"])
+    assert not os.path.exists(source_path)
+
+    # 舊文本塊從向量存儲和詞彙索引中移除，其他文檔不受影響
+    old_query = old_text.splitlines()[1]
+    assert all(doc.metadata["doc_id"] != doc_info["id"] or "娛樂稅" in doc.page_content
+               for doc in knowledge_base.search(old_query, k=20))
+    assert all("娛樂稅" in knowledge_base.lexical_index.chunks[chunk_id][0]
+               for chunk_id in knowledge_base.lexical_index.doc_chunks[doc_info["id"]])
+    assert knowledge_base.search("娛樂稅代徵人", k=1)[0].metadata["doc_id"] == doc_info["id"]
+    assert knowledge_base.document_versions([other["id"]]) == other_version
+
+
+def test_replace_with_unparsable_file_keeps_original(knowledge_base, tmp_path):
+    knowledge_base.sync()
+    doc_info = knowledge_base.catalog.list_documents()[0]
+    chunks = chunk_ids(knowledge_base, doc_info["id"])
+    version = knowledge_base.document_versions([doc_info["id"]])
+    source_path = os.path.join(tmp_path, "損壞.pdf")
+    with open(source_path, "wb") as f:
+        f.write(b"not a pdf")
+
+    with pytest.raises(Exception):
+        knowledge_base.replace_document(doc_info["id"], source_path, name="損壞.pdf")
+
+    assert knowledge_base.catalog.get(doc_info["id"]) == doc_info
+    assert os.path.exists(doc_info["path"])
+    assert chunk_ids(knowledge_base, doc_info["id"]) == chunks
+    assert set(knowledge_base.lexical_index.doc_chunks[doc_info["id"]]) == chunks
+    assert knowledge_base.document_versions([doc_info["id"]]) == version
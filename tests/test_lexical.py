@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""倒數排名融合與BM25詞彙索引"""
+
+import os
+
+from langchain_core.documents import Document
+
+from rag.lexical import LexicalIndex, rrf_fuse
+
+
+def doc(text, doc_id="doc-1", **metadata):
+    return Document(page_content=text, metadata={"doc_id": doc_id, **metadata})
+
+
+def test_rrf_fuse_rewards_agreement():
+    a, b, c, d = doc("甲"), doc("乙"), doc("丙"), doc("丁")
+    fused = rrf_fuse([[a, b, c], [c, b, d]], k=4)
+    # 兩路都出現的丙（第三、第一）和乙（第二、第二）排在只出現一次的甲、丁之前
+    assert [item.page_content for item in fused] == ["丙", "乙", "甲", "丁"]
+
+
+def test_rrf_fuse_dedupes_and_truncates():
+    first = doc("相同內容")
+    duplicate = doc("相同內容")
+    other_doc = doc("相同內容", doc_id="doc-2")
+    fused = rrf_fuse([[first], [duplicate, other_doc]], k=6)
+    assert fused == [first, other_doc]
+    assert fused[0] is first
+    assert len(rrf_fuse([[doc(str(i)) for i in range(10)]], k=3)) == 3
+
+
+def test_lexical_index_add_search_remove(tmp_path):
+    path = os.path.join(tmp_path, "lexical.pkl")
+    index = LexicalIndex(path, background_merge=False)
+    index.add_chunks("vat", ["vat:0", "vat:1"], [
+        doc("營業人應於每單月十五日前申報銷售額", "vat", category="營業稅"),
+        doc("違反前項規定者處罰鍰", "vat", category="營業稅"),
+    ])
+    index.add_chunks("income", ["income:0"], [doc("納稅義務人應於五月申報綜合所得稅", "income", category="所得稅")])
+
+    results = index.search("單月申報銷售額", k=2)
+    assert results[0][0].metadata["doc_id"] == "vat"
+    filtered = index.search("申報", k=5, filter={"category": {"$in": ["所得稅"]}})
+    assert [result.metadata["doc_id"] for result, _ in filtered] == ["income"]
+
+    index.remove_document("vat")
+    assert all(result.metadata["doc_id"] != "vat" for result, _ in index.search("單月申報銷售額", k=5))
+
+    index.save()
+    reloaded = LexicalIndex(path, background_merge=False)
+    assert [result.metadata["doc_id"] for result, _ in reloaded.search("綜合所得稅", k=5)] == ["income"]
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""LINE Webhook：簽名驗證、重送去重和立即確認，LINE API由line_chatbot.mock_api模擬"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+import requests
+
+from benchmarks.suite import make_knowledge_base
+from line_chatbot.app import BUSY_MESSAGE, create_app
+from line_chatbot.client import LineClient, compute_signature
+from line_chatbot.mock_api import create_mock_app, webhook_body
+from rag import config
+from rag.catalog import DocumentCatalog
+from tests.helpers import serve, wait_for
+
+SECRET = "test-secret"
+
+
+@pytest.fixture
+def line_api():
+    """模擬的LINE API；app.state.expired中的回覆權杖會被拒絕"""
+    expired = set()
+    app = create_mock_app(expired_reply_tokens=expired)
+    app.state.expired = expired
+    stop = serve(app)
+    yield app
+    stop()
+
+
+@pytest.fixture
+def webhook(tmp_path, line_api):
+    catalog = DocumentCatalog(os.path.join(tmp_path, "catalog.sqlite"))
+    knowledge_base = make_knowledge_base(str(tmp_path), "line", catalog, backend="faiss")
+    app = create_app(knowledge_base=knowledge_base, line_client=LineClient(api_base=line_api.state.base_url),
+                     channel_secret=SECRET)
+    stop = serve(app)
+    yield app
+    stop()
+
+
+def post(app, payload, secret=SECRET, signature=None):
+    data = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return requests.post(f"{app.state.base_url}/callback", data=data, timeout=10, headers={
+        "Content-Type": "application/json",
+        "X-Line-Signature": signature if signature is not None else compute_signature(secret, data),
+    })
+
+
+def sent(line_api, kind):
+    return [message for message in line_api.state.messages if message["kind"] == kind]
+
+
+def test_rejects_bad_signature(webhook, line_api):
+    body = webhook_body("營業稅申報期限？")
+    assert post(webhook, body, secret="wrong-secret").status_code == 400
+    assert post(webhook, body, signature="").status_code == 400
+    assert webhook.state.bot.pending == 0
+    assert line_api.state.messages == []
+
+
+def test_rejects_malformed_body_with_valid_signature(webhook):
+    assert post(webhook, b"{not json").status_code == 400
+    assert post(webhook, b"[]").status_code == 400
+    assert post(webhook, b"\xff\xfe").status_code == 400
+
+
+def test_redelivered_event_is_answered_once(webhook, line_api):
+    body = webhook_body("營業稅申報期限？", user_id="U-dedup")
+    redelivery = webhook_body("營業稅申報期限？", user_id="U-dedup",
+                              redelivery_of=body["events"][0]["webhookEventId"])
+
+    assert post(webhook, body).status_code == 200
+    assert post(webhook, redelivery).status_code == 200
+
+    assert wait_for(lambda: webhook.state.bot.pending == 0 and sent(line_api, "reply"))
+    replies = sent(line_api, "reply")
+    assert [reply["replyToken"] for reply in replies] == [body["events"][0]["replyToken"]]
+    assert replies[0]["messages"][0]["text"]
+
+
+def test_acknowledges_before_answer_is_ready(webhook, line_api, monkeypatch):
+    pipeline = webhook.state.bot.pipeline
+    release = threading.Event()
+    answer = pipeline.invoke
+
+    def slow_invoke(*args, **kwargs):
+        release.wait(timeout=10)
+        return answer(*args, **kwargs)
+
+    monkeypatch.setattr(pipeline, "invoke", slow_invoke)
+
+    started = time.perf_counter()
+    response = post(webhook, webhook_body("營業稅申報期限？", user_id="U-ack"))
+    elapsed = time.perf_counter() - started
+
+    # 問答還卡在模型生成時Webhook已經返回
+    assert response.status_code == 200
+    assert elapsed < 2
+    assert webhook.state.bot.pending == 1
+    assert sent(line_api, "reply") == []
+
+    release.set()
+    assert wait_for(lambda: sent(line_api, "reply"))
+    assert webhook.state.bot.pending == 0
+
+
+def test_falls_back_to_push_when_reply_token_expired(webhook, line_api):
+    body = webhook_body("營業稅申報期限？", user_id="U-push")
+    line_api.state.expired.add(body["events"][0]["replyToken"])
+
+    assert post(webhook, body).status_code == 200
+
+    assert wait_for(lambda: sent(line_api, "push"))
+    assert sent(line_api, "reply") == []
+    assert sent(line_api, "push")[0]["to"] == "U-push"
+
+
+def test_flooding_user_does_not_block_others(webhook, line_api, monkeypatch):
+    bot = webhook.state.bot
+    release = threading.Event()
+    answer = bot.pipeline.invoke
+    flooded = []
+
+    def slow_for_flooder(question, *args, **kwargs):
+        if question.startswith("洗版"):
+            flooded.append(question)
+            release.wait(timeout=10)
+        return answer(question, *args, **kwargs)
+
+    monkeypatch.setattr(bot.pipeline, "invoke", slow_for_flooder)
+
+    # 一個用戶一次送出比工作執行緒還多的訊息
+    count = config.LINE_WORKERS + bot.max_queued_per_user
+    body = webhook_body("洗版0", user_id="U-flood")
+    for i in range(1, count):
+        body["events"] += webhook_body(f"洗版{i}", user_id="U-flood")["events"]
+    assert post(webhook, body).status_code == 200
+    assert wait_for(lambda: flooded)
+
+    other = webhook_body("營業稅申報期限？", user_id="U-other")
+    assert post(webhook, other).status_code == 200
+
+    # 洗版用戶只佔用一個工作執行緒，其他用戶的訊息照常回答；超出排隊上限的訊息回覆忙碌提示
+    reply_token = other["events"][0]["replyToken"]
+    assert wait_for(lambda: any(reply["replyToken"] == reply_token for reply in sent(line_api, "reply")))
+    assert flooded == ["洗版0"]
+    busy = [reply for reply in sent(line_api, "reply") if reply["messages"][0]["text"] == BUSY_MESSAGE]
+    assert len(busy) == count - 1 - bot.max_queued_per_user
+
+    release.set()
+    assert wait_for(lambda: bot.pending == 0)
+    # 排隊的訊息按順序回答
+    assert flooded == [f"洗版{i}" for i in range(bot.max_queued_per_user + 1)]
+    assert len(sent(line_api, "reply")) == count + 1
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""摘要式對話記憶：預算內保留最近對話，摘要在鎖外生成"""
+
+import re
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from rag.memory import SUMMARY_PREFIX, MemoryStore, SummaryBufferMemory
+
+
+class Reply:
+    def __init__(self, content):
+        self.content = content
+
+
+class BlockingSummarizer:
+    """記錄摘要提示；release之前一直阻塞，模擬很慢的摘要模型"""
+
+    def __init__(self, summary="用戶詢問營業稅申報"):
+        self.summary = summary
+        self.prompts = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        self.started.set()
+        self.release.wait(timeout=10)
+        return Reply(self.summary)
+
+
+def add_turn(memory, question, answer="好的"):
+    memory.add_message(HumanMessage(content=question))
+    memory.add_message(AIMessage(content=answer))
+
+
+def test_keeps_recent_turns_and_summarizes_older():
+    llm = BlockingSummarizer()
+    llm.release.set()
+    memory = SummaryBufferMemory(llm=llm, max_turns=2, token_budget=3000)
+    for i in range(4):
+        add_turn(memory, f"第{i}個問題")
+
+    messages = memory.messages
+    assert isinstance(messages[0], SystemMessage)
+    assert messages[0].content == SUMMARY_PREFIX + "用戶詢問營業稅申報"
+    assert [message.content for message in messages[1:]] == ["第2個問題", "好的", "第3個問題", "好的"]
+    assert memory.summarized_turns == 2
+
+
+def test_summary_prompt_limit_is_in_characters():
+    llm = BlockingSummarizer()
+    llm.release.set()
+    # 每個字算兩個token：1000 token的摘要預算只容得下約一半的字
+    memory = SummaryBufferMemory(llm=llm, max_turns=1, token_budget=3000, count_tokens=lambda text: 2 * len(text))
+    add_turn(memory, "營業稅申報期限")
+    add_turn(memory, "所得稅申報期限")
+
+    max_chars = int(re.search(r"不超過(\d+)字", llm.prompts[0]).group(1))
+    assert max_chars == 500
+
+
+def test_summarizer_runs_outside_the_lock():
+    llm = BlockingSummarizer()
+    memory = SummaryBufferMemory(llm=llm, max_turns=1, token_budget=3000)
+    add_turn(memory, "營業稅申報期限")
+    memory.add_message(HumanMessage(content="所得稅申報期限"))
+    pruning = threading.Thread(target=memory.add_message, args=(AIMessage(content="五月"),))
+    pruning.start()
+    assert llm.started.wait(timeout=5)
+
+    # 摘要進行中：讀取和寫入不被阻塞，讀到的仍是完整的舊對話
+    reader = threading.Thread(target=lambda: memory.messages)
+    reader.start()
+    reader.join(timeout=1)
+    assert not reader.is_alive()
+    assert [message.content for message in memory.messages] == ["營業稅申報期限", "好的", "所得稅申報期限", "五月"]
+    memory.add_message(HumanMessage(content="遺產稅呢"))
+
+    llm.release.set()
+    pruning.join(timeout=5)
+    assert [message.content for message in memory.messages] == [
+        SUMMARY_PREFIX + "用戶詢問營業稅申報", "所得稅申報期限", "五月", "遺產稅呢"
+    ]
+
+
+def test_clear_during_summary_discards_result():
+    llm = BlockingSummarizer()
+    memory = SummaryBufferMemory(llm=llm, max_turns=1, token_budget=3000)
+    add_turn(memory, "營業稅申報期限")
+    memory.add_message(HumanMessage(content="所得稅申報期限"))
+    pruning = threading.Thread(target=memory.add_message, args=(AIMessage(content="五月"),))
+    pruning.start()
+    assert llm.started.wait(timeout=5)
+
+    memory.clear()
+    llm.release.set()
+    pruning.join(timeout=5)
+    assert memory.messages == [] and memory.summary == ""
+
+
+def test_without_llm_keeps_questions_within_budget():
+    memory = SummaryBufferMemory(max_turns=1, token_budget=30, count_tokens=len)
+    for i in range(6):
+        add_turn(memory, f"問題{i}" * 3)
+
+    # 摘要預算為三分之一（10個token），從尾部保留最近被移出的問題
+    assert memory.summary.endswith("問題4問題4問題4")
+    assert len(memory.summary) <= 10
+    assert memory.token_count() <= 30
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryStore(max_users=2, ttl=0)
+    first, _ = store.session("a")
+    second, _ = store.session("b")
+    assert store.session("a")[0] is first
+    store.session("c")
+
+    # b最久未使用，被淘汰後重新建立
+    assert len(store) == 2
+    assert store.session("b")[0] is not second
+    assert store.session("c")[0] is not first
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""指標註冊表：直方圖和計數器的累計、百分位摘要、Prometheus文本格式，以及Streamlit側邊欄的效能指標"""
+
+import os
+import re
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+from rag.metrics import MetricsRegistry, estimate_cost, get_metrics
+
+SAMPLE = re.compile(r'^(?P<name>[a-z_]+)(?:\{(?P<labels>.*)\})? (?P<value>\S+)$')
+
+
+def parse(text):
+    """Prometheus文本格式 -> （{指標名: 類型}，{(樣本名, 標籤字串): 值}）"""
+    types, samples = {}, {}
+    assert text.endswith("\n")
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            types[name] = kind
+        elif not line.startswith("# HELP "):
+            match = SAMPLE.match(line)
+            assert match, line
+            samples[(match["name"], match["labels"] or "")] = float(match["value"])
+    return types, samples
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry(buckets=(0.1, 1.0), recent_size=3)
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    for seconds in (0.05, 0.1, 0.5, 2.0):
+        registry.observe("retrieve", seconds)
+
+    types, samples = parse(registry.export_prometheus())
+
+    assert types["rag_stage_seconds"] == "histogram"
+    # 桶的上限包含等於上限的值
+    assert samples[("rag_stage_seconds_bucket", 'stage="retrieve",le="0.1"')] == 2
+    assert samples[("rag_stage_seconds_bucket", 'stage="retrieve",le="1.0"')] == 3
+    assert samples[("rag_stage_seconds_bucket", 'stage="retrieve",le="+Inf"')] == 4
+    assert samples[("rag_stage_seconds_count", 'stage="retrieve"')] == 4
+    assert samples[("rag_stage_seconds_sum", 'stage="retrieve"')] == pytest.approx(2.65)
+
+
+def test_summary_uses_recent_samples(registry):
+    for seconds in (10.0, 1.0, 2.0, 3.0):
+        registry.observe("generate", seconds)
+    registry.observe("load", 0.5)
+    registry.record_error("rerank")
+
+    summary = registry.summary()
+
+    # 總次數累計全部樣本，百分位只看最近recent_size個
+    assert summary["generate"]["count"] == 4
+    assert (summary["generate"]["p50"], summary["generate"]["last"]) == (2.0, 3.0)
+    assert summary["rerank"] == {"count": 0, "errors": 1, "p50": None, "p95": None, "last": None}
+    # 按導入、問答各階段的順序排列
+    assert list(summary) == ["load", "rerank", "generate"]
+
+
+def test_timer_records_duration_or_error(registry):
+    with registry.timer("embed"):
+        pass
+    with pytest.raises(RuntimeError):
+        with registry.timer("embed"):
+            raise RuntimeError("嵌入服務不可用")
+
+    assert (registry.summary()["embed"]["count"], registry.summary()["embed"]["errors"]) == (1, 1)
+    _, samples = parse(registry.export_prometheus())
+    assert samples[("rag_stage_errors_total", 'stage="embed"')] == 1
+
+
+def test_counters_aggregate_by_labels(registry):
+    registry.increment("route_queries", {"route": "fast", "model": "gpt-4o-mini"}, description="查詢次數")
+    registry.increment("route_queries", {"model": "gpt-4o-mini", "route": "fast"}, 2)
+    registry.increment("route_queries", {"route": "strong", "model": "gpt-4o"})
+    registry.increment("retries")
+    registry.set_gauge("queue_depth", 3, {"priority": "chat"})
+    registry.set_gauge("queue_depth", 1, {"priority": "chat"})
+
+    # 標籤的順序不影響累計
+    assert registry.counters()["route_queries"] == {
+        (("model", "gpt-4o-mini"), ("route", "fast")): 3,
+        (("model", "gpt-4o"), ("route", "strong")): 1,
+    }
+    types, samples = parse(registry.export_prometheus())
+    assert types["rag_route_queries_total"] == "counter" and types["rag_queue_depth"] == "gauge"
+    assert samples[("rag_route_queries_total", 'model="gpt-4o-mini",route="fast"')] == 3
+    assert samples[("rag_retries_total", "")] == 1
+    assert samples[("rag_queue_depth", 'priority="chat"')] == 1
+    assert "# HELP rag_route_queries_total 查詢次數" in registry.export_prometheus()
+
+
+def test_usage_and_label_escaping(registry):
+    registry.add_usage('ft:gpt-4o"a\\b', 100, 20, 0.5)
+    registry.add_usage('ft:gpt-4o"a\\b', 50, 10, 0.25)
+    registry.increment("queries", {"source": 'say "hi"'})
+
+    text = registry.export_prometheus()
+    _, samples = parse(text)
+
+    assert samples[("rag_llm_tokens_total", 'model="ft:gpt-4o\\"a\\\\b",kind="prompt"')] == 150
+    assert samples[("rag_llm_tokens_total", 'model="ft:gpt-4o\\"a\\\\b",kind="completion"')] == 30
+    assert samples[("rag_llm_cost_usd_total", 'model="ft:gpt-4o\\"a\\\\b"')] == 0.75
+    assert 'rag_queries_total{source="say \\"hi\\""} 1' in text.splitlines()
+
+    registry.reset()
+    assert registry.summary() == {} and registry.usage() == {} and registry.counters() == {}
+
+
+def test_estimate_cost_uses_longest_prefix():
+    assert estimate_cost("gpt-4o-mini-2024-07-18", 1000, 1000) == pytest.approx(0.00075)
+    assert estimate_cost("gpt-4o-2024-08-06", 1000, 0) == pytest.approx(0.0025)
+    assert estimate_cost("unknown", 1000, 1000) == 0.0
+    assert estimate_cost(None, 1000, 1000) == 0.0
+
+
+def test_metrics_panel_shows_when_page_stops(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    # 從空的共用註冊表開始，不受其他測試記錄的指標影響
+    get_metrics().reset()
+    app = AppTest.from_file(os.path.join(os.path.dirname(__file__), "..", "streamlit_app.py"), default_timeout=60)
+    app.run()
+    app.sidebar.radio[0].set_value("聊天對話").run()
+
+    # 未設置API Key時聊天頁面提前st.stop()，側邊欄仍顯示效能指標
+    assert not app.exception
+    assert [warning.value for warning in app.warning] == ["請在側邊欄設置OpenAI API Key"]
+    assert [expander.label for expander in app.sidebar.expander] == ["📊 效能指標"]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""在新的一代目錄中完整重建、切換CURRENT指針、其他實例跟隨切換、清理舊的一代，以及背景更新任務"""
+
+import os
+import threading
+
+import pytest
+
+from benchmarks.corpus import build_corpus
+from benchmarks.suite import make_knowledge_base, write_corpus
+from rag.catalog import DocumentCatalog
+from rag.reindex import REBUILD, SYNC, ReindexWorker
+from tests.helpers import wait_for
+
+
+@pytest.fixture(params=["faiss", "chroma"])
+def knowledge_base(request, tmp_path):
+    documents, _ = build_corpus(articles_per_law=3)
+    catalog = DocumentCatalog(os.path.join(tmp_path, "catalog.sqlite"))
+    for doc_info in write_corpus(str(tmp_path), documents, replicas=1):
+        catalog.add(doc_info)
+    knowledge_base = make_knowledge_base(str(tmp_path), "kb", catalog, backend=request.param)
+    knowledge_base.sync()
+    return knowledge_base
+
+
+def reopen(knowledge_base, tmp_path):
+    """同一數據目錄上的另一個實例（相當於另一個工作進程）"""
+    return make_knowledge_base(str(tmp_path), "kb", knowledge_base.catalog, backend=knowledge_base.backend)
+
+
+def versions(knowledge_base):
+    return knowledge_base.document_versions([doc["id"] for doc in knowledge_base.catalog.list_documents()])
+
+
+def generations(knowledge_base):
+    return sorted(name for name in os.listdir(knowledge_base.generations_dir)
+                  if os.path.isdir(os.path.join(knowledge_base.generations_dir, name)))
+
+
+def test_rebuild_builds_and_switches_to_generation(knowledge_base):
+    before = versions(knowledge_base)
+    cache = knowledge_base.vectorstore.embeddings.cache
+    misses = cache.misses
+
+    stats = knowledge_base.rebuild()
+
+    generation = knowledge_base.generation
+    assert generation is not None and stats.added == len(before) and stats.errors == []
+    with open(os.path.join(knowledge_base.generations_dir, "CURRENT"), encoding="utf-8") as f:
+        assert f.read() == generation
+    directory = os.path.join(knowledge_base.generations_dir, generation)
+    assert knowledge_base.persist_directory == os.path.join(directory, "vectorstore")
+    for name in ("vectorstore", "index_state.json", "lexical_index.pkl"):
+        assert os.path.exists(os.path.join(directory, name))
+
+    # 內容和設置未變，指紋相同；重建的嵌入全部命中緩存
+    assert versions(knowledge_base) == before
+    assert cache.misses == misses
+    assert knowledge_base.search("營業人應於每單月十五日前申報銷售額", k=3)
+
+
+def test_other_instance_follows_pointer(knowledge_base, tmp_path):
+    other = reopen(knowledge_base, tmp_path)
+    assert other.search("遺產稅申報", k=3) and other.generation is None
+
+    knowledge_base.rebuild()
+    doc_info = knowledge_base.catalog.list_documents()[0]
+    knowledge_base.delete_document(doc_info["id"])
+
+    # 下一次查詢時發現指針變更，改用新的一代並看到其後的刪除
+    assert other.document_versions([doc_info["id"]]) == {doc_info["id"]: None}
+    assert other.generation == knowledge_base.generation
+    assert all(doc.metadata["doc_id"] != doc_info["id"] for doc in other.search(doc_info["name"], k=20))
+
+    # 新建的實例直接打開當前的一代
+    assert reopen(knowledge_base, tmp_path).generation == knowledge_base.generation
+
+
+def test_old_generations_are_removed(knowledge_base):
+    knowledge_base.rebuild()
+    first = knowledge_base.generation
+    knowledge_base.rebuild()
+    second = knowledge_base.generation
+    # 上一代保留到下次重建，讓其他進程有時間切換
+    assert generations(knowledge_base) == sorted([first, second])
+
+    knowledge_base.rebuild()
+    assert generations(knowledge_base) == sorted([second, knowledge_base.generation])
+
+
+def test_changes_during_rebuild_are_caught_up(knowledge_base):
+    documents = knowledge_base.catalog.list_documents()
+    removed = documents[0]
+    deleted = []
+
+    def progress(done, total, name):
+        # 重建的第一輪期間在舊的一代上刪除一個文檔，切換前的補同步應該在新的一代中移除它
+        if not deleted:
+            deleted.append(knowledge_base.delete_document(removed["id"]))
+
+    knowledge_base.rebuild(progress=progress)
+
+    assert deleted and deleted[0] > 0
+    assert removed["id"] not in knowledge_base.indexer.state
+    assert len(knowledge_base.indexer.state) == len(documents) - 1
+
+
+def test_failed_rebuild_keeps_current_index(knowledge_base, monkeypatch):
+    before = versions(knowledge_base)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("嵌入服務不可用")
+
+    monkeypatch.setattr("rag.knowledge_base.IncrementalIndexer.sync", fail)
+    with pytest.raises(RuntimeError):
+        knowledge_base.rebuild()
+
+    assert knowledge_base.generation is None
+    assert not os.path.exists(knowledge_base.generations_dir) or generations(knowledge_base) == []
+    monkeypatch.undo()
+    assert versions(knowledge_base) == before
+
+
+@pytest.fixture
+def worker(knowledge_base):
+    return ReindexWorker(knowledge_base)
+
+
+def finished(worker, job):
+    assert wait_for(lambda: job.finished, timeout=60)
+    return worker.get(job.id)
+
+
+def test_worker_runs_sync_and_rebuild_jobs(worker, knowledge_base):
+    job = finished(worker, worker.submit(SYNC))
+    assert job.status == "done" and job.stats["unchanged"] == len(knowledge_base.catalog)
+    assert job.started_at <= job.finished_at and job.current is None
+
+    job = finished(worker, worker.submit(REBUILD))
+    assert job.status == "done" and job.stats["added"] == len(knowledge_base.catalog)
+    assert (job.done, job.total) == (len(knowledge_base.catalog), len(knowledge_base.catalog))
+    assert job.cache_hits > 0 and job.cache_misses == 0
+    assert knowledge_base.generation is not None
+    assert worker.latest() is job and not worker.busy
+
+    with pytest.raises(ValueError):
+        worker.submit("full")
+
+
+def test_worker_merges_queued_jobs_and_reports_failures(worker, knowledge_base, monkeypatch):
+    release = threading.Event()
+    started = threading.Event()
+    sync = knowledge_base.sync
+
+    def blocked_sync(progress=None):
+        started.set()
+        release.wait(timeout=10)
+        return sync(progress=progress)
+
+    monkeypatch.setattr(knowledge_base, "sync", blocked_sync)
+    running = worker.submit(SYNC)
+    assert started.wait(timeout=10)
+
+    # 執行中的任務之後，同一模式的排隊任務只保留一個
+    queued = worker.submit(SYNC)
+    assert worker.submit(SYNC) is queued and queued is not running
+    assert worker.busy
+
+    monkeypatch.setattr(knowledge_base, "rebuild", lambda progress=None: 1 / 0)
+    failed = worker.submit(REBUILD)
+    release.set()
+    assert finished(worker, running).status == "done"
+    assert finished(worker, queued).status == "done"
+    failed = finished(worker, failed)
+    assert failed.status == "failed" and "division by zero" in failed.error
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""檢索結果重排：MinHash去除近似重複、候選集BM25重新排序、token預算"""
+
+import pytest
+from langchain_core.documents import Document
+
+from rag.metrics import MetricsRegistry
+from rag.rerank import Reranker, create_reranker, minhash, near_duplicates, term_hashes
+
+ARTICLE = (
+    "營業人應於每單月十五日前，將上期之銷售額、應納或溢付營業稅額，向主管稽徵機關申報，"
+    "並檢附統一發票明細表及依規定應檢附之進項憑證。營業人使用電子發票者，得免檢附明細表。"
+    "營業人未依規定期限申報銷售額者，應按其應納稅額加徵滯報金或怠報金。"
+    "主管稽徵機關得視實際需要，通知營業人提示有關帳簿、文據及進銷貨憑證，營業人不得拒絕。"
+    "依本法規定應申報之事項，得以電子方式為之；其實施辦法由財政部定之。"
+    "營業人開立發票金額短開或漏開者，除追繳稅款外，按所漏稅額處五倍以下罰鍰。"
+)
+
+
+def doc(text, doc_id):
+    return Document(page_content=text, metadata={"doc_id": doc_id})
+
+
+@pytest.fixture
+def reranker():
+    return Reranker(token_budget=10000, count_tokens=len, metrics=MetricsRegistry())
+
+
+def test_near_duplicates_are_collapsed(reranker):
+    # 重複上傳且只有一個字修訂的條文與原文幾乎相同（Jaccard約0.97），只保留排在前面的原文；
+    # 門檻放寬到0.8，MinHash的估計誤差不會讓結果隨雜湊種子改變
+    reranker.dedupe_threshold = 0.8
+    revised = ARTICLE.replace("十五日", "十六日")
+    other = "遺產稅納稅義務人應於被繼承人死亡之日起六個月內，向戶籍所在地主管稽徵機關辦理遺產稅申報。"
+    documents = [doc(ARTICLE, "original"), doc(revised, "revised"), doc(other, "estate")]
+
+    results = reranker.rerank("遺產稅申報", documents, k=3)
+
+    assert [result.metadata["doc_id"] for result in results] == ["estate", "original"]
+    features = [reranker.features(document.page_content) for document in documents]
+    assert near_duplicates(features, 0.8) == {1}
+    assert near_duplicates(features[:1], 0.8) == set()
+    # 修訂版排在前面時保留修訂版
+    results = reranker.rerank("營業稅申報", [documents[1], documents[0]], k=3)
+    assert [result.metadata["doc_id"] for result in results] == ["revised"]
+
+
+def test_identical_term_sets_have_identical_signatures():
+    hashes, _ = term_hashes("營業稅 申報期限")
+    same, _ = term_hashes("申報期限，營業稅")
+    assert (minhash(hashes) == minhash(same)).all()
+    different, _ = term_hashes("綜合所得稅結算申報")
+    assert (minhash(hashes) != minhash(different)).any()
+
+
+def test_reorders_candidates_by_relevance(reranker):
+    documents = [
+        doc("綜合所得稅納稅義務人應於每年五月一日起至五月三十一日止辦理結算申報。", "income"),
+        doc("營業稅的稅率除另有規定外，最低不得少於百分之五，最高不得超過百分之十。", "rate"),
+        doc(ARTICLE, "deadline"),
+    ]
+
+    results = reranker.rerank("營業人每單月十五日前申報銷售額", documents, k=3)
+
+    # 向量檢索排在最後的條文包含全部查詢詞項，重排後排在最前；完全無關的所得稅條文排在最後
+    assert [result.metadata["doc_id"] for result in results] == ["deadline", "rate", "income"]
+    assert [result.metadata["doc_id"] for result in reranker.rerank("營業稅率", documents, k=1)] == ["rate"]
+
+
+def test_token_budget_keeps_at_least_one(reranker):
+    documents = [doc(ARTICLE, "long"), doc("營業稅申報", "short")]
+    reranker.token_budget = 10
+    assert [result.metadata["doc_id"] for result in reranker.rerank("營業稅申報期限", documents, k=2)] == ["short"]
+    reranker.token_budget = 1
+    assert len(reranker.rerank("營業稅申報期限", documents, k=2)) == 1
+
+
+def test_features_are_cached_and_timed(reranker):
+    assert reranker.features(ARTICLE) is reranker.features(ARTICLE)
+    reranker.rerank("營業稅", [doc(ARTICLE, "a")], k=1)
+    assert reranker.metrics.summary()["rerank"]["count"] == 1
+
+
+def test_create_reranker_rejects_unknown_model():
+    assert isinstance(create_reranker("lexical"), Reranker)
+    with pytest.raises(ValueError):
+        create_reranker("bm42")
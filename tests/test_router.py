@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""模型路由：查詢特徵、啟發式分類器選擇快速或強模型，以及分類失敗時的預設路由"""
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from rag.llm import get_chat_model
+from rag.metrics import MetricsRegistry
+from rag.router import FAST, STRONG, HeuristicClassifier, ModelRouter, RouteFeatures, create_classifier, route_features
+
+DOCUMENTS = [
+    Document(page_content="營業人應於每單月十五日前，將上期之銷售額向主管稽徵機關申報。", metadata={"doc_id": "vat"}),
+    Document(page_content="遺產稅納稅義務人應於被繼承人死亡之日起六個月內辦理遺產稅申報。", metadata={"doc_id": "estate"}),
+    Document(page_content="綜合所得稅納稅義務人應於每年五月一日起至五月三十一日止辦理結算申報。",
+             metadata={"doc_id": "income"}),
+]
+SIMPLE = "營業人銷售額申報期限"
+COMPLEX = ("如果被繼承人生前有未申報的營業稅銷售額，同時繼承人也要辦理綜合所得稅結算申報與遺產稅申報，"
+           "各項申報期限分別是什麼，逾期會有什麼處罰")
+HISTORY = [HumanMessage("問一"), AIMessage("答一"), HumanMessage("問二"), AIMessage("答二"),
+           HumanMessage("問三"), AIMessage("答三")]
+
+
+class FixedClassifier:
+    name = "fixed"
+
+    def __init__(self, result):
+        self.result = result
+
+    def classify(self, features):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def make_router(classifier=None, **kwargs):
+    return ModelRouter(get_chat_model(model="gpt-4o-mini"), get_chat_model(model="gpt-4o"), classifier,
+                       metrics=MetricsRegistry(), **kwargs)
+
+
+def test_route_features():
+    features = route_features(SIMPLE, DOCUMENTS)
+    # 只有營業稅條文與問題相關，最高分遠高於其他文本塊
+    assert (features.sources, features.history_turns, features.has_summary) == (1, 0, False)
+    assert features.score_spread > 0.5
+
+    features = route_features(COMPLEX, DOCUMENTS, HISTORY + [SystemMessage("較早的對話摘要")])
+    assert features.sources >= 2 and features.score_spread < 0.5
+    assert (features.history_turns, features.has_summary) == (3, True)
+    assert features.question_tokens > route_features(SIMPLE, DOCUMENTS).question_tokens
+
+    features = route_features(SIMPLE, [])
+    assert (features.sources, features.score_spread) == (0, 0.0)
+
+
+def test_heuristic_classifier_counts_signals():
+    classifier = HeuristicClassifier(strong_signals=2, long_question_tokens=40, min_sources=2,
+                                     max_score_spread=0.1, history_turns=3)
+    assert classifier.classify(RouteFeatures(10, 1, 0.9, 0)) == (FAST, "簡單查找")
+    # 只有一個信號成立時仍用快速模型，原因列出該信號
+    name, reason = classifier.classify(RouteFeatures(10, 3, 0.9, 0))
+    assert (name, reason) == (FAST, "相關內容分佈在 3 份文檔")
+    name, reason = classifier.classify(RouteFeatures(50, 1, 0.05, 0))
+    assert name == STRONG and "問題較長" in reason and "沒有明顯最相關的文本塊" in reason
+    assert classifier.classify(RouteFeatures(10, 1, 0.9, 0, has_summary=True))[1] == "多輪對話"
+
+
+def test_simple_and_complex_questions_use_expected_model():
+    router = make_router()
+    route = router.route(SIMPLE, DOCUMENTS)
+    assert (route.name, route.model, route.reason) == (FAST, "gpt-4o-mini", "簡單查找")
+
+    route = router.route(COMPLEX, DOCUMENTS, HISTORY)
+    assert (route.name, route.model) == (STRONG, "gpt-4o")
+    assert "多輪對話" in route.reason
+    assert router.llm(route.name) is router.llms[STRONG]
+
+
+@pytest.mark.parametrize("result", [RuntimeError("分類服務不可用"), ("medium", "未知路由"), None])
+@pytest.mark.parametrize("fallback", [FAST, STRONG])
+def test_failed_classification_uses_configured_fallback(result, fallback):
+    router = make_router(FixedClassifier(result), fallback=fallback)
+
+    route = router.route(SIMPLE, DOCUMENTS)
+
+    assert route.name == fallback and route.model == {FAST: "gpt-4o-mini", STRONG: "gpt-4o"}[fallback]
+    assert route.reason == "分類失敗，使用預設路由"
+    assert router.metrics.summary()["route"]["errors"] == 1
+
+
+def test_unknown_fallback_is_rejected():
+    with pytest.raises(ValueError):
+        make_router(fallback="medium")
+
+
+def test_create_classifier():
+    assert isinstance(create_classifier("heuristic"), HeuristicClassifier)
+    assert isinstance(create_classifier("rag.router:HeuristicClassifier"), HeuristicClassifier)
+    with pytest.raises(ValueError):
+        create_classifier("bert")
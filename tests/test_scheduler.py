@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""OpenAI請求調度器：對rag.mock_openai發出真實的HTTP請求，驗證退避、限額和優先級"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from rag.metrics import MetricsRegistry
+from rag.mock_openai import create_mock_app
+from rag.scheduler import OpenAIScheduler, ScheduledTransport, background
+from tests.helpers import serve
+
+MODEL = "gpt-test"
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """記錄每次真正發出的請求的時間和響應"""
+
+    def __init__(self):
+        self.transport = httpx.HTTPTransport()
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def handle_request(self, request):
+        response = self.transport.handle_request(request)
+        with self._lock:
+            self.sent.append((time.monotonic(), response.status_code, response.headers.get("retry-after-ms")))
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+@pytest.fixture
+def openai_api(request):
+    """啟動rag.mock_openai；參數化時以參數作為create_mock_app的關鍵字參數"""
+    app = create_mock_app(**getattr(request, "param", {}))
+    stop = serve(app)
+    yield app
+    stop()
+
+
+def make_client(api, rpm=100000, tpm=10 ** 8, **kwargs):
+    metrics = MetricsRegistry()
+    scheduler = OpenAIScheduler(limits={"default": {"rpm": rpm, "tpm": tpm}}, metrics=metrics, **kwargs)
+    recorder = RecordingTransport()
+    client = httpx.Client(base_url=f"{api.state.base_url}/v1", transport=ScheduledTransport(recorder, scheduler),
+                          timeout=30)
+    return client, scheduler, recorder, metrics
+
+
+def chat(client):
+    return client.post("/chat/completions", json={
+        "model": MODEL, "messages": [{"role": "user", "content": "營業稅申報期限？"}], "max_tokens": 16
+    })
+
+
+@pytest.mark.parametrize("openai_api", [{"throttle_rate": 0.3, "seed": 7}], indirect=True)
+def test_retries_wait_for_retry_after(openai_api):
+    client, _, recorder, metrics = make_client(openai_api)
+
+    responses = [chat(client) for _ in range(20)]
+
+    assert all(response.status_code == 200 for response in responses)
+    throttled = [(sent_at, float(retry_after_ms)) for sent_at, status, retry_after_ms in recorder.sent
+                 if status == 429]
+    assert throttled and len(throttled) == openai_api.state.throttled["chat"]
+    assert metrics.counters()["openai_retries"][(("model", MODEL),)] == len(throttled)
+    # 每個429之後的下一個請求都在Retry-After之後才發出
+    for sent_at, retry_after_ms in throttled:
+        next_sent = min(at for at, _, _ in recorder.sent if at > sent_at)
+        assert next_sent - sent_at >= retry_after_ms / 1000 - 0.01
+
+
+@pytest.mark.parametrize("openai_api", [{"throttle_rate": 1.0}], indirect=True)
+def test_gives_up_after_max_retries(openai_api):
+    client, _, recorder, _ = make_client(openai_api, max_retries=2)
+
+    assert chat(client).status_code == 429
+    assert [status for _, status, _ in recorder.sent] == [429, 429, 429]
+
+
+@pytest.mark.parametrize("openai_api", [{"rpm": 600}], indirect=True)
+def test_token_bucket_keeps_requests_under_server_limit(openai_api):
+    # 客戶端限額略低於服務端，超出令牌桶容量的請求按補充速度放行，服務端不會返回429
+    client, _, recorder, _ = make_client(openai_api, rpm=570)
+    extra = 15
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        statuses = list(executor.map(lambda _: chat(client).status_code, range(570 + extra)))
+    elapsed = time.monotonic() - started
+
+    assert statuses == [200] * (570 + extra)
+    assert openai_api.state.throttled["chat"] == 0
+    assert len(recorder.sent) == 570 + extra
+    assert elapsed >= extra / (570 / 60) * 0.9
+
+
+def test_background_requests_yield_to_interactive(openai_api):
+    client, scheduler, _, _ = make_client(openai_api, rpm=600, reserve=0.0)
+    limiter = scheduler.limiter(MODEL)
+    # 清空令牌桶，之後每0.1秒放行一個請求
+    limiter.requests.level = 0.0
+    finished = []
+    lock = threading.Lock()
+
+    def request(name, priority_background):
+        if priority_background:
+            with background():
+                chat(client)
+        else:
+            chat(client)
+        with lock:
+            finished.append(name)
+
+    threads = [threading.Thread(target=request, args=(f"background-{i}", True)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=request, args=("interactive", False))
+    interactive.start()
+    for thread in threads + [interactive]:
+        thread.join(timeout=10)
+
+    assert len(finished) == 7
+    # 背景請求先到，但聊天請求只等正在放行的那一個
+    assert finished.index("interactive") <= 1
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""中文分割器：按分類的token上限、在法條和句號處分割，以及分割設置改變時指紋隨之改變"""
+
+import pytest
+from langchain_core.documents import Document
+
+from rag import config
+from rag.splitter import CategorySplitter, approximate_token_count, chunk_settings
+
+ARTICLES = "\n".join(
+    f"第{number}條\n營業人應於每單月十五日前申報銷售額。逾期申報者加徵滯報金；情節重大者處罰鍰。"
+    for number in "一二三四五六七八九十"
+)
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    monkeypatch.setitem(config.CHUNK_SETTINGS, "default", {"chunk_size": 120, "chunk_overlap": 0})
+    monkeypatch.setitem(config.CHUNK_SETTINGS, "營業稅", {"chunk_size": 45})
+    return config.CHUNK_SETTINGS
+
+
+def split(splitter, category):
+    return splitter.split_documents([Document(page_content=ARTICLES, metadata={"category": category})])
+
+
+def test_chunks_respect_category_token_limits(settings):
+    splitter = CategorySplitter(length_function=approximate_token_count)
+    # 分類只覆蓋塊大小，重疊沿用預設值
+    assert chunk_settings("營業稅") == {"chunk_size": 45, "chunk_overlap": 0}
+
+    small = split(splitter, "營業稅")
+    large = split(splitter, "所得稅")
+
+    assert all(approximate_token_count(chunk.page_content) <= 45 for chunk in small)
+    assert all(approximate_token_count(chunk.page_content) <= 120 for chunk in large)
+    assert len(small) > len(large) > 1
+    # 每個法條約42 token，小塊剛好一條一塊，從「第X條」開始，句號留在句尾
+    assert all(chunk.page_content.startswith("第") and chunk.page_content.endswith("。") for chunk in small)
+    assert all(chunk.metadata["category"] == "營業稅" for chunk in small)
+    assert splitter.splitter_for("所得稅") is splitter.splitter_for("遺產稅")
+
+
+def test_signature_changes_with_settings(settings, monkeypatch):
+    splitter = CategorySplitter(length_function=len, tokenizer_model="gpt-4o")
+    before = splitter.signature("營業稅")
+    assert splitter.signature("所得稅") != before
+    assert splitter.signature("所得稅") == splitter.signature("遺產稅")
+
+    monkeypatch.setitem(config.CHUNK_SETTINGS, "營業稅", {"chunk_size": 45, "chunk_overlap": 10})
+    assert splitter.signature("營業稅") != before
+
+
+def test_signature_includes_tokenizer(settings):
+    signature = CategorySplitter(length_function=len, tokenizer_model="gpt-4o").signature("營業稅")
+    assert CategorySplitter(length_function=len, tokenizer_model="gpt-4o").signature("營業稅") == signature
+    assert CategorySplitter(length_function=len, tokenizer_model="gpt-3.5-turbo").signature("營業稅") != signature
+    # 離線時按字數估算的結果與tiktoken不同，指紋也分開
+    approximate = CategorySplitter(length_function=approximate_token_count, tokenizer_model="gpt-4o")
+    assert approximate.tokenizer == "approximate"
+    assert approximate.signature("營業稅") != signature
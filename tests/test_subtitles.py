@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""字幕解析：手動字幕保留重複的短句，自動字幕去除滾動重複"""
+
+from rag.subtitles import cues_to_text, group_cues, parse_subtitles
+
+MANUAL_SRT = """1
+00:00:01,000 --> 00:00:02,000
+對
+
+2
+00:00:02,000 --> 00:00:03,000
+對
+
+3
+00:00:03,000 --> 00:00:05,000
+所以要在<i>十五日前</i>
+申報 &amp; 繳納
+
+4
+00:00:05,000 --> 00:00:06,000
+好
+"""
+
+AUTO_VTT = """WEBVTT
+Kind: captions
+
+00:00:00.000 --> 00:00:02.000 align:start position:0%
+ 
+營業稅<00:00:01.000><c>申報</c>
+
+00:00:02.000 --> 00:00:02.010 align:start position:0%
+營業稅申報
+ 
+
+00:00:02.010 --> 00:00:04.000 align:start position:0%
+營業稅申報
+期限是單月十五日
+
+00:00:04.000 --> 00:00:06.000 align:start position:0%
+期限是單月十五日
+期限是單月十五日前
+"""
+
+
+def test_manual_captions_keep_repeated_lines():
+    cues = parse_subtitles(MANUAL_SRT.splitlines())
+
+    assert [cue.text for cue in cues] == ["對", "對", "所以要在十五日前申報 & 繳納", "好"]
+    assert [(cue.start, cue.end) for cue in cues][:2] == [(1.0, 2.0), (2.0, 3.0)]
+
+
+def test_auto_captions_drop_rolling_duplicates():
+    cues = parse_subtitles(AUTO_VTT.splitlines(), rolling=True)
+
+    assert [(cue.start, cue.text) for cue in cues] == [(0.0, "營業稅申報"), (2.01, "期限是單月十五日"), (4.0, "前")]
+    assert cues_to_text(cues) == "營業稅申報期限是單月十五日前"
+
+
+def test_group_cues_respects_max_chars():
+    cues = parse_subtitles(MANUAL_SRT.splitlines())
+    assert group_cues(cues, max_chars=5) == [(1.0, "對對"), (3.0, "所以要在十五日前申報 & 繳納"), (5.0, "好")]
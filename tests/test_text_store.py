@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""抽取文本存儲：按內容雜湊存取gzip壓縮的JSONL、相同內容只抽取和存儲一次、清理不再使用的存儲"""
+
+import gzip
+import json
+import os
+
+import pytest
+from langchain_core.documents import Document
+
+from rag.text_store import TextStore
+
+PAGES = [
+    Document(page_content="第一條\n營業人應於每單月十五日前申報銷售額。", metadata={"source": "/tmp/a.pdf", "page": 0}),
+    Document(page_content="第二條\n逾期申報者加徵滯報金。", metadata={"source": "/tmp/a.pdf", "page": 1}),
+]
+
+
+class CountingLoader:
+    """記錄調用次數的加載器工廠"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.calls = []
+
+    def __call__(self, path, doc_type):
+        self.calls.append((path, doc_type))
+        return self
+
+    def load(self):
+        return [Document(page_content=doc.page_content, metadata=dict(doc.metadata)) for doc in self.documents]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return TextStore(os.path.join(tmp_path, "texts"))
+
+
+def test_round_trip_is_gzip_jsonl_keyed_by_content_hash(store):
+    store.put("abc123", "pdf", PAGES)
+
+    path = os.path.join(store.directory, "abc123.pdf.jsonl.gz")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    # 每行一頁；source是文件路徑，不保存
+    assert records == [{"text": doc.page_content, "metadata": {"page": doc.metadata["page"]}} for doc in PAGES]
+    assert os.listdir(store.directory) == ["abc123.pdf.jsonl.gz"]
+
+    documents = store.get("abc123", "pdf")
+    assert [(doc.page_content, doc.metadata) for doc in documents] == [
+        (doc.page_content, {"page": doc.metadata["page"]}) for doc in PAGES
+    ]
+    assert (store.hits, store.misses) == (1, 0)
+
+
+def test_missing_key_returns_none(store):
+    store.put("abc123", "pdf", PAGES)
+    assert store.get("def456", "pdf") is None
+    # 同一內容的不同類型分開存儲
+    assert store.get("abc123", "docx") is None
+    assert (store.hits, store.misses) == (0, 2)
+
+
+def test_identical_content_is_extracted_and_stored_once(store, tmp_path):
+    loader = CountingLoader(PAGES)
+
+    first = store.load(os.path.join(tmp_path, "a.pdf"), "pdf", "abc123", loader)
+    # 內容相同的另一個文件（例如重複上傳）直接讀取存儲，不再調用解析器
+    second = store.load(os.path.join(tmp_path, "b.pdf"), "pdf", "abc123", loader)
+
+    assert loader.calls == [(os.path.join(tmp_path, "a.pdf"), "pdf")]
+    assert [doc.page_content for doc in first] == [doc.page_content for doc in second]
+    assert os.listdir(store.directory) == ["abc123.pdf.jsonl.gz"]
+    assert (store.hits, store.misses) == (1, 1)
+
+    store.load(os.path.join(tmp_path, "c.pdf"), "pdf", "other", CountingLoader(PAGES[:1]))
+    assert sorted(os.listdir(store.directory)) == ["abc123.pdf.jsonl.gz", "other.pdf.jsonl.gz"]
+
+
+def test_prune_keeps_listed_hashes_and_temporary_files(store):
+    store.put("keep", "pdf", PAGES)
+    store.put("drop", "pdf", PAGES)
+    store.put("drop", "docx", PAGES[:1])
+    temporary = os.path.join(store.directory, "drop.pdf.jsonl.gz.0123.tmp")
+    open(temporary, "wb").close()
+
+    removed, freed = store.prune({"keep"})
+
+    assert removed == 2 and freed > 0
+    assert sorted(os.listdir(store.directory)) == ["drop.pdf.jsonl.gz.0123.tmp", "keep.pdf.jsonl.gz"]
+    assert store.prune({"keep"}) == (0, 0)
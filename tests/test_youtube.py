@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""YouTubeFetcher：以樁提取器和本地HTTP服務代替yt-dlp和YouTube"""
+
+import os
+
+import pytest
+
+from rag.youtube import YouTubeError, YouTubeFetcher, select_subtitle_track
+
+YOUTUBE_ID = "dQw4w9WgXcQ"
+
+MANUAL_VTT = """WEBVTT
+
+00:00:01.000 --> 00:00:03.000
+營業稅每兩個月申報一次
+
+00:00:03.500 --> 00:00:05.000
+申報期限為單月十五日
+
+00:00:05.000 --> 00:00:05.500
+對
+
+00:00:05.500 --> 00:00:06.000
+對
+"""
+
+# 自動字幕：每段重複上一段的行，再加上新的一行
+AUTO_VTT = """WEBVTT
+Kind: captions
+Language: zh-Hant
+
+00:00:00.000 --> 00:00:02.000
+綜合所得稅<00:00:01.000><c>五月申報</c>
+
+00:00:02.000 --> 00:00:04.000
+綜合所得稅五月申報
+扣繳憑單一月寄發
+"""
+
+
+class StubExtractor:
+    """代替yt_dlp.YoutubeDL：返回固定的影片信息並記錄調用"""
+
+    calls = []
+
+    def __init__(self, info):
+        self.info = info
+
+    def __call__(self, options):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def extract_info(self, url, download=False):
+        StubExtractor.calls.append(url)
+        if isinstance(self.info, Exception):
+            raise self.info
+        return self.info
+
+
+def video_info(subtitles=None, automatic_captions=None):
+    return {
+        "title": "營業稅申報說明",
+        "uploader": "財政部",
+        "upload_date": "20240115",
+        "view_count": 1234,
+        "thumbnail": "https://example.com/thumb.jpg",
+        "subtitles": subtitles or {},
+        "automatic_captions": automatic_captions or {},
+    }
+
+
+def make_fetcher(tmp_path, info):
+    StubExtractor.calls = []
+    return YouTubeFetcher(cache_dir=str(tmp_path / "cache"), extractor_factory=StubExtractor(info),
+                          watch_url="https://stub.invalid/watch?v={}")
+
+
+def test_manual_captions_preferred_over_automatic(tmp_path, static_server):
+    static_server.routes["/manual.vtt"] = (200, MANUAL_VTT.encode("utf-8"))
+    static_server.routes["/auto.vtt"] = (200, AUTO_VTT.encode("utf-8"))
+    info = video_info(
+        subtitles={"zh-TW": [{"ext": "json3", "url": "unused"},
+                             {"ext": "vtt", "url": static_server.url("/manual.vtt")}]},
+        automatic_captions={"zh-Hant": [{"ext": "vtt", "url": static_server.url("/auto.vtt")}]},
+    )
+    fetcher = make_fetcher(tmp_path, info)
+
+    video = fetcher.fetch(YOUTUBE_ID)
+
+    assert (video.subtitle_source, video.subtitle_lang) == ("手動", "zh-TW")
+    # 手動字幕不去重：連續兩段「對」都保留
+    assert video.transcript == "營業稅每兩個月申報一次申報期限為單月十五日對對"
+    assert video.cues == [(1.0, "營業稅每兩個月申報一次"), (3.5, "申報期限為單月十五日"), (5.0, "對"), (5.5, "對")]
+    assert (video.title, video.author, video.views) == ("營業稅申報說明", "財政部", 1234)
+    assert video.available_langs == ["zh-TW", "zh-Hant"]
+    assert static_server.requests == ["/manual.vtt"]
+    assert StubExtractor.calls == [f"https://stub.invalid/watch?v={YOUTUBE_ID}"]
+
+
+def test_fetch_is_cached_by_youtube_id(tmp_path, static_server):
+    static_server.routes["/manual.vtt"] = (200, MANUAL_VTT.encode("utf-8"))
+    info = video_info(subtitles={"zh-TW": [{"ext": "vtt", "url": static_server.url("/manual.vtt")}]})
+    fetcher = make_fetcher(tmp_path, info)
+    first = fetcher.fetch(YOUTUBE_ID)
+
+    # 第二次不再提取也不再下載字幕
+    fetcher.extractor_factory = StubExtractor(RuntimeError("不應再提取"))
+    cached = fetcher.fetch(YOUTUBE_ID)
+    assert (cached.title, cached.transcript, cached.subtitle_source) == (first.title, first.transcript, "手動")
+    assert [tuple(cue) for cue in cached.cues] == first.cues
+    assert len(static_server.requests) == 1
+    assert os.path.exists(tmp_path / "cache" / f"{YOUTUBE_ID}.json")
+
+
+def test_falls_back_to_automatic_captions(tmp_path, static_server):
+    static_server.routes["/auto.vtt"] = (200, AUTO_VTT.encode("utf-8"))
+    info = video_info(automatic_captions={
+        "en": [{"ext": "vtt", "url": static_server.url("/en.vtt")}],
+        "zh-Hant": [{"ext": "srv3", "url": "unused"}, {"ext": "vtt", "url": static_server.url("/auto.vtt")}],
+    })
+    fetcher = make_fetcher(tmp_path, info)
+
+    video = fetcher.fetch(YOUTUBE_ID)
+
+    assert (video.subtitle_source, video.subtitle_lang) == ("自動", "zh-Hant")
+    # 滾動重複的行只保留一次，行內時間標記被去掉
+    assert video.transcript == "綜合所得稅五月申報扣繳憑單一月寄發"
+    assert [start for start, _ in video.cues] == [0.0, 2.0]
+    assert static_server.requests == ["/auto.vtt"]
+
+
+def test_no_subtitles_raises_and_caches_nothing(tmp_path, static_server):
+    fetcher = make_fetcher(tmp_path, video_info())
+
+    with pytest.raises(YouTubeError, match="沒有任何可用字幕"):
+        fetcher.fetch(YOUTUBE_ID)
+    assert static_server.requests == []
+    assert not os.path.exists(tmp_path / "cache" / f"{YOUTUBE_ID}.json")
+
+
+def test_subtitle_download_error_is_reported(tmp_path, static_server):
+    info = video_info(subtitles={"zh-TW": [{"ext": "vtt", "url": static_server.url("/missing.vtt")}]})
+    fetcher = make_fetcher(tmp_path, info)
+
+    with pytest.raises(YouTubeError, match="下載字幕失敗"):
+        fetcher.fetch(YOUTUBE_ID)
+
+
+def test_extractor_failure_is_wrapped(tmp_path):
+    fetcher = make_fetcher(tmp_path, RuntimeError("Video unavailable"))
+
+    with pytest.raises(YouTubeError, match="Video unavailable"):
+        fetcher.fetch(YOUTUBE_ID)
+
+
+def test_select_subtitle_track_prefers_chinese_then_english():
+    info = video_info(
+        subtitles={"fr": [{"ext": "vtt", "url": "fr"}], "en": [{"ext": "vtt", "url": "en"}]},
+        automatic_captions={"zh-Hans": [{"ext": "vtt", "url": "zh-auto"}]},
+    )
+    assert select_subtitle_track(info) == ("zh-auto", "自動", "zh-Hans")
+    del info["automatic_captions"]["zh-Hans"]
+    assert select_subtitle_track(info) == ("en", "手動", "en")